@@ -3,7 +3,11 @@ import copy
 import logging
 from inspect import Parameter, signature
 from .type_helpers import load_type_from_name, load_constant_from_name, has_method
-from diffusers.utils import load_image, load_video
+from diffusers.utils import is_av_available, load_image, load_video
+from .decoded_media import load_decoded
+from .lazy_image import LazyImage
+from .media_cache import cached_path
+from .video_source import VideoSource
 from .security import (
     validate_path,
     validate_constant_name,
@@ -236,7 +240,8 @@ def fetch_media(spec, base_dir=None):
     """Load the media an explicit reference names.
 
     Args:
-        spec: Dict with 'media_type' ('image' or 'video') and 'location'
+        spec: Dict with 'media_type' ('image' or 'video') and 'location' - and for
+            a video, optionally the 'size' and 'stride' fetch_video takes
         base_dir: Directory relative paths are resolved against
 
     Returns:
@@ -252,7 +257,10 @@ def fetch_media(spec, base_dir=None):
     if media_type == "image":
         return fetch_image(location, base_dir)
     if media_type == "video":
-        return fetch_video(location, base_dir)
+        decode_options = {
+            key: spec[key] for key in ("size", "max_size", "stride") if key in spec
+        }
+        return fetch_video(location | decode_options, base_dir)
     raise ValueError(f"Unknown media_type {media_type!r} - use 'image' or 'video'")
 
 
@@ -668,9 +676,7 @@ def media_arguments(object_type, artifact):
     import torch
     from PIL import Image
 
-    from .result import AudioVideo
-    from .tasks.audio_utils import as_channels_samples
-    from .tasks.video_utils import frames_as_pil_list
+    from .tasks.video_utils import frames_as_pil_list, soundtrack
 
     kind = object_type.kind
 
@@ -683,12 +689,11 @@ def media_arguments(object_type, artifact):
             )
         return {"image": artifact}
 
-    # A generated soundtrack arrives paired with the frames it was generated with;
-    # anything else the step produced carries none
-    audio, sample_rate = None, None
-    if isinstance(artifact, AudioVideo) and artifact.audio is not None:
-        audio = torch.as_tensor(as_channels_samples(artifact.audio))
-        sample_rate = artifact.sample_rate
+    # A generated soundtrack arrives paired with the frames it was generated with,
+    # or muxed into the file a streamed chain wrote; anything else carries none
+    audio, sample_rate = soundtrack(artifact)
+    if audio is not None:
+        audio = torch.as_tensor(audio)
 
     if kind == "video":
         frames = frames_as_pil_list(artifact)
@@ -753,10 +758,35 @@ def resolve_relative_path(path, base_dir):
     return path
 
 
+def validate_image_path(path, base_dir=None):
+    """Validate a local image file's path and extension.
+
+    Args:
+        path: The file, relative paths resolved against base_dir
+        base_dir: Directory relative paths are resolved against
+
+    Returns:
+        The validated, absolute path
+
+    Raises:
+        SecurityError: If the path or its extension is not allowed
+    """
+    validated_path = validate_path(
+        resolve_relative_path(str(path), base_dir), allow_create=False
+    )
+    ext = os.path.splitext(validated_path)[1].lower()
+    if ext not in ALLOWED_IMAGE_EXTENSIONS:
+        raise SecurityError(f"Image file extension not allowed: {ext}")
+    return validated_path
+
+
 def fetch_image(img_spec, base_dir=None):
     """
     Load image from file path or URL with security validation.
 
+    URLs are fetched through the media cache, so a URL already downloaded is only
+    revalidated.
+
     Args:
         img_spec: Image specification (file path, URL, dict with 'location' key, PIL Image, or list of any of these)
         base_dir: Directory relative file paths are resolved against - the
@@ -777,8 +807,11 @@ def fetch_image(img_spec, base_dir=None):
         logger.debug(f"Loading list of {len(img_spec)} images")
         return [fetch_image(img, base_dir) for img in img_spec]
 
-    # If already a PIL Image, return as-is (allows multiple realize_args calls)
-    if hasattr(img_spec, "mode") and hasattr(img_spec, "size"):
+    # If already a PIL Image or a gathered one, return as-is (allows multiple
+    # realize_args calls)
+    if isinstance(img_spec, LazyImage) or (
+        hasattr(img_spec, "mode") and hasattr(img_spec, "size")
+    ):
         logger.debug(f"Image already loaded, returning as-is")
         return img_spec
 
@@ -806,17 +839,11 @@ def fetch_image(img_spec, base_dir=None):
             img_spec.startswith("http://") or img_spec.startswith("https://")
         ):
             validated_url = validate_url(img_spec)
-            return load_image(validated_url)
+            return load_decoded(cached_path(validated_url), load_image, kind="image")
         else:
             # Treat as file path, relative to the workflow file
-            validated_path = validate_path(
-                resolve_relative_path(str(img_spec), base_dir), allow_create=False
-            )
-            # Validate file extension
-            ext = os.path.splitext(validated_path)[1].lower()
-            if ext not in ALLOWED_IMAGE_EXTENSIONS:
-                raise SecurityError(f"Image file extension not allowed: {ext}")
-            return load_image(validated_path)
+            path = validate_image_path(img_spec, base_dir)
+            return load_decoded(path, load_image, kind="image")
 
     except SecurityError:
         raise
@@ -829,13 +856,21 @@ def fetch_video(video_spec, base_dir=None):
     """
     Load video from file path or URL with security validation.
 
+    A local file is opened as a VideoSource, which reads its metadata now and
+    decodes frames only when a step asks for them. A URL is downloaded into the
+    media cache, or revalidated there, and opened the same way. Without PyAV
+    installed, videos are decoded in full by load_video.
+
     Args:
-        video_spec: Video specification (file path, URL, dict with 'location' key, loaded frames, or list of any of these)
+        video_spec: Video specification (file path, URL, dict with 'location' key, loaded frames, or list of any of these).
+            The dict form may add 'size' - {"width", "height"} or [width, height]
+            to scale frames to as they are decoded - or 'max_size', a longest
+            side to fit them within, and 'stride', to keep every n-th frame
         base_dir: Directory relative file paths are resolved against - the
             workflow file's directory. Defaults to the process working directory
 
     Returns:
-        Loaded video frames, list of video frames, or None if video_spec is None
+        VideoSource, loaded video frames, list of those, or None if video_spec is None
 
     Raises:
         SecurityError: If validation fails
@@ -844,11 +879,15 @@ def fetch_video(video_spec, base_dir=None):
     if video_spec is None:
         return None
 
+    # Already opened (allows multiple realize_args calls)
+    if isinstance(video_spec, VideoSource):
+        return video_spec
+
     # Handle lists of videos (need to distinguish from video frames)
     # Check if it's a list of specifications (dicts/strings) rather than video frames
     if isinstance(video_spec, list) and len(video_spec) > 0:
         # If first element is a dict with 'location' or a string, treat as list of video specs
-        if isinstance(video_spec[0], (dict, str)):
+        if isinstance(video_spec[0], (dict, str, VideoSource)):
             logger.debug(f"Loading list of {len(video_spec)} videos")
             return [fetch_video(vid, base_dir) for vid in video_spec]
         # Otherwise assume it's already loaded video frames
@@ -862,11 +901,22 @@ def fetch_video(video_spec, base_dir=None):
         return video_spec
 
     # Handle dict format: {"location": "url_or_path"}
+    decode_options = {}
     if isinstance(video_spec, dict):
         if "location" not in video_spec:
             raise ValueError(
                 f"Video dict must have 'location' key, got keys: {list(video_spec.keys())}"
             )
+        decode_options = {
+            key: video_spec[key]
+            for key in ("size", "max_size", "stride")
+            if key in video_spec
+        }
+        size = decode_options.get("size", None)
+        if isinstance(size, dict):
+            decode_options["size"] = (size["width"], size["height"])
+        elif isinstance(size, list):
+            decode_options["size"] = tuple(size)
         video_spec = video_spec["location"]
 
     if not isinstance(video_spec, str):
@@ -881,13 +931,18 @@ def fetch_video(video_spec, base_dir=None):
 
     logger.debug(f"Loading video from: {video_spec}")
 
+    def open_video(path):
+        if not is_av_available():
+            return load_video(path)
+        return VideoSource(path, **decode_options)
+
     try:
         # Check if it's a URL
         if isinstance(video_spec, str) and (
             video_spec.startswith("http://") or video_spec.startswith("https://")
         ):
-            validated_url = validate_url(video_spec)
-            return load_video(validated_url)
+            path = cached_path(validate_url(video_spec))
+            return load_decoded(path, open_video, kind="video", **decode_options)
         else:
             # Treat as file path, relative to the workflow file
             validated_path = validate_path(
@@ -897,7 +952,9 @@ def fetch_video(video_spec, base_dir=None):
             ext = os.path.splitext(validated_path)[1].lower()
             if ext not in ALLOWED_VIDEO_EXTENSIONS:
                 raise SecurityError(f"Video file extension not allowed: {ext}")
-            return load_video(validated_path)
+            return load_decoded(
+                validated_path, open_video, kind="video", **decode_options
+            )
 
     except SecurityError:
         raise
@@ -0,0 +1,176 @@
+"""Decoded media kept in memory for the runs that load it again.
+
+Every `workflow run` in the REPL realizes a fresh copy of the definition, so the
+reference image an img2img prompt is being iterated on was opened and decoded
+again on every run - a 4K PNG is most of a second of zlib each time, for pixels
+that had not changed. Images, videos and audio tracks loaded from files are kept
+here, least recently used first, under a memory cap, and a file loaded again is
+handed the object decoded the first time.
+
+An entry is keyed by the file's resolved path, modification time and size, and by
+the options it was decoded with, so an edited file or another decode size is
+decoded afresh. Media from URLs is keyed by the media cache's copy, which keeps
+its modification time until it is downloaded again.
+
+A hit hands back the same object, not a copy. Like the values get_iterations
+shares across a step's iterations, loaded media is never modified in place -
+steps that change an image or a waveform make a new one.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from . import settings
+from .settings import parse_size
+
+logger = logging.getLogger("dw")
+
+DEFAULT_MAX_BYTES = 1024**3
+
+# What an entry of no measurable size - an unopened VideoSource - is counted as
+OBJECT_BYTES = 4096
+
+
+def media_bytes(value):
+    """Bytes held by decoded media - images, arrays, tensors and lists of them."""
+    if isinstance(value, (list, tuple)):
+        return sum(media_bytes(item) for item in value)
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if hasattr(value, "element_size") and hasattr(value, "numel"):
+        return value.numel() * value.element_size()
+    if hasattr(value, "getbands") and hasattr(value, "size"):
+        width, height = value.size
+        return width * height * len(value.getbands())
+    if hasattr(value, "array"):
+        return media_bytes(value.array)
+    return 0
+
+
+def media_key(path, options):
+    """What a decoding of a file depends on, or None if the file cannot be read.
+
+    Args:
+        path: The file
+        options: What it is decoded as, and with - compared by value
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (
+        os.path.realpath(path),
+        stat.st_mtime_ns,
+        stat.st_size,
+        tuple(sorted(options.items())),
+    )
+
+
+class DecodedMediaCache:
+    """Decoded files, least recently used first, within a memory cap.
+
+    Args:
+        max_bytes: Bytes of decoded media held. 0 turns caching off
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key):
+        """The media stored under a key, counting the lookup."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Store decoded media, evicting the least recently used to make room for it."""
+        size = max(media_bytes(value), OBJECT_BYTES)
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            while self._entries and self._bytes + size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+    def load(self, path, decode, **options):
+        """A file decoded, or the object it was decoded to before.
+
+        Args:
+            path: The file
+            decode: Called with the path on a miss
+            options: What the file is decoded as, and with - part of the key
+
+        Returns:
+            What decode returned, now or on an earlier call
+        """
+        key = media_key(path, options) if self.enabled else None
+        if key is None:
+            return decode(path)
+        value = self.get(key)
+        if value is None:
+            value = decode(path)
+            self.put(key, value)
+        else:
+            logger.debug(f"{path} served from the decoded media cache")
+        return value
+
+    def clear(self):
+        """Drop every decoded file."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit and miss counts, and the media currently held."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "max_bytes": self.max_bytes,
+                "cached_bytes": self._bytes,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+
+
+def get_decoded_media_cache():
+    """The process-wide decoded media cache, with its cap read from settings."""
+    global _cache
+    if _cache is None:
+        size = getattr(settings, "decoded_media_cache_size", None)
+        _cache = DecodedMediaCache(
+            DEFAULT_MAX_BYTES if size is None else parse_size(size)
+        )
+    return _cache
+
+
+def load_decoded(path, decode, **options):
+    """Decode a file through the process-wide cache - see DecodedMediaCache.load."""
+    return get_decoded_media_cache().load(path, decode, **options)
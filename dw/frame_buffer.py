@@ -0,0 +1,227 @@
+"""Video frames held as one contiguous uint8 array.
+
+Videos moved between steps as lists of PIL images, and every hand-off converted
+them: frames_as_array stacked the list into an array, encoding stacked it again,
+a segment read back from disk was decoded into a list and stacked, and an array
+handed to a step that wanted PIL frames was split back into images. Each of those
+copied every frame.
+
+A FrameBuffer is the video as a single (frames, height, width, 3) uint8 array -
+in memory, or memory-mapped from a .npy file so a long clip lives on disk and is
+paged in as it is read. Slicing it is a view; the array, a torch tensor or a
+DLPack capsule of it is the same memory. A PIL image is only made for a frame
+when something asks for that frame, so code written for frame lists indexes and
+iterates it unchanged.
+"""
+
+import numpy
+import torch
+from PIL import Image
+
+# How much a growing buffer over-allocates when a frame does not fit
+GROWTH_FACTOR = 1.5
+
+
+def rgb_frames(frames):
+    """A (frames, height, width, channels) array as uint8 RGB.
+
+    Float frames are taken to be [0, 1] - diffusers' np output convention.
+    Frames that already are uint8 RGB are returned as they are.
+    """
+    if frames.dtype != numpy.uint8:
+        frames = (numpy.clip(frames, 0.0, 1.0) * 255).round().astype(numpy.uint8)
+    if frames.shape[-1] == 1:
+        frames = numpy.repeat(frames, 3, axis=-1)
+    elif frames.shape[-1] == 4:
+        frames = frames[..., :3]
+    return frames
+
+
+def rgb_frame(frame):
+    """One frame - PIL image, array or tensor - as a (height, width, 3) uint8 array."""
+    if isinstance(frame, Image.Image):
+        return numpy.asarray(frame.convert("RGB"))
+    if torch.is_tensor(frame):
+        frame = frame.detach().cpu().numpy()
+    frame = numpy.asarray(frame)
+    # Channels-first (C, H, W) -> channels-last
+    if frame.shape[0] in (1, 3, 4) and frame.shape[-1] not in (1, 3, 4):
+        frame = numpy.moveaxis(frame, 0, -1)
+    return rgb_frames(frame[numpy.newaxis])[0]
+
+
+def rgb_frame_array(frames):
+    """A (frames, height, width, channels) array or tensor as uint8 RGB, channels last.
+
+    Tensors are moved to the CPU and shared with, not copied, when already uint8
+    channels-last; a one-video batch is unwrapped.
+    """
+    if frames.ndim == 5 and frames.shape[0] == 1:
+        frames = frames[0]
+    if torch.is_tensor(frames):
+        frames = frames.detach().cpu()
+        # (frames, channels, height, width) -> channels-last
+        if frames.shape[1] in (1, 3, 4) and frames.shape[-1] not in (1, 3, 4):
+            frames = frames.permute(0, 2, 3, 1)
+        frames = frames.numpy()
+    return rgb_frames(frames)
+
+
+class FrameBuffer:
+    """A video's frames as one (frames, height, width, 3) uint8 array.
+
+    Indexing a frame gives a PIL image made from it on access; indexing a slice
+    gives a FrameBuffer viewing the same memory. A buffer made with capacity to
+    spare is filled with append().
+
+    Args:
+        array: The frames, uint8 (frames, height, width, 3). Held, not copied
+    """
+
+    def __init__(self, array):
+        if array.ndim != 4 or array.shape[-1] != 3 or array.dtype != numpy.uint8:
+            raise ValueError(
+                f"A FrameBuffer holds uint8 (frames, height, width, 3) frames, "
+                f"not {array.dtype} {tuple(array.shape)}"
+            )
+        self._storage = array
+        self._length = len(array)
+
+    @classmethod
+    def allocate(cls, capacity, height, width, path=None):
+        """An empty buffer with room for capacity frames.
+
+        Args:
+            capacity: Frames it holds before append() has to grow it
+            height, width: Frame size
+            path: A .npy file to memory-map the frames into, instead of memory
+
+        Returns:
+            The FrameBuffer, with no frames yet
+        """
+        shape = (capacity, height, width, 3)
+        if path is None:
+            storage = numpy.empty(shape, dtype=numpy.uint8)
+        else:
+            storage = numpy.lib.format.open_memmap(
+                path, mode="w+", dtype=numpy.uint8, shape=shape
+            )
+        buffer = cls(storage)
+        buffer._length = 0
+        return buffer
+
+    @classmethod
+    def open(cls, path, writable=False):
+        """Memory-map the frames a buffer saved to a .npy file."""
+        return cls(numpy.load(path, mmap_mode="r+" if writable else "r"))
+
+    @classmethod
+    def from_frames(cls, frames):
+        """The frames of a list, array or tensor, as a FrameBuffer.
+
+        A FrameBuffer is returned as it is and a uint8 RGB array is wrapped
+        without a copy. Anything else is converted a frame at a time into one
+        allocation, never holding a second copy of the whole video.
+        """
+        if isinstance(frames, FrameBuffer):
+            return frames
+        if isinstance(frames, numpy.ndarray) or torch.is_tensor(frames):
+            return cls(numpy.ascontiguousarray(rgb_frame_array(frames)))
+
+        frames = list(frames)
+        if not frames:
+            raise ValueError("Cannot make a FrameBuffer of no frames")
+        first = rgb_frame(frames[0])
+        buffer = cls.allocate(len(frames), *first.shape[:2])
+        buffer.append(first[numpy.newaxis])
+        for frame in frames[1:]:
+            buffer.append(rgb_frame(frame)[numpy.newaxis])
+        return buffer
+
+    @property
+    def array(self):
+        """The frames, as the buffer's own memory."""
+        return self._storage[: self._length]
+
+    @property
+    def shape(self):
+        return (self._length,) + self._storage.shape[1:]
+
+    @property
+    def height(self):
+        return self._storage.shape[1]
+
+    @property
+    def width(self):
+        return self._storage.shape[2]
+
+    @property
+    def capacity(self):
+        return len(self._storage)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return FrameBuffer(self.array[index])
+        return Image.fromarray(self.array[index])
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield Image.fromarray(self._storage[index])
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.array
+        if dtype is not None and dtype != array.dtype:
+            return array.astype(dtype)
+        return array.copy() if copy else array
+
+    def __dlpack__(self, **kwargs):
+        return self.array.__dlpack__(**kwargs)
+
+    def __dlpack_device__(self):
+        return self.array.__dlpack_device__()
+
+    def as_tensor(self):
+        """The frames as a uint8 torch tensor sharing the buffer's memory."""
+        return torch.from_numpy(self.array)
+
+    def append(self, frames):
+        """Copy frames onto the end of the buffer, growing it if they do not fit.
+
+        Args:
+            frames: A (frames, height, width, channels) array or tensor, a list
+                of frames, or a FrameBuffer, of this buffer's frame size
+        """
+        if isinstance(frames, FrameBuffer):
+            frames = frames.array
+        elif isinstance(frames, numpy.ndarray) or torch.is_tensor(frames):
+            frames = rgb_frame_array(frames)
+        else:
+            frames = numpy.stack([rgb_frame(frame) for frame in frames])
+        if frames.shape[1:3] != self._storage.shape[1:3]:
+            raise ValueError(
+                f"Frames of {frames.shape[2]}x{frames.shape[1]} cannot join a "
+                f"{self.width}x{self.height} video"
+            )
+
+        end = self._length + len(frames)
+        if end > self.capacity:
+            if isinstance(self._storage, numpy.memmap):
+                raise ValueError(
+                    f"A memory-mapped FrameBuffer holds {self.capacity} frames, "
+                    f"not {end}"
+                )
+            capacity = max(end, int(self.capacity * GROWTH_FACTOR))
+            storage = numpy.empty(
+                (capacity,) + self._storage.shape[1:], dtype=numpy.uint8
+            )
+            storage[: self._length] = self.array
+            self._storage = storage
+        self._storage[self._length : end] = frames
+        self._length = end
+
+    def save(self, path):
+        """Write the frames to a .npy file that open() memory-maps."""
+        numpy.save(path, self.array)
@@ -0,0 +1,155 @@
+"""Images gathered by reference and decoded when a step uses them.
+
+gather_images decoded every file its glob matched before the step could start, one
+after another - a folder of 5,000 images was 5,000 decodes, and all of them held in
+memory, before the first caption or upscale ran. A LazyImage names the file or URL,
+validated when it is gathered, and decodes it when a step's iteration takes it.
+
+Images gathered together share an ImagePrefetcher. Loading one starts decoding
+the next few on a small thread pool, so a step working through them in order
+finds each already decoded. Only those few wait in memory, and a decoded image is
+handed over, not kept - a step over 5,000 images holds a handful at a time. Once
+the last image is handed over the pool is shut down and anything still waiting is
+dropped, so gathered images a cached result keeps hold no threads or pixels.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from diffusers.utils import load_image
+from PIL import Image
+
+from .media_cache import cached_path
+
+logger = logging.getLogger("dw")
+
+# Images decoded ahead of the one a step is using
+DEFAULT_PREFETCH = 4
+
+
+class LazyImage:
+    """An image file or URL, decoded on load().
+
+    Args:
+        location: Validated file path or URL
+        max_size: Longest side to scale the image down to as it loads, or None
+    """
+
+    def __init__(self, location, max_size=None):
+        self.location = location
+        self.max_size = max_size
+        self.prefetcher = None
+        self.index = None
+
+    def __repr__(self):
+        return f"LazyImage({self.location!r})"
+
+    def load(self):
+        """The decoded RGB image - from the prefetcher, when one decoded it ahead."""
+        if self.prefetcher is not None:
+            return self.prefetcher.load(self.index)
+        return self.decode()
+
+    def decode(self):
+        """Decode the image now, downscaled to max_size."""
+        path = self.location
+        if path.startswith(("http://", "https://")):
+            path = cached_path(path)
+        image = Image.open(path)
+        if self.max_size is not None:
+            # JPEG decodes straight to a reduced scale no smaller than asked
+            image.draft("RGB", (self.max_size, self.max_size))
+        image = load_image(image)
+        if self.max_size is not None and max(image.size) > self.max_size:
+            image.thumbnail((self.max_size, self.max_size), Image.Resampling.LANCZOS)
+        return image
+
+
+class ImagePrefetcher:
+    """Decodes gathered images a few ahead of the one being loaded.
+
+    Args:
+        images: The LazyImages, in the order steps consume them. Each is bound to
+            this prefetcher
+        prefetch: Images decoded ahead - the threads decoding them, and the most
+            that wait in memory
+    """
+
+    def __init__(self, images, prefetch=DEFAULT_PREFETCH):
+        self.images = list(images)
+        self.prefetch = max(int(prefetch), 0)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.pool = None
+        for index, image in enumerate(self.images):
+            image.prefetcher = self
+            image.index = index
+
+    def load(self, index):
+        """Hand over an image, and start decoding the ones after it."""
+        with self.lock:
+            future = self.pending.pop(index, None)
+            if index == len(self.images) - 1:
+                # Nothing follows to decode ahead - what is still pending was skipped
+                self._close()
+            else:
+                self._schedule(index + 1)
+        if future is None:
+            return self.images[index].decode()
+        return future.result()
+
+    def _close(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        if self.pool is not None:
+            # The future just popped is left to finish - its image is being handed over
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+    def _schedule(self, start):
+        if not self.prefetch:
+            return
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(
+                self.prefetch, thread_name_prefix="dw-prefetch"
+            )
+        for index in range(start, min(start + self.prefetch, len(self.images))):
+            if index not in self.pending:
+                self.pending[index] = self.pool.submit(self.images[index].decode)
+
+
+def load_lazy_images(value):
+    """A step's arguments with every LazyImage in them decoded.
+
+    Containers holding one are copied rather than changed - iterations share the
+    values of their argument template.
+
+    Args:
+        value: Arguments - a dict, a list, or a single value
+
+    Returns:
+        The arguments, LazyImages replaced by their images
+    """
+    if isinstance(value, LazyImage):
+        return value.load()
+    if isinstance(value, dict):
+        if any(_holds_lazy_image(item) for item in value.values()):
+            return {key: load_lazy_images(item) for key, item in value.items()}
+        return value
+    if isinstance(value, list):
+        if any(_holds_lazy_image(item) for item in value):
+            return [load_lazy_images(item) for item in value]
+        return value
+    return value
+
+
+def _holds_lazy_image(value):
+    if isinstance(value, LazyImage):
+        return True
+    if isinstance(value, dict):
+        return any(_holds_lazy_image(item) for item in value.values())
+    if isinstance(value, list):
+        return any(_holds_lazy_image(item) for item in value)
+    return False
@@ -0,0 +1,256 @@
+"""Media from URLs kept on disk, revalidated rather than downloaded again.
+
+An image, video or audio track given by URL was downloaded every time its argument
+was realized - every run of a workflow, and in the REPL every `workflow run`, since
+the definition is copied and realized afresh each time. A run over a handful of
+remote references spent its first seconds on the network for bytes it already had.
+
+Downloads are kept in the media_cache directory under the settings directory, one
+file per URL. A URL fetched again is asked for only if it changed - If-None-Match
+with the ETag it was served with, If-Modified-Since with its Last-Modified - and a
+304 answer serves the file on disk. When the server cannot be reached, the cached
+copy is used with a warning. Offline mode (media_cache_offline in settings.json, or
+DW_OFFLINE=1) never touches the network: a cached URL is served as it is and one
+that is not cached raises.
+
+Files are evicted least recently used first once they pass media_cache_size. All
+requests share one pooled session, so URLs on the same host reuse a connection, and
+connection errors and 5xx responses are retried.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+from . import settings
+from .settings import parse_size, resolve_path
+
+logger = logging.getLogger("dw")
+
+DEFAULT_DIRECTORY = "media_cache"
+DEFAULT_MAX_BYTES = 2 * 1024**3
+DEFAULT_TIMEOUT = 60
+DEFAULT_RETRIES = 3
+# Connections kept open per host - gathered images are fetched on several threads
+POOL_CONNECTIONS = 8
+CHUNK_BYTES = 1024**2
+
+_METADATA_SUFFIX = ".headers.json"
+_PARTIAL_PREFIX = ".partial-"
+
+
+class MediaCache:
+    """URL downloads kept in a directory, under a size cap.
+
+    Args:
+        directory: Where the files are kept
+        max_bytes: Total size of the files before the least recently used are
+            evicted. The file just fetched is never evicted, so 0 keeps only that
+        offline: Serve only what is cached, without touching the network
+        timeout: Seconds to wait on a server before giving up
+        retries: Attempts after a connection error or 5xx response
+    """
+
+    def __init__(
+        self,
+        directory,
+        max_bytes=DEFAULT_MAX_BYTES,
+        offline=False,
+        timeout=DEFAULT_TIMEOUT,
+        retries=DEFAULT_RETRIES,
+    ):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.timeout = timeout
+        self.downloads = 0
+        self.revalidations = 0
+
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+        )
+        adapter = HTTPAdapter(
+            pool_connections=POOL_CONNECTIONS,
+            pool_maxsize=POOL_CONNECTIONS,
+            max_retries=retry,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+
+    def fetch(self, url):
+        """A local copy of a URL, downloaded only if it is new or has changed.
+
+        Args:
+            url: A validated http(s) URL
+
+        Returns:
+            Path of the cached file. Its extension is the URL's, for loaders that
+            go by it
+
+        Raises:
+            ValueError: If offline mode is on and the URL is not cached
+            requests.RequestException: If the download fails and nothing is cached
+        """
+        import requests
+
+        path, metadata_path = self._paths(url)
+        metadata = self._read_metadata(metadata_path) if path.exists() else None
+
+        if self.offline:
+            if metadata is None:
+                raise ValueError(
+                    f"{url} is not in the media cache, and offline mode is on"
+                )
+            logger.debug(f"Serving {url} from the media cache (offline)")
+            return self._used(path)
+
+        headers = {}
+        if metadata is not None:
+            if metadata.get("etag"):
+                headers["If-None-Match"] = metadata["etag"]
+            if metadata.get("last_modified"):
+                headers["If-Modified-Since"] = metadata["last_modified"]
+
+        try:
+            response = self.session.get(
+                url, headers=headers, stream=True, timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            if metadata is None:
+                raise
+            logger.warning(f"Could not revalidate {url} ({e}) - using the cached copy")
+            return self._used(path)
+
+        with response:
+            if response.status_code == 304 and metadata is not None:
+                logger.debug(f"{url} is unchanged - serving it from the media cache")
+                self.revalidations += 1
+                return self._used(path)
+            response.raise_for_status()
+            logger.debug(f"Downloading {url} into the media cache")
+            self._store(url, response, path, metadata_path)
+            self.downloads += 1
+
+        self._evict(keep=path)
+        return str(path)
+
+    def clear(self):
+        """Delete every cached file."""
+        with self._lock:
+            for entry in self.directory.iterdir():
+                entry.unlink(missing_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+        extension = os.path.splitext(urlparse(url).path)[1].lower()
+        if not extension[1:].isalnum() or len(extension) > 6:
+            extension = ""
+        return (
+            self.directory / f"{key}{extension}",
+            self.directory / f"{key}{_METADATA_SUFFIX}",
+        )
+
+    def _read_metadata(self, metadata_path):
+        try:
+            with open(metadata_path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, url, response, path, metadata_path):
+        # Written beside the entry and renamed over it, so a reader never sees half
+        # a file and two threads fetching one URL both leave a whole one
+        descriptor, partial = tempfile.mkstemp(
+            prefix=_PARTIAL_PREFIX, dir=self.directory
+        )
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                for chunk in response.iter_content(CHUNK_BYTES):
+                    file.write(chunk)
+            os.replace(partial, path)
+        except BaseException:
+            os.unlink(partial)
+            raise
+
+        metadata = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        with open(metadata_path, "w") as file:
+            json.dump(metadata, file)
+
+    def _used(self, path):
+        # Access time orders eviction - set on every use. The modification time is
+        # left alone: it says when the file was downloaded, and decoded copies of
+        # it are keyed by it
+        try:
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except OSError:
+            pass
+        return str(path)
+
+    def _evict(self, keep):
+        with self._lock:
+            entries = []
+            for entry in self.directory.iterdir():
+                name = entry.name
+                if name.startswith(_PARTIAL_PREFIX) or name.endswith(_METADATA_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, entry))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries, key=lambda item: item[0]):
+                if total <= self.max_bytes:
+                    break
+                if entry == keep:
+                    continue
+                logger.debug(f"Evicting {entry.name} from the media cache")
+                entry.unlink(missing_ok=True)
+                key = entry.name.split(".")[0]
+                (self.directory / f"{key}{_METADATA_SUFFIX}").unlink(missing_ok=True)
+                total -= size
+
+
+_cache = None
+
+
+def get_media_cache():
+    """The process-wide media cache, configured from settings."""
+    global _cache
+    if _cache is None:
+        size = getattr(settings, "media_cache_size", None)
+        offline = os.environ.get("DW_OFFLINE", "").lower() in ("1", "true", "yes")
+        _cache = MediaCache(
+            resolve_path(
+                getattr(settings, "media_cache_dir", None) or DEFAULT_DIRECTORY
+            ),
+            DEFAULT_MAX_BYTES if size is None else parse_size(size),
+            offline=offline or bool(getattr(settings, "media_cache_offline", False)),
+        )
+    return _cache
+
+
+def cached_path(url):
+    """A local copy of a validated URL, through the process-wide media cache."""
+    return get_media_cache().fetch(url)
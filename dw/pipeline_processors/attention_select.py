@@ -0,0 +1,390 @@
+"""Pick the fastest attention backend for each attention shape, and remember it.
+
+Which backend wins depends on the GPU, the dtype, the head dimension and the
+sequence length, and naming one per pipeline meant probing them by hand - a backend
+missing its package, rejecting the dtype or quantizing too coarsely only shows up
+once a run is under way. With "attention_backend": "auto" the first attention call
+at a shape - (model, head_dim, sequence lengths, dtype, device) - times every
+backend diffusers' dispatcher can run there on that call's own query, key and
+value. A backend that raises, or whose output strays from native SDPA's by more
+than the dtype's tolerance, is rejected. The fastest of the rest is stored in a
+table in the settings directory and used for that shape from then on, in this run
+and every later one.
+
+The choice is made where the dispatcher calls its active backend, so attention of
+any processor that dispatches through diffusers is covered, at every shape it sees
+- self and cross attention of one model can settle on different backends. Hub
+kernels are downloaded when first used, so they are not benchmarked; pin one by
+name to use it.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import torch
+
+from .. import settings
+from ..settings import resolve_path
+
+logger = logging.getLogger("dw")
+
+AUTO_BACKEND = "auto"
+DEFAULT_TABLE = "attention_backends.json"
+
+# Timed calls per backend, after one untimed call
+BENCHMARK_REPEATS = 3
+# Mean relative error against native SDPA a backend may have, by dtype. Half
+# precision leaves room for the int8 quantization of SageAttention
+MAX_RELATIVE_ERROR = {torch.float32: 1e-3, torch.float64: 1e-6}
+DEFAULT_MAX_RELATIVE_ERROR = 3e-2
+
+# The reference every backend's output is compared with
+REFERENCE_BACKEND = "native"
+# Both materialize the whole score matrix - flex unfused without torch.compile,
+# _native_math by design - so a video-length sequence runs out of memory
+_EXCLUDED_BACKENDS = {"flex", "_native_math"}
+
+
+def _dispatch():
+    from diffusers.models import attention_dispatch
+
+    return attention_dispatch
+
+
+def available_backends():
+    """The backends diffusers has registered and can run here, hub kernels excluded."""
+    dispatch = _dispatch()
+    names = []
+    for backend in dispatch._AttentionBackendRegistry.list_backends():
+        name = backend.value
+        if name.endswith("_hub") or name in _EXCLUDED_BACKENDS:
+            continue
+        try:
+            dispatch._check_attention_backend_requirements(backend)
+        except (RuntimeError, ValueError):
+            continue
+        names.append(name)
+    return names
+
+
+def device_name(device):
+    """The device as the table records it - the GPU model, not its index."""
+    device = torch.device(device)
+    if device.type == "cuda" and torch.cuda.is_available():
+        return torch.cuda.get_device_name(device)
+    return device.type
+
+
+def shape_key(model, query, key, attn_mask=None):
+    """The table key of an attention call.
+
+    diffusers lays attention inputs out as (batch, sequence, heads, head_dim).
+    """
+    masked = "|masked" if attn_mask is not None else ""
+    return (
+        f"{model}|head_dim={query.shape[-1]}|seq={query.shape[1]}x{key.shape[1]}|"
+        f"{str(query.dtype).removeprefix('torch.')}|{device_name(query.device)}"
+        f"{masked}"
+    )
+
+
+def _synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    elif device.type == "mps" and hasattr(torch.mps, "synchronize"):
+        torch.mps.synchronize()
+
+
+def _relative_error(output, reference):
+    output, reference = output.float(), reference.float()
+    scale = reference.abs().mean()
+    error = (output - reference).abs().mean()
+    return float(error / scale) if scale > 0 else float(error)
+
+
+def _run_backend(name, arguments, native=None):
+    dispatch = _dispatch()
+    backend = dispatch.AttentionBackendName(name)
+    # The dispatcher only checks a backend's constraints when DIFFUSERS_ATTN_CHECKS
+    # is set - check them here, so a backend that cannot take these inputs is
+    # rejected rather than trusted
+    for check in dispatch._AttentionBackendRegistry._constraints.get(backend, []):
+        check(**arguments)
+    if native is not None and name == REFERENCE_BACKEND:
+        return native(**arguments)
+    return dispatch.dispatch_attention_fn(**arguments, backend=backend)
+
+
+def benchmark_backends(
+    query,
+    key,
+    value,
+    attn_mask=None,
+    is_causal=False,
+    scale=None,
+    backends=None,
+    repeats=BENCHMARK_REPEATS,
+    native=None,
+):
+    """Time each backend on one attention call's inputs.
+
+    Args:
+        query, key, value: The call's inputs, (batch, sequence, heads, head_dim)
+        attn_mask, is_causal, scale: The call's other arguments
+        backends: Backend names to try. Defaults to available_backends()
+        repeats: Timed calls per backend
+        native: The native backend's function, when the registry's entry for it is
+            the auto backend itself
+
+    Returns:
+        dict with 'backend', the fastest backend that ran and matched native SDPA,
+        'timings_ms' per accepted backend and 'rejected', the reason per rejected
+        one
+
+    Raises:
+        RuntimeError: If no backend ran and matched
+    """
+    arguments = dict(
+        query=query,
+        key=key,
+        value=value,
+        attn_mask=attn_mask,
+        dropout_p=0.0,
+        is_causal=is_causal,
+        scale=scale,
+    )
+    if backends is None:
+        backends = available_backends()
+    tolerance = MAX_RELATIVE_ERROR.get(query.dtype, DEFAULT_MAX_RELATIVE_ERROR)
+    reference = _run_backend(REFERENCE_BACKEND, arguments, native)
+
+    timings, rejected = {}, {}
+    for name in backends:
+        try:
+            output = _run_backend(name, arguments, native)
+            error = _relative_error(output, reference)
+            if not error <= tolerance:
+                rejected[name] = f"relative error {error:.2e} over {tolerance:.0e}"
+                continue
+            _synchronize(query.device)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                _run_backend(name, arguments, native)
+            _synchronize(query.device)
+        except Exception as e:
+            message = (str(e).splitlines() or [""])[0][:200]
+            rejected[name] = f"{type(e).__name__}: {message}"
+            continue
+        timings[name] = (time.perf_counter() - start) / repeats * 1000
+
+    if not timings:
+        raise RuntimeError(
+            f"No attention backend ran and matched native attention: {rejected}"
+        )
+    return {
+        "backend": min(timings, key=timings.get),
+        "timings_ms": timings,
+        "rejected": rejected,
+    }
+
+
+class AttentionBackendTable:
+    """The backend chosen per attention shape, stored as JSON.
+
+    Args:
+        path: The JSON file. Read on first use; written whenever a shape is added
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as file:
+                    self._entries = json.load(file).get("entries", {})
+            except FileNotFoundError:
+                self._entries = {}
+            except (json.JSONDecodeError, AttributeError) as e:
+                logger.warning(
+                    f"Ignoring unreadable attention backend table {self.path}: {e}"
+                )
+                self._entries = {}
+        return self._entries
+
+    def get(self, key):
+        """The entry stored for a shape, or None."""
+        with self._lock:
+            return self._load().get(key)
+
+    def put(self, key, entry):
+        """Store a shape's entry and write the table."""
+        with self._lock:
+            entries = self._load()
+            entries[key] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Written aside and moved into place, so a run that dies mid-write
+            # leaves the previous table rather than half of one
+            temporary = self.path.with_name(self.path.name + ".tmp")
+            with open(temporary, "w") as file:
+                json.dump({"entries": entries}, file, indent=2)
+            os.replace(temporary, self.path)
+
+    def forget(self, key):
+        """Drop a shape's entry, so it is benchmarked again."""
+        with self._lock:
+            self._load().pop(key, None)
+
+    def entries(self):
+        with self._lock:
+            return dict(self._load())
+
+
+_table = None
+
+
+def get_attention_backend_table():
+    """The process-wide table, at the path read from settings."""
+    global _table
+    if _table is None:
+        path = getattr(settings, "attention_backend_table", None) or DEFAULT_TABLE
+        _table = AttentionBackendTable(resolve_path(path))
+    return _table
+
+
+class _AutoBackend:
+    """Stands in for the active backend, calling the one chosen for each shape."""
+
+    def __init__(self, model, original, table):
+        self.model = model
+        self.original = original
+        self.table = table
+        self.chosen = {}
+
+    def choose(self, query, key, value, attn_mask, is_causal, scale):
+        shape = shape_key(self.model, query, key, attn_mask)
+        name = self.chosen.get(shape)
+        if name is not None:
+            return name
+
+        entry = self.table.get(shape)
+        if entry is not None and entry.get("backend") in available_backends():
+            name = entry["backend"]
+            logger.debug(f"Attention {shape}: {name}, from the backend table")
+        else:
+            if entry is not None:
+                logger.info(
+                    f"Attention backend {entry.get('backend')} stored for {shape} is "
+                    f"no longer available - benchmarking again"
+                )
+                self.table.forget(shape)
+            result = benchmark_backends(
+                query, key, value, attn_mask, is_causal, scale, native=self.original
+            )
+            name = result["backend"]
+            self.table.put(shape, {**result, "torch": torch.__version__})
+            timings = ", ".join(
+                f"{backend} {ms:.2f}ms"
+                for backend, ms in sorted(
+                    result["timings_ms"].items(), key=lambda item: item[1]
+                )
+            )
+            logger.info(f"Attention {shape}: chose {name} ({timings})")
+            for backend, reason in result["rejected"].items():
+                logger.debug(f"Attention backend {backend} rejected: {reason}")
+        self.chosen[shape] = name
+        return name
+
+    def __call__(
+        self,
+        query,
+        key,
+        value,
+        attn_mask=None,
+        dropout_p=0.0,
+        is_causal=False,
+        scale=None,
+        enable_gqa=False,
+        return_lse=False,
+        _parallel_config=None,
+    ):
+        arguments = dict(
+            query=query,
+            key=key,
+            value=value,
+            attn_mask=attn_mask,
+            dropout_p=dropout_p,
+            is_causal=is_causal,
+            scale=scale,
+            enable_gqa=enable_gqa,
+            return_lse=return_lse,
+            _parallel_config=_parallel_config,
+        )
+        # Context parallel, log-sum-exp and grouped-query calls stay on native, which
+        # handles them; the benchmark times plain attention
+        if (
+            _parallel_config is not None
+            or return_lse
+            or enable_gqa
+            or query.shape[2] != key.shape[2]
+        ):
+            return self.original(**arguments)
+        name = self.choose(query, key, value, attn_mask, is_causal, scale)
+        if name == REFERENCE_BACKEND:
+            return self.original(**arguments)
+        dispatch = _dispatch()
+        return dispatch.dispatch_attention_fn(
+            query,
+            key,
+            value,
+            attn_mask=attn_mask,
+            dropout_p=dropout_p,
+            is_causal=is_causal,
+            scale=scale,
+            backend=dispatch.AttentionBackendName(name),
+        )
+
+
+def attention_model_name(pipeline):
+    """What the table keys a pipeline's attention by - its denoiser's class."""
+    from .pipeline import get_cache_transformer
+
+    transformer = get_cache_transformer(pipeline)
+    return type(transformer if transformer is not None else pipeline).__name__
+
+
+@contextlib.contextmanager
+def auto_attention_backend(pipeline, table=None):
+    """Run attention dispatched through diffusers on the best backend per shape.
+
+    Args:
+        pipeline: The diffusers pipeline, whose denoiser names its shapes
+        table: The AttentionBackendTable. Defaults to the process-wide one
+    """
+    dispatch = _dispatch()
+    registry = dispatch._AttentionBackendRegistry
+    native = dispatch.AttentionBackendName(REFERENCE_BACKEND)
+    original = registry._backends[native]
+    auto = _AutoBackend(
+        attention_model_name(pipeline),
+        original,
+        table if table is not None else get_attention_backend_table(),
+    )
+
+    # Calls made with no backend of their own run the active backend - native,
+    # here standing in for whichever backend each shape chose
+    previous = registry._active_backend
+    registry._backends[native] = auto
+    registry.set_active_backend(native)
+    try:
+        yield auto
+    finally:
+        registry._backends[native] = original
+        registry.set_active_backend(previous)
@@ -0,0 +1,339 @@
+"""Report what a transformer cache actually skipped.
+
+first_block, mag, faster, taylorseer and TeaCache each decide per step whether the
+transformer's blocks run, and none of them said what it decided. A threshold change
+could buy 5% or 40% and the log looked the same; a cache whose hooks never fired,
+on a modular pipeline that denoises through a component they are not on, looked like
+one that worked.
+
+Each pipeline call with a cache on is watched from the transformer's blocks. Every
+Linear layer inside a block counts the weights it multiplies when it runs, so a
+block a cache skipped - wholly, or only its attention as FasterCache does - shows up
+as work not done, whichever cache did the skipping. Per transformer call this gives
+the blocks computed and reused and the step and guidance branch it belongs to, with
+the cache's accumulated error where the cache keeps one. Block compute saved is
+estimated against the most work a call did, which a cache's always-computed first
+step provides.
+
+A compiled block would recompile for every hook added and removed around it, so
+blocks are not watched under torch.compile; transformer calls are still counted.
+"""
+
+import contextlib
+import logging
+import threading
+
+import torch
+
+logger = logging.getLogger("dw")
+
+# Transformer calls of the last pipeline call kept per step in stats()
+MAX_STEP_RECORDS = 1000
+
+
+def _is_compiled(module):
+    return (
+        getattr(module, "_compiled_call_impl", None) is not None
+        or type(module).__name__ == "OptimizedModule"
+    )
+
+
+def transformer_blocks(transformer):
+    """The transformer's blocks: every module in its ModuleLists of layers.
+
+    Refiner stacks that no cache skips are blocks too, so the compute saved is a
+    share of everything the blocks do.
+    """
+    blocks = []
+    for child in transformer.children():
+        if isinstance(child, torch.nn.ModuleList):
+            blocks.extend(
+                block for block in child if next(block.parameters(), None) is not None
+            )
+    return blocks
+
+
+class CallTelemetry:
+    """What a cache computed and reused over one pipeline call.
+
+    Args:
+        method: The cache - 'teacache', or the cache type: 'first_block', 'mag',
+            'faster', 'taylorseer'
+        transformer: The transformer it caches
+    """
+
+    def __init__(self, method, transformer):
+        self.method = method
+        self.transformer_class = type(transformer).__name__
+        self.transformer = transformer
+        self.steps = []
+        self.watched = False
+        self.signal = None
+
+        self._blocks = []
+        self._work = {}
+        self._full_work = {}
+        self._handles = []
+        self._step = -1
+        self._branch = 0
+        self._previous_timestep = None
+
+    # -- Hooks -------------------------------------------------------------
+
+    def _count(self, block):
+        def hook(module, args, output):
+            self._work[block] = self._work.get(block, 0) + module.weight.numel()
+
+        return hook
+
+    def _begin(self, module, args, kwargs):
+        timestep = kwargs.get("timestep", None)
+        # A call repeating the previous call's timestep is the next guidance
+        # branch of the same step, as TeaCache tells them apart
+        if (
+            isinstance(timestep, torch.Tensor)
+            and self._previous_timestep is not None
+            and timestep.shape == self._previous_timestep.shape
+            and torch.equal(timestep, self._previous_timestep)
+        ):
+            self._branch += 1
+        else:
+            self._branch = 0
+            self._step += 1
+        if isinstance(timestep, torch.Tensor):
+            self._previous_timestep = timestep.detach().clone()
+        self._work = {}
+        self.signal = None
+
+    def _end(self, module, args, kwargs, output):
+        if len(self.steps) >= MAX_STEP_RECORDS:
+            return
+        record = {"step": self._step, "branch": self._branch}
+        if self.watched:
+            for block, work in self._work.items():
+                self._full_work[block] = max(self._full_work.get(block, 0), work)
+            record["blocks_computed"] = len(self._work)
+            record["blocks_total"] = len(self._blocks)
+            record["work"] = sum(self._work.values())
+        signal = self.signal if self.signal is not None else self._diffusers_signal()
+        record["signal"] = signal
+        self.steps.append(record)
+
+    def _diffusers_signal(self):
+        # MagCache keeps the error it accumulated since the last computed step in
+        # the state of its block hooks
+        for block in self._blocks[:1]:
+            registry = getattr(block, "_diffusers_hook", None)
+            if registry is None:
+                continue
+            for hook in registry.hooks.values():
+                state_manager = getattr(hook, "state_manager", None)
+                if state_manager is None:
+                    continue
+                try:
+                    state = state_manager.get_state()
+                except (ValueError, RuntimeError, KeyError):
+                    continue
+                value = getattr(state, "accumulated_err", None)
+                if value is not None:
+                    return float(value)
+        return None
+
+    def note_signal(self, value):
+        """The accumulated error the cache compared with its threshold this call."""
+        self.signal = float(value)
+
+    def install(self):
+        transformer = self.transformer
+        self._handles.append(
+            transformer.register_forward_pre_hook(self._begin, with_kwargs=True)
+        )
+        self._handles.append(
+            transformer.register_forward_hook(self._end, with_kwargs=True)
+        )
+        if _is_compiled(transformer):
+            return
+        self._blocks = transformer_blocks(transformer)
+        if any(_is_compiled(block) for block in self._blocks):
+            logger.debug("Cache telemetry does not watch compiled transformer blocks")
+            self._blocks = []
+            return
+        for block in self._blocks:
+            linears = [
+                module
+                for module in block.modules()
+                if isinstance(module, torch.nn.Linear)
+            ]
+            for module in linears:
+                self._handles.append(module.register_forward_hook(self._count(block)))
+        self.watched = bool(self._blocks)
+
+    def remove(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        self.transformer = None
+
+    # -- Results -----------------------------------------------------------
+
+    def summary(self):
+        """Totals over the call, with the record of each transformer call."""
+        calls = len(self.steps)
+        summary = {
+            "method": self.method,
+            "transformer": self.transformer_class,
+            "transformer_calls": calls,
+            "steps": len({record["step"] for record in self.steps}),
+            "calls_computed": None,
+            "calls_reused": None,
+            "blocks_computed": None,
+            "blocks_total": None,
+            "compute_saved": None,
+            "records": self.steps,
+        }
+        if not self.watched or not calls:
+            return summary
+
+        full_work = sum(self._full_work.values())
+        total_blocks = sum(record["blocks_total"] for record in self.steps)
+        computed_blocks = sum(record["blocks_computed"] for record in self.steps)
+        work = sum(record["work"] for record in self.steps)
+        computed = sum(
+            1 for record in self.steps if full_work and record["work"] >= full_work
+        )
+        summary.update(
+            calls_computed=computed,
+            calls_reused=calls - computed,
+            blocks_computed=computed_blocks,
+            blocks_total=total_blocks,
+            compute_saved=1 - work / (full_work * calls) if full_work else 0.0,
+        )
+        return summary
+
+
+def describe(summary):
+    """One line saying what a call's cache did."""
+    prefix = f"Cache telemetry ({summary['method']} on {summary['transformer']}): "
+    calls = summary["transformer_calls"]
+    if summary["blocks_total"] is None:
+        return f"{prefix}{calls} transformer calls over {summary['steps']} steps"
+    return (
+        f"{prefix}{summary['calls_computed']} of {calls} transformer calls computed "
+        f"in full, {summary['blocks_computed']}/{summary['blocks_total']} blocks "
+        f"run, ~{summary['compute_saved']:.0%} of block compute saved"
+    )
+
+
+class CacheTelemetry:
+    """What caches skipped across pipeline calls, and in the last one."""
+
+    def __init__(self):
+        self.pipeline_calls = 0
+        self.transformer_calls = 0
+        self.blocks_computed = 0
+        self.blocks_total = 0
+        self.work_saved = 0.0
+        self.last = None
+        self._lock = threading.Lock()
+
+    def record(self, summary):
+        with self._lock:
+            self.pipeline_calls += 1
+            self.transformer_calls += summary["transformer_calls"]
+            if summary["blocks_total"] is not None:
+                self.blocks_computed += summary["blocks_computed"]
+                self.blocks_total += summary["blocks_total"]
+                self.work_saved += (
+                    summary["compute_saved"] * summary["transformer_calls"]
+                )
+            self.last = summary
+
+    def stats(self):
+        """Totals across calls, and the last call's summary."""
+        with self._lock:
+            watched_calls = self.transformer_calls if self.blocks_total else 0
+            return {
+                "pipeline_calls": self.pipeline_calls,
+                "transformer_calls": self.transformer_calls,
+                "blocks_computed": self.blocks_computed,
+                "blocks_total": self.blocks_total,
+                "compute_saved": (
+                    self.work_saved / watched_calls if watched_calls else 0.0
+                ),
+                "last_call": self.last,
+            }
+
+
+_telemetry = None
+_active = threading.local()
+
+
+def get_cache_telemetry():
+    """The process-wide cache telemetry."""
+    global _telemetry
+    if _telemetry is None:
+        _telemetry = CacheTelemetry()
+    return _telemetry
+
+
+def current_call():
+    """The CallTelemetry of the pipeline call in progress on this thread, or None."""
+    return getattr(_active, "call", None)
+
+
+def cache_method(pipeline, configuration):
+    """The cache a pipeline configuration runs its calls with, or None."""
+    if configuration.get("teacache", None) is not None:
+        return "teacache"
+    cache = configuration.get("cache", None)
+    if cache is None:
+        return None
+    from .pipeline import get_cache_transformer
+
+    transformer = get_cache_transformer(pipeline)
+    if transformer is None or not getattr(transformer, "is_cache_enabled", False):
+        return None
+    return cache.get("type", "cache")
+
+
+@contextlib.contextmanager
+def cache_telemetry_context(pipeline, configuration):
+    """Record what the pipeline's cache does over one call, and report it after.
+
+    Args:
+        pipeline: The diffusers pipeline
+        configuration: The pipeline configuration. cache_telemetry false turns
+            recording off
+    """
+    from .pipeline import get_cache_transformer
+
+    method = cache_method(pipeline, configuration)
+    transformer = get_cache_transformer(pipeline)
+    if (
+        method is None
+        or not configuration.get("cache_telemetry", True)
+        or not isinstance(transformer, torch.nn.Module)
+    ):
+        yield
+        return
+
+    call = CallTelemetry(method, transformer)
+    call.install()
+    _active.call = call
+    try:
+        yield
+    finally:
+        _active.call = None
+        call.remove()
+
+    summary = call.summary()
+    get_cache_telemetry().record(summary)
+    if summary["transformer_calls"] == 0:
+        logger.warning(
+            f"{method} cache is on, but {summary['transformer']} was never called - "
+            f"the pipeline denoises through something else and nothing was cached"
+        )
+    elif summary["calls_reused"] == 0 and summary["steps"] > 2:
+        logger.info(f"{describe(summary)} - the cache reused nothing")
+    else:
+        logger.info(describe(summary))
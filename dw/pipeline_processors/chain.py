@@ -19,6 +19,13 @@ Two ways to specify the length:
   chunks, and mux the final video with the original, unsliced track - so the
   soundtrack has no seams at all
 
+Three ways to hold the stitched frames:
+- in memory, until the result saves them (the default)
+- save_segments: true - each segment spills to its own file, and the final
+  video is streamed from them at save time
+- stream: true - each segment is encoded straight into the final video as it
+  finishes, and the audio muxed in once the chain ends
+
 The chain runs inside one cartesian iteration, so it composes with
 previous_result fan-out: three keyframes in, three chained videos out.
 """
@@ -28,11 +35,12 @@ import logging
 import math
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, wait
 from dataclasses import dataclass
 
 import numpy
 import torch
-from diffusers.utils import encode_video, is_av_available
+from diffusers.utils import is_av_available
 
 from .. import empty_device_cache
 from ..result import AudioVideo, get_artifact_list
@@ -43,7 +51,22 @@ from ..tasks.audio_utils import (
     frames_to_samples,
     slice_samples,
 )
-from ..tasks.video_utils import extract_frame, frames_as_pil_list
+from ..frame_buffer import FrameBuffer
+from ..video_source import VideoSource
+from ..tasks.video_utils import (
+    extract_frame,
+    frame_count,
+    frames_as_array,
+    frames_as_pil_list,
+)
+from ..video_writer import (
+    EncodedVideo,
+    VideoWriter,
+    remux_incompatibility,
+    remux_videos,
+    video_frame_count,
+    write_video,
+)
 
 logger = logging.getLogger("dw")
 
@@ -51,6 +74,10 @@ logger = logging.getLogger("dw")
 # previous_results.MAX_ITERATIONS
 MAX_SEGMENTS = 1000
 
+# Finished segments save_segments holds while the background encoder catches up -
+# the one being encoded and the one waiting behind it
+SPILL_QUEUE_SEGMENTS = 2
+
 
 class LastFrameContinuity:
     """Carry the last frame of each segment into the next as its keyframe."""
@@ -90,11 +117,11 @@ class LastSegmentContinuity:
         self.config = config
 
     def extract(self, artifact):
-        frames = frames_as_pil_list(artifact)
         audio, sample_rate = _generated_audio(artifact)
 
+        # Only the carried tail is converted - or, from a VideoSource, decoded
         carry_frames = self.config.carry_frames
-        if carry_frames is not None and carry_frames < len(frames):
+        if carry_frames is not None and carry_frames < frame_count(artifact):
             if audio is not None:
                 if self.config.fps is None:
                     raise ValueError(
@@ -103,7 +130,9 @@ class LastSegmentContinuity:
                     )
                 samples = frames_to_samples(carry_frames, self.config.fps, sample_rate)
                 audio = audio[:, -samples:]
-            frames = frames[-carry_frames:]
+            frames = frames_as_pil_list(artifact, -carry_frames)
+        else:
+            frames = frames_as_pil_list(artifact)
 
         if not self.config.carry_audio:
             audio, sample_rate = None, None
@@ -150,8 +179,11 @@ class SegmentedFrames:
     """Chained segments spilled to disk, replayed at save time.
 
     Iterating yields one uint8 (frames, height, width, 3) torch tensor per
-    segment file - the chunk shape encode_video streams from - so the final
-    video is written holding only one segment in memory at a time.
+    segment file - the chunk shape write_video streams from - so a video
+    encoded from them holds only one segment in memory at a time. write()
+    does better where it can: the segment files were all encoded alike, each
+    from its own keyframe, so their packets are copied into the final file
+    without decoding or encoding a frame.
     """
 
     def __init__(self, paths, total_frames=None, keep_files=False):
@@ -182,6 +214,64 @@ class SegmentedFrames:
             if remaining == 0:
                 return
 
+    def write(self, output_path, fps, audio=None, audio_sample_rate=None):
+        """Write the final video, remuxing the segment files where they allow it.
+
+        A match_audio tail trim that ends inside a segment re-encodes that
+        segment's kept frames alone. When the files cannot be joined packet for
+        packet - they play at another rate than fps, or were not encoded alike -
+        every frame is decoded and encoded again.
+
+        Args:
+            output_path: The mp4 to write
+            fps: The frame rate the video is saved at
+            audio: Optional (channels, samples) soundtrack to mux in
+            audio_sample_rate: Its sample rate
+        """
+        reason = remux_incompatibility(self.paths, fps)
+        temporary = None
+        try:
+            if reason is None:
+                paths, temporary = self._remux_paths(output_path, fps)
+                reason = remux_incompatibility(paths, fps)
+            if reason is None:
+                logger.debug(f"Remuxing {len(paths)} segments into {output_path}")
+                remux_videos(paths, output_path, audio, audio_sample_rate)
+                return
+        finally:
+            if temporary is not None:
+                os.remove(temporary)
+
+        logger.debug(f"Re-encoding the segments into {output_path} because {reason}")
+        write_video(
+            self,
+            output_path=output_path,
+            fps=fps,
+            audio=audio,
+            audio_sample_rate=audio_sample_rate,
+        )
+
+    def _remux_paths(self, output_path, fps):
+        """The files holding exactly the frames to write, and any made for it."""
+        if self.total_frames is None:
+            return list(self.paths), None
+
+        paths, remaining = [], self.total_frames
+        for path in self.paths:
+            count = video_frame_count(path)
+            if count <= remaining:
+                paths.append(path)
+                remaining -= count
+            else:
+                # Frames past the cut may be the references of frames before
+                # it, so the kept ones are encoded anew
+                tail = f"{output_path}.tail.mp4"
+                write_video(_decode_segment(path)[:remaining], tail, fps=fps)
+                return paths + [tail], tail
+            if remaining == 0:
+                break
+        return paths, None
+
     def cleanup(self):
         """Remove the segment files once the final video is safely written."""
         if self.keep_files:
@@ -199,47 +289,39 @@ class SegmentSpill:
     Files are named {prefix}.{iteration}.segment-{index:03d}.mp4 in the
     workflow's output directory - a crashed chain leaves them behind, ready to
     salvage with gather_videos + concat_videos.
+
+    Segments are encoded on one background thread, in order, so the next
+    segment's denoise starts while the last one is still being encoded. At most
+    SPILL_QUEUE_SEGMENTS segments wait on the encoder; a segment that would
+    exceed that waits for the oldest to be written. An encode that failed is
+    raised at the next segment boundary or at finish().
     """
 
     def __init__(self, pipeline, config):
-        output_dir = getattr(pipeline, "output_dir", None)
-        file_prefix = getattr(pipeline, "file_prefix", None)
-        if not output_dir or not file_prefix:
-            raise ValueError(
-                "save_segments needs the workflow's output directory - it is "
-                "only available when the chain runs through a workflow"
-            )
-        if not is_av_available():
-            raise ValueError(
-                "save_segments writes mp4 segment files with PyAV - install "
-                "it with: pip install av"
-            )
-        if config.fps is None:
-            raise ValueError(
-                "save_segments needs the frame rate to encode segment files - "
-                "set 'fps' on the chain or a 'frame_rate' pipeline argument"
-            )
-
-        # The same step can chain more than once (previous_result fan-out) -
-        # a per-wrapper counter keeps each iteration's files apart
-        iteration = getattr(pipeline, "_chain_iteration", -1) + 1
-        pipeline._chain_iteration = iteration
-
-        self.output_dir = output_dir
-        self.base_name = f"{file_prefix}.{iteration}"
+        self.output_dir, self.base_name = _chain_output(
+            pipeline, config, "save_segments", "segment files"
+        )
         self.fps = config.fps
         self.paths = []
+        self.pending = []
+        self.encoder = None
 
     def write(self, frames, audio, sample_rate):
-        """Encode one trimmed segment to disk and record its path.
+        """Queue one trimmed segment to be encoded to disk and record its path.
 
         Args:
-            frames: The segment's on-timeline PIL frames
+            frames: The segment's on-timeline frames, a uint8 array - held by
+                the encoder until written, so not modified afterwards
             audio: The segment's on-timeline generated audio as
                 (channels, samples) numpy, or None - muxed in so a crashed
                 chain leaves fully playable segments
             sample_rate: Sample rate of that audio
+
+        Raises:
+            Exception: A previous segment's encode error
         """
+        self._collect(block=len(self.pending) >= SPILL_QUEUE_SEGMENTS)
+
         path = validate_output_path(
             os.path.join(
                 self.output_dir,
@@ -252,26 +334,187 @@ class SegmentSpill:
         if audio is not None and audio.shape[1] and sample_rate is not None:
             audio_track = torch.from_numpy(numpy.ascontiguousarray(audio))
 
-        encode_video(
+        if self.encoder is None:
+            self.encoder = ThreadPoolExecutor(1, thread_name_prefix="dw-spill")
+        self.pending.append(
+            self.encoder.submit(
+                self._encode,
+                frames,
+                path,
+                audio_track,
+                sample_rate if audio_track is not None else None,
+            )
+        )
+        self.paths.append(path)
+
+    def _encode(self, frames, path, audio, sample_rate):
+        write_video(
             frames,
-            fps=self.fps,
             output_path=path,
-            audio=audio_track,
-            audio_sample_rate=sample_rate if audio_track is not None else None,
+            fps=self.fps,
+            audio=audio,
+            audio_sample_rate=sample_rate,
         )
-        self.paths.append(path)
         logger.info(f"Saved chain segment to {path}")
 
+    def _collect(self, block):
+        """Drop written segments, raising the first encode error.
+
+        Args:
+            block: Wait for the oldest queued segment to be written first
+        """
+        if block:
+            wait(self.pending[:1])
+        while self.pending and self.pending[0].done():
+            self.pending.pop(0).result()
+
+    def finish(self):
+        """Wait for every queued segment to be written.
+
+        Raises:
+            Exception: The first encode error
+        """
+        try:
+            while self.pending:
+                self._collect(block=True)
+        finally:
+            self.close()
+
+    def close(self):
+        """Let the queued segments finish writing and stop the encoder.
+
+        Called when the chain fails, so the segments it finished are on disk to
+        salvage. Their encode errors are logged, not raised - the chain's own
+        error is the one that matters.
+        """
+        for future in self.pending:
+            error = future.exception()
+            if error is not None:
+                logger.error(f"Chain segment failed to save: {error}")
+        self.pending = []
+        if self.encoder is not None:
+            self.encoder.shutdown()
+            self.encoder = None
+
+
+class StreamedOutput:
+    """Encodes the stitched video into one file as each segment finishes.
+
+    The file is {prefix}.{iteration}.chain.mp4 in the workflow's output
+    directory, written while the chain runs and moved into place when the result
+    saves. Only the frames of the segment being written are held. The soundtrack
+    - joined generated audio or the match_audio track - is muxed in at finish,
+    once every crossfade is known.
+    """
+
+    def __init__(self, pipeline, config):
+        output_dir, base_name = _chain_output(
+            pipeline, config, "stream", "the chained video"
+        )
+        self.path = validate_output_path(
+            os.path.join(output_dir, f"{base_name}.chain.mp4"), output_dir
+        )
+        self.fps = config.fps
+        # The match_audio overshoot is never written
+        self.remaining = (
+            config.total_frames if config.source_audio is not None else None
+        )
+        self.writer = VideoWriter(
+            self.path,
+            config.fps,
+            config.source_rate if config.source_audio is not None else None,
+        )
+
+    def write(self, frames, sample_rate):
+        """Encode one trimmed segment's frames onto the end of the video.
+
+        Args:
+            frames: The segment's on-timeline frames, a uint8 array
+            sample_rate: The rate of the audio the segment generated - the
+                first segment's declares the file's audio stream
+        """
+        if self.remaining is not None:
+            frames = frames[: self.remaining]
+            self.remaining -= len(frames)
+        if self.writer.frames_written == 0 and self.writer.audio_sample_rate is None:
+            self.writer.audio_sample_rate = sample_rate
+        self.writer.write(frames)
+
+    def finish(self, audio):
+        """Mux the soundtrack in and close the file.
+
+        Returns:
+            The EncodedVideo
+        """
+        if audio is not None and self.writer.audio_sample_rate is None:
+            logger.warning(
+                f"Saving {self.path} without its audio because the first segment "
+                f"generated none to declare its sample rate"
+            )
+            audio = None
+        if audio is not None:
+            audio = numpy.ascontiguousarray(audio)
+        self.writer.close(audio)
+        logger.info(
+            f"Streamed {self.writer.frames_written} chained frames to {self.path}"
+        )
+        return EncodedVideo(
+            self.path, self.fps, self.writer.frames_written, self.writer.has_audio
+        )
+
+    def abort(self):
+        self.writer.abort()
+
+
+def _chain_output(pipeline, config, option, what):
+    """The output directory and file base name of a chain that writes files.
+
+    Raises:
+        ValueError: Naming the option, if the chain runs outside a workflow,
+            PyAV is missing or the frame rate is unknown
+    """
+    output_dir = getattr(pipeline, "output_dir", None)
+    file_prefix = getattr(pipeline, "file_prefix", None)
+    if not output_dir or not file_prefix:
+        raise ValueError(
+            f"{option} needs the workflow's output directory - it is "
+            f"only available when the chain runs through a workflow"
+        )
+    if not is_av_available():
+        raise ValueError(
+            f"{option} writes mp4 files with PyAV - install it with: pip install av"
+        )
+    if config.fps is None:
+        raise ValueError(
+            f"{option} needs the frame rate to encode {what} - "
+            f"set 'fps' on the chain or a 'frame_rate' pipeline argument"
+        )
+
+    # The same step can chain more than once (previous_result fan-out) -
+    # a per-wrapper counter keeps each iteration's files apart
+    iteration = getattr(pipeline, "_chain_iteration", -1) + 1
+    pipeline._chain_iteration = iteration
+    return output_dir, f"{file_prefix}.{iteration}"
+
 
 def _decode_segment(path):
-    """Read a segment file back as a uint8 (frames, height, width, 3) tensor."""
+    """Read a segment file back as a uint8 (frames, height, width, 3) tensor.
+
+    The frames are decoded into one buffer sized from the stream's frame count,
+    rather than into a list that is then stacked into a second copy.
+    """
     import av
 
     with av.open(path) as container:
-        frames = [
-            frame.to_ndarray(format="rgb24") for frame in container.decode(video=0)
-        ]
-    return torch.from_numpy(numpy.stack(frames, axis=0))
+        stream = container.streams.video[0]
+        buffer = FrameBuffer.allocate(
+            max(stream.frames, 1),
+            stream.codec_context.height,
+            stream.codec_context.width,
+        )
+        for frame in container.decode(stream):
+            buffer.append(frame.to_ndarray(format="rgb24")[numpy.newaxis])
+    return buffer.as_tensor()
 
 
 def run_chain(pipeline, chain_definition, arguments):
@@ -285,7 +528,8 @@ def run_chain(pipeline, chain_definition, arguments):
 
     Returns:
         A single AudioVideo holding the stitched frames, and either the joined
-        generated audio, the original match_audio track, or no audio at all
+        generated audio, the original match_audio track, or no audio at all -
+        or, with stream, the EncodedVideo already holding both
     """
     # Step.run resolved any previous_result references in the chain's prompts,
     # which the chain block cannot express on its own
@@ -294,12 +538,26 @@ def run_chain(pipeline, chain_definition, arguments):
     )
     continuity = CONTINUITY_MODES[config.continuity](config)
 
-    # With save_segments, each completed segment is written to disk and its
-    # frames freed, bounding memory to one segment - a crash leaves the
-    # finished segments behind as playable files
+    # With save_segments, each completed segment is handed to a background
+    # encoder and its frames freed once written, bounding memory to a few
+    # segments - a crash leaves the finished segments behind as playable files
     spill = SegmentSpill(pipeline, config) if config.save_segments else None
+    # With stream, each segment's frames are encoded into the final file as
+    # soon as the segment finishes and freed with it
+    stream = StreamedOutput(pipeline, config) if config.stream else None
+    try:
+        return _run_segments(pipeline, config, continuity, arguments, spill, stream)
+    except BaseException:
+        if spill is not None:
+            spill.close()
+        if stream is not None:
+            stream.abort()
+        raise
+
 
-    frames = []  # PIL frames on the output timeline (unspilled chains)
+def _run_segments(pipeline, config, continuity, arguments, spill, stream):
+    """Run every planned segment, holding, spilling or streaming its frames."""
+    frames = None  # FrameBuffer of the output timeline (unspilled chains)
     audio = None  # joined generated audio, (channels, samples) float32
     audio_rate = None
     carry = None
@@ -330,7 +588,7 @@ def run_chain(pipeline, chain_definition, arguments):
         artifact = _single_artifact(output)
 
         carry = continuity.extract(artifact)
-        segment_frames = frames_as_pil_list(artifact)
+        segment_frames = frames_as_array(artifact)
         segment_audio, segment_rate = _generated_audio(artifact)
 
         kept_frames = segment_frames[segment.head_trim :]
@@ -340,8 +598,16 @@ def run_chain(pipeline, chain_definition, arguments):
                 _on_timeline_audio(segment_audio, segment, config, segment_rate),
                 segment_rate,
             )
+        elif stream is not None:
+            stream.write(kept_frames, segment_rate)
         else:
-            frames.extend(kept_frames)
+            if frames is None:
+                # Room for the whole chain, so the buffer is allocated once
+                frames = FrameBuffer.allocate(
+                    config.output_frames(len(segment_frames)),
+                    *segment_frames.shape[1:3],
+                )
+            frames.append(kept_frames)
 
         if config.source_audio is None and segment_audio is not None:
             audio, audio_rate = _joined_audio(
@@ -356,6 +622,7 @@ def run_chain(pipeline, chain_definition, arguments):
         empty_device_cache()
 
     if spill is not None:
+        spill.finish()
         # match_audio overshoots by design - the tail trim happens as the
         # lazy frames replay, so the files themselves stay whole
         frames = SegmentedFrames(
@@ -364,6 +631,11 @@ def run_chain(pipeline, chain_definition, arguments):
             config.keep_segments,
         )
 
+    if stream is not None:
+        return stream.finish(
+            config.source_audio if config.source_audio is not None else audio
+        )
+
     if config.source_audio is not None:
         # The video matches the track's duration; the original, unsliced audio
         # is muxed in so the soundtrack has no seams
@@ -406,6 +678,12 @@ class ChainConfig:
         self.frame_snap = chain_definition.get("frame_snap", None)
         self.save_segments = bool(chain_definition.get("save_segments", False))
         self.keep_segments = bool(chain_definition.get("keep_segments", False))
+        self.stream = bool(chain_definition.get("stream", False))
+        if self.stream and self.save_segments:
+            raise ValueError(
+                "A chain can use 'stream' or 'save_segments', not both - stream "
+                "already writes the final video as segments finish"
+            )
 
         self.source_audio = None
         self.source_rate = None
@@ -433,6 +711,18 @@ class ChainConfig:
                 for index in range(segments)
             ]
 
+    def output_frames(self, generated_frames):
+        """Frames the stitched output holds before any match_audio tail trim.
+
+        Args:
+            generated_frames: What the first segment generated - the length of
+                segments whose num_frames the step leaves to the pipeline
+        """
+        return sum(
+            (segment.num_frames or generated_frames) - segment.head_trim
+            for segment in self.plan
+        )
+
     def _plan_from_audio(self, arguments):
         """Derive the segment plan from the audio reference's duration."""
         if self.fps is None:
@@ -688,7 +978,7 @@ def _single_artifact(output):
 
 
 def _is_video_artifact(artifact):
-    if isinstance(artifact, AudioVideo):
+    if isinstance(artifact, (AudioVideo, FrameBuffer, VideoSource)):
         return True
     if isinstance(artifact, list) and artifact:
         return not isinstance(artifact[0], str)
@@ -0,0 +1,186 @@
+"""Share a component between steps that load it identically, without being told to.
+
+Two steps that declare the same VAE or text encoder - same checkpoint, dtype,
+quantization and placement - otherwise hold two copies of it unless the workflow wires
+shared_components and reused_components by hand. Every component block a pipeline
+loads is fingerprinted from its definition, and a later load with the same fingerprint
+is handed the module already in memory.
+
+The registry holds its modules weakly, so a component lives exactly as long as some
+pipeline still holds it: the last step to release it releases it, and nothing here
+keeps it alive past that.
+
+Only components that the pipeline does not alter after loading them are shared.
+A denoiser is excluded - cache hooks, TeaCache and compile are installed on it per
+pipeline - as is every component of a pipeline that loads LoRAs or an IP-Adapter,
+which are fused into the encoders and the denoiser alike. A cached pipeline that
+shares components and is then asked for LoRAs is loaded again rather than changed -
+see Workflow.create_step_action.
+"""
+
+import hashlib
+import json
+import logging
+import weakref
+
+logger = logging.getLogger("dw")
+
+# Components a pipeline modifies after loading them, so sharing one would carry
+# one step's hooks into another
+_UNSHAREABLE_COMPONENTS = {"transformer", "transformer_2", "unet", "controlnet"}
+
+# Pipeline keys whose presence means the pipeline modifies its components after load
+_MODIFYING_PIPELINE_KEYS = ("loras", "ip_adapter")
+
+# Pipeline configuration load_component applies to every component the pipeline
+# holds - offload hooks, meta weights and dtype casting a sharing step would inherit
+_PIPELINE_PLACEMENT_KEYS = (
+    "offload",
+    "exclude_from_cpu_offload",
+    "group_offload",
+    "enable_layerwise_casting",
+    "preserve_device_placement",
+)
+
+_registry = weakref.WeakValueDictionary()
+_names = {}
+_stats = {"loaded": 0, "deduplicated": 0}
+
+
+def _canonical(value):
+    """A JSON-able stand-in for a realized argument value - a type, a dtype."""
+    if isinstance(value, type):
+        return f"{value.__module__}.{value.__qualname__}"
+    return str(value)
+
+
+def component_fingerprint(component_name, pipeline_definition, device):
+    """Fingerprint what loading a component block would produce.
+
+    Everything that shapes the loaded module goes in: its class, its source and load
+    arguments, its quantization, the configuration applied to it after load - its own
+    and the pipeline's offloading and casting - and the device it is placed on.
+
+    Args:
+        component_name: Name of the component in the pipeline
+        pipeline_definition: The pipeline definition declaring it
+        device: Device the pipeline loads onto
+
+    Returns:
+        The fingerprint, or None when this component must not be shared
+    """
+    configuration = pipeline_definition.get("configuration", {})
+    if configuration.get("deduplicate_components", True) is False:
+        return None
+    if component_name in _UNSHAREABLE_COMPONENTS:
+        return None
+    if any(pipeline_definition.get(key) for key in _MODIFYING_PIPELINE_KEYS):
+        return None
+    if component_name in configuration.get("sdnq_optimize", []):
+        return None
+
+    component_definition = pipeline_definition.get(component_name)
+    if not isinstance(component_definition, dict):
+        return None
+
+    identity = {
+        "name": component_name,
+        "definition": component_definition,
+        "placement": configuration.get("components", {}).get(component_name),
+        # The pipeline-level block for this name, e.g. 'vae': enable_tiling
+        "settings": configuration.get(component_name),
+        "pipeline_placement": {
+            key: configuration.get(key) for key in _PIPELINE_PLACEMENT_KEYS
+        },
+        "device": str(device),
+    }
+    encoded = json.dumps(identity, sort_keys=True, default=_canonical)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def find_component(fingerprint):
+    """The loaded component with this fingerprint, if a pipeline still holds one."""
+    if fingerprint is None:
+        return None
+    component = _registry.get(fingerprint)
+    if component is not None:
+        _stats["deduplicated"] += 1
+        logger.info(
+            f"Reusing {_names.get(fingerprint, 'component')} loaded identically by "
+            "an earlier step"
+        )
+    return component
+
+
+def register_component(fingerprint, component_name, component):
+    """Record a freshly loaded component so later identical loads can share it.
+
+    Returns:
+        Whether it was registered
+    """
+    if fingerprint is None or component is None:
+        return False
+    try:
+        _registry[fingerprint] = component
+    except TypeError:
+        # Not every component can be weakly referenced; those are simply not shared
+        logger.debug(f"Not registering {component_name} - it cannot be weakly held")
+        return False
+    _names[fingerprint] = component_name
+    _stats["loaded"] += 1
+    return True
+
+
+def component_registry_stats():
+    """How many components were loaded through the registry and how many were shared."""
+    return {**_stats, "held": len(_registry)}
+
+
+def clear_component_registry():
+    """Forget every registered component. The components themselves are untouched."""
+    _registry.clear()
+    _names.clear()
+    _stats.update(loaded=0, deduplicated=0)
+
+
+def find_duplicate_components(workflow_definition, device="default"):
+    """Find the components a workflow's steps would share, without loading anything.
+
+    Args:
+        workflow_definition: The workflow as loaded from its JSON file
+        device: Device the workflow runs on. Steps that override it are compared
+            with their own device
+
+    Returns:
+        List of (component name, names of the steps loading it), one per component
+        loaded by more than one step
+    """
+    import copy
+    from .pipeline import declared_component_names
+    from ..variables import replace_variables
+
+    workflow = copy.deepcopy(workflow_definition)
+    replace_variables(workflow, workflow.get("variables", None))
+
+    groups = {}
+    for step in workflow.get("steps", []):
+        pipeline_definition = step.get("pipeline")
+        if pipeline_definition is None:
+            continue
+        step_device = pipeline_definition.get("configuration", {}).get("device", device)
+        for component_name in declared_component_names(pipeline_definition):
+            if component_name not in pipeline_definition:
+                continue
+            fingerprint = component_fingerprint(
+                component_name, pipeline_definition, step_device
+            )
+            if fingerprint is not None:
+                groups.setdefault(fingerprint, (component_name, []))[1].append(
+                    step["name"]
+                )
+
+    return [
+        (component_name, step_names)
+        for component_name, step_names in groups.values()
+        if len(step_names) > 1
+    ]
@@ -0,0 +1,344 @@
+"""Encode each prompt once, however many calls it is used in.
+
+A step's iterations, every segment of a chain and every rerun in the REPL call the
+pipeline with the same prompt, and each call ran the text encoder again - at 14GB of
+Gemma per LTX-2 segment, a chain spent more time encoding than some of its segments
+took to denoise. Embeddings are kept here, least recently used first, under a memory
+cap, and a call whose prompt was encoded before is handed the embeddings instead.
+
+A pipeline's own encode_prompt is cached where it is called, so whatever the pipeline
+does with the result - the classifier-free guidance batch, per-prompt repeats - it
+gets exactly what encoding would have returned. Prompt weighting and the remote text
+encoder produce prompt_embeds before the call and are cached the same way.
+
+A cached encoding is keyed by everything it depends on: which text encoders produced
+it (not their names - the modules themselves), the LoRAs active on the pipeline, the
+prompts and every other encoder argument. An argument that cannot be compared by
+value, such as a tensor, means the call is not cached at all.
+"""
+
+import contextlib
+import inspect
+import itertools
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+
+from .. import settings
+from ..settings import parse_size
+
+logger = logging.getLogger("dw")
+
+DEFAULT_MAX_BYTES = 512 * 1024**2
+
+# Encoder attributes whose module identity goes into every key
+_ENCODER_NAMES = ("text_encoder", "text_encoder_2", "text_encoder_3")
+
+_tokens = weakref.WeakKeyDictionary()
+_counter = itertools.count(1)
+# Tokens of encoders taken off a pipeline whose prompts are still served from here
+_released = weakref.WeakKeyDictionary()
+
+
+class Uncacheable(Exception):
+    """An encoder argument that cannot be compared by value."""
+
+
+def _encoder_token(module):
+    # id() can be reused once a module is collected; a token handed out per module
+    # cannot, so embeddings of a released encoder never match its replacement
+    try:
+        token = _tokens.get(module)
+        if token is None:
+            token = _tokens[module] = next(_counter)
+        return token
+    except TypeError:
+        return id(module)
+
+
+def keep_encoder_identity(pipeline, name, module):
+    """Keep a pipeline's encodings keyed by an encoder taken off it for a while.
+
+    The token is kept, not the module, so an encoder that is deleted is still freed.
+    """
+    _released.setdefault(pipeline, {})[name] = _encoder_token(module)
+
+
+def forget_released_encoders(pipeline):
+    """The encoders kept by keep_encoder_identity are back on the pipeline, or gone."""
+    _released.pop(pipeline, None)
+
+
+def encoder_identity(pipeline):
+    """What decides a pipeline's encodings besides its arguments."""
+    from .lora import _adapters
+
+    released = _released.get(pipeline, {}) if pipeline in _released else {}
+    encoders = tuple(
+        (
+            name,
+            (
+                _encoder_token(getattr(pipeline, name))
+                if getattr(pipeline, name, None) is not None
+                else released[name]
+            ),
+        )
+        for name in _ENCODER_NAMES
+        if getattr(pipeline, name, None) is not None or name in released
+    )
+    # LoRAs can adapt the text encoders as well as the denoiser
+    adapters = _adapters.get(pipeline) if pipeline in _adapters else None
+    return (type(pipeline).__name__, encoders, adapters.active if adapters else None)
+
+
+def freeze(value):
+    """A hashable stand-in for an argument, compared by value.
+
+    Raises:
+        Uncacheable: When the value cannot be compared by value
+    """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+
+    import torch
+
+    if isinstance(value, (torch.device, torch.dtype)):
+        return str(value)
+    raise Uncacheable(type(value).__name__)
+
+
+def tensor_bytes(value):
+    """Bytes of the tensors in an encoding - a tensor, or tuples, lists and dicts of them."""
+    if isinstance(value, (list, tuple)):
+        return sum(tensor_bytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(tensor_bytes(v) for v in value.values())
+    if hasattr(value, "element_size") and hasattr(value, "numel"):
+        return value.numel() * value.element_size()
+    return 0
+
+
+class EmbeddingCache:
+    """Prompt encodings, least recently used first, within a memory cap.
+
+    Args:
+        max_bytes: Bytes of embeddings held. 0 turns caching off
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        """The encoding stored under a key, counting the lookup."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Store an encoding, evicting the least recently used to make room for it."""
+        size = tensor_bytes(value)
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            while self._entries and self._bytes + size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+    def encode(self, key, compute):
+        """The encoding for a key, computed and stored on a miss."""
+        if not self.enabled:
+            return compute()
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        else:
+            logger.debug("Prompt embeddings served from the embedding cache")
+        return value
+
+    def clear(self):
+        """Drop every encoding, e.g. when the models that produced them are released."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit and miss counts, and the embeddings currently held."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "max_bytes": self.max_bytes,
+                "cached_bytes": self._bytes,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+
+
+def get_embedding_cache():
+    """The process-wide embedding cache, with its cap read from settings."""
+    global _cache
+    if _cache is None:
+        size = getattr(settings, "embedding_cache_size", None)
+        _cache = EmbeddingCache(DEFAULT_MAX_BYTES if size is None else parse_size(size))
+    return _cache
+
+
+def cached_encoding(identity, arguments, compute, enabled=True, before_encode=None):
+    """Encode through the process-wide cache.
+
+    Args:
+        identity: What produces the encoding - encoder_identity() of a pipeline, or
+            the address of a remote encoder
+        arguments: Everything else the encoding depends on, compared by value
+        compute: Produces the encoding on a miss
+        enabled: The pipeline configuration's embedding_cache setting
+        before_encode: Called before compute() runs, e.g. to put back text encoders
+            released once their prompts were encoded ahead
+
+    Returns:
+        The encoding, from the cache or from compute()
+    """
+    compute = _preceded_by(before_encode, compute)
+    if not enabled:
+        return compute()
+    try:
+        key = (identity, freeze(arguments))
+    except Uncacheable as e:
+        logger.debug(f"Not caching this encoding: {e}")
+        return compute()
+    return get_embedding_cache().encode(key, compute)
+
+
+def cached_batch_encoding(identity, arguments_list, compute, before_encode=None):
+    """Encode in one batch every set of arguments the process-wide cache lacks.
+
+    Calls that follow with any of the arguments find their encoding in the cache.
+
+    Args:
+        identity: What produces the encodings, as for cached_encoding
+        arguments_list: The arguments of each encoding, compared by value
+        compute: Encodes a list of the missing arguments, returning one encoding
+            for each
+        before_encode: Called before compute() runs
+
+    Returns:
+        The number of encodings computed
+    """
+    cache = get_embedding_cache()
+    if not cache.enabled:
+        return 0
+    missing = {}
+    for arguments in arguments_list:
+        try:
+            key = (identity, freeze(arguments))
+        except Uncacheable:
+            continue
+        if key not in cache:
+            missing[key] = arguments
+    if not missing:
+        return 0
+
+    encodings = _preceded_by(before_encode, compute)(list(missing.values()))
+    for key, encoding in zip(missing, encodings):
+        cache.put(key, encoding)
+    return len(missing)
+
+
+def _preceded_by(before_encode, compute):
+    if before_encode is None:
+        return compute
+
+    def run(*args, **kwargs):
+        before_encode()
+        return compute(*args, **kwargs)
+
+    return run
+
+
+def cached_encode_prompt(pipeline, encode_prompt, cache, before_encode=None):
+    """Wrap a pipeline's bound encode_prompt so repeated encodings come from the cache."""
+    signature = inspect.signature(encode_prompt)
+    encode_prompt = _preceded_by(before_encode, encode_prompt)
+
+    def encode(*args, **kwargs):
+        try:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (
+                "encode_prompt",
+                encoder_identity(pipeline),
+                freeze(dict(bound.arguments)),
+            )
+        except (TypeError, Uncacheable) as e:
+            logger.debug(f"Not caching this encode_prompt call: {e}")
+            return encode_prompt(*args, **kwargs)
+        return cache.encode(key, lambda: encode_prompt(*args, **kwargs))
+
+    return encode
+
+
+@contextlib.contextmanager
+def embedding_cache_context(pipeline, enabled=True, before_encode=None):
+    """Cache a pipeline's encode_prompt for the duration of one call.
+
+    Args:
+        pipeline: The diffusers pipeline
+        enabled: The pipeline configuration's embedding_cache setting
+        before_encode: Called before the encoders run on a miss
+    """
+    cache = get_embedding_cache()
+    encode_prompt = getattr(type(pipeline), "encode_prompt", None)
+    if not callable(encode_prompt) or (
+        before_encode is None and not (enabled and cache.enabled)
+    ):
+        yield
+        return
+
+    # An instance attribute shadows the method for the pipeline's own
+    # self.encode_prompt calls, and deleting it restores the method
+    bound = encode_prompt.__get__(pipeline)
+    if enabled and cache.enabled:
+        pipeline.encode_prompt = cached_encode_prompt(
+            pipeline, bound, cache, before_encode
+        )
+    else:
+        pipeline.encode_prompt = _preceded_by(before_encode, bound)
+    try:
+        yield
+    finally:
+        del pipeline.encode_prompt
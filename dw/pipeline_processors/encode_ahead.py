@@ -0,0 +1,223 @@
+"""Encode a step's prompts up front and free the text encoder before denoising.
+
+A big text encoder - Gemma on LTX-2, Qwen3-VL on H3 - is needed for a few seconds at
+the start of each call and then sits on the device, or in host memory, for the whole
+denoising loop it takes no part in. With encode_ahead, a step first encodes the
+prompts of all its iterations and chain segments into the embedding cache, then moves
+its text encoders off the device for the rest of the step; every call that follows is
+served its embeddings from the cache. The memory goes to the transformer instead,
+which can then run with less aggressive offloading.
+
+Prompts are encoded by running the pipeline itself and stopping it as its denoiser is
+first called. Whatever the pipeline passes its encode_prompt - the classifier-free
+guidance flag, the sequence length, prompt weighting - is therefore exactly what the
+real call will pass, and the real call finds the encoding in the cache.
+"""
+
+import contextlib
+import logging
+
+import torch
+
+from .. import empty_device_cache
+from .embedding_cache import forget_released_encoders, keep_encoder_identity
+
+logger = logging.getLogger("dw")
+
+ENCODER_NAMES = ("text_encoder", "text_encoder_2", "text_encoder_3")
+DENOISER_NAMES = ("transformer", "transformer_2", "unet")
+
+RELEASE_MODES = ("offload", "delete")
+
+
+class _Encoded(Exception):
+    """Raised at the denoiser to end a call whose prompts have been encoded."""
+
+
+def encode_ahead_options(configuration):
+    """The release mode a pipeline configuration's encode_ahead asks for, or None.
+
+    Raises:
+        ValueError: If the release mode is not one of RELEASE_MODES
+    """
+    options = configuration.get("encode_ahead", False)
+    if options is False or options is None:
+        return None
+    if options is True:
+        return "offload"
+    release = options.get("release", "offload")
+    if release not in RELEASE_MODES:
+        raise ValueError(
+            f"encode_ahead release must be one of {', '.join(RELEASE_MODES)}, "
+            f"not '{release}'"
+        )
+    return release
+
+
+def chain_prompt_arguments(arguments, prompts):
+    """One set of call arguments per distinct prompt a chained run will use."""
+    if not prompts:
+        return [arguments]
+    distinct = list(dict.fromkeys(p for p in prompts if isinstance(p, str)))
+    return [{**arguments, "prompt": prompt} for prompt in distinct]
+
+
+@contextlib.contextmanager
+def generators_rewound(arguments):
+    """Give back any generator's state after a call, as if it had not been made.
+
+    Latent noise drawn while encoding ahead would otherwise shift the noise of the
+    real call, and a seed would no longer reproduce the image it made without
+    encode_ahead.
+    """
+    values = arguments.values()
+    generators = [v for v in values if isinstance(v, torch.Generator)] + [
+        g
+        for v in values
+        if isinstance(v, (list, tuple))
+        for g in v
+        if isinstance(g, torch.Generator)
+    ]
+    states = [(generator, generator.get_state()) for generator in generators]
+    try:
+        yield
+    finally:
+        for generator, state in states:
+            generator.set_state(state)
+
+
+@contextlib.contextmanager
+def stop_at_denoiser(pipeline):
+    """End a pipeline call as soon as its denoiser is called.
+
+    The hooks run before any offloading hook would move the denoiser to the device,
+    so stopping costs nothing but what the pipeline did before denoising.
+
+    Raises:
+        ValueError: If the pipeline has no denoiser to stop at
+    """
+    denoisers = [
+        module
+        for name in DENOISER_NAMES
+        if isinstance(module := getattr(pipeline, name, None), torch.nn.Module)
+    ]
+    if not denoisers:
+        raise ValueError(
+            f"encode_ahead needs a transformer or unet to stop at - "
+            f"{type(pipeline).__name__} has neither"
+        )
+
+    def stop(module, args, kwargs=None):
+        raise _Encoded()
+
+    handles = [
+        denoiser.register_forward_pre_hook(stop, prepend=True) for denoiser in denoisers
+    ]
+    try:
+        yield
+    except _Encoded:
+        pass
+    finally:
+        for handle in handles:
+            handle.remove()
+
+
+def _placement_managed(module):
+    # Offload hooks, group offloading and on-demand placement already keep the
+    # module off the device between its calls; moving it by hand would fight them
+    from .residency import get_residency_manager
+
+    return (
+        getattr(module, "_hf_hook", None) is not None
+        or getattr(module, "_diffusers_hook", None) is not None
+        or get_residency_manager().tracks(module)
+    )
+
+
+def _module_device(module):
+    parameter = next(module.parameters(), None)
+    return parameter.device if parameter is not None else None
+
+
+class ReleasedEncoders:
+    """Text encoders taken off a pipeline while its calls are served from the cache.
+
+    'offload' parks them in system memory and restore() puts them back where they
+    were; 'delete' drops the pipeline's reference, so one nothing else holds is freed,
+    and they cannot be put back.
+
+    Args:
+        pipeline: The diffusers pipeline
+        release: 'offload' or 'delete'
+    """
+
+    def __init__(self, pipeline, release):
+        self.pipeline = pipeline
+        self.release = release
+        # name -> (module, device it was on)
+        self.encoders = {}
+        self.freed = []
+
+    def take(self):
+        """Take the text encoders off the pipeline."""
+        offload_hooks = False
+        for name in ENCODER_NAMES:
+            module = getattr(self.pipeline, name, None)
+            if not isinstance(module, torch.nn.Module):
+                continue
+            if _placement_managed(module) and self.release == "offload":
+                offload_hooks = offload_hooks or hasattr(module, "_hf_hook")
+                continue
+
+            device = _module_device(module)
+            if self.release == "offload":
+                try:
+                    module.to("cpu")
+                except (ValueError, RuntimeError, NotImplementedError) as e:
+                    # e.g. bitsandbytes weights, which cannot leave their device
+                    logger.warning(f"encode_ahead cannot offload {name}: {e}")
+                    continue
+            # Encodings stay keyed by the encoder that made them while it is away
+            keep_encoder_identity(self.pipeline, name, module)
+            setattr(self.pipeline, name, None)
+            self.encoders[name] = (module, device)
+            self.freed.append(name)
+
+        if self.release == "delete":
+            self.encoders.clear()
+
+        # Model offload leaves the last model it ran on the device until the call
+        # ends - the stopped call never got there
+        if offload_hooks and hasattr(self.pipeline, "maybe_free_model_hooks"):
+            self.pipeline.maybe_free_model_hooks()
+            self.freed.append("offloaded models")
+
+        empty_device_cache()
+        if self.freed:
+            logger.info(
+                f"Encoded ahead - released {', '.join(self.freed)} until the step ends"
+            )
+
+    def restore(self):
+        """Put offloaded text encoders back where they were. Deleted ones stay gone."""
+        for name, (module, device) in self.encoders.items():
+            if device is not None:
+                module.to(device)
+            setattr(self.pipeline, name, module)
+        self.encoders.clear()
+        if self.release == "offload":
+            forget_released_encoders(self.pipeline)
+
+    def needed(self):
+        """A prompt missed the cache and has to be encoded - restore the encoders.
+
+        Raises:
+            ValueError: If the encoders were deleted
+        """
+        if self.release == "delete" and self.freed:
+            raise ValueError(
+                "A prompt needs the text encoder after encode_ahead deleted it. Use "
+                "'release': 'offload' when a prompt can change between calls - "
+                "e.g. a prompt enhancer, or a REPL rerun with a new prompt"
+            )
+        self.restore()
@@ -0,0 +1,239 @@
+"""Switch LoRAs on a loaded pipeline without reloading its base model.
+
+A cached pipeline - the worker and REPL keep one per step between runs - used to keep
+whatever LoRAs it was loaded with: loading them happened only inside Pipeline.load, so
+a run asking for a different LoRA, or a different scale, either got the old one or had
+to reload the whole base model. Here every run declares the LoRAs it wants and the
+pipeline is brought to that state: adapters it already holds are switched on with
+set_adapters, the rest are loaded beside them, and the least recently used are
+deleted once more are held than the cache allows. A sweep over LoRAs on one base model
+then costs adapter loads, not base-model loads.
+
+An adapter is identified by where it is loaded from - its repo, weight file, subfolder
+and any other load argument - not by its adapter_name, so a LoRA asked for again under
+another name is still found.
+"""
+
+import hashlib
+import json
+import logging
+import weakref
+from collections import OrderedDict
+
+logger = logging.getLogger("dw")
+
+DEFAULT_MAX_ADAPTERS = 4
+
+# Keys of a LoRA definition that select how it is applied rather than what is loaded
+_APPLY_KEYS = ("adapter_name", "scale")
+
+
+def lora_key(lora):
+    """Identify a LoRA by everything that determines the weights it loads."""
+    source = {k: v for k, v in lora.items() if k not in _APPLY_KEYS}
+    return json.dumps(source, sort_keys=True, default=str)
+
+
+def _default_adapter_name(key):
+    # Derived from the source rather than the LoRA's position in the list, so the
+    # first LoRA of one run and the first of the next never claim the same name
+    return "lora_" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+
+class LoraAdapters:
+    """The adapters loaded into one pipeline, least recently used first.
+
+    Options, from the pipeline configuration's lora_cache block:
+        max_adapters: Adapters held before the least recently used are deleted. The
+            ones a run asks for are always held, however many that is
+        hotswap: Load a new adapter over the weights of the least recently used one
+            rather than beside it, once the cache is full. The adapter keeps its name
+            and shape, so a compiled denoiser is not recompiled
+        target_rank: Largest LoRA rank that will be hotswapped in. Needed when the
+            denoiser is compiled, and applied before the first adapter is loaded
+        fuse: Fuse the active adapters into the base weights for faster inference,
+            unfusing them before the next switch. A run asking for what is already
+            fused changes nothing
+    """
+
+    def __init__(self, pipeline, options=None):
+        self.pipeline = weakref.ref(pipeline)
+        self.configure(options or {})
+        # lora_key -> adapter name
+        self.loaded = OrderedDict()
+        self.active = None
+        self.fused = False
+        self.disabled = False
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def configure(self, options):
+        """Take up a run's lora_cache options - they belong to the step, not the load."""
+        self.max_adapters = max(
+            int(options.get("max_adapters", DEFAULT_MAX_ADAPTERS)), 1
+        )
+        self.hotswap = options.get("hotswap", False)
+        self.target_rank = options.get("target_rank", None)
+        self.fuse = options.get("fuse", False)
+
+    def activate(self, loras):
+        """Bring the pipeline to exactly the given LoRAs, at the given scales.
+
+        Args:
+            loras: LoRA definitions as the workflow declares them. They are not
+                modified
+        """
+        pipeline = self.pipeline()
+        requested = []
+        for lora in loras:
+            lora = dict(lora)
+            # float() because the schema takes a 'variable:' reference here, and a
+            # variable declared as a string default substitutes as one
+            requested.append((lora_key(lora), float(lora.pop("scale", 1.0)), lora))
+
+        active = tuple((key, scale) for key, scale, _ in requested)
+        if active == self.active and self.fused == (self.fuse and bool(active)):
+            if active:
+                self.hits += len(active)
+            return
+
+        if self.fused:
+            logger.debug("Unfusing LoRAs before switching them")
+            pipeline.unfuse_lora()
+            self.fused = False
+
+        if not requested:
+            if self.loaded and not self.disabled:
+                logger.info("Disabling LoRAs - this run asks for none")
+                pipeline.disable_lora()
+                self.disabled = True
+            self.active = active
+            return
+
+        names = []
+        wanted = {key for key, _, _ in requested}
+        for key, _, lora in requested:
+            if key in self.loaded:
+                self.hits += 1
+                self.loaded.move_to_end(key)
+                logger.debug(f"LoRA already loaded: {self.loaded[key]}")
+            else:
+                self._load(pipeline, key, lora, wanted)
+            names.append(self.loaded[key])
+
+        if self.disabled:
+            pipeline.enable_lora()
+            self.disabled = False
+
+        weights = [scale for _, scale, _ in requested]
+        logger.info(f"Setting adapter weights: {list(zip(names, weights))}")
+        pipeline.set_adapters(names, adapter_weights=weights)
+        self._evict(pipeline, wanted)
+
+        if self.fuse:
+            pipeline.fuse_lora(adapter_names=names)
+            self.fused = True
+        self.active = active
+
+    def stats(self):
+        """Adapter loads and cache hits so far, and the adapters held."""
+        return {
+            "loaded_adapters": list(self.loaded.values()),
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+    def _load(self, pipeline, key, lora, wanted):
+        model_name = lora.pop("model_name", None)
+        adapter_name = lora.pop("adapter_name", None) or _default_adapter_name(key)
+
+        victim = None
+        if self.hotswap and len(self.loaded) >= self.max_adapters:
+            victim = self._least_recently_used(wanted)
+        owner = next((k for k, n in self.loaded.items() if n == adapter_name), None)
+        if owner is not None and victim is None:
+            # The name is taken by an adapter from another source; it cannot hold both
+            self._delete(pipeline, owner)
+
+        if self.loads == 0 and self.hotswap and self.target_rank:
+            pipeline.enable_lora_hotswap(target_rank=int(self.target_rank))
+
+        if victim is not None:
+            adapter_name = self.loaded.pop(victim)
+            logger.info(f"Hotswapping LoRA {model_name} into adapter {adapter_name}")
+            pipeline.load_lora_weights(
+                model_name, adapter_name=adapter_name, hotswap=True, **lora
+            )
+            self.evictions += 1
+        else:
+            logger.info(f"Loading LoRA: {model_name}")
+            pipeline.load_lora_weights(model_name, adapter_name=adapter_name, **lora)
+        self.loaded[key] = adapter_name
+        self.loads += 1
+
+    def _least_recently_used(self, wanted):
+        return next((key for key in self.loaded if key not in wanted), None)
+
+    def _evict(self, pipeline, wanted):
+        while len(self.loaded) > self.max_adapters:
+            key = self._least_recently_used(wanted)
+            if key is None:
+                return
+            self._delete(pipeline, key)
+
+    def _delete(self, pipeline, key):
+        adapter_name = self.loaded.pop(key)
+        logger.debug(f"Deleting LoRA adapter {adapter_name}")
+        pipeline.delete_adapters([adapter_name])
+        self.evictions += 1
+
+
+_adapters = weakref.WeakKeyDictionary()
+
+
+def lora_adapters(pipeline, options=None):
+    """The adapter cache of a pipeline, created on first use.
+
+    Args:
+        pipeline: The diffusers pipeline
+        options: The pipeline configuration's lora_cache block, if any
+    """
+    adapters = _adapters.get(pipeline)
+    if adapters is None:
+        adapters = _adapters[pipeline] = LoraAdapters(pipeline, options)
+    else:
+        adapters.configure(options or {})
+    return adapters
+
+
+def activate_loras(pipeline, loras, options=None):
+    """Switch a pipeline to the given LoRAs, loading only the adapters it lacks.
+
+    Args:
+        pipeline: The diffusers pipeline
+        loras: The pipeline definition's LoRA list
+        options: The pipeline configuration's lora_cache block, if any
+    """
+    if not loras and pipeline not in _adapters:
+        # Never had a LoRA - nothing to switch off
+        return
+    lora_adapters(pipeline, options).activate(loras)
+
+
+def without_loras(workflow_definition):
+    """A workflow definition with its pipelines' LoRAs left out.
+
+    Two definitions that compare equal this way load the same base models, so a
+    change between them can be applied to the pipelines already loaded.
+    """
+    if isinstance(workflow_definition, dict):
+        return {
+            key: without_loras(value)
+            for key, value in workflow_definition.items()
+            if key != "loras"
+        }
+    if isinstance(workflow_definition, list):
+        return [without_loras(value) for value in workflow_definition]
+    return workflow_definition
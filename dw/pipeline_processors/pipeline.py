@@ -12,9 +12,20 @@ from .config_objects import (
     get_load_components_arguments,
 )
 from .remote import remote_text_encoder
+from .embedding_cache import cached_encoding, embedding_cache_context
+from .cache_telemetry import cache_telemetry_context
+from .attention_select import AUTO_BACKEND, auto_attention_backend
+from .residency import get_residency_manager, prefetch_after_calls
+from .component_registry import (
+    component_fingerprint,
+    find_component,
+    register_component,
+)
 from ..cache_blocks import register_cache_blocks
 from ..teacache import teacache_context
+from ..lazy_image import load_lazy_images
 from ..type_helpers import has_method
+from ..video_source import decode_video_sources
 from .. import empty_device_cache, get_device_type
 from diffusers import attention_backend
 
@@ -116,8 +127,26 @@ class Pipeline:
         self.pipeline = pipeline
         self.output_dir = output_dir
         self.file_prefix = file_prefix
+        # Components handed over by an earlier step that loaded them identically
+        self.deduplicated_components = {}
+        # Names of the components this pipeline loaded and offered to later
+        # identical loads - names only, so the registry's hold stays weak
+        self.registered_component_names = set()
+        # Text encoders encode_ahead took off the pipeline for the rest of a step
+        self.released_encoders = None
         logger.debug(f"Initialized pipeline with device: {self.device}")
 
+    def shared_component_names(self):
+        """Components this pipeline may hold in common with other steps' pipelines.
+
+        Those it was handed by the component registry, and those it registered for
+        later loads to be handed. LoRAs must not be loaded into any of them - they
+        would be injected into every pipeline holding the module.
+        """
+        return sorted(
+            set(self.deduplicated_components) | self.registered_component_names
+        )
+
     @property
     def configuration(self):
         return self.pipeline_definition.get("configuration", {})
@@ -293,7 +322,11 @@ class Pipeline:
             shared_components[shared_component_name] = component
 
         # Load and configure LoRA models
-        load_loras(self.pipeline_definition.get("loras", []), self.pipeline)
+        load_loras(
+            self.pipeline_definition.get("loras", []),
+            self.pipeline,
+            self.configuration.get("lora_cache"),
+        )
 
         # Load and configure IP-Adapter
         load_ip_adapter(self.pipeline_definition.get("ip_adapter", None), self.pipeline)
@@ -301,8 +334,13 @@ class Pipeline:
         # Place the components the pipeline loaded itself, once everything that alters
         # them - dtypes, adapters, quantized matmuls - has been applied. Offloading hooks
         # installed before those would be fighting them
+        # A component deduplicated from an earlier step carries that step's
+        # placement already, the same as one it shared explicitly
         configure_components(
-            self.pipeline, self.configuration, self.device, reused_components
+            self.pipeline,
+            self.configuration,
+            self.device,
+            {**reused_components, **self.deduplicated_components},
         )
 
         # Set up random generator if needed - no_generator is a boolean, so an
@@ -387,21 +425,9 @@ class Pipeline:
         pipeline call itself, and output normalization - shared by the single
         run and every segment of a chained run.
         """
-        if self.pipeline_definition.get("remote_text_encoder", None) is not None:
-            logger.info("Invoking remote text encoder")
-            remote_config = self.pipeline_definition["remote_text_encoder"]
-            prompt_embeds = remote_text_encoder(
-                arguments.pop("prompt"),
-                remote_config.get("url"),
-                device=self.device,
-            )
-            arguments["prompt_embeds"] = prompt_embeds
-        elif self.configuration.get("prompt_weighting", False):
-            from ..prompt_weighting import apply_prompt_weighting
-
-            # The step's device override travels with the call - embeddings
-            # must land where the transformer runs
-            apply_prompt_weighting(self.pipeline, arguments, self.device)
+        self._prepare_prompt(arguments)
+        # Input videos stay on disk until the call that needs their frames
+        decode_video_sources(arguments)
 
         # Run standard pipeline
         logger.debug("Running standard pipeline")
@@ -419,7 +445,207 @@ class Pipeline:
 
         return output
 
+    def _prepare_prompt(self, arguments):
+        """Encode the prompt ahead of the call when a remote encoder or weighting does."""
+        use_cache = self.configuration.get("embedding_cache", True)
+        if self.pipeline_definition.get("remote_text_encoder", None) is not None:
+            remote_config = self.pipeline_definition["remote_text_encoder"]
+            prompt = arguments.pop("prompt")
+
+            def encode():
+                logger.info("Invoking remote text encoder")
+                return remote_text_encoder(
+                    prompt,
+                    remote_config.get("url"),
+                    device=self.device,
+                    options=remote_config,
+                )
+
+            arguments["prompt_embeds"] = cached_encoding(
+                ("remote_text_encoder", remote_config.get("url")),
+                (prompt, str(self.device)),
+                encode,
+                enabled=use_cache,
+            )
+        elif self.configuration.get("prompt_weighting", False):
+            from ..prompt_weighting import apply_prompt_weighting
+
+            # The step's device override travels with the call - embeddings
+            # must land where the transformer runs
+            apply_prompt_weighting(
+                self.pipeline,
+                arguments,
+                self.device,
+                use_cache=use_cache,
+                before_encode=self._encoders_needed(),
+            )
+
+    def _encoders_needed(self):
+        """What to call before the text encoders run, when encode_ahead released them."""
+        if self.released_encoders is None:
+            return None
+        return self.released_encoders.needed
+
+    @contextlib.contextmanager
+    def encode_ahead(self, iterations):
+        """Encode every prompt a step will use, and release the text encoders.
+
+        Does nothing unless the configuration sets encode_ahead. The step's
+        iterations - and each segment prompt of a chained step - are encoded into
+        the embedding cache first; the text encoders are then released until the
+        step's calls are done. Encoding ahead that fails for any reason leaves the
+        encoders where they are and lets the step run as it would have.
+
+        Args:
+            iterations: The argument sets the step will run the pipeline with
+        """
+        from .embedding_cache import get_embedding_cache
+        from .encode_ahead import ReleasedEncoders, encode_ahead_options
+
+        release = encode_ahead_options(self.configuration)
+        if release is None or not iterations:
+            if iterations and self.pipeline_definition.get("remote_text_encoder"):
+                self._request_prompts_ahead(iterations)
+            yield
+            return
+        if not (
+            self.configuration.get("embedding_cache", True)
+            and get_embedding_cache().enabled
+        ):
+            logger.warning(
+                "encode_ahead needs the embedding cache to hold what it encodes - "
+                "running without it"
+            )
+            yield
+            return
+        if not self._encode_prompts(iterations):
+            yield
+            return
+
+        released = ReleasedEncoders(self.pipeline, release)
+        released.take()
+        self.released_encoders = released
+        try:
+            yield
+        finally:
+            self.released_encoders = None
+            released.restore()
+
+    @torch.inference_mode()
+    def _encode_prompts(self, iterations):
+        """Encode the prompts of a step's calls by stopping each at its denoiser.
+
+        Returns:
+            Whether every prompt was encoded
+        """
+        from .embedding_cache import get_embedding_cache
+        from .encode_ahead import (
+            chain_prompt_arguments,
+            generators_rewound,
+            stop_at_denoiser,
+        )
+
+        prompts = self._segment_prompts()
+        cache = get_embedding_cache()
+        evictions = cache.evictions
+        try:
+            self._batch_prompts_ahead(iterations, prompts)
+            for arguments in iterations:
+                for call_arguments in chain_prompt_arguments(arguments, prompts):
+                    # The call runs as far as its denoiser, so it checks and
+                    # preprocesses its inputs - gathered images and input videos
+                    # decoded, as Step.run and _run_once decode them for the real call
+                    call_arguments = load_lazy_images(dict(call_arguments))
+                    decode_video_sources(call_arguments)
+                    with generators_rewound(call_arguments), stop_at_denoiser(
+                        self.pipeline
+                    ):
+                        self._prepare_prompt(call_arguments)
+                        self._call_pipeline(call_arguments, None)
+        except Exception as e:
+            logger.warning(f"Could not encode prompts ahead, running without: {e}")
+            return False
+
+        if cache.evictions > evictions:
+            logger.warning(
+                "The embedding cache is too small to hold every prompt of this step - "
+                "raise embedding_cache_size, or the text encoders come back for the "
+                "prompts it dropped"
+            )
+        return True
+
+    def _segment_prompts(self):
+        """The prompts of a chained step's segments, or None."""
+        chain_definition = self.pipeline_definition.get("chain", None)
+        if chain_definition is None:
+            return None
+        return getattr(self, "chain_prompts", None) or chain_definition.get(
+            "prompts", None
+        )
+
+    def _request_prompts_ahead(self, iterations):
+        """Send a remote-encoded step's prompts as one request before its calls.
+
+        Unlike encode_ahead this releases nothing - there is no local encoder - so
+        it needs no configuration. A failed request leaves each call to make its own.
+        """
+        if not self.configuration.get("embedding_cache", True):
+            return
+        try:
+            self._batch_prompts_ahead(iterations, self._segment_prompts())
+        except Exception as e:
+            logger.warning(f"Could not encode prompts ahead, running without: {e}")
+
+    def _batch_prompts_ahead(self, iterations, prompts):
+        """Encode every prompt of a step in one batch, when a remote encoder or
+        prompt weighting encodes them.
+
+        The calls that follow find their embeddings in the cache instead of
+        encoding - or making a request - once per prompt.
+        """
+        from .encode_ahead import chain_prompt_arguments
+
+        calls = [
+            call_arguments
+            for arguments in iterations
+            for call_arguments in chain_prompt_arguments(arguments, prompts)
+        ]
+        remote_config = self.pipeline_definition.get("remote_text_encoder", None)
+        if remote_config is not None:
+            from .embedding_cache import cached_batch_encoding
+            from .remote import remote_encoder_client
+
+            def encode(missing):
+                logger.info(
+                    f"Invoking remote text encoder for {len(missing)} prompts at once"
+                )
+                rows = remote_encoder_client(
+                    remote_config.get("url"), remote_config
+                ).encode_batch([prompt for prompt, _ in missing])
+                return [embeds.to(self.device) for embeds in rows]
+
+            cached_batch_encoding(
+                ("remote_text_encoder", remote_config.get("url")),
+                list(
+                    dict.fromkeys(
+                        (call["prompt"], str(self.device))
+                        for call in calls
+                        if isinstance(call.get("prompt", None), str)
+                    )
+                ),
+                encode,
+            )
+        elif self.configuration.get("prompt_weighting", False):
+            from ..prompt_weighting import encode_weighted_prompts
+
+            encode_weighted_prompts(self.pipeline, calls, self.device)
+
     def _execute_pipeline(self, arguments):
+        """Execute the pipeline, reporting what its cache skipped."""
+        with cache_telemetry_context(self.pipeline, self.configuration):
+            return self._execute_cached(arguments)
+
+    def _execute_cached(self, arguments):
         """Execute the pipeline with optional TeaCache and attention backend contexts."""
         teacache_config = self.configuration.get("teacache", None)
         attn_backend = self.configuration.get("attention_backend", None)
@@ -437,7 +663,13 @@ class Pipeline:
             coefficients = teacache_config.get("coefficients", None)
             variant = teacache_config.get("variant", None)
             with teacache_context(
-                self.pipeline, num_steps, rel_l1_thresh, coefficients, variant
+                self.pipeline,
+                num_steps,
+                rel_l1_thresh,
+                coefficients,
+                variant,
+                calibrate=teacache_config.get("calibrate", False),
+                calibration_file=teacache_config.get("calibration_file", None),
             ):
                 return self._call_pipeline(arguments, attn_backend)
         else:
@@ -446,11 +678,26 @@ class Pipeline:
     def _call_pipeline(self, arguments, attn_backend):
         """Call the pipeline with optional attention backend and cache contexts."""
         with contextlib.ExitStack() as stack:
-            if attn_backend is not None:
+            if attn_backend == AUTO_BACKEND:
+                logger.info("Choosing the attention backend per attention shape")
+                stack.enter_context(auto_attention_backend(self.pipeline))
+            elif attn_backend is not None:
                 logger.info(f"Using attention backend: {attn_backend}")
                 stack.enter_context(attention_backend(attn_backend))
 
             stack.enter_context(stateful_cache_context(self.pipeline))
+            stack.enter_context(
+                prefetch_context(self.pipeline, self.configuration, arguments)
+            )
+            # Iterations, chain segments and reruns repeat their prompts; encode
+            # each once
+            stack.enter_context(
+                embedding_cache_context(
+                    self.pipeline,
+                    self.configuration.get("embedding_cache", True),
+                    before_encode=self._encoders_needed(),
+                )
+            )
 
             return self.pipeline(**arguments)
 
@@ -461,8 +708,21 @@ class Pipeline:
         component_definition = self.pipeline_definition.get(component_name, None)
 
         if component_definition is not None:
-            logger.info(f"Loading component: {component_name}")
             component_configuration = component_definition.get("configuration", None)
+            device = (component_configuration or {}).get("device", default_device)
+
+            # An earlier step may have loaded exactly this - same checkpoint, dtype,
+            # quantization and placement - and still hold it
+            fingerprint = component_fingerprint(
+                component_name, self.pipeline_definition, device
+            )
+            component = find_component(fingerprint)
+            if component is not None:
+                self.deduplicated_components[component_name] = component
+                from_pretrained_arguments[component_name] = component
+                return
+
+            logger.info(f"Loading component: {component_name}")
             if component_configuration is not None:
                 # A copy for the same reason the pipeline's own arguments are copied:
                 # what goes in here is consumed by load_component, and the definition
@@ -481,14 +741,14 @@ class Pipeline:
                         quantization_configuration
                     )
 
-                device = component_configuration.get("device", default_device)
-
                 component = load_component(
                     component_name,
                     component_configuration,
                     component_from_pretrained_arguments,
                     device,
                 )
+                if register_component(fingerprint, component_name, component):
+                    self.registered_component_names.add(component_name)
 
                 logger.debug(f"Loaded optional component: {component_name}")
                 from_pretrained_arguments[component_name] = component
@@ -826,6 +1086,11 @@ def apply_on_demand_placement(
     denoising transformer is called once per step, so per-call transfers would cost
     far more than they save - group offloading is the tool for those.
 
+    Whether the component leaves the device as soon as its call returns is up to the
+    process-wide residency manager: with a 'residency_budget' setting it stays until
+    other on-demand components need the room, so a VAE decoding every chain segment
+    is moved once rather than twice per segment.
+
     Args:
         component: The component to place
         component_name: Name of the component, for logging
@@ -852,7 +1117,8 @@ def apply_on_demand_placement(
         )
         return
 
-    component.to(offload_device)
+    residency = get_residency_manager()
+    residency.register(component, component_name, device, offload_device)
 
     # One depth counter for the whole component, not one per entry point: decode()
     # calls forward() internally, and an inner return must not offload the model
@@ -867,17 +1133,16 @@ def apply_on_demand_placement(
         @functools.wraps(original)
         def on_demand(*args, **kwargs):
             if state["depth"] == 0:
-                component.to(device)
+                residency.acquire(component)
             state["depth"] += 1
             try:
                 return original(*args, **kwargs)
             finally:
                 state["depth"] -= 1
                 if state["depth"] == 0:
-                    component.to(offload_device)
-                    # Hand the freed space back to the driver rather than leaving it
-                    # reserved - the headroom is the entire point of doing this
-                    empty_device_cache()
+                    # The manager moves it back to offload_device, now or once
+                    # something else needs the room - see dw.pipeline_processors.residency
+                    residency.release(component)
 
         # functools.wraps carries __wrapped__, so inspect.signature() still reports
         # the real parameters. Callers introspect them: MiniMax H3's denoiser picks
@@ -898,6 +1163,63 @@ def apply_on_demand_placement(
     )
 
 
+def prefetch_context(pipeline, configuration, arguments):
+    """Start moving on-demand components to the device ahead of their first call.
+
+    A component whose configuration has a 'prefetch' block is prefetched once the
+    component it names under 'after' - the denoiser, by default - has been called all
+    but 'steps_before_end' times, so the copy runs during the last denoising steps
+    rather than stalling the decode that follows them. The count comes from the call's
+    num_inference_steps; a pipeline that calls its denoiser twice a step, for true CFG,
+    simply starts the copy earlier.
+
+    Args:
+        pipeline: The loaded pipeline
+        configuration: Pipeline configuration dictionary
+        arguments: Arguments of the call about to run
+
+    Returns:
+        A context manager that removes the triggers when the call returns
+    """
+    stack = contextlib.ExitStack()
+    num_inference_steps = arguments.get("num_inference_steps", None)
+    for component_name, settings in configuration.get("components", {}).items():
+        prefetch = (
+            settings.get("prefetch", None) if isinstance(settings, dict) else None
+        )
+        if prefetch is None:
+            continue
+        if settings.get("residency") != "on_demand":
+            logger.warning(
+                f"Ignoring 'prefetch' for {component_name} - only an on_demand "
+                "component is ever off the device to be fetched"
+            )
+            continue
+        if num_inference_steps is None:
+            logger.debug(
+                f"Not prefetching {component_name} - the call has no "
+                "num_inference_steps to count down from"
+            )
+            continue
+
+        trigger_name = prefetch.get("after", "transformer")
+        trigger = get_component(pipeline, trigger_name)
+        component = get_component(pipeline, component_name)
+        if not has_method(trigger, "register_forward_pre_hook") or component is None:
+            logger.warning(
+                f"Not prefetching {component_name} - '{trigger_name}' is not a loaded "
+                "module to count calls of"
+            )
+            continue
+
+        calls = max(1, num_inference_steps - prefetch.get("steps_before_end", 2))
+        logger.debug(
+            f"Prefetching {component_name} after {calls} calls of {trigger_name}"
+        )
+        stack.enter_context(prefetch_after_calls(trigger, [component], calls))
+    return stack
+
+
 def apply_compile(component, component_name, compile_configuration, device):
     """Compile a component with torch.compile.
 
@@ -1005,34 +1327,20 @@ def attach_audio_sample_rate(pipeline, output):
     output.audio_sample_rate = sample_rate
 
 
-def load_loras(loras, pipeline):
-    """Load and configure LoRA models."""
-    adapter_names = []
-    adapter_weights = []
-
-    for i, lora in enumerate(loras):
-        model_name = lora.pop("model_name", None)
-        logger.info(f"Loading LoRA: {model_name}")
-
-        # Use provided adapter_name or generate from index
-        adapter_name = lora.pop("adapter_name", str(i))
-        adapter_names.append(adapter_name)
+def load_loras(loras, pipeline, options=None):
+    """Load and configure LoRA models.
 
-        # Extract scale for adapter weights - float() because the schema takes a
-        # 'variable:' reference here, and a variable declared as a string default
-        # substitutes as one
-        scale = float(lora.pop("scale", 1.0))
-        adapter_weights.append(scale)
+    Brings the pipeline to exactly these LoRAs, whether it was just loaded or is a
+    cached one that ran with others - see lora.LoraAdapters.
 
-        # Load the LoRA with the adapter name
-        pipeline.load_lora_weights(model_name, adapter_name=adapter_name, **lora)
+    Args:
+        loras: The pipeline definition's LoRA list
+        pipeline: The diffusers pipeline
+        options: The pipeline configuration's lora_cache block, if any
+    """
+    from .lora import activate_loras
 
-    # Set adapter weights for all loaded LoRAs
-    if adapter_names:
-        logger.info(
-            f"Setting adapter weights: {list(zip(adapter_names, adapter_weights))}"
-        )
-        pipeline.set_adapters(adapter_names, adapter_weights=adapter_weights)
+    activate_loras(pipeline, loras, options)
 
 
 def load_ip_adapter(ip_adapter_definition, pipeline):
@@ -1584,3 +1892,23 @@ def enable_cache_on_transformer(pipeline, cache_config):
         f"Enabling {cache_config.__class__.__name__} on {transformer.__class__.__name__}"
     )
     transformer.enable_cache(cache_config)
+
+
+def replace_cache_on_transformer(pipeline, cache_config):
+    """Swap the cache on the pipeline's transformer for another, or for none.
+
+    enable_cache refuses a transformer that already has a cache, and a loaded
+    pipeline keeps the one load() enabled for as long as it is loaded - so one
+    model compared under several caches has each disabled before the next.
+
+    Args:
+        pipeline: The loaded diffusers pipeline
+        cache_config: Cache configuration object from get_cache_configuration(),
+            or None to leave the transformer uncached
+    """
+    transformer = get_cache_transformer(pipeline)
+    if transformer is not None and getattr(transformer, "is_cache_enabled", False):
+        logger.debug(f"Disabling the cache on {transformer.__class__.__name__}")
+        transformer.disable_cache()
+    if cache_config is not None:
+        enable_cache_on_transformer(pipeline, cache_config)
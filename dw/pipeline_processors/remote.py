@@ -1,18 +1,346 @@
+"""Client for a remote text-encoder service.
+
+A remote text encoder saves loading a 24B-parameter encoder locally, but a call that
+opens a new connection, waits on it without a timeout and unpickles the response
+gives much of that time back - and one that hangs hangs the whole run. A client is
+kept per service: its HTTP session reuses one connection across calls, requests time
+out and are retried on connection errors and 5xx responses, and prompts from calls
+made while a request is in flight are sent together in the next request instead of
+one request each.
+
+Responses are decoded without unpickling. A service answering in safetensors, or as
+a raw buffer with X-Tensor-Dtype and X-Tensor-Shape headers, is read straight into a
+tensor's memory. The torch.save response of the Hugging Face endpoints is still
+read, with torch.load restricted to tensors (weights_only).
+
+dw.remote_encoder_server is a stand-in service for on-prem use and tests.
+"""
+
+import io
+import json
+import logging
+import threading
+
+import requests
 import torch
 from huggingface_hub import get_token
-import requests
-import io
 
+logger = logging.getLogger("dw")
+
+DEFAULT_TIMEOUT = 120
+DEFAULT_RETRIES = 3
+DEFAULT_MAX_BATCH = 16
+
+SAFETENSORS_TYPE = "application/x-safetensors"
+RAW_TYPE = "application/octet-stream"
+
+# safetensors dtype names, and the names a raw response's X-Tensor-Dtype uses
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+RAW_DTYPES = {
+    str(dtype).removeprefix("torch."): dtype for dtype in SAFETENSORS_DTYPES.values()
+}
+
+
+def _read_body(response):
+    """The response body in a writable buffer a tensor can be made over."""
+    length = response.headers.get("Content-Length")
+    if length is None or response.headers.get("Content-Encoding"):
+        return bytearray(response.content)
+
+    buffer = bytearray(int(length))
+    view = memoryview(buffer)
+    read = 0
+    while read < len(buffer):
+        count = response.raw.readinto(view[read:])
+        if not count:
+            raise ValueError(
+                f"Remote text encoder response ended after {read} of {len(buffer)} bytes"
+            )
+        read += count
+    return buffer
+
+
+def decode_safetensors(buffer, name="prompt_embeds"):
+    """A tensor over a safetensors buffer, without copying it.
+
+    Args:
+        buffer: The serialized safetensors
+        name: The tensor to read. A buffer holding a single tensor is read whatever
+            it is called
+
+    Raises:
+        ValueError: If the buffer holds no such tensor or a dtype torch lacks
+    """
+    header_size = int.from_bytes(buffer[:8], "little")
+    header = json.loads(bytes(buffer[8 : 8 + header_size]))
+    header.pop("__metadata__", None)
+    if name not in header:
+        if len(header) != 1:
+            raise ValueError(
+                f"Remote text encoder response holds {', '.join(header)} - "
+                f"expected {name}"
+            )
+        name = next(iter(header))
+
+    entry = header[name]
+    dtype = SAFETENSORS_DTYPES.get(entry["dtype"])
+    if dtype is None:
+        raise ValueError(f"Unsupported tensor dtype in response: {entry['dtype']}")
+    start, end = entry["data_offsets"]
+    offset = 8 + header_size + start
+    count = (end - start) // torch.empty(0, dtype=dtype).element_size()
+    if count == 0:
+        return torch.empty(entry["shape"], dtype=dtype)
+    return torch.frombuffer(buffer, dtype=dtype, count=count, offset=offset).view(
+        entry["shape"]
+    )
+
+
+def decode_raw(buffer, dtype_name, shape):
+    """A tensor over a raw buffer, without copying it.
+
+    Raises:
+        ValueError: If the dtype is not one torch has
+    """
+    dtype = RAW_DTYPES.get(dtype_name)
+    if dtype is None:
+        raise ValueError(f"Unsupported tensor dtype in response: {dtype_name}")
+    shape = [int(size) for size in shape.split(",") if size.strip()]
+    if len(buffer) == 0:
+        return torch.empty(shape, dtype=dtype)
+    return torch.frombuffer(buffer, dtype=dtype).view(shape)
+
+
+def decode_response(response):
+    """The embeddings in a remote text encoder's response."""
+    buffer = _read_body(response)
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+    if content_type == SAFETENSORS_TYPE:
+        return decode_safetensors(buffer)
+    if "X-Tensor-Shape" in response.headers:
+        return decode_raw(
+            buffer,
+            response.headers.get("X-Tensor-Dtype", "float32"),
+            response.headers["X-Tensor-Shape"],
+        )
+    return torch.load(io.BytesIO(buffer), weights_only=True)
+
+
+class _Waiting:
+    """A prompt waiting on a request, and what the request brought back for it."""
+
+    __slots__ = ("prompt", "done", "lead", "embeds", "error")
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.done = threading.Event()
+        self.lead = False
+        self.embeds = None
+        self.error = None
 
-def remote_text_encoder(prompts, url, device):
-    response = requests.post(
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.embeds
+
+
+class RemoteTextEncoder:
+    """A persistent, batching client for one remote text-encoder service.
+
+    Args:
+        url: The service's endpoint
+        timeout: Seconds to wait on a request before retrying it
+        retries: Times a request is retried after a connection error or 5xx response
+        max_batch: Most prompts sent in one request
+    """
+
+    def __init__(
+        self,
+        url,
+        timeout=DEFAULT_TIMEOUT,
+        retries=DEFAULT_RETRIES,
+        max_batch=DEFAULT_MAX_BATCH,
+    ):
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.url = url
+        self.timeout = timeout
+        self.max_batch = max_batch
+        self.requests = 0
+        self.prompts = 0
+
+        self.session = requests.Session()
+        # Encoding is idempotent, so a POST is as safe to retry as a GET
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=None,
+        )
+        adapter = HTTPAdapter(max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept"] = (
+            f"{SAFETENSORS_TYPE}, {RAW_TYPE};q=0.9, */*;q=0.5"
+        )
+        token = get_token()
+        if token is not None:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+        self._lock = threading.Lock()
+        self._queue = []
+        self._sending = False
+
+    def encode(self, prompts):
+        """Encode prompts in one request.
+
+        Args:
+            prompts: A prompt, or a list of prompts
+
+        Returns:
+            The embeddings, batched along the first dimension
+
+        Raises:
+            requests.HTTPError: If the service answers with an error
+            ValueError: If the response cannot be read as a tensor
+        """
+        response = self.session.post(
+            self.url, json={"prompt": prompts}, timeout=self.timeout, stream=True
+        )
+        with response:
+            response.raise_for_status()
+            embeds = decode_response(response)
+        self.requests += 1
+        self.prompts += len(prompts) if isinstance(prompts, list) else 1
+        return embeds
+
+    def encode_batch(self, prompts):
+        """Encode a list of prompts in as few requests as max_batch allows.
+
+        Returns:
+            One tensor of embeddings per prompt, each batched as a single prompt's
+        """
+        rows = []
+        for start in range(0, len(prompts), self.max_batch):
+            batch = prompts[start : start + self.max_batch]
+            embeds = self.encode(list(batch))
+            if embeds.shape[0] != len(batch):
+                raise ValueError(
+                    f"Remote text encoder returned {embeds.shape[0]} embeddings for "
+                    f"{len(batch)} prompts"
+                )
+            rows.extend(embeds[row : row + 1] for row in range(len(batch)))
+        return rows
+
+    def encode_prompt(self, prompt):
+        """Encode one prompt, sharing a request with other threads encoding at once.
+
+        The first caller sends its request straight away. Prompts arriving while it
+        is in flight queue up and are sent together by the next of them to lead.
+        """
+        if not isinstance(prompt, str):
+            return self.encode(prompt)
+
+        waiting = _Waiting(prompt)
+        with self._lock:
+            self._queue.append(waiting)
+            lead = not self._sending
+            self._sending = True
+        if not lead:
+            waiting.done.wait()
+            if not waiting.lead:
+                return waiting.result()
+
+        try:
+            with self._lock:
+                batch = self._queue[: self.max_batch]
+                del self._queue[: self.max_batch]
+            self._send(batch)
+        finally:
+            with self._lock:
+                if self._queue:
+                    successor = self._queue[0]
+                    successor.lead = True
+                    successor.done.set()
+                else:
+                    self._sending = False
+        return waiting.result()
+
+    def _send(self, batch):
+        if len(batch) > 1:
+            logger.debug(f"Sending {len(batch)} prompts to the remote text encoder")
+        try:
+            if len(batch) == 1:
+                rows = [self.encode(batch[0].prompt)]
+            else:
+                rows = self.encode_batch([waiting.prompt for waiting in batch])
+            for waiting, embeds in zip(batch, rows):
+                waiting.embeds = embeds
+        except Exception as e:
+            for waiting in batch:
+                waiting.error = e
+        for waiting in batch:
+            waiting.done.set()
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def remote_encoder_client(url, options=None):
+    """The process-wide client for a service, made on first use.
+
+    Args:
+        url: The service's endpoint
+        options: The remote_text_encoder definition - timeout, retries, max_batch
+    """
+    options = options or {}
+    key = (
         url,
-        json={"prompt": prompts},
-        headers={
-            "Authorization": f"Bearer {get_token()}",
-            "Content-Type": "application/json",
-        },
+        options.get("timeout", DEFAULT_TIMEOUT),
+        options.get("retries", DEFAULT_RETRIES),
+        options.get("max_batch", DEFAULT_MAX_BATCH),
     )
-    prompt_embeds = torch.load(io.BytesIO(response.content))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = RemoteTextEncoder(*key)
+        return client
+
+
+def close_remote_encoder_clients():
+    """Close every client's session - the worker does when it releases its models."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def remote_text_encoder(prompts, url, device, options=None):
+    """Encode a prompt with a remote text-encoder service.
+
+    Args:
+        prompts: The prompt, or a list of prompts
+        url: The service's endpoint
+        device: Where the embeddings are needed
+        options: The remote_text_encoder definition
 
-    return prompt_embeds.to(device)
+    Returns:
+        The prompt embeddings on the device
+    """
+    return remote_encoder_client(url, options).encode_prompt(prompts).to(device)
@@ -0,0 +1,375 @@
+"""Keep recently used on-demand components on the device while there is room for them.
+
+On-demand placement moves a component to the device around each of its calls. Moving
+it straight back afterwards is right when the device is full, but a VAE decoded in
+every chain segment, with VRAM to spare, is then shipped across the bus twice per
+segment for nothing. The residency manager leaves a component on the device once its
+call returns, and only moves it back - least recently used first - when the components
+it holds exceed the budget. With no budget, every component leaves the device as soon
+as its call returns, which is on-demand placement as it always was.
+
+With pinned memory on, a component's weights rest in page-locked host buffers made once
+when it is registered. Moving it to the device is then an asynchronous copy on a side
+stream, and moving it back is free - the device copies are dropped and the weights point
+at the pinned buffers again, which never changed. That is also what lets a component be
+prefetched: its copy starts ahead of its first call, say during the last denoising steps,
+and overlaps the compute instead of stalling it.
+"""
+
+import contextlib
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+
+from .. import empty_device_cache, settings
+from ..settings import parse_size
+
+logger = logging.getLogger("dw")
+
+
+def component_bytes(component):
+    """Bytes of a component's parameters and buffers - what moving it transfers."""
+    total = 0
+    for tensors in (
+        getattr(component, "parameters", None),
+        getattr(component, "buffers", None),
+    ):
+        if callable(tensors):
+            total += sum(t.numel() * t.element_size() for t in tensors())
+    return total
+
+
+def _named_tensors(component):
+    yield from component.named_parameters()
+    yield from component.named_buffers()
+
+
+class TorchTransferBackend:
+    """Moves components with torch - pinned host buffers and a side copy stream.
+
+    The manager only ever calls these four methods, so the scheduling above them can be
+    driven by a stand-in that records the calls instead of moving anything.
+    """
+
+    def __init__(self):
+        self._streams = {}
+
+    def pin(self, component, offload_device):
+        """Rest a component's tensors in page-locked host memory.
+
+        Returns:
+            The pinned copies by tensor name, or None when the component is not a
+            module and is moved with its own to()
+        """
+        import torch
+
+        if not isinstance(component, torch.nn.Module):
+            component.to(offload_device)
+            return None
+
+        # Pinning needs a CUDA driver; elsewhere the host copy is plain memory and
+        # the transfers are merely synchronous
+        pin = torch.cuda.is_available()
+        store = {}
+        for name, tensor in _named_tensors(component):
+            host = tensor.data.to(offload_device)
+            store[name] = host.pin_memory() if pin else host
+            tensor.data = store[name]
+        return store
+
+    def onload(self, component, store, device, non_blocking):
+        """Start copying a component to the device.
+
+        Returns:
+            A handle wait() takes once the component is needed, or None when the copy
+            has already completed
+        """
+        import torch
+
+        if store is None:
+            component.to(device)
+            return None
+
+        device = torch.device(device)
+        if not (non_blocking and device.type == "cuda"):
+            for name, tensor in _named_tensors(component):
+                tensor.data = store[name].to(device)
+            return None
+
+        stream = self._streams.get(device)
+        if stream is None:
+            stream = self._streams[device] = torch.cuda.Stream(device)
+        with torch.cuda.stream(stream):
+            for name, tensor in _named_tensors(component):
+                tensor.data = store[name].to(device, non_blocking=True)
+            event = torch.cuda.Event()
+            event.record(stream)
+        return event
+
+    def wait(self, component, handle):
+        """Make the compute stream wait for a copy onload() started."""
+        import torch
+
+        if handle is None:
+            return
+        stream = torch.cuda.current_stream()
+        stream.wait_event(handle)
+        # The copies were allocated on the side stream but are read on this one; tell
+        # the allocator, or freeing them at offload could hand the memory out early
+        for _, tensor in _named_tensors(component):
+            tensor.data.record_stream(stream)
+
+    def offload(self, component, store, offload_device):
+        """Move a component back to the host."""
+        if store is None:
+            component.to(offload_device)
+            return
+        # The weights did not change on the device, so the pinned copies are still
+        # current - pointing back at them is the whole transfer
+        for name, tensor in _named_tensors(component):
+            tensor.data = store[name]
+
+
+class _Entry:
+    """A component the manager has moved to the device."""
+
+    def __init__(self, component, name, device, offload_device, store):
+        self.component = weakref.ref(component)
+        self.name = name
+        self.device = str(device)
+        self.offload_device = offload_device
+        self.size = component_bytes(component)
+        self.store = store
+        self.pending = None
+        self.prefetched = False
+        self.resident = False
+        self.in_use = 0
+
+
+class ResidencyManager:
+    """Decide which on-demand components stay on the device between their calls.
+
+    A component is acquired when its outermost call starts and released when it
+    returns. Acquiring one that is still resident is a hit and moves nothing; acquiring
+    one that is not is a miss, and first moves idle components off its device until it
+    fits. Released components stay resident until the ones on their device exceed the
+    budget, then leave least recently used first. A component in the middle of a call
+    is never moved, so the budget can be overrun while more than one runs at once.
+
+    A prefetched component counts as resident from the moment its copy starts. The call
+    that acquires it waits for that copy rather than making a new one, and is a hit.
+    """
+
+    def __init__(self, budget_bytes=0, pin_memory=False, backend=None):
+        self.budget_bytes = budget_bytes or 0
+        self.pin_memory = pin_memory
+        self.backend = backend if backend is not None else TorchTransferBackend()
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+        self.evictions = 0
+        # Ordered least to most recently used
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def register(self, component, name, device, offload_device="cpu"):
+        """Start tracking a component placed on demand, resting it on offload_device."""
+        with self._lock:
+            if self.pin_memory:
+                store = self.backend.pin(component, offload_device)
+            else:
+                component.to(offload_device)
+                store = None
+            self._entries[id(component)] = _Entry(
+                component, name, device, offload_device, store
+            )
+
+    def tracks(self, component):
+        """Whether a component is placed on demand through this manager."""
+        with self._lock:
+            return id(component) in self._entries and any(
+                entry.component() is component for entry in self._live_entries()
+            )
+
+    def resident_bytes(self, device=None):
+        """Bytes of the tracked components resident on a device, or on any."""
+        with self._lock:
+            return sum(
+                entry.size
+                for entry in self._live_entries()
+                if entry.resident and (device is None or entry.device == str(device))
+            )
+
+    def acquire(self, component):
+        """Make sure a component is on its device before one of its calls runs."""
+        with self._lock:
+            entry = self._entries[id(component)]
+            self._entries.move_to_end(id(component))
+            entry.in_use += 1
+            entry.prefetched = False
+            if entry.resident:
+                self.hits += 1
+                logger.debug(
+                    f"Residency hit: {entry.name} is already on {entry.device}"
+                )
+                self._finish_copy(entry)
+                return
+
+            self.misses += 1
+            self._evict(entry.device, needed=entry.size)
+            logger.debug(f"Residency miss: moving {entry.name} to {entry.device}")
+            self._onload(entry, non_blocking=False)
+
+    def prefetch(self, component):
+        """Start moving a component to its device ahead of its next call.
+
+        Does nothing when it is already resident or on its way. The copy is
+        asynchronous where the backend can make it so; the next acquire() waits for it.
+        """
+        with self._lock:
+            entry = self._entries.get(id(component))
+            if entry is None or entry.resident:
+                return
+            self._entries.move_to_end(id(component))
+            self.prefetches += 1
+            self._evict(entry.device, needed=entry.size)
+            logger.debug(f"Prefetching {entry.name} to {entry.device}")
+            self._onload(entry, non_blocking=self.pin_memory)
+            # Held until the call it was fetched for, whatever the budget says -
+            # evicting it first would throw the transfer away
+            entry.prefetched = True
+
+    def release(self, component):
+        """Note that a component's call has returned, evicting what no longer fits."""
+        with self._lock:
+            entry = self._entries[id(component)]
+            entry.in_use -= 1
+            if entry.in_use == 0:
+                self._evict(entry.device)
+
+    def evict_all(self):
+        """Move every idle component off the device, e.g. before a full cleanup."""
+        with self._lock:
+            evicted = False
+            for entry in list(self._live_entries()):
+                if entry.resident and entry.in_use == 0:
+                    entry.prefetched = False
+                    self._offload(entry)
+                    evicted = True
+            if evicted:
+                empty_device_cache()
+
+    def stats(self):
+        """Hit and miss counts, and what the manager currently holds on the device."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "budget_bytes": self.budget_bytes,
+                "resident_bytes": self.resident_bytes(),
+                "resident_components": [
+                    entry.name for entry in self._live_entries() if entry.resident
+                ],
+                "hits": self.hits,
+                "misses": self.misses,
+                "prefetches": self.prefetches,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _live_entries(self):
+        # Drop components that have been garbage collected along with their pipeline
+        for key in [k for k, e in self._entries.items() if e.component() is None]:
+            del self._entries[key]
+        return list(self._entries.values())
+
+    def _over_budget(self, device, needed):
+        if self.budget_bytes <= 0:
+            return True
+        return self.resident_bytes(device) + needed > self.budget_bytes
+
+    def _evict(self, device, needed=0):
+        evicted = False
+        for entry in self._live_entries():
+            if not self._over_budget(device, needed):
+                break
+            if (
+                entry.resident
+                and entry.in_use == 0
+                and not entry.prefetched
+                and entry.device == device
+            ):
+                self._offload(entry)
+                evicted = True
+        if evicted:
+            # Hand the freed space back to the driver rather than leaving it
+            # reserved - the headroom is the entire point of evicting
+            empty_device_cache()
+
+    def _onload(self, entry, non_blocking):
+        component = entry.component()
+        entry.pending = self.backend.onload(
+            component, entry.store, entry.device, non_blocking
+        )
+        entry.resident = True
+        if entry.in_use:
+            self._finish_copy(entry)
+
+    def _finish_copy(self, entry):
+        if entry.pending is not None:
+            self.backend.wait(entry.component(), entry.pending)
+            entry.pending = None
+
+    def _offload(self, entry):
+        logger.debug(
+            f"Residency eviction: moving {entry.name} to {entry.offload_device}"
+        )
+        component = entry.component()
+        # A prefetch nobody used still has to land before its memory is let go
+        self._finish_copy(entry)
+        self.backend.offload(component, entry.store, entry.offload_device)
+        entry.resident = False
+        self.evictions += 1
+
+
+_manager = None
+
+
+def get_residency_manager():
+    """The process-wide residency manager, with its budget read from settings."""
+    global _manager
+    if _manager is None:
+        budget = getattr(settings, "residency_budget", None)
+        _manager = ResidencyManager(
+            parse_size(budget) if budget else 0,
+            pin_memory=getattr(settings, "residency_pin_memory", False),
+        )
+    return _manager
+
+
+@contextlib.contextmanager
+def prefetch_after_calls(trigger, components, calls):
+    """Prefetch components once a trigger module has been called a number of times.
+
+    The trigger is typically the denoiser: prefetching a VAE once the transformer has
+    run all but the last couple of steps overlaps the VAE's transfer with those steps.
+
+    Args:
+        trigger: Module whose calls are counted
+        components: Components to prefetch through the residency manager
+        calls: Number of trigger calls after which the prefetch starts
+    """
+    manager = get_residency_manager()
+    state = {"calls": 0}
+
+    def count(module, args):
+        state["calls"] += 1
+        if state["calls"] == calls:
+            for component in components:
+                manager.prefetch(component)
+
+    handle = trigger.register_forward_pre_hook(count)
+    try:
+        yield
+    finally:
+        handle.remove()
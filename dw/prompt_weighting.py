@@ -12,12 +12,19 @@ License: Apache 2.0
 
 import re
 import gc
+import contextlib
 import logging
 from typing import Tuple
 
 import torch
 from transformers import CLIPTokenizer, T5Tokenizer
 
+from .pipeline_processors.embedding_cache import (
+    cached_batch_encoding,
+    cached_encoding,
+    encoder_identity,
+)
+
 logger = logging.getLogger("dw")
 
 
@@ -199,6 +206,202 @@ def _hook_managed(module):
     return getattr(module, "_hf_hook", None) is not None
 
 
+# The empty CLIP group a prompt with fewer groups is padded with
+_EMPTY_GROUP = [49406] + [49407] * 76
+
+
+@contextlib.contextmanager
+def _encoders_on_device(pipe, encoders, device):
+    """Move text encoders to the device for an encoding if the pipeline sits on the CPU.
+
+    Unless offload hooks manage them, in which case they move themselves on forward.
+    Encoders moved here go back to the CPU afterwards.
+    """
+    moved = pipe.device.type == "cpu" and not any(
+        _hook_managed(encoder) for encoder in encoders
+    )
+    if moved:
+        for encoder in encoders:
+            encoder.to(device)
+    try:
+        yield
+    finally:
+        if moved:
+            for encoder in encoders:
+                encoder.to("cpu")
+            gc.collect()
+
+            from . import empty_device_cache
+
+            empty_device_cache()
+
+
+def _row_prompts(prompts, other):
+    """A second or third prompt list, each row defaulting to the primary prompt."""
+    if other is None:
+        return list(prompts)
+    if len(other) != len(prompts):
+        raise ValueError(
+            f"Got {len(other)} secondary prompts for {len(prompts)} prompts"
+        )
+    return [p if o is None else o for p, o in zip(prompts, other)]
+
+
+def _clip_groups(tokenizer, prompts):
+    """Each prompt's 77-token CLIP groups with their weights."""
+    return [
+        _group_tokens_and_weights(*_tokenize_clip_with_weights(tokenizer, prompt))
+        for prompt in prompts
+    ]
+
+
+def _encode_clip(text_encoder, groups, count, device, pooled_output, hidden_states):
+    """Run a CLIP encoder once over every token group of every prompt.
+
+    Each prompt is padded with empty groups to count groups, so the groups of all
+    prompts go through the encoder as one batch.
+
+    Args:
+        text_encoder: The CLIP text model
+        groups: Per prompt, its (token groups, weight groups)
+        count: Groups every prompt is padded to
+        device: The device to encode on
+        pooled_output: The output attribute holding the pooled embedding -
+            pooler_output for CLIPTextModel, text_embeds with a projection. None
+            takes text_embeds when the output has it, pooler_output otherwise
+        hidden_states: Also return the weighted penultimate hidden states
+
+    Returns:
+        (pooled [N, D] - the mean over each prompt's own groups,
+        sequence [N, count * 77, D] or None)
+    """
+    tokens, weights = [], []
+    for token_groups, weight_groups in groups:
+        padding = count - len(token_groups)
+        tokens.extend(token_groups + [_EMPTY_GROUP] * padding)
+        weights.extend(weight_groups + [[1.0] * len(_EMPTY_GROUP)] * padding)
+
+    token_tensor = torch.tensor(tokens, dtype=torch.long, device=device)
+    with torch.no_grad():
+        output = text_encoder(token_tensor, output_hidden_states=hidden_states)
+
+    if pooled_output is None:
+        pooled = getattr(output, "text_embeds", None)
+        if pooled is None:
+            pooled = output.pooler_output
+    else:
+        pooled = getattr(output, pooled_output)
+    pooled = pooled.view(len(groups), count, -1)
+    pooled = torch.stack(
+        [
+            pooled[row, : len(token_groups)].mean(dim=0)
+            for row, (token_groups, _) in enumerate(groups)
+        ]
+    ).to(dtype=text_encoder.dtype, device=device)
+
+    if not hidden_states:
+        return pooled, None
+    sequence = output.hidden_states[-2].to(device)
+    sequence = sequence.reshape(len(groups), count * sequence.shape[1], -1)
+    return pooled, _weighted(sequence, weights, len(groups))
+
+
+def _weighted(embeds, weights, rows):
+    """Scale each token's embedding by its weight in one multiply."""
+    weight_tensor = torch.tensor(weights, dtype=torch.float32, device=embeds.device)
+    weight_tensor = weight_tensor.reshape(rows, -1, 1)
+    return (embeds.float() * weight_tensor).to(embeds.dtype)
+
+
+def _encode_t5(tokenizer, text_encoder, prompts, device):
+    """Run T5 once over every prompt, padded to the longest and masked.
+
+    Returns:
+        (weighted embeddings [N, longest, D], each prompt's token count)
+    """
+    tokenized = [_tokenize_t5_with_weights(tokenizer, prompt) for prompt in prompts]
+    lengths = [len(tokens) for tokens, _ in tokenized]
+    longest = max(lengths)
+    pad = getattr(tokenizer, "pad_token_id", None) or 0
+
+    tokens = [t + [pad] * (longest - len(t)) for t, _ in tokenized]
+    weights = [w + [1.0] * (longest - len(w)) for _, w in tokenized]
+    token_tensor = torch.tensor(tokens, dtype=torch.long, device=device)
+    encoder_arguments = {}
+    if min(lengths) < longest:
+        # Padding is masked out so a prompt encodes the same in any batch
+        encoder_arguments["attention_mask"] = torch.tensor(
+            [[1] * n + [0] * (longest - n) for n in lengths],
+            dtype=torch.long,
+            device=device,
+        )
+    with torch.no_grad():
+        embeds = text_encoder(token_tensor, **encoder_arguments)[0].to(device)
+    return _weighted(embeds, weights, len(prompts)), lengths
+
+
+def _rows(prompt_embeds, pooled_prompt_embeds, lengths, same_length):
+    """Split batched embeddings into one (prompt_embeds, pooled) pair per prompt."""
+    return [
+        (
+            (
+                prompt_embeds[row : row + 1]
+                if same_length
+                else prompt_embeds[row : row + 1, :length]
+            ),
+            pooled_prompt_embeds[row : row + 1],
+        )
+        for row, length in enumerate(lengths)
+    ]
+
+
+def get_weighted_text_embeddings_flux_batch(
+    pipe, prompts, prompts2=None, device=None, same_length=False
+):
+    """Weighted text embeddings for many prompts of a Flux pipeline at once.
+
+    Each encoder runs once over the batch: the CLIP groups of every prompt together,
+    then T5 over every prompt padded to the longest.
+
+    Args:
+        pipe: A loaded FluxPipeline with tokenizer, tokenizer_2, text_encoder, text_encoder_2
+        prompts: Primary prompts with optional weighting syntax
+        prompts2: Optional second prompts for the T5 encoder, one per prompt. A None
+            entry defaults to its prompt
+        device: Target device override
+        same_length: Leave every prompt padded to the longest instead of trimming each
+            to its own tokens
+
+    Returns:
+        One (prompt_embeds, pooled_prompt_embeds) pair per prompt, each what
+        get_weighted_text_embeddings_flux returns for it
+    """
+    prompts2 = _row_prompts(prompts, prompts2)
+    target_device = device if device is not None else _get_device(pipe)
+
+    with _encoders_on_device(
+        pipe, (pipe.text_encoder, pipe.text_encoder_2), target_device
+    ):
+        # CLIP (tokenizer 1) only contributes the pooled embeddings
+        groups = _clip_groups(pipe.tokenizer, prompts)
+        pooled_prompt_embeds, _ = _encode_clip(
+            pipe.text_encoder,
+            groups,
+            max(len(token_groups) for token_groups, _ in groups),
+            target_device,
+            "pooler_output",
+            hidden_states=False,
+        )
+
+        # T5 (tokenizer 2) for the main prompt embeddings
+        prompt_embeds, lengths = _encode_t5(
+            pipe.tokenizer_2, pipe.text_encoder_2, prompts2, target_device
+        )
+
+    prompt_embeds = prompt_embeds.to(dtype=pipe.text_encoder_2.dtype)
+    return _rows(prompt_embeds, pooled_prompt_embeds, lengths, same_length)
+
+
 def get_weighted_text_embeddings_flux(
     pipe,
     prompt: str = "",
@@ -218,70 +421,170 @@ def get_weighted_text_embeddings_flux(
     Returns:
         (prompt_embeds, pooled_prompt_embeds) — pass directly to pipe() as kwargs
     """
-    prompt2 = prompt if prompt2 is None else prompt2
+    return get_weighted_text_embeddings_flux_batch(pipe, [prompt], [prompt2], device)[0]
 
+
+def _encode_dual_clip(pipe, prompts, prompts2, device):
+    """Both CLIP encoders of an SDXL or SD3 pipeline over a batch of prompts.
+
+    Both are padded to the same number of groups, so their hidden states line up.
+    SDXL's first encoder is a CLIPTextModel and SD3's has a projection, so the
+    pooled embedding is read from whichever the output holds.
+
+    Returns:
+        (pooled of text_encoder, pooled of text_encoder_2, hidden states of both
+        concatenated [N, count * 77, D1 + D2], each prompt's group count)
+    """
+    groups = _clip_groups(pipe.tokenizer, prompts)
+    groups_2 = _clip_groups(pipe.tokenizer_2, prompts2)
+    counts = [
+        max(len(first[0]), len(second[0])) for first, second in zip(groups, groups_2)
+    ]
+
+    pooled, sequence = _encode_clip(
+        pipe.text_encoder, groups, max(counts), device, None, True
+    )
+    pooled_2, sequence_2 = _encode_clip(
+        pipe.text_encoder_2, groups_2, max(counts), device, "text_embeds", True
+    )
+    return pooled, pooled_2, torch.cat([sequence, sequence_2], dim=-1), counts
+
+
+def get_weighted_text_embeddings_sdxl_batch(
+    pipe, prompts, prompts2=None, device=None, same_length=False
+):
+    """Weighted text embeddings for many prompts of an SDXL pipeline at once.
+
+    The penultimate hidden states of both CLIP encoders are concatenated per token,
+    as SDXL's own encode_prompt does; the pooled embeddings come from
+    text_encoder_2's projection.
+
+    Args:
+        pipe: A loaded SDXL pipeline with tokenizer, tokenizer_2, text_encoder,
+            text_encoder_2
+        prompts: Primary prompts with optional weighting syntax
+        prompts2: Optional prompts for text_encoder_2, one per prompt. A None entry
+            defaults to its prompt
+        device: Target device override
+        same_length: Leave every prompt padded to the longest instead of trimming each
+            to its own tokens
+
+    Returns:
+        One (prompt_embeds, pooled_prompt_embeds) pair per prompt
+    """
+    prompts2 = _row_prompts(prompts, prompts2)
     target_device = device if device is not None else _get_device(pipe)
 
-    # Move text encoders to device if the pipeline sits on the CPU - unless
-    # offload hooks manage them, in which case they move themselves on forward
-    encoders_moved = False
-    if pipe.device.type == "cpu" and not (
-        _hook_managed(pipe.text_encoder) or _hook_managed(pipe.text_encoder_2)
+    with _encoders_on_device(
+        pipe, (pipe.text_encoder, pipe.text_encoder_2), target_device
     ):
-        pipe.text_encoder.to(target_device)
-        pipe.text_encoder_2.to(target_device)
-        encoders_moved = True
-
-    # Tokenize with CLIP (tokenizer 1) for pooled embeddings
-    prompt_tokens, prompt_weights = _tokenize_clip_with_weights(pipe.tokenizer, prompt)
-    prompt_token_groups, _ = _group_tokens_and_weights(prompt_tokens, prompt_weights)
-
-    # Generate pooled CLIP embeddings (mean across token groups)
-    pool_embeds_list = []
-    for token_group in prompt_token_groups:
-        token_tensor = torch.tensor(
-            [token_group], dtype=torch.long, device=target_device
+        _, pooled_prompt_embeds, prompt_embeds, counts = _encode_dual_clip(
+            pipe, prompts, prompts2, target_device
         )
-        with torch.no_grad():
-            embeds = pipe.text_encoder(token_tensor, output_hidden_states=False)
-        pool_embeds_list.append(embeds.pooler_output.squeeze(0))
-
-    pooled_prompt_embeds = torch.stack(pool_embeds_list, dim=0)
-    pooled_prompt_embeds = pooled_prompt_embeds.mean(dim=0, keepdim=True)
-    pooled_prompt_embeds = pooled_prompt_embeds.to(
-        dtype=pipe.text_encoder.dtype, device=target_device
-    )
 
-    # Tokenize with T5 (tokenizer 2) for main prompt embeddings
-    prompt_tokens_2, prompt_weights_2 = _tokenize_t5_with_weights(
-        pipe.tokenizer_2, prompt2
-    )
+    prompt_embeds = prompt_embeds.to(dtype=pipe.text_encoder_2.dtype)
+    lengths = [count * len(_EMPTY_GROUP) for count in counts]
+    return _rows(prompt_embeds, pooled_prompt_embeds, lengths, same_length)
 
-    token_tensor_2 = torch.tensor([prompt_tokens_2], dtype=torch.long)
-    with torch.no_grad():
-        t5_embeds = pipe.text_encoder_2(token_tensor_2.to(target_device))[0].squeeze(0)
-    t5_embeds = t5_embeds.to(device=target_device)
 
-    # Apply per-token weights to T5 embeddings
-    for i in range(len(prompt_weights_2)):
-        if prompt_weights_2[i] != 1.0:
-            t5_embeds[i] = t5_embeds[i] * prompt_weights_2[i]
+def get_weighted_text_embeddings_sdxl(
+    pipe, prompt: str = "", prompt2: str = None, device=None
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Generate weighted text embeddings for SDXL pipelines.
 
-    prompt_embeds = t5_embeds.unsqueeze(0).to(
-        dtype=pipe.text_encoder_2.dtype, device=target_device
-    )
+    Args:
+        pipe: A loaded SDXL pipeline
+        prompt: Primary prompt with optional weighting syntax
+        prompt2: Optional prompt for text_encoder_2 (defaults to prompt)
+        device: Target device override
+
+    Returns:
+        (prompt_embeds, pooled_prompt_embeds)
+    """
+    return get_weighted_text_embeddings_sdxl_batch(pipe, [prompt], [prompt2], device)[0]
+
+
+def get_weighted_text_embeddings_sd3_batch(
+    pipe, prompts, prompts2=None, prompts3=None, device=None, same_length=False
+):
+    """Weighted text embeddings for many prompts of an SD3 pipeline at once.
+
+    As SD3's own encode_prompt does, the two CLIP encoders' hidden states are
+    concatenated per token, zero-padded to T5's width and followed by the T5
+    embeddings; the pooled embeddings of both CLIP encoders are concatenated.
 
-    # Release encoders back to CPU if we moved them
-    if encoders_moved:
-        pipe.text_encoder.to("cpu")
-        pipe.text_encoder_2.to("cpu")
-        gc.collect()
+    Args:
+        pipe: A loaded SD3 pipeline with tokenizer, tokenizer_2, tokenizer_3 and
+            text_encoder, text_encoder_2, text_encoder_3
+        prompts: Primary prompts with optional weighting syntax
+        prompts2: Optional prompts for text_encoder_2. None entries default to prompt
+        prompts3: Optional prompts for the T5 text_encoder_3. None entries default to
+            prompt
+        device: Target device override
+        same_length: Leave every prompt padded to the longest instead of trimming each
+            to its own tokens
 
-        from . import empty_device_cache
+    Returns:
+        One (prompt_embeds, pooled_prompt_embeds) pair per prompt
+    """
+    prompts2 = _row_prompts(prompts, prompts2)
+    prompts3 = _row_prompts(prompts, prompts3)
+    target_device = device if device is not None else _get_device(pipe)
+    dtype = pipe.text_encoder_3.dtype
 
-        empty_device_cache()
+    with _encoders_on_device(
+        pipe,
+        (pipe.text_encoder, pipe.text_encoder_2, pipe.text_encoder_3),
+        target_device,
+    ):
+        pooled, pooled_2, clip_embeds, counts = _encode_dual_clip(
+            pipe, prompts, prompts2, target_device
+        )
+        t5_embeds, t5_lengths = _encode_t5(
+            pipe.tokenizer_3, pipe.text_encoder_3, prompts3, target_device
+        )
+
+    clip_embeds = torch.nn.functional.pad(
+        clip_embeds, (0, t5_embeds.shape[-1] - clip_embeds.shape[-1])
+    ).to(dtype)
+    pooled_prompt_embeds = torch.cat([pooled, pooled_2], dim=-1)
+    if same_length:
+        prompt_embeds = torch.cat([clip_embeds, t5_embeds.to(dtype)], dim=1)
+        return _rows(prompt_embeds, pooled_prompt_embeds, counts, same_length=True)
+
+    return [
+        (
+            torch.cat(
+                [
+                    clip_embeds[row : row + 1, : count * len(_EMPTY_GROUP)],
+                    t5_embeds[row : row + 1, :length].to(dtype),
+                ],
+                dim=1,
+            ),
+            pooled_prompt_embeds[row : row + 1],
+        )
+        for row, (count, length) in enumerate(zip(counts, t5_lengths))
+    ]
+
+
+def get_weighted_text_embeddings_sd3(
+    pipe, prompt: str = "", prompt2: str = None, device=None, prompt3: str = None
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Generate weighted text embeddings for SD3 pipelines.
+
+    Args:
+        pipe: A loaded SD3 pipeline
+        prompt: Primary prompt with optional weighting syntax
+        prompt2: Optional prompt for text_encoder_2 (defaults to prompt)
+        device: Target device override
+        prompt3: Optional prompt for the T5 encoder (defaults to prompt)
 
-    return prompt_embeds, pooled_prompt_embeds
+    Returns:
+        (prompt_embeds, pooled_prompt_embeds)
+    """
+    return get_weighted_text_embeddings_sd3_batch(
+        pipe, [prompt], [prompt2], [prompt3], device
+    )[0]
 
 
 # ---------------------------------------------------------------------------
@@ -294,37 +597,163 @@ _PIPELINE_FUNCTIONS = {
     "FluxImg2ImgPipeline": get_weighted_text_embeddings_flux,
     "FluxInpaintPipeline": get_weighted_text_embeddings_flux,
     "FluxControlNetPipeline": get_weighted_text_embeddings_flux,
+    "StableDiffusionXLPipeline": get_weighted_text_embeddings_sdxl,
+    "StableDiffusionXLImg2ImgPipeline": get_weighted_text_embeddings_sdxl,
+    "StableDiffusionXLInpaintPipeline": get_weighted_text_embeddings_sdxl,
+    "StableDiffusionXLControlNetPipeline": get_weighted_text_embeddings_sdxl,
+    "StableDiffusion3Pipeline": get_weighted_text_embeddings_sd3,
+    "StableDiffusion3Img2ImgPipeline": get_weighted_text_embeddings_sd3,
+    "StableDiffusion3InpaintPipeline": get_weighted_text_embeddings_sd3,
+    "StableDiffusion3ControlNetPipeline": get_weighted_text_embeddings_sd3,
 }
 
 # The encoder stack get_weighted_text_embeddings_flux drives - CLIP for pooled
 # embeddings, T5 for the main ones
 _FLUX_ENCODER_STACK = ("tokenizer", "tokenizer_2", "text_encoder", "text_encoder_2")
+# SDXL's two CLIP encoders. The refiner carries only the second and is not covered
+_SDXL_ENCODER_STACK = _FLUX_ENCODER_STACK
+# SD3's two CLIP encoders and T5 - a pipeline loaded without T5 is not covered
+_SD3_ENCODER_STACK = _FLUX_ENCODER_STACK + ("tokenizer_3", "text_encoder_3")
+
+# Class name prefix of a pipeline family -> the encoder stack its function drives
+_FAMILY_FUNCTIONS = (
+    ("Flux", _FLUX_ENCODER_STACK, get_weighted_text_embeddings_flux),
+    ("StableDiffusionXL", _SDXL_ENCODER_STACK, get_weighted_text_embeddings_sdxl),
+    ("StableDiffusion3", _SD3_ENCODER_STACK, get_weighted_text_embeddings_sd3),
+)
+
+# Each embedding function's batched form
+_BATCH_FUNCTIONS = {
+    get_weighted_text_embeddings_flux: get_weighted_text_embeddings_flux_batch,
+    get_weighted_text_embeddings_sdxl: get_weighted_text_embeddings_sdxl_batch,
+    get_weighted_text_embeddings_sd3: get_weighted_text_embeddings_sd3_batch,
+}
+
+# Stacks whose pipelines take negative_prompt_embeds - a negative prompt is weighted
+# in the same batch as the prompt instead of being dropped
+_NEGATIVE_PROMPT_FUNCTIONS = (
+    get_weighted_text_embeddings_sdxl,
+    get_weighted_text_embeddings_sd3,
+)
+
+_PROMPT_ARGUMENTS = ("prompt", "prompt_2", "prompt_3")
+_NEGATIVE_PROMPT_ARGUMENTS = (
+    "negative_prompt",
+    "negative_prompt_2",
+    "negative_prompt_3",
+)
 
 
 def _select_embedding_function(pipeline):
     """The weighted-embedding function for a pipeline, or None.
 
-    Exact class names first; any other Flux-family pipeline (FluxKontext,
-    FluxFill, a user subclass) carrying the same CLIP+T5 encoder stack uses the
-    flux function too, so support does not lag every new variant diffusers adds.
+    Exact class names first; any other pipeline of a supported family (FluxKontext,
+    FluxFill, a user subclass) carrying the same encoder stack uses the family's
+    function too, so support does not lag every new variant diffusers adds. A
+    pipeline of a family loaded without one of the stack's encoders is not
+    supported.
     """
-    embed_fn = _PIPELINE_FUNCTIONS.get(pipeline.__class__.__name__)
-    if embed_fn is not None:
-        return embed_fn
+    class_name = pipeline.__class__.__name__
+    embed_fn = _PIPELINE_FUNCTIONS.get(class_name)
+
+    for prefix, stack, family_fn in _FAMILY_FUNCTIONS:
+        if not class_name.startswith(prefix):
+            continue
+        if not all(getattr(pipeline, name, None) is not None for name in stack):
+            return None
+        if embed_fn is None:
+            logger.info(
+                f"{class_name} carries the {prefix} encoder stack - "
+                f"applying {prefix} prompt weighting"
+            )
+        return embed_fn or family_fn
+
+    return embed_fn
+
 
-    if pipeline.__class__.__name__.startswith("Flux") and all(
-        getattr(pipeline, name, None) is not None for name in _FLUX_ENCODER_STACK
+def _has_weighting(prompt):
+    return isinstance(prompt, str) and ("(" in prompt or "[" in prompt)
+
+
+def _weighted_prompts(embed_fn, arguments):
+    """The prompt arguments a weighted encoding of a call consumes, by name."""
+    names = _PROMPT_ARGUMENTS
+    if embed_fn in _NEGATIVE_PROMPT_FUNCTIONS and isinstance(
+        arguments.get("negative_prompt", None), str
     ):
-        logger.info(
-            f"{pipeline.__class__.__name__} carries the Flux encoder stack - "
-            f"applying flux prompt weighting"
-        )
-        return get_weighted_text_embeddings_flux
+        names += _NEGATIVE_PROMPT_ARGUMENTS
+    return {name: arguments[name] for name in names if name in arguments}
+
+
+def _batch_arguments(rows):
+    """Batch function arguments for rows of prompt arguments, one row per prompt."""
+    batch = {
+        "prompts": [row["prompt"] for row in rows],
+        "prompts2": [row.get("prompt_2", None) for row in rows],
+    }
+    if any(row.get("prompt_3", None) is not None for row in rows):
+        batch["prompts3"] = [row.get("prompt_3", None) for row in rows]
+    return batch
+
+
+def _encode_with_negative(pipeline, embed_fn, prompts, device):
+    """A prompt and its negative weighted as one batch, padded to the same length."""
+    negative = {
+        name[len("negative_") :]: prompts.get(name, None)
+        for name in _NEGATIVE_PROMPT_ARGUMENTS
+    }
+    positive, negative = _BATCH_FUNCTIONS[embed_fn](
+        pipeline,
+        **_batch_arguments([prompts, negative]),
+        device=device,
+        same_length=True,
+    )
+    return positive + negative
 
-    return None
 
+def encode_weighted_prompts(pipeline, argument_sets, device=None, before_encode=None):
+    """Weight the prompts of many calls as one batch, into the embedding cache.
+
+    The calls then find their embeddings in the cache. Each encoder runs once for
+    every prompt not cached yet, instead of once per call. A call with a negative
+    prompt is weighted as its own batch when it runs, since its prompt and negative
+    are padded to each other's length.
+
+    Args:
+        pipeline: The loaded diffusers pipeline
+        argument_sets: Pipeline call arguments, one per call
+        device: The device the pipeline runs on
+        before_encode: Called before the encoders run, when they do
 
-def apply_prompt_weighting(pipeline, arguments, device=None):
+    Returns:
+        The number of prompts encoded
+    """
+    embed_fn = _select_embedding_function(pipeline)
+    batch_fn = _BATCH_FUNCTIONS.get(embed_fn)
+    if batch_fn is None:
+        return 0
+
+    pending = []
+    for arguments in argument_sets:
+        if not _has_weighting(arguments.get("prompt", None)):
+            continue
+        prompts = _weighted_prompts(embed_fn, arguments)
+        if "negative_prompt" not in prompts:
+            pending.append(("prompt_weighting", prompts, device))
+
+    def encode(missing):
+        logger.info(f"Applying prompt weighting to {len(missing)} prompts in one batch")
+        rows = [prompts for _, prompts, _ in missing]
+        return batch_fn(pipeline, **_batch_arguments(rows), device=device)
+
+    return cached_batch_encoding(
+        encoder_identity(pipeline), pending, encode, before_encode
+    )
+
+
+def apply_prompt_weighting(
+    pipeline, arguments, device=None, use_cache=True, before_encode=None
+):
     """Apply prompt weighting to pipeline arguments if the prompt contains weight syntax.
 
     Checks if the prompt uses weighting syntax. If so, generates weighted embeddings
@@ -336,6 +765,9 @@ def apply_prompt_weighting(pipeline, arguments, device=None):
         device: The device the pipeline runs on - embeddings are created there.
             Defaults to the pipeline's own device, or the dw device when offloading
             parks the pipeline on the CPU
+        use_cache: Reuse the embeddings of a prompt weighted before, from the
+            process-wide embedding cache
+        before_encode: Called before the encoders run, when they do
 
     Returns:
         True if weighting was applied, False if prompt was left as-is.
@@ -345,7 +777,7 @@ def apply_prompt_weighting(pipeline, arguments, device=None):
         return False
 
     # Quick check: does the prompt contain any weighting syntax?
-    if "(" not in prompt and "[" not in prompt:
+    if not _has_weighting(prompt):
         return False
 
     class_name = pipeline.__class__.__name__
@@ -353,25 +785,51 @@ def apply_prompt_weighting(pipeline, arguments, device=None):
     if embed_fn is None:
         logger.warning(
             f"Prompt weighting not supported for {class_name}. "
-            f"Supported: {', '.join(_PIPELINE_FUNCTIONS.keys())} and Flux-family "
-            f"pipelines with the CLIP+T5 encoder stack. "
-            f"Passing prompt as plain text."
+            f"Supported: {', '.join(_PIPELINE_FUNCTIONS.keys())} and other Flux, "
+            f"StableDiffusionXL and StableDiffusion3 pipelines with their "
+            f"family's encoder stack. Passing prompt as plain text."
         )
         return False
 
     logger.info(f"Applying prompt weighting for {class_name}")
-    prompt2 = arguments.pop("prompt_2", None)
-    prompt_str = arguments.pop("prompt")
-
-    prompt_embeds, pooled_prompt_embeds = embed_fn(
-        pipeline, prompt=prompt_str, prompt2=prompt2, device=device
+    prompts = _weighted_prompts(embed_fn, arguments)
+    for name in prompts:
+        arguments.pop(name)
+
+    if "negative_prompt" in prompts:
+
+        def encode():
+            return _encode_with_negative(pipeline, embed_fn, prompts, device)
+
+    else:
+        extra = {"prompt3": prompts["prompt_3"]} if "prompt_3" in prompts else {}
+
+        def encode():
+            return embed_fn(
+                pipeline,
+                prompt=prompts["prompt"],
+                prompt2=prompts.get("prompt_2", None),
+                device=device,
+                **extra,
+            )
+
+    embeddings = cached_encoding(
+        encoder_identity(pipeline),
+        ("prompt_weighting", prompts, device),
+        encode,
+        enabled=use_cache,
+        before_encode=before_encode,
     )
 
-    arguments["prompt_embeds"] = prompt_embeds
-    arguments["pooled_prompt_embeds"] = pooled_prompt_embeds
+    arguments["prompt_embeds"], arguments["pooled_prompt_embeds"] = embeddings[:2]
+    if "negative_prompt" in prompts:
+        (
+            arguments["negative_prompt_embeds"],
+            arguments["negative_pooled_prompt_embeds"],
+        ) = embeddings[2:]
 
     # Remove negative_prompt if present — can't mix string and embeds
-    if "negative_prompt" in arguments:
+    elif "negative_prompt" in arguments:
         logger.debug("Removing negative_prompt (incompatible with prompt_embeds)")
         arguments.pop("negative_prompt")
 
@@ -0,0 +1,570 @@
+"""Pick per-component quantization that fits a pipeline's weights into a memory budget.
+
+Finding a combination that loads is otherwise trial and OOM, and each trial is a
+multi-minute load. The advisor builds each component on the meta device from its
+config alone - a few kilobytes of JSON rather than the weights - counts what the
+quantization backends dw supports would store for it, and recommends the least-lossy
+assignment that fits. The plan is written back in the shape dw already reads: a
+quantization_config on each component block, or load_components.quantization_config
+for a modular pipeline.
+"""
+
+import copy
+import logging
+from dataclasses import dataclass, field
+
+from .settings import parse_size
+from .type_helpers import load_type_from_name
+
+logger = logging.getLogger("dw")
+
+# Precision levels from least to most lossy. A component is only ever moved down this
+# list, so a plan never quantizes harder than the budget requires
+LEVELS = ("none", "int8", "int4")
+
+# Bytes each backend stores per quantized weight, including the per-group scales held
+# alongside it - nf4 keeps an fp32 absmax per 64 weights, int4 weight-only formats a
+# scale and zero point per group of 128, GGUF's Q8_0 and Q4_K are 8.5 and 4.5 bits
+BACKENDS = {
+    "bnb": {"int8": 1.0, "int4": 0.5 + 4 / 64},
+    "torchao": {"int8": 1.0, "int4": 0.5 + 4 / 128},
+    "sdnq": {"int8": 1.0, "int4": 0.5 + 4 / 64},
+    "quanto": {"int8": 1.0, "int4": 0.5 + 4 / 128},
+    "gguf": {"int8": 8.5 / 8, "int4": 4.5 / 8},
+}
+
+DEFAULT_BACKEND = "sdnq"
+
+# diffusers reads GGUF only from pre-quantized single-file checkpoints, so a GGUF plan
+# is a report of the file each component needs - the quant type of each level - and
+# is never written into a workflow
+GGUF_QUANT_TYPES = {"int8": "Q8_0", "int4": "Q4_K"}
+
+
+def format_size(num_bytes):
+    """Format a byte count in GiB for reports."""
+    return f"{num_bytes / 1024**3:.2f}GB"
+
+
+@dataclass
+class ComponentFootprint:
+    """The weights of one component, split by whether a backend can quantize them.
+
+    Every backend quantizes the weights of linear layers; norms, embeddings, biases and
+    convolutions stay at the component's dtype whatever the plan says.
+    """
+
+    name: str
+    component_type: str
+    library: str
+    quantizable_params: int
+    other_params: int
+    dtype_bytes: float
+
+    def size(self, level, backend):
+        """Bytes this component's weights take at a precision level."""
+        weight_bytes = self.dtype_bytes if level == "none" else BACKENDS[backend][level]
+        return int(
+            self.quantizable_params * weight_bytes
+            + self.other_params * self.dtype_bytes
+        )
+
+
+@dataclass
+class QuantizationPlan:
+    """The precision chosen for each component, and what the pipeline then weighs."""
+
+    backend: str
+    budget_bytes: int
+    footprints: list
+    levels: dict = field(default_factory=dict)
+
+    @property
+    def total_bytes(self):
+        return sum(
+            footprint.size(self.levels[footprint.name], self.backend)
+            for footprint in self.footprints
+        )
+
+    @property
+    def fits(self):
+        return self.total_bytes <= self.budget_bytes
+
+    def report(self):
+        """A table of each component's precision and size, for the command line."""
+        lines = [
+            f"Quantization plan ({self.backend}, budget {format_size(self.budget_bytes)}):"
+        ]
+        # A GGUF level is shown with the quant type of the file it needs
+        gguf = self.backend == "gguf"
+        width = 10 if gguf else 5
+        for footprint in self.footprints:
+            level = self.levels[footprint.name]
+            precision = level
+            if gguf and level in GGUF_QUANT_TYPES:
+                precision = f"{level} {GGUF_QUANT_TYPES[level]}"
+            lines.append(
+                f"  {footprint.name:<20} {precision:<{width}} "
+                f"{format_size(footprint.size(level, self.backend)):>10}"
+                f"  (unquantized {format_size(footprint.size('none', self.backend))})"
+            )
+        lines.append(
+            f"  {'total':<20} {'':<{width}} {format_size(self.total_bytes):>10}"
+            + ("" if self.fits else "  - does not fit")
+        )
+        if gguf and any(level != "none" for level in self.levels.values()):
+            lines.append(
+                "  GGUF loads only pre-quantized files: each quantized component "
+                "needs a .gguf checkpoint of the type shown, given as its "
+                "from_single_file"
+            )
+        return "\n".join(lines)
+
+
+def dtype_bytes(dtype, default=4):
+    """Bytes per element of a dtype given as 'torch.bfloat16', a torch dtype, or None."""
+    import torch
+
+    if dtype is None:
+        return default
+    if isinstance(dtype, str):
+        dtype = getattr(torch, dtype.removeprefix("torch."), None)
+        if not isinstance(dtype, torch.dtype):
+            return default
+    return torch.empty((), dtype=dtype).element_size()
+
+
+def module_footprint(name, module, component_type, library, dtype=None):
+    """Count a module's weights, split into those a backend can quantize and the rest.
+
+    Args:
+        name: Component name in the pipeline
+        module: The module, typically built on the meta device
+        component_type: Name of the component's class, for the report
+        library: 'diffusers' or 'transformers' - which config class quantizes it
+        dtype: The dtype the component is loaded in; its own parameters' dtype if None
+
+    Returns:
+        ComponentFootprint
+    """
+    import torch
+
+    quantizable = set()
+    for submodule in module.modules():
+        if isinstance(submodule, torch.nn.Linear):
+            quantizable.add(id(submodule.weight))
+
+    quantizable_params = 0
+    other_params = 0
+    element_size = None
+    for parameter in module.parameters():
+        element_size = element_size or parameter.element_size()
+        if id(parameter) in quantizable:
+            quantizable_params += parameter.numel()
+        else:
+            other_params += parameter.numel()
+    for buffer in module.buffers():
+        if buffer.is_floating_point():
+            other_params += buffer.numel()
+
+    return ComponentFootprint(
+        name=name,
+        component_type=component_type,
+        library=library,
+        quantizable_params=quantizable_params,
+        other_params=other_params,
+        dtype_bytes=dtype_bytes(dtype, default=element_size or 4),
+    )
+
+
+def estimate_component_footprint(
+    name, component_type, library, model_name, subfolder=None, dtype=None
+):
+    """Build a component from its config on the meta device and count its weights.
+
+    Only the config is downloaded, and the meta device allocates nothing, so this
+    costs a few kilobytes whatever the size of the model.
+
+    Args:
+        name: Component name in the pipeline
+        component_type: Class name, dotted when it is not a diffusers class
+        library: 'diffusers' or 'transformers'
+        model_name: Hub name or local path of the checkpoint
+        subfolder: Subfolder holding the component, usually its name
+        dtype: The dtype the component is loaded in
+
+    Returns:
+        ComponentFootprint, or None when the component holds no weights (a tokenizer
+        or scheduler)
+    """
+    import torch
+    from accelerate import init_empty_weights
+
+    component_class = load_type_from_name(
+        component_type if library == "diffusers" else f"{library}.{component_type}"
+    )
+    if not (
+        isinstance(component_class, type)
+        and issubclass(component_class, torch.nn.Module)
+    ):
+        return None
+
+    logger.debug(f"Estimating {name} ({component_type}) on the meta device")
+    if library == "transformers":
+        from transformers import AutoConfig
+
+        config = AutoConfig.from_pretrained(model_name, subfolder=subfolder or "")
+        with init_empty_weights():
+            module = component_class._from_config(config)
+    else:
+        config = component_class.load_config(model_name, subfolder=subfolder)
+        with init_empty_weights():
+            module = component_class.from_config(config)
+
+    return module_footprint(name, module, component_type, library, dtype)
+
+
+def _levels_for(footprint, backend):
+    """The precision levels a backend offers a component."""
+    # GGUF checkpoints load through diffusers' from_single_file; a transformers
+    # component has no GGUF path in dw, so it stays at its own dtype
+    if backend == "gguf" and footprint.library != "diffusers":
+        return ("none",)
+    return LEVELS
+
+
+def plan_quantization(footprints, budget, backend=DEFAULT_BACKEND, exclude=()):
+    """Choose the least-lossy precision for each component that fits the budget.
+
+    Every component is tried at int8 before any goes to int4. Within a level, if one
+    component's quantization alone closes the gap, the smallest such component is
+    chosen - the fewest weights touched; otherwise the largest is quantized and the
+    search goes on.
+
+    Args:
+        footprints: ComponentFootprint for each component
+        budget: Memory for the pipeline's weights, in bytes or as '24GB'
+        backend: One of BACKENDS
+        exclude: Component names to leave unquantized, e.g. a VAE
+
+    Returns:
+        QuantizationPlan - check its 'fits' when even the smallest assignment is over
+
+    Raises:
+        ValueError: If the backend is not known
+    """
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown quantization backend '{backend}'. Expected one of: {list(BACKENDS)}"
+        )
+
+    plan = QuantizationPlan(
+        backend=backend,
+        budget_bytes=parse_size(budget),
+        footprints=list(footprints),
+        levels={footprint.name: "none" for footprint in footprints},
+    )
+    candidates = [
+        footprint
+        for footprint in plan.footprints
+        if footprint.name not in exclude and footprint.quantizable_params > 0
+    ]
+
+    for level in LEVELS[1:]:
+        while not plan.fits:
+            saving = {
+                footprint.name: footprint.size(plan.levels[footprint.name], backend)
+                - footprint.size(level, backend)
+                for footprint in candidates
+                if level in _levels_for(footprint, backend)
+                and LEVELS.index(plan.levels[footprint.name]) < LEVELS.index(level)
+            }
+            if not saving:
+                break
+            gap = plan.total_bytes - plan.budget_bytes
+            closing = [name for name, saved in saving.items() if saved >= gap]
+            chosen = (
+                min(closing, key=saving.get) if closing else max(saving, key=saving.get)
+            )
+            plan.levels[chosen] = level
+
+    if not plan.fits:
+        logger.warning(
+            f"No {backend} assignment fits {format_size(plan.budget_bytes)}; "
+            f"the smallest is {format_size(plan.total_bytes)}"
+        )
+    return plan
+
+
+def quantization_definition(backend, level, library, compute_dtype="torch.bfloat16"):
+    """The quantization_config block dw reads, for a backend at a precision level.
+
+    Args:
+        backend: One of BACKENDS
+        level: 'int8' or 'int4'
+        library: 'diffusers' or 'transformers' - a transformers component takes the
+            transformers config class
+        compute_dtype: The dtype quantized weights are computed in
+
+    Returns:
+        Dictionary in the workflow's quantization_config shape
+
+    Raises:
+        ValueError: If the backend is unknown, or is GGUF - see GGUF_QUANT_TYPES
+    """
+    prefix = "transformers." if library == "transformers" else ""
+    if backend == "bnb":
+        config_type = f"{prefix}BitsAndBytesConfig"
+        arguments = (
+            {"load_in_8bit": True}
+            if level == "int8"
+            else {
+                "load_in_4bit": True,
+                "bnb_4bit_quant_type": "{nf4}",
+                "bnb_4bit_compute_dtype": compute_dtype,
+            }
+        )
+    elif backend == "torchao":
+        config_type = f"{prefix}TorchAoConfig"
+        arguments = {
+            "quant_type": (
+                "torchao.quantization.Int8WeightOnlyConfig"
+                if level == "int8"
+                else "torchao.quantization.Int4WeightOnlyConfig"
+            )
+        }
+    elif backend == "sdnq":
+        config_type = "sdnq.SDNQConfig"
+        arguments = {"weights_dtype": f"{{{level}}}"}
+    elif backend == "quanto":
+        config_type = f"{prefix}QuantoConfig"
+        # transformers names the argument 'weights', diffusers 'weights_dtype'
+        key = "weights" if library == "transformers" else "weights_dtype"
+        arguments = {key: f"{{{level}}}"}
+    elif backend == "gguf":
+        raise ValueError(
+            f"A GGUF plan cannot be written into a workflow - the component needs a "
+            f"{GGUF_QUANT_TYPES[level]} .gguf checkpoint loaded with from_single_file"
+        )
+    else:
+        raise ValueError(
+            f"Unknown quantization backend '{backend}'. Expected one of: {list(BACKENDS)}"
+        )
+
+    return {"configuration": {"config_type": config_type}, "arguments": arguments}
+
+
+def is_modular(pipeline_definition):
+    """Whether a pipeline loads its component weights through load_components()."""
+    configuration = pipeline_definition.get("configuration", {})
+    return "load_components" in configuration or configuration.get(
+        "component_type", ""
+    ).endswith("ModularPipeline")
+
+
+def pipeline_dtype(pipeline_definition):
+    """The dtype a pipeline's components load in, as written in the workflow."""
+    load_components = pipeline_definition.get("configuration", {}).get(
+        "load_components", {}
+    )
+    return load_components.get("dtype") or pipeline_definition.get(
+        "from_pretrained_arguments", {}
+    ).get("torch_dtype")
+
+
+def component_index(model_name):
+    """Map each component of a checkpoint to its (library, class name).
+
+    Read from the checkpoint's model_index.json, or modular_model_index.json for a
+    repository that only ships a modular pipeline.
+    """
+    from diffusers import DiffusionPipeline
+
+    try:
+        index = DiffusionPipeline.load_config(model_name)
+    except EnvironmentError:
+        import json
+        from huggingface_hub import hf_hub_download
+
+        with open(hf_hub_download(model_name, "modular_model_index.json")) as file:
+            index = json.load(file)
+
+    return {
+        name: (value[0], value[1])
+        for name, value in index.items()
+        if isinstance(value, (list, tuple))
+        and len(value) >= 2
+        and value[0] is not None
+        and value[1] is not None
+    }
+
+
+def pipeline_components(pipeline_definition):
+    """List the components of a pipeline definition with where their weights load from.
+
+    The checkpoint's own index supplies every component; a component block in the
+    definition overrides its class and source.
+
+    Returns:
+        List of (name, component_type, library, model_name, subfolder, dtype)
+    """
+    from_pretrained_arguments = pipeline_definition.get("from_pretrained_arguments", {})
+    model_name = from_pretrained_arguments.get("model_name")
+    dtype = pipeline_dtype(pipeline_definition)
+
+    components = {}
+    if model_name is not None:
+        for name, (library, component_type) in component_index(model_name).items():
+            components[name] = (name, component_type, library, model_name, name, dtype)
+
+    for name, block in pipeline_definition.items():
+        if not isinstance(block, dict):
+            continue
+        component_type = block.get("configuration", {}).get("component_type")
+        block_arguments = block.get("from_pretrained_arguments", {})
+        if component_type is None or "model_name" not in block_arguments:
+            continue
+        library = "diffusers"
+        if "." in component_type:
+            library, _, component_type = component_type.partition(".")
+        components[name] = (
+            name,
+            component_type,
+            library,
+            block_arguments["model_name"],
+            block_arguments.get("subfolder"),
+            block_arguments.get("torch_dtype", dtype),
+        )
+
+    return list(components.values())
+
+
+def advise_pipeline(
+    pipeline_definition,
+    budget,
+    backend=DEFAULT_BACKEND,
+    exclude=(),
+    estimate=estimate_component_footprint,
+):
+    """Plan quantization for one pipeline definition from a workflow.
+
+    Args:
+        pipeline_definition: The 'pipeline' block of a workflow step
+        budget: Memory for the pipeline's weights, in bytes or as '24GB'
+        backend: One of BACKENDS
+        exclude: Component names to leave unquantized
+        estimate: Builds a component's ComponentFootprint; the meta-device estimate
+
+    Returns:
+        QuantizationPlan
+    """
+    footprints = []
+    for (
+        name,
+        component_type,
+        library,
+        model_name,
+        subfolder,
+        dtype,
+    ) in pipeline_components(pipeline_definition):
+        footprint = estimate(
+            name, component_type, library, model_name, subfolder, dtype
+        )
+        if footprint is not None:
+            footprints.append(footprint)
+
+    return plan_quantization(footprints, budget, backend, exclude)
+
+
+def apply_plan(pipeline_definition, plan):
+    """Write a plan into a copy of a pipeline definition.
+
+    A modular pipeline gets a load_components.quantization_config entry per quantized
+    component. Any other pipeline gets a quantization_config on the component's block,
+    with the block created when the definition did not declare one. A component the
+    plan leaves at full precision is not touched.
+
+    Returns:
+        The updated copy of the pipeline definition
+    """
+    definition = copy.deepcopy(pipeline_definition)
+    compute_dtype = pipeline_dtype(definition) or "torch.bfloat16"
+    model_name = definition.get("from_pretrained_arguments", {}).get("model_name")
+
+    for footprint in plan.footprints:
+        level = plan.levels[footprint.name]
+        if level == "none":
+            continue
+        quantization_config = quantization_definition(
+            plan.backend, level, footprint.library, compute_dtype
+        )
+
+        if is_modular(definition):
+            load_components = definition["configuration"].setdefault(
+                "load_components", {}
+            )
+            load_components.setdefault("quantization_config", {})[
+                footprint.name
+            ] = quantization_config
+            continue
+
+        component_type = footprint.component_type
+        if footprint.library != "diffusers":
+            component_type = f"{footprint.library}.{component_type}"
+        block = definition.setdefault(
+            footprint.name,
+            {
+                "configuration": {"component_type": component_type},
+                "from_pretrained_arguments": {
+                    "model_name": model_name,
+                    "subfolder": footprint.name,
+                    "torch_dtype": compute_dtype,
+                },
+            },
+        )
+        block["quantization_config"] = quantization_config
+
+    return definition
+
+
+def advise_workflow(
+    workflow_definition,
+    budget,
+    backend=DEFAULT_BACKEND,
+    exclude=(),
+    estimate=estimate_component_footprint,
+):
+    """Plan quantization for every pipeline step of a workflow.
+
+    Variables are substituted with their defaults to find each checkpoint, but the
+    plan is written into the definition as it was, so its variable references survive.
+
+    Args:
+        workflow_definition: The workflow as loaded from its JSON file
+        budget: Memory for each pipeline's weights, in bytes or as '24GB'
+        backend: One of BACKENDS
+        exclude: Component names to leave unquantized
+        estimate: Builds a component's ComponentFootprint; the meta-device estimate
+
+    Returns:
+        Tuple of (list of (step name, QuantizationPlan), updated copy of the workflow).
+        A GGUF plan is only reported, so the copy is the workflow unchanged
+    """
+    from .variables import replace_variables
+
+    resolved = copy.deepcopy(workflow_definition)
+    replace_variables(resolved, resolved.get("variables", None))
+
+    updated = copy.deepcopy(workflow_definition)
+    plans = []
+    for step, resolved_step in zip(updated.get("steps", []), resolved.get("steps", [])):
+        if "pipeline" not in resolved_step:
+            continue
+        plan = advise_pipeline(
+            resolved_step["pipeline"], budget, backend, exclude, estimate
+        )
+        plans.append((step["name"], plan))
+        if backend != "gguf":
+            step["pipeline"] = apply_plan(step["pipeline"], plan)
+
+    return plans, updated
@@ -0,0 +1,164 @@
+"""A local stand-in for a remote text-encoder service.
+
+Serves the protocol the remote_text_encoder client speaks: a POST of
+{"prompt": "..."} or {"prompt": [...]} answered with the prompt embeddings, batched
+along the first dimension. Run it on a machine with memory for the text encoder and
+point workflows on other machines at it:
+
+    python -m dw.remote_encoder_server black-forest-labs/FLUX.2-dev --port 8000
+
+Responses are safetensors when the request accepts them, as dw's client does, and a
+raw buffer described by X-Tensor-Dtype and X-Tensor-Shape headers otherwise. Nothing
+is pickled. Requests are encoded one at a time, in the order they arrive.
+
+Tests serve an encode function of their own with serve_text_encoder.
+"""
+
+import argparse
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("dw")
+
+SAFETENSORS_TYPE = "application/x-safetensors"
+RAW_TYPE = "application/octet-stream"
+
+
+def _safetensors_bytes(tensor):
+    from safetensors.torch import save
+
+    return save({"prompt_embeds": tensor.contiguous()})
+
+
+def _raw_bytes(tensor):
+    import torch
+
+    tensor = tensor.contiguous()
+    return tensor.view(torch.uint8).numpy().tobytes() if tensor.numel() else b""
+
+
+def _handler(encode, path, lock):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path.split("?")[0] != path:
+                self.send_error(404)
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                prompt = json.loads(self.rfile.read(length))["prompt"]
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_error(400, f"Expected a JSON body with a prompt: {e}")
+                return
+
+            prompts = [prompt] if isinstance(prompt, str) else list(prompt)
+            try:
+                with lock:
+                    embeds = encode(prompts).detach().to("cpu")
+            except Exception as e:
+                logger.error(f"Encoding failed: {e}", exc_info=True)
+                self.send_error(500, str(e))
+                return
+
+            if SAFETENSORS_TYPE in self.headers.get("Accept", ""):
+                body = _safetensors_bytes(embeds)
+                headers = {"Content-Type": SAFETENSORS_TYPE}
+            else:
+                body = _raw_bytes(embeds)
+                headers = {
+                    "Content-Type": RAW_TYPE,
+                    "X-Tensor-Dtype": str(embeds.dtype).removeprefix("torch."),
+                    "X-Tensor-Shape": ",".join(str(size) for size in embeds.shape),
+                }
+            self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f"remote encoder server: {format % args}")
+
+    return Handler
+
+
+def serve_text_encoder(encode, host="127.0.0.1", port=8000, path="/predict"):
+    """A server answering encode requests. Call serve_forever() on it to serve.
+
+    Args:
+        encode: Encodes a list of prompts into one tensor of embeddings, batched along
+            the first dimension
+        host: The address to listen on
+        port: The port to listen on. 0 picks a free one - see server_address
+        path: The endpoint's path
+
+    Returns:
+        The ThreadingHTTPServer
+    """
+    return ThreadingHTTPServer((host, port), _handler(encode, path, threading.Lock()))
+
+
+def pipeline_encoder(model_name, component_type, device, torch_dtype=None):
+    """An encode function over a diffusers pipeline loaded without its denoiser and VAE.
+
+    Args:
+        model_name: The model to load the text encoders of
+        component_type: The diffusers pipeline class, e.g. Flux2Pipeline
+        device: Where to encode
+        torch_dtype: The dtype to load the encoders in, e.g. 'bfloat16'
+    """
+    import diffusers
+    import torch
+
+    pipeline_class = getattr(diffusers, component_type)
+    arguments = {"transformer": None, "vae": None}
+    if torch_dtype is not None:
+        arguments["torch_dtype"] = getattr(torch, torch_dtype.removeprefix("torch."))
+    pipeline = pipeline_class.from_pretrained(model_name, **arguments).to(device)
+
+    @torch.inference_mode()
+    def encode(prompts):
+        return pipeline.encode_prompt(prompt=prompts, device=device)[0]
+
+    return encode
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve a model's text encoder to remote_text_encoder clients."
+    )
+    parser.add_argument("model_name", type=str, help="The model to serve")
+    parser.add_argument(
+        "--component_type",
+        type=str,
+        default="Flux2Pipeline",
+        help="The diffusers pipeline class the model loads with",
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--path", type=str, default="/predict")
+    parser.add_argument("--device", type=str, default=None)
+    parser.add_argument("--torch_dtype", type=str, default="bfloat16")
+    parser.add_argument(
+        "-l",
+        "--log_level",
+        type=str,
+        default="INFO",
+        help="Set the logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)",
+    )
+    args = parser.parse_args()
+
+    from . import get_device, startup
+
+    startup(args.log_level)
+    encode = pipeline_encoder(
+        args.model_name,
+        args.component_type,
+        args.device or get_device(),
+        args.torch_dtype,
+    )
+    server = serve_text_encoder(encode, args.host, args.port, args.path)
+    print(f"Serving {args.model_name} at http://{args.host}:{args.port}{args.path}")
+    server.serve_forever()
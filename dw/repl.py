@@ -161,6 +161,46 @@ class DiffusersWorkflowREPL(cmd.Cmd):
             print(f"  Free: {info.get('gpu_memory_free_mb', 0):.1f} MB")
             print(f"  Total: {info.get('gpu_memory_total_mb', 0):.1f} MB")
 
+        residency = info.get("residency")
+        if residency and residency.get("hits", 0) + residency.get("misses", 0):
+            print(
+                f"  On-demand residency: {residency['resident_bytes'] / 1024**2:.1f} MB "
+                f"held, {residency['hits']} hits / {residency['misses']} misses, "
+                f"{residency['evictions']} evictions"
+            )
+
+        embeddings = info.get("embedding_cache")
+        if embeddings and embeddings.get("hits", 0) + embeddings.get("misses", 0):
+            print(
+                f"  Prompt embeddings: {embeddings['cached_bytes'] / 1024**2:.1f} MB "
+                f"cached, {embeddings['hit_rate']:.0%} hit rate "
+                f"({embeddings['hits']} hits / {embeddings['misses']} misses)"
+            )
+
+        media = info.get("decoded_media_cache")
+        if media and media.get("hits", 0) + media.get("misses", 0):
+            print(
+                f"  Decoded media: {media['cached_bytes'] / 1024**2:.1f} MB "
+                f"cached, {media['hit_rate']:.0%} hit rate "
+                f"({media['hits']} hits / {media['misses']} misses)"
+            )
+
+        telemetry = info.get("cache_telemetry")
+        if telemetry and telemetry.get("pipeline_calls", 0):
+            last = telemetry["last_call"]
+            if last["blocks_total"] is None:
+                print(
+                    f"  Transformer cache: {last['method']}, "
+                    f"{last['transformer_calls']} calls in the last run"
+                )
+            else:
+                print(
+                    f"  Transformer cache: {last['method']}, last run "
+                    f"{last['calls_reused']}/{last['transformer_calls']} calls reused, "
+                    f"~{last['compute_saved']:.0%} of block compute saved "
+                    f"(~{telemetry['compute_saved']:.0%} this session)"
+                )
+
         print(f"  Runs in this session: {info.get('run_count', 0)}")
         print()
 
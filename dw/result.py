@@ -5,14 +5,18 @@ import soundfile
 import json
 import mimetypes
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from diffusers.utils import (
     export_to_video,
     export_to_gif,
-    encode_video,
     is_av_available,
 )
 from collections.abc import Mapping
+from . import settings
+from .lazy_image import LazyImage
 from .security import validate_output_path, validate_string_input, SecurityError
+from .type_helpers import has_method
+from .video_writer import EncodedVideo, write_video
 
 logger = logging.getLogger("dw")
 
@@ -42,7 +46,39 @@ AUDIO_WRITE_ARGUMENTS = ["subtype", "format", "compression_level", "bitrate_mode
 # Audio is written in chunks of this many frames - see write_audio
 AUDIO_WRITE_CHUNK_FRAMES = 1 << 20
 
-# The only container encode_video writes - it always encodes h264 video
+# Artifacts are encoded on this many threads at most when the save_workers setting
+# is not set - PNG and JPEG encoding release the GIL, so threads encode in parallel
+DEFAULT_MAX_SAVE_WORKERS = 8
+
+# Pillow save arguments per image content type for each image_preset. Without a
+# preset, images are saved with Pillow's defaults
+IMAGE_PRESETS = {
+    "fast": {
+        "image/png": {"compress_level": 1},
+        "image/jpeg": {"quality": 90},
+        "image/webp": {"quality": 90, "method": 0},
+    },
+    "balanced": {
+        "image/png": {"compress_level": 6},
+        "image/jpeg": {"quality": 90, "optimize": True},
+        "image/webp": {"quality": 90, "method": 4},
+    },
+    "small": {
+        "image/png": {"compress_level": 9, "optimize": True},
+        "image/jpeg": {"quality": 85, "optimize": True, "progressive": True},
+        "image/webp": {"quality": 85, "method": 6},
+    },
+}
+
+# Result definition keys setting one Pillow save argument, and the image content
+# types it applies to - these override the preset's
+IMAGE_SAVE_ARGUMENTS = {
+    "png_compress_level": ("compress_level", ("image/png",)),
+    "quality": ("quality", ("image/jpeg", "image/webp")),
+    "webp_method": ("method", ("image/webp",)),
+}
+
+# The only container write_video writes - it always encodes h264 video
 MUXED_VIDEO_CONTENT_TYPE = "video/mp4"
 
 # Distinguishes "the artifact has no such attribute" from "it has one holding None" -
@@ -73,7 +109,7 @@ class AudioVideo:
     def __init__(self, frames, audio, sample_rate):
         """
         Args:
-            frames: The video, as PIL images or an array of frames
+            frames: The video, as PIL images, a FrameBuffer or an array of frames
             audio: Waveform for this video, shaped (channels, samples)
             sample_rate: Sample rate of the waveform, or None if the pipeline did not report one
         """
@@ -233,7 +269,8 @@ class Result:
             f"Saving with content type: {content_type}, extension: {extension}"
         )
 
-        # Save each result
+        # Save each result. Artifacts are named here, in order, and encoded after
+        artifacts = []
         for i, result in enumerate(self.result_list):
             if content_type.endswith("json"):
                 # Handle JSON content type
@@ -246,13 +283,59 @@ class Result:
             else:
                 # Handle other content types
                 for j, artifact in enumerate(get_artifact_list(result)):
-                    self.save_artifact(
-                        validated_output_dir,
-                        artifact,
-                        f"{file_base_name}-{i}.{j}",
-                        content_type,
-                        extension,
-                    )
+                    artifacts.append((artifact, f"{file_base_name}-{i}.{j}"))
+
+        self.save_artifacts(validated_output_dir, artifacts, content_type, extension)
+
+    def save_artifacts(self, output_dir, artifacts, content_type, extension):
+        """Save artifacts on a thread pool sized by the save_workers setting.
+
+        A batch of large PNGs spent seconds single-threaded in zlib. Every artifact is
+        attempted whichever fail, and each failure is logged with its file; the
+        first is then raised.
+
+        Args:
+            output_dir: Directory to save files in, already validated by save()
+            artifacts: (artifact, file base name) pairs
+            content_type: MIME type of the content
+            extension: File extension to use
+
+        Raises:
+            Exception: The first artifact's error, when any failed to save
+        """
+        workers = min(save_workers(), len(artifacts))
+
+        def save(artifact, file_base_name):
+            self.save_artifact(
+                output_dir, artifact, file_base_name, content_type, extension
+            )
+
+        if workers <= 1:
+            errors = []
+            for artifact, file_base_name in artifacts:
+                try:
+                    save(artifact, file_base_name)
+                    errors.append(None)
+                except Exception as e:
+                    errors.append(e)
+        else:
+            logger.debug(f"Saving {len(artifacts)} artifacts on {workers} threads")
+            with ThreadPoolExecutor(workers, thread_name_prefix="dw-save") as pool:
+                futures = [pool.submit(save, *pair) for pair in artifacts]
+            errors = [future.exception() for future in futures]
+
+        failed = [
+            (file_base_name, error)
+            for (_, file_base_name), error in zip(artifacts, errors)
+            if error is not None
+        ]
+        if failed:
+            if len(failed) > 1:
+                logger.error(
+                    f"{len(failed)} of {len(artifacts)} artifacts failed to save: "
+                    f"{', '.join(name for name, _ in failed)}"
+                )
+            raise failed[0][1]
 
     def save_artifact(
         self, output_dir, artifact, file_base_name, content_type, extension
@@ -286,16 +369,25 @@ class Result:
                 )
             return
 
+        if isinstance(artifact, LazyImage):
+            # Gathered images are saved as the images they decode to
+            artifact = artifact.load()
+
         output_path = os.path.join(output_dir, f"{file_base_name}{extension}")
         logger.info(f"Saving artifact to {output_path}")
 
         try:
             if content_type.startswith("video"):
-                if isinstance(artifact, AudioVideo):
+                if isinstance(artifact, EncodedVideo):
+                    self.save_encoded_video(artifact, output_path, content_type)
+                elif isinstance(artifact, AudioVideo):
                     self.save_audio_video(artifact, output_path, content_type)
                 else:
-                    export_to_video(
-                        artifact, output_path, fps=self.result_definition.get("fps", 8)
+                    self.save_video_frames(
+                        artifact,
+                        output_path,
+                        content_type,
+                        self.result_definition.get("fps", 8),
                     )
             elif content_type == "image/gif":
                 export_to_gif(
@@ -338,7 +430,9 @@ class Result:
                 ):
                     self._save_image_with_metadata(artifact, output_path, content_type)
                 else:
-                    artifact.save(output_path)
+                    artifact.save(
+                        output_path, **self.get_image_save_arguments(content_type)
+                    )
             else:
                 raise ValueError(
                     f"Content type {content_type} does not match result type {type(artifact)}"
@@ -352,9 +446,10 @@ class Result:
     def save_audio_video(self, artifact, output_path, content_type):
         """Write a video and the audio generated with it into a single file.
 
-        encode_video muxes the two into an h264/mp4 file with PyAV. When PyAV is missing,
-        the container is not mp4, or nothing told us the sample rate, the video is written
-        on its own and the audio is dropped.
+        write_video streams the frames into an h264/mp4 file with PyAV a chunk at a
+        time and muxes the audio in. When PyAV is missing, the container is not mp4, or
+        nothing told us the sample rate, the video is written on its own and the audio
+        is dropped.
 
         Args:
             artifact: AudioVideo holding the frames and their waveform
@@ -368,9 +463,9 @@ class Result:
             "audio_sample_rate", artifact.sample_rate
         )
 
-        # Segment-backed frames (a chained step with save_segments) replay from
-        # disk one segment at a time, so the final video is streamed instead of
-        # materialized - and the segment files are removed once it is written
+        # Segment-backed frames (a chained step with save_segments) are joined
+        # from disk - remuxed where the files allow it, else replayed one segment
+        # at a time - and the segment files are removed once it is written
         if hasattr(artifact.frames, "cleanup"):
             if content_type != MUXED_VIDEO_CONTENT_TYPE:
                 raise ValueError(
@@ -386,16 +481,12 @@ class Result:
             audio = None
             if artifact.audio is not None and sample_rate is not None:
                 audio = as_audio_track(artifact.audio)
-            logger.debug(
-                f"Streaming {len(artifact.frames)} segments into {output_path}"
-            )
-            encode_video(
-                iter(artifact.frames),
-                fps=fps,
-                output_path=output_path,
+            logger.debug(f"Joining {len(artifact.frames)} segments into {output_path}")
+            artifact.frames.write(
+                output_path,
+                fps,
                 audio=audio,
                 audio_sample_rate=sample_rate if audio is not None else None,
-                video_chunks_number=len(artifact.frames),
             )
             artifact.frames.cleanup()
             return
@@ -415,18 +506,63 @@ class Result:
             # concatenations - so it logs quietly; losing audio we do have warns
             log = logger.debug if artifact.audio is None else logger.warning
             log(f"Saving {output_path} without its audio because {reason}")
-            export_to_video(artifact.frames, output_path, fps=fps)
+            self.save_video_frames(artifact.frames, output_path, content_type, fps)
             return
 
         logger.debug(f"Muxing audio at {sample_rate}Hz into {output_path}")
-        encode_video(
+        write_video(
             artifact.frames,
-            fps=fps,
             output_path=output_path,
+            fps=fps,
             audio=as_audio_track(artifact.audio),
             audio_sample_rate=sample_rate,
         )
 
+    def save_video_frames(self, frames, output_path, content_type, fps):
+        """Write a video with no audio.
+
+        An mp4 is streamed through write_video, converting a chunk of frames at a
+        time; export_to_video, which converts them all first, writes other
+        containers and stands in when PyAV is missing.
+
+        Args:
+            frames: The video's frames
+            output_path: Path of the file to write
+            content_type: MIME type of the video being written
+            fps: Frame rate
+        """
+        if content_type == MUXED_VIDEO_CONTENT_TYPE and is_av_available():
+            write_video(frames, output_path=output_path, fps=fps)
+        else:
+            # Lazy sources - generated, on disk or joined - realized in full
+            if has_method(frames, "as_list"):
+                frames = frames.as_list()
+            export_to_video(frames, output_path, fps=fps)
+
+    def save_encoded_video(self, artifact, output_path, content_type):
+        """Move a video its producer already encoded into place.
+
+        A streamed chain writes its final file as it runs, audio and all, so there
+        is nothing to encode - the file is moved, at the producer's frame rate.
+
+        Args:
+            artifact: The EncodedVideo
+            output_path: Path the result saves it at
+            content_type: MIME type of the video being written
+        """
+        if content_type != MUXED_VIDEO_CONTENT_TYPE:
+            raise ValueError(
+                f"An encoded video can only be saved as {MUXED_VIDEO_CONTENT_TYPE}, "
+                f"not {content_type}"
+            )
+        fps = self.result_definition.get("fps", None)
+        if fps is not None and fps != artifact.fps:
+            logger.warning(
+                f"{output_path} keeps the {artifact.fps} fps it was encoded at, "
+                f"not the result's {fps}"
+            )
+        artifact.move_to(output_path)
+
     def get_audio_write_arguments(self, content_type):
         """Collect the soundfile arguments for an audio content type.
 
@@ -449,6 +585,36 @@ class Result:
 
         return write_arguments
 
+    def get_image_save_arguments(self, content_type):
+        """Collect the Pillow save arguments for an image content type.
+
+        The result definition's image_preset gives the defaults, and
+        png_compress_level, quality and webp_method override them.
+
+        Args:
+            content_type: MIME type of the image being written
+
+        Returns:
+            Dict of keyword arguments for Image.save
+
+        Raises:
+            ValueError: If the image_preset is not one of IMAGE_PRESETS
+        """
+        preset = self.result_definition.get("image_preset", None)
+        if preset is not None and preset not in IMAGE_PRESETS:
+            raise ValueError(
+                f"image_preset must be one of {', '.join(IMAGE_PRESETS)}, "
+                f"not '{preset}'"
+            )
+        save_arguments = dict(IMAGE_PRESETS.get(preset, {}).get(content_type, {}))
+
+        for key, (argument_name, content_types) in IMAGE_SAVE_ARGUMENTS.items():
+            value = self.result_definition.get(key, None)
+            if value is not None and content_type in content_types:
+                save_arguments[argument_name] = value
+
+        return save_arguments
+
     def _save_image_with_metadata(self, image, output_path, content_type):
         """Save an image with embedded generation metadata.
 
@@ -458,13 +624,14 @@ class Result:
             content_type: MIME type of the image
         """
         metadata_json = json.dumps(self.metadata, default=str)
+        save_arguments = self.get_image_save_arguments(content_type)
 
         if content_type == "image/png":
             from PIL.PngImagePlugin import PngInfo
 
             png_info = PngInfo()
             png_info.add_text("parameters", metadata_json)
-            image.save(output_path, pnginfo=png_info)
+            image.save(output_path, pnginfo=png_info, **save_arguments)
             logger.debug(f"Embedded PNG metadata in {output_path}")
         elif content_type in ("image/jpeg", "image/webp"):
             try:
@@ -477,16 +644,27 @@ class Result:
                     piexif.helper.UserComment.dump(metadata_json)
                 )
                 exif_bytes = piexif.dump(exif_dict)
-                image.save(output_path, exif=exif_bytes)
+                image.save(output_path, exif=exif_bytes, **save_arguments)
                 logger.debug(f"Embedded EXIF metadata in {output_path}")
             except ImportError:
                 logger.warning(
                     "piexif not installed - saving without metadata. "
                     "Install with: pip install piexif"
                 )
-                image.save(output_path)
+                image.save(output_path, **save_arguments)
         else:
-            image.save(output_path)
+            image.save(output_path, **save_arguments)
+
+
+def save_workers():
+    """Threads artifacts are saved on - the save_workers setting, or one per CPU.
+
+    Without the setting, at most DEFAULT_MAX_SAVE_WORKERS; 1 saves them one at a time.
+    """
+    workers = getattr(settings, "save_workers", None)
+    if workers is None:
+        workers = min(DEFAULT_MAX_SAVE_WORKERS, os.cpu_count() or 1)
+    return max(1, int(workers))
 
 
 def _frames_from_attributes(result):
@@ -695,9 +873,9 @@ def as_waveform_array(audio):
 
 
 def as_audio_track(audio):
-    """Convert a generated waveform into the tensor encode_video expects.
+    """Convert a generated waveform into the tensor write_video expects.
 
-    encode_video wants a float torch tensor on the CPU shaped (channels, samples) -
+    write_video wants a float torch tensor on the CPU shaped (channels, samples) -
     pipelines hand back bfloat16 tensors that are still on the GPU, or numpy arrays.
 
     Args:
@@ -1,5 +1,6 @@
 import json
 import os
+import re
 from pathlib import Path
 
 
@@ -18,6 +19,38 @@ class Settings:
     cudnn_benchmark: bool = True  # cuDNN autotuner (faster for fixed sizes)
     cudnn_deterministic: bool = False  # Set True for reproducibility
 
+    # Device memory on-demand components may keep between their calls, e.g. '8GB'.
+    # None moves each one off the device as soon as its call returns
+    residency_budget: str = None
+    # Rest on-demand components in pinned host memory, so their moves to the device
+    # are asynchronous and can be prefetched. Costs page-locked RAM equal to their size
+    residency_pin_memory: bool = False
+
+    # Memory prompt embeddings may occupy between the calls that reuse them, e.g.
+    # '1GB'. '0' encodes every prompt on every call
+    embedding_cache_size: str = "512MB"
+
+    # Threads a step's result artifacts are encoded and saved on. None uses one per
+    # CPU, up to 8; 1 saves them one at a time
+    save_workers: int = None
+
+    # Where "attention_backend": "auto" keeps the backend it chose per attention
+    # shape - relative to the settings directory unless absolute
+    attention_backend_table: str = "attention_backends.json"
+
+    # Memory decoded images, videos and audio may occupy between the runs that load
+    # the same files again, e.g. '1GB'. '0' decodes every file on every load
+    decoded_media_cache_size: str = "1GB"
+
+    # Where media fetched from URLs is kept between runs - relative to the settings
+    # directory unless absolute - and the total size kept before the least recently
+    # used files are evicted, e.g. '2GB'
+    media_cache_dir: str = "media_cache"
+    media_cache_size: str = "2GB"
+    # Serve URL media only from the cache, never the network. The DW_OFFLINE
+    # environment variable turns this on for a single run
+    media_cache_offline: bool = False
+
 
 def load_settings():
     settings = Settings()
@@ -41,6 +74,20 @@ def load_settings():
     settings.cudnn_benchmark = settings_dict.get("cudnn_benchmark", True)
     settings.cudnn_deterministic = settings_dict.get("cudnn_deterministic", False)
 
+    settings.residency_budget = settings_dict.get("residency_budget", None)
+    settings.residency_pin_memory = settings_dict.get("residency_pin_memory", False)
+    settings.embedding_cache_size = settings_dict.get("embedding_cache_size", "512MB")
+    settings.save_workers = settings_dict.get("save_workers", None)
+    settings.attention_backend_table = settings_dict.get(
+        "attention_backend_table", "attention_backends.json"
+    )
+    settings.decoded_media_cache_size = settings_dict.get(
+        "decoded_media_cache_size", "1GB"
+    )
+    settings.media_cache_dir = settings_dict.get("media_cache_dir", "media_cache")
+    settings.media_cache_size = settings_dict.get("media_cache_size", "2GB")
+    settings.media_cache_offline = settings_dict.get("media_cache_offline", False)
+
     return settings
 
 
@@ -54,6 +101,42 @@ def settings_exist():
     return get_settings_full_path().is_file()
 
 
+_SIZE_UNITS = {
+    "": 1,
+    "b": 1,
+    "kb": 1024,
+    "kib": 1024,
+    "mb": 1024**2,
+    "mib": 1024**2,
+    "gb": 1024**3,
+    "gib": 1024**3,
+    "tb": 1024**4,
+    "tib": 1024**4,
+}
+
+
+def parse_size(size):
+    """Parse a memory size such as '24GB' or '12.5GiB' into bytes.
+
+    Units are binary - '24GB' is 24 * 1024**3, the figure torch and nvidia-smi report.
+
+    Args:
+        size: Size in bytes, or a string with an optional unit
+
+    Returns:
+        The size in bytes
+
+    Raises:
+        ValueError: If the string is not a size
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.fullmatch(r"\s*([0-9]*\.?[0-9]+)\s*([a-zA-Z]*)\s*", str(size))
+    if match is None or match.group(2).lower() not in _SIZE_UNITS:
+        raise ValueError(f"'{size}' is not a memory size, e.g. '24GB'")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).lower()])
+
+
 def resolve_path(path):
     full_path = get_settings_dir().joinpath(path)
     # make the directory if it doesn't exist
@@ -1,4 +1,6 @@
+import contextlib
 import logging
+from .lazy_image import load_lazy_images
 from .result import Result
 from .previous_results import get_iterations, resolve_chain_prompts
 
@@ -65,13 +67,25 @@ class Step:
                 logger.warning(f"Step {step_name} has no iterations to execute")
                 return result
 
-            for i, arguments in enumerate(iterations, 1):
-                logger.debug(
-                    f"Running iteration {i}/{len(iterations)} with arguments: {arguments}"
-                )
-                self.iteration = i
-                iteration_result = step_action.run(arguments, previous_pipelines)
-                result.add_result(iteration_result)
+            # A pipeline configured to encode ahead encodes every iteration's
+            # prompts now and frees its text encoders for the runs below
+            encode_ahead = getattr(type(step_action), "encode_ahead", None)
+            with (
+                step_action.encode_ahead(iterations)
+                if encode_ahead is not None
+                else contextlib.nullcontext()
+            ):
+                for i, arguments in enumerate(iterations, 1):
+                    logger.debug(
+                        f"Running iteration {i}/{len(iterations)} with arguments: "
+                        f"{arguments}"
+                    )
+                    self.iteration = i
+                    # Gathered images decode as their iteration comes up, the
+                    # next few already decoding behind it
+                    arguments = load_lazy_images(arguments)
+                    iteration_result = step_action.run(arguments, previous_pipelines)
+                    result.add_result(iteration_result)
 
             logger.debug(f"Successfully completed step: {step_name}")
             return result
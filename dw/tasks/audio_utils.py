@@ -5,13 +5,14 @@ as_channels_samples normalizes the shapes pipelines and files actually produce
 into that layout.
 """
 
-import io
 import logging
 
 import numpy
 import soundfile
 import torch
 
+from ..decoded_media import load_decoded
+from ..media_cache import cached_path
 from ..security import (
     validate_path,
     validate_url,
@@ -103,6 +104,61 @@ def equal_power_crossfade_join(previous, head, following, sample_rate, crossfade
     return numpy.concatenate([previous[:, :-window], blended, following], axis=1)
 
 
+def equal_power_crossfade_join_all(segments, sample_rate, crossfade_ms):
+    """Join many segments' audio the way equal_power_crossfade_join joins two.
+
+    Joining them one pair at a time copies everything joined so far at every
+    seam. Here the joined length is known up front - each seam blends the trimmed
+    head into audio already written, so it adds only the on-timeline part - and
+    every segment is written into one buffer allocated once.
+
+    Args:
+        segments: (head, following) (channels, samples) pairs in order - the
+            audio trimmed off each segment's start and its on-timeline audio.
+            The first segment's head is ignored
+        sample_rate: Sample rate of every segment
+        crossfade_ms: Crossfade at each seam, clamped to the head material
+
+    Returns:
+        The joined (channels, samples) float32 waveform - mono tiled up when any
+        segment has more channels
+    """
+    if not segments:
+        raise ValueError("No audio segments to join")
+    channels = max(following.shape[0] for _, following in segments)
+    total = sum(following.shape[1] for _, following in segments)
+    joined = numpy.empty((channels, total), dtype=numpy.float32)
+
+    cursor = 0
+    for index, (head, following) in enumerate(segments):
+        window = 0
+        if index > 0:
+            window = min(
+                int(crossfade_ms / 1000.0 * sample_rate), head.shape[1], cursor
+            )
+        end = cursor + following.shape[1]
+
+        if window > 0:
+            fade_out, fade_in = _equal_power_ramps(window)
+            joined[:, cursor - window : cursor] *= fade_out
+            joined[:, cursor - window : cursor] += head[:, -window:] * fade_in
+            joined[:, cursor:end] = following
+        else:
+            joined[:, cursor:end] = following
+            ramp = 0
+            if index > 0:
+                ramp = min(
+                    int(DECLICK_MS / 1000.0 * sample_rate), cursor, following.shape[1]
+                )
+            if ramp > 0:
+                # The declick of a seam with no head material
+                fade_out, fade_in = _equal_power_ramps(ramp)
+                joined[:, cursor - ramp : cursor] *= fade_out
+                joined[:, cursor : cursor + ramp] *= fade_in
+        cursor = end
+    return joined
+
+
 def crossfade_concat(waveforms, sample_rate, crossfade_ms):
     """Concatenate waveforms, overlapping each seam by an equal-power crossfade.
 
@@ -141,21 +197,18 @@ def load_audio(location, base_dir=None):
         Tuple of a (channels, samples) float32 waveform and its sample rate
     """
     if location.startswith(("http://", "https://")):
-        import requests
-
         validated_url = validate_url(location)
-        logger.debug(f"Downloading audio from {validated_url}")
-        response = requests.get(validated_url, timeout=60)
-        response.raise_for_status()
-        data, sample_rate = soundfile.read(
-            io.BytesIO(response.content), dtype="float32"
-        )
+        logger.debug(f"Fetching audio from {validated_url}")
+        path = cached_path(validated_url)
     else:
-        validated_path = validate_path(location, base_dir=base_dir, allow_create=False)
-        validate_file_extension(validated_path, ALLOWED_AUDIO_EXTENSIONS)
-        logger.debug(f"Reading audio from {validated_path}")
-        data, sample_rate = soundfile.read(validated_path, dtype="float32")
+        path = validate_path(location, base_dir=base_dir, allow_create=False)
+        validate_file_extension(path, ALLOWED_AUDIO_EXTENSIONS)
+        logger.debug(f"Reading audio from {path}")
+    return load_decoded(path, _read_audio, kind="audio")
+
 
+def _read_audio(path):
+    data, sample_rate = soundfile.read(path, dtype="float32")
     # soundfile returns (samples,) or (samples, channels)
     return as_channels_samples(data), sample_rate
 
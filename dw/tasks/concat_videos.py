@@ -5,17 +5,19 @@ frames are joined end to end with an optional head trim on every video after
 the first, and audio tracks are joined at each seam with an equal-power
 crossfade drawn from the trimmed-off material, so video and audio stay in
 sync.
+
+Nothing is joined in memory. The frames are ConcatenatedFrames, read from each
+input only as they are saved or asked for, one video at a time - gathered
+video files stay on disk until then - and the audio is written into a single
+buffer sized for the joined track. Salvaging the segment files of a long chain
+holds a chunk of frames, not the film.
 """
 
 import logging
 
 from ..result import AudioVideo
-from .audio_utils import (
-    as_channels_samples,
-    equal_power_crossfade_join,
-    frames_to_samples,
-)
-from .video_utils import frames_as_pil_list
+from .audio_utils import equal_power_crossfade_join_all, frames_to_samples
+from .video_utils import ConcatenatedFrames, soundtrack
 
 logger = logging.getLogger("dw")
 
@@ -24,8 +26,9 @@ def concat_videos(videos, trim_frames=0, crossfade_ms=75, fps=None):
     """Concatenate a list of videos into a single AudioVideo.
 
     Args:
-        videos: The videos to join, in order - frame lists, frame arrays, or
-            AudioVideos (from gather_videos or previous_result references)
+        videos: The videos to join, in order - frame lists, frame arrays,
+            VideoSources, AudioVideos or streamed chain outputs (from
+            gather_videos or previous_result references)
         trim_frames: Frames dropped from the head of every video after the
             first - the trim used when each video was generated from the
             previous one's last frame
@@ -39,26 +42,26 @@ def concat_videos(videos, trim_frames=0, crossfade_ms=75, fps=None):
     if not isinstance(videos, list) or not videos:
         raise ValueError("concat_videos needs a non-empty list of videos")
 
-    frames = []
-    audio = None
-    sample_rate = None
+    head_trims = [trim_frames if index > 0 else 0 for index in range(len(videos))]
+    frames = ConcatenatedFrames(videos, head_trims)
 
-    for index, video in enumerate(videos):
-        head_trim = trim_frames if index > 0 else 0
-        frames.extend(frames_as_pil_list(video)[head_trim:])
+    segments = []  # (trimmed head, on-timeline audio) per video carrying audio
+    sample_rate = None
 
-        if not isinstance(video, AudioVideo) or video.audio is None:
+    for video, head_trim in zip(videos, head_trims):
+        waveform, video_rate = soundtrack(video)
+        if waveform is None:
             continue
 
-        waveform = as_channels_samples(video.audio)
-        if audio is None:
-            audio, sample_rate = waveform, video.sample_rate
+        if not segments:
+            segments.append((waveform[:, :0], waveform))
+            sample_rate = video_rate
             continue
 
-        if video.sample_rate != sample_rate:
+        if video_rate != sample_rate:
             raise ValueError(
                 f"Videos carry audio at different sample rates: "
-                f"{sample_rate} then {video.sample_rate}"
+                f"{sample_rate} then {video_rate}"
             )
         if head_trim > 0 and fps is None:
             raise ValueError(
@@ -68,13 +71,11 @@ def concat_videos(videos, trim_frames=0, crossfade_ms=75, fps=None):
         trim_samples = (
             frames_to_samples(head_trim, fps, sample_rate) if head_trim else 0
         )
-        audio = equal_power_crossfade_join(
-            audio,
-            waveform[:, :trim_samples],
-            waveform[:, trim_samples:],
-            sample_rate,
-            crossfade_ms,
-        )
+        segments.append((waveform[:, :trim_samples], waveform[:, trim_samples:]))
+
+    audio = None
+    if segments:
+        audio = equal_power_crossfade_join_all(segments, sample_rate, crossfade_ms)
 
     logger.debug(f"Concatenated {len(videos)} videos into {len(frames)} frames")
     return AudioVideo(frames, audio, sample_rate)
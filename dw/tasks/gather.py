@@ -1,130 +1,149 @@
 import glob as glob_lib
 import logging
-from diffusers.utils import load_image, load_video
-from ..arguments import fetch_image, fetch_video
+from concurrent.futures import ThreadPoolExecutor
+from ..arguments import fetch_video, validate_image_path
+from ..lazy_image import DEFAULT_PREFETCH, ImagePrefetcher, LazyImage
 from ..security import validate_url, SecurityError
 
 logger = logging.getLogger("dw")
 
 
-def gather_images(glob=None, urls=None):
+def gather_images(
+    glob=None, urls=None, max_count=None, max_size=None, prefetch=DEFAULT_PREFETCH
+):
     """
     Gather images from local files and/or URLs.
 
+    Nothing is decoded here. Each match is validated and handed on as a LazyImage,
+    decoded when a step's iteration uses it, with the next few decoded ahead of it.
+
     Args:
-        glob: Pattern for matching local image files (e.g., "images/*.png")
-        urls: List of URLs to download images from
+        glob: Pattern for matching local image files (e.g., "images/*.png"). Matches
+            are taken in sorted order, so reruns see the same sequence
+        urls: List of URLs to download images from, taken after the files
+        max_count: Keep only the first max_count images
+        max_size: Longest side to scale larger images down to as they load
+        prefetch: Images decoded ahead of the one a step is using; 0 decodes each
+            only when it is used
 
     Returns:
-        List of loaded images
+        List of LazyImages
 
     Raises:
-        ValueError: If no images are found
+        ValueError: If no images are found, or max_count is not positive
         SecurityError: If validation fails
     """
     if urls is None:
         urls = []
-    images = []
+    locations = []
 
-    # Load local images matching glob pattern
+    # Validate local images matching glob pattern
     if glob is not None:
         logger.debug(f"Searching for images matching pattern: {glob}")
-        image_paths = glob_lib.glob(glob)
+        image_paths = sorted(glob_lib.glob(glob))
         logger.info(f"Found {len(image_paths)} local images")
 
-        for path in image_paths:
-            try:
-                logger.debug(f"Loading image from: {path}")
-                images.append(fetch_image(path))
-            except SecurityError:
-                raise
-            except Exception as e:
-                logger.error(
-                    f"Failed to load image from {path}: {str(e)}", exc_info=True
-                )
-                raise
-
-    # Load images from URLs
+        for path in _first(image_paths, max_count):
+            logger.debug(f"Gathering image from: {path}")
+            locations.append(validate_image_path(path))
+
+    # Validate image URLs
     for url in urls:
-        try:
-            logger.debug(f"Loading image from URL: {url}")
-            validated_url = validate_url(url)
-            images.append(load_image(validated_url))
-        except SecurityError:
-            raise
-        except Exception as e:
-            logger.error(
-                f"Failed to load image from URL {url}: {str(e)}", exc_info=True
-            )
-            raise
+        logger.debug(f"Gathering image from URL: {url}")
+        locations.append(validate_url(url))
+    locations = _first(locations, max_count)
 
     # Validate that we found at least one image
-    if len(images) == 0:
+    if len(locations) == 0:
         error_msg = "No images found"
         logger.error(error_msg)
         raise ValueError(error_msg)
 
+    images = [LazyImage(location, max_size) for location in locations]
+    ImagePrefetcher(images, prefetch)
     logger.debug(f"Successfully gathered {len(images)} images")
     return images
 
 
-def gather_videos(glob=None, urls=None):
+def gather_videos(
+    glob=None, urls=None, max_count=None, max_size=None, prefetch=DEFAULT_PREFETCH
+):
     """
     Gather videos from local files and/or URLs.
 
+    Videos are opened as VideoSources, which read only their metadata - a few at a
+    time, in parallel. URLs are fetched through the media cache first.
+
     Args:
-        glob: Pattern for matching local video files (e.g., "videos/*.mp4")
-        urls: List of URLs to download videos from
+        glob: Pattern for matching local video files (e.g., "videos/*.mp4"). Matches
+            are taken in sorted order, so reruns see the same sequence
+        urls: List of URLs to download videos from, taken after the files
+        max_count: Keep only the first max_count videos
+        max_size: Longest side to scale larger videos' frames down to as they are
+            decoded
+        prefetch: Videos opened at once
 
     Returns:
         List of loaded videos
+
+    Raises:
+        ValueError: If no videos are found, or max_count is not positive
+        SecurityError: If validation fails
     """
     if urls is None:
         urls = []
-    videos = []
+    locations = []
 
-    # Load local videos matching glob pattern
+    # Match local videos to the glob pattern
     if glob is not None:
         logger.debug(f"Searching for videos matching pattern: {glob}")
-        video_paths = glob_lib.glob(glob)
+        video_paths = sorted(glob_lib.glob(glob))
         logger.info(f"Found {len(video_paths)} local videos")
+        locations.extend(video_paths)
 
-        for path in video_paths:
-            try:
-                logger.debug(f"Loading video from: {path}")
-                videos.append(fetch_video(path))
-            except SecurityError:
-                raise
-            except Exception as e:
-                logger.error(
-                    f"Failed to load video from {path}: {str(e)}", exc_info=True
-                )
-                raise
-
-    # Load videos from URLs
+    # Validate video URLs
     for url in urls:
-        try:
-            logger.debug(f"Loading video from URL: {url}")
-            validated_url = validate_url(url)
-            videos.append(load_video(validated_url))
-        except SecurityError:
-            raise
-        except Exception as e:
-            logger.error(
-                f"Failed to load video from URL {url}: {str(e)}", exc_info=True
-            )
-            raise
+        logger.debug(f"Gathering video from URL: {url}")
+        locations.append(validate_url(url))
+    locations = _first(locations, max_count)
 
     # Validate that we found at least one video
-    if len(videos) == 0:
+    if len(locations) == 0:
         error_msg = "No videos found"
         logger.error(error_msg)
         raise ValueError(error_msg)
 
+    decode_options = {} if max_size is None else {"max_size": max_size}
+    workers = max(int(prefetch), 1)
+    with ThreadPoolExecutor(workers, thread_name_prefix="dw-gather") as pool:
+        specs = [{"location": location} | decode_options for location in locations]
+        videos = list(pool.map(_load_video, specs))
+
     logger.debug(f"Successfully gathered {len(videos)} videos")
     return videos
 
 
+def _load_video(spec):
+    location = spec["location"]
+    try:
+        logger.debug(f"Loading video from: {location}")
+        return fetch_video(spec)
+    except SecurityError:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to load video from {location}: {str(e)}", exc_info=True)
+        raise
+
+
+def _first(items, max_count):
+    """The first max_count items, or all of them when max_count is None."""
+    if max_count is None:
+        return items
+    if int(max_count) < 1:
+        raise ValueError(f"max_count must be at least 1, got {max_count}")
+    return items[: int(max_count)]
+
+
 def gather_inputs(kwargs):
     """
     Gather input arguments for passing to next task.
@@ -5,11 +5,17 @@ Takes a list of video frames and generates intermediate frames to increase
 frame rate. Supports 2x, 4x, and 8x multipliers.
 
 Model weights are downloaded from HuggingFace Hub on first use.
+
+The passes are chained generators: each frame of one pass is interpolated from
+the previous pass's frames as they come, so no pass is held in full. With
+stream, the frames are returned as a FrameStream and only generated as the
+result encodes them - an 8x clip never exists in memory at once.
 """
 
 import logging
 import torch
 
+from ..video_writer import FrameStream
 from .tensor_image import pil_to_float_tensor as _pil_to_tensor, float_tensor_to_pil
 
 logger = logging.getLogger("dw")
@@ -27,13 +33,17 @@ def interpolate_frames(video, device="cpu", **kwargs):
             multiplier: Frame count multiplier — 2, 4, or 8 (default: 2)
             model_name: HuggingFace repo with RIFE v4.13 weights (default: auto)
             filename: Weights filename within the repo (default: auto)
+            stream: Return a FrameStream that interpolates as the frames are
+                saved, instead of a list (default: False)
 
     Returns:
-        List of PIL Images with interpolated frames inserted.
+        List of PIL Images with interpolated frames inserted, or with stream,
+        a FrameStream of them.
     """
     multiplier = int(kwargs.get("multiplier", 2))
     model_name = kwargs.get("model_name", None)
     filename = kwargs.get("filename", None)
+    stream = bool(kwargs.get("stream", False))
 
     if multiplier not in _VALID_MULTIPLIERS:
         raise ValueError(
@@ -47,29 +57,41 @@ def interpolate_frames(video, device="cpu", **kwargs):
         f"Interpolating {len(video)} frames with {multiplier}x multiplier on {device}"
     )
 
-    model = _load_rife_model(device, model_name, filename)
-
     passes = {2: 1, 4: 2, 8: 3}[multiplier]
-    frames = list(video)
-
-    for pass_num in range(passes):
-        logger.debug(
-            f"Interpolation pass {pass_num + 1}/{passes}: {len(frames)} frames"
-        )
-        frames = _interpolate_2x(frames, model)
-
+    # The passes run interleaved, so each gets its own inference and the frame
+    # it carries between pairs is not overwritten by another pass
+    models = [_load_rife_model(device, model_name, filename) for _ in range(passes)]
+    frame_count = (len(video) - 1) * multiplier + 1
+
+    def produce():
+        frames = iter(video)
+        for model in models:
+            frames = _iter_interpolate_2x(frames, model)
+        return frames
+
+    if stream:
+        logger.info(f"Streaming {frame_count} interpolated frames as they are saved")
+        return FrameStream(produce, frame_count)
+
+    frames = list(produce())
     logger.info(f"Interpolation complete: {len(video)} -> {len(frames)} frames")
     return frames
 
 
 def _interpolate_2x(frames, model):
     """Single pass of 2x interpolation — insert one frame between each pair."""
-    result = [frames[0]]
-    for i in range(len(frames) - 1):
-        mid_frame = model(frames[i], frames[i + 1])
-        result.append(mid_frame)
-        result.append(frames[i + 1])
-    return result
+    return list(_iter_interpolate_2x(frames, model))
+
+
+def _iter_interpolate_2x(frames, model):
+    """_interpolate_2x as a generator, taking the frames as an iterable."""
+    frames = iter(frames)
+    previous = next(frames)
+    yield previous
+    for frame in frames:
+        yield model(previous, frame)
+        yield frame
+        previous = frame
 
 
 _DEFAULT_RIFE_REPO = "imaginairy/rife-interpolation"
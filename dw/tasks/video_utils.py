@@ -1,17 +1,25 @@
 """Frame access for videos in any of the shapes results carry them.
 
-A video artifact can be a list of PIL images, a numpy array of frames
-(frames, height, width, channels), a torch tensor (frames first, channels
-first or last), or an AudioVideo pairing frames with their generated
-soundtrack. extract_frame gives tasks and the segment-chaining loop one way
-to pull a single frame out of any of them, always as a PIL image.
+A video artifact can be a list of PIL images, a FrameBuffer, a numpy array of
+frames (frames, height, width, channels), a torch tensor (frames first, channels
+first or last), a VideoSource still on disk, or an AudioVideo pairing frames
+with their generated soundtrack. extract_frame gives tasks and the
+segment-chaining loop one way to pull a single frame out of any of them, always
+as a PIL image - from a VideoSource, by decoding that frame alone.
+
+ConcatenatedFrames joins videos of any of those shapes end to end without
+reading them: frames come from each input only as they are asked for.
 """
 
 import numpy
 import torch
 from PIL import Image
 
+from ..frame_buffer import FrameBuffer
 from ..result import AudioVideo
+from ..video_source import VideoSource
+from ..video_writer import DEFAULT_CHUNK_FRAMES, EncodedVideo, FrameStream
+from .audio_utils import as_channels_samples
 
 
 def process_video(video, processor, device, kwargs):
@@ -53,13 +61,39 @@ def frame_count(video):
     return len(_frames_of(video))
 
 
-def frames_as_pil_list(video):
+def frames_as_pil_list(video, start=None, stop=None):
     """The video's frames as a list of PIL images.
 
     Frames that already are PIL images are carried over by identity; array and
-    tensor frames are converted the way extract_frame converts them.
+    tensor frames are converted the way extract_frame converts them, and a
+    FrameBuffer's frames are made into images from its array.
+
+    Args:
+        video: The video, in any shape extract_frame takes
+        start, stop: The span of frames wanted, as a slice takes them - a
+            VideoSource decodes only those
     """
-    return [_to_pil(frame) for frame in _frames_of(video)]
+    frames = _frames_of(video)
+    if start is not None or stop is not None:
+        frames = frames[start:stop]
+    return [_to_pil(frame) for frame in frames]
+
+
+def soundtrack(video):
+    """The audio a video carries, whatever holds it.
+
+    Returns:
+        A (channels, samples) float32 array and its sample rate, or (None, None)
+        for a video without audio. A streamed video's soundtrack is decoded from
+        its file
+    """
+    if isinstance(video, AudioVideo):
+        if video.audio is None:
+            return None, None
+        return as_channels_samples(video.audio), video.sample_rate
+    if isinstance(video, EncodedVideo):
+        return video.decode_audio()
+    return None, None
 
 
 def frames_as_array(video):
@@ -70,12 +104,21 @@ def frames_as_array(video):
     earlier step generated. One array is also one artifact, where a list of frames
     would become one artifact per frame and multiply the step that consumed it.
 
-    Frames that already are a channels-last RGB array are converted in a single
-    operation; anything else goes through the same per-frame conversion
-    extract_frame uses.
+    A FrameBuffer's array is returned as it is, and frames that already are a
+    channels-last RGB array are converted in a single operation; anything else
+    goes through the same per-frame conversion extract_frame uses.
     """
     frames = _frames_of(video)
 
+    if isinstance(frames, FrameBuffer):
+        return frames.array
+
+    if isinstance(frames, VideoSource):
+        return frames.decode().array
+
+    if torch.is_tensor(frames) and frames.dtype == torch.uint8:
+        frames = frames.numpy()
+
     if isinstance(frames, numpy.ndarray) and frames.ndim == 4 and frames.shape[-1] == 3:
         if frames.dtype == numpy.uint8:
             return frames
@@ -87,11 +130,149 @@ def frames_as_array(video):
     )
 
 
+def frames_as_buffer(video):
+    """The video's frames as a FrameBuffer.
+
+    A FrameBuffer is returned as it is and a uint8 RGB array is wrapped without a
+    copy; a VideoSource is decoded and frame lists converted into one allocation.
+    """
+    frames = _frames_of(video)
+    if isinstance(frames, VideoSource):
+        return frames.decode()
+    return FrameBuffer.from_frames(frames)
+
+
+class ConcatenatedFrames:
+    """Videos joined end to end, read from their inputs only as frames are needed.
+
+    Indexing and iterating give the joined frames, each from the input it comes
+    from - PIL frames by identity. Saving streams them through chunks(), one
+    input at a time, so a joined film is never held whole; the frames trimmed
+    off an input's head are never read.
+
+    Args:
+        videos: The videos, in any shape extract_frame takes
+        head_trims: Frames dropped from the head of each video
+    """
+
+    def __init__(self, videos, head_trims):
+        self.videos = [
+            video.frames if isinstance(video, AudioVideo) else video for video in videos
+        ]
+        self.head_trims = list(head_trims)
+        self.lengths = [
+            max(_length(video) - trim, 0)
+            for video, trim in zip(self.videos, self.head_trims)
+        ]
+
+    def __len__(self):
+        return sum(self.lengths)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indexes = range(*index.indices(len(self)))
+            if indexes.step != 1:
+                return [self[i] for i in indexes]
+            frames = []
+            offset = 0
+            for video, trim, length in zip(self.videos, self.head_trims, self.lengths):
+                start = max(indexes.start - offset, 0)
+                stop = min(indexes.stop - offset, length)
+                if start < stop:
+                    frames.extend(frames_as_pil_list(video, trim + start, trim + stop))
+                offset += length
+            return frames
+
+        if index < 0:
+            index += len(self)
+        for video, trim, length in zip(self.videos, self.head_trims, self.lengths):
+            if 0 <= index < length:
+                return extract_frame(video, trim + index)
+            index -= length
+        raise IndexError("Frame index out of range of the joined videos")
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            for frame in chunk:
+                yield _to_pil(frame)
+
+    def chunks(self, chunk_frames=DEFAULT_CHUNK_FRAMES):
+        """The joined frames a chunk at a time - frame lists, arrays or tensors.
+
+        Yields:
+            Runs of at most chunk_frames frames, none spanning two inputs
+        """
+        for video, trim in zip(self.videos, self.head_trims):
+            yield from _video_chunks(video, trim, chunk_frames)
+
+    def as_list(self):
+        """Every joined frame as a PIL image."""
+        return list(self)
+
+
+def _length(video):
+    """Frames in a video, read from its metadata where it is not in memory."""
+    if isinstance(video, AudioVideo):
+        return _length(video.frames)
+    if isinstance(video, (VideoSource, EncodedVideo, FrameStream, ConcatenatedFrames)):
+        return len(video)
+    return len(_frames_of(video))
+
+
+def _video_chunks(video, start, chunk_frames):
+    """A video's frames from start on, a chunk at a time, decoding only those."""
+    if isinstance(video, AudioVideo):
+        yield from _video_chunks(video.frames, start, chunk_frames)
+        return
+
+    if isinstance(video, VideoSource):
+        yield from video.chunks(start, chunk_frames=chunk_frames)
+        return
+
+    if isinstance(video, EncodedVideo):
+        yield from VideoSource(video.path).chunks(start, chunk_frames=chunk_frames)
+        return
+
+    # Produced or decoded in chunks of their own; the trimmed head is skipped
+    chunks = None
+    if isinstance(video, ConcatenatedFrames):
+        chunks = video.chunks(chunk_frames)
+    elif isinstance(video, FrameStream):
+        chunks = iter(video)
+    if chunks is not None:
+        for chunk in chunks:
+            if start >= len(chunk):
+                start -= len(chunk)
+                continue
+            yield chunk[start:]
+            start = 0
+        return
+
+    frames = _frames_of(video)
+    for offset in range(start, len(frames), chunk_frames):
+        yield frames[offset : offset + chunk_frames]
+
+
 def _frames_of(video):
     """Unwrap containers until an indexable run of frames remains."""
     if isinstance(video, AudioVideo):
         return _frames_of(video.frames)
 
+    # Frames generated or encoded as they were saved are realized in full here -
+    # the step asking for them needs them indexable
+    if isinstance(video, FrameStream):
+        return video.as_list()
+
+    # A finished file is opened, not decoded - its frames are uint8, read as
+    # they are asked for
+    if isinstance(video, EncodedVideo):
+        return VideoSource(video.path)
+
+    # Indexes to PIL frames and slices to views of its array - or, from a
+    # VideoSource, to just the frames asked for, decoded then
+    if isinstance(video, (FrameBuffer, VideoSource, ConcatenatedFrames)):
+        return video
+
     if isinstance(video, list):
         # A one-video batch - [[frame, ...]] or [ndarray] - unwraps to the video;
         # a single-frame video - [frame] - is already the frames
@@ -132,7 +313,9 @@ def _to_pil(frame):
         return frame
 
     if torch.is_tensor(frame):
-        frame = frame.detach().cpu().float().numpy()
+        frame = frame.detach().cpu()
+        # uint8 frames are already pixel values; anything else is [0, 1] float
+        frame = frame.numpy() if frame.dtype == torch.uint8 else frame.float().numpy()
 
     if isinstance(frame, numpy.ndarray):
         if frame.ndim != 3:
@@ -7,15 +7,23 @@ when the input hasn't changed significantly between timesteps.
 Based on: https://github.com/ali-vilab/TeaCache
 Adapted from: https://github.com/Teriks/dgenerate (Apache 2.0)
 
-Implemented: Flux (FluxTransformer2DModel)
-Registry includes: Mochi, LTX-Video, CogVideoX, Lumina2, HunyuanVideo, Wan2.1
-(these require custom forward functions to be added)
-
-Each model requires a custom forward function because transformer architectures
-differ. The core caching algorithm is the same: extract a signal from the first
-block's normalization, compare via polynomial rescaling, skip if below threshold.
+Implemented: Flux, Mochi, LTX-Video, CogVideoX, Lumina2, HunyuanVideo, Wan2.1
+
+The core caching algorithm is the same for every model: extract a signal from the
+first block's normalization (or the timestep embedding), compare via polynomial
+rescaling, skip the transformer blocks if below threshold. Flux has a forward of
+its own. The others keep their diffusers forward, and only the block stack it
+iterates is swapped for one that runs or skips all blocks together - so a change
+to a model's forward upstream does not need copying here, and only the signal
+each model compares is architecture-specific.
+
+A checkpoint the registry has no coefficients for - a fine-tune, a distilled
+variant - can be calibrated: a run with calibrate skips nothing, records each
+step's input change against the change in what its blocks added, and fits the
+rescaling polynomial to them with numpy, logging a registry entry at the end.
 """
 
+import functools
 import json
 import typing
 import logging
@@ -31,6 +39,8 @@ from diffusers.utils import (
     unscale_lora_layers,
 )
 
+from .pipeline_processors.cache_telemetry import current_call
+
 logger = logging.getLogger("dw")
 
 
@@ -86,14 +96,216 @@ def _get_model_info(transformer, variant=None):
 # ---------------------------------------------------------------------------
 
 
-def _create_flux_teacache_forward(num_inference_steps, rel_l1_thresh, coefficients):
+def _relative_l1(current, previous):
+    return ((current - previous).abs().mean() / previous.abs().mean()).cpu().item()
+
+
+class _BranchState:
+    """What TeaCache remembers of one guidance branch between its steps."""
+
+    def __init__(self):
+        self.accumulated_rel_l1_distance = 0
+        self.previous_modulated_input = None
+        self.previous_residual = None
+        self.previous_encoder_residual = None
+
+        # Calibration: this step's input change, and (input change, residual
+        # change) per step in order
+        self.input_change = None
+        self.samples = []
+
+
+class _TeaCacheState:
+    """TeaCache's step counting and skip decisions, kept per guidance branch.
+
+    Pipelines running classifier-free guidance as separate calls - Flux with
+    negative_prompt and true_cfg_scale > 1, Wan, Lumina2 - call the transformer
+    twice per step with the identical timestep: the conditional pass, then the
+    unconditional one. A call repeating the previous call's timestep is therefore
+    the next branch of the same step, and each branch compares its signal with its
+    own previous step and skips on its own. The step count is shared, so every
+    branch computes the first and last step.
+
+    Args:
+        num_inference_steps: Number of inference steps (must match pipeline call)
+        rel_l1_thresh: Cache threshold
+        coefficients: np.poly1d rescaling coefficients
+        calibrate: Skip nothing, and record each step's input and residual change
+            for calibration_entry()
+    """
+
+    def __init__(
+        self, num_inference_steps, rel_l1_thresh, coefficients, calibrate=False
+    ):
+        self.num_inference_steps = num_inference_steps
+        self.rel_l1_thresh = rel_l1_thresh
+        self.rescale_func = np.poly1d(coefficients)
+        self.calibrate = calibrate
+
+        self.step = -1
+        self.branch_index = 0
+        self.previous_timestep = None
+        self.branches = {}
+
+    def begin_call(self, timestep):
+        """Count a transformer call and return the state of the branch it runs."""
+        if (
+            isinstance(timestep, torch.Tensor)
+            and self.previous_timestep is not None
+            and timestep.shape == self.previous_timestep.shape
+            and torch.equal(timestep, self.previous_timestep)
+        ):
+            self.branch_index += 1
+        else:
+            self.branch_index = 0
+            self.step = (self.step + 1) % self.num_inference_steps
+        if isinstance(timestep, torch.Tensor):
+            self.previous_timestep = timestep.detach().clone()
+        return self.branches.setdefault(self.branch_index, _BranchState())
+
+    def should_calc(self, branch, modulated_inp):
+        """Whether this call's branch runs its blocks, given this step's signal."""
+        previous = branch.previous_modulated_input
+        if self.calibrate:
+            # A run's first step has nothing of its own to compare with
+            branch.input_change = (
+                _relative_l1(modulated_inp, previous)
+                if self.step > 0
+                and previous is not None
+                and previous.shape == modulated_inp.shape
+                else None
+            )
+            branch.previous_modulated_input = modulated_inp
+            return True
+
+        if (
+            self.step == 0
+            or self.step == self.num_inference_steps - 1
+            or previous is None
+            or previous.shape != modulated_inp.shape
+        ):
+            should_calc = True
+            branch.accumulated_rel_l1_distance = 0
+        else:
+            relative_diff = _relative_l1(modulated_inp, previous)
+            branch.accumulated_rel_l1_distance += self.rescale_func(relative_diff)
+            telemetry = current_call()
+            if telemetry is not None:
+                telemetry.note_signal(branch.accumulated_rel_l1_distance)
+            if branch.accumulated_rel_l1_distance < self.rel_l1_thresh:
+                should_calc = False
+            else:
+                should_calc = True
+                branch.accumulated_rel_l1_distance = 0
+
+        branch.previous_modulated_input = modulated_inp
+        return should_calc
+
+    def store_residual(self, branch, residual, encoder_residual=None):
+        """Keep what a computed step's blocks added, for the steps that skip them."""
+        previous = branch.previous_residual
+        if (
+            self.calibrate
+            and branch.input_change is not None
+            and previous is not None
+            and previous.shape == residual.shape
+        ):
+            branch.samples.append(
+                (branch.input_change, _relative_l1(residual, previous))
+            )
+        branch.previous_residual = residual
+        branch.previous_encoder_residual = encoder_residual
+
+    def calibration_entry(self, transformer_class):
+        """The registry entry a calibration run measured, or None with too few steps.
+
+        The coefficients map a step's input change to its residual change, fitted
+        over every branch; the thresholds come from replaying the recorded changes
+        through the skip decision.
+        """
+        samples = [
+            sample for branch in self.branches.values() for sample in branch.samples
+        ]
+        if len(samples) < CALIBRATION_DEGREE + 1:
+            return None
+        inputs, outputs = zip(*samples)
+        coefficients = np.polyfit(inputs, outputs, CALIBRATION_DEGREE)
+
+        runs = [
+            [change for change, _ in branch.samples]
+            for branch in self.branches.values()
+            if branch.samples
+        ]
+        speedups = [
+            (threshold, _simulated_speedup(runs, np.poly1d(coefficients), threshold))
+            for threshold in CALIBRATION_THRESHOLDS
+        ]
+        guide = {}
+        for threshold, speedup in speedups:
+            rounded = round(speedup, 1)
+            if 1.0 < rounded <= 3.0 and rounded not in guide.values():
+                guide[threshold] = rounded
+        at_most_double = [t for t, speedup in speedups if speedup <= 2.0]
+        default_threshold = at_most_double[-1] if at_most_double else speedups[0][0]
+
+        return {
+            "transformer_class": transformer_class,
+            "coefficients": [float(c) for c in coefficients],
+            "default_threshold": default_threshold,
+            "threshold_guide": ", ".join(
+                f"{threshold}=~{speedup}x" for threshold, speedup in guide.items()
+            ),
+        }
+
+
+# Calibration fits a polynomial of this degree, like the registry's coefficients
+CALIBRATION_DEGREE = 4
+# Thresholds whose speedup a calibration run estimates
+CALIBRATION_THRESHOLDS = (
+    0.01,
+    0.02,
+    0.03,
+    0.05,
+    0.08,
+    0.1,
+    0.15,
+    0.2,
+    0.25,
+    0.3,
+    0.4,
+    0.5,
+    0.6,
+    0.8,
+    1.0,
+)
+
+
+def _simulated_speedup(runs, rescale_func, threshold):
+    """Steps per computed step, had the recorded input changes been cached.
+
+    Each run holds the input changes of a branch's steps after its first. The
+    first step and the last are always computed.
+    """
+    steps = 0
+    computed = 0
+    for changes in runs:
+        steps += len(changes) + 1
+        computed += 2 if changes else 1
+        accumulated = 0
+        for change in changes[:-1]:
+            accumulated += rescale_func(change)
+            if accumulated >= threshold:
+                computed += 1
+                accumulated = 0
+    return steps / computed
+
+
+def _create_flux_teacache_forward(
+    num_inference_steps, rel_l1_thresh, coefficients, state=None
+):
     """Create TeaCache forward for FluxTransformer2DModel."""
-    cnt = 0
-    accumulated_rel_l1_distance = 0
-    previous_modulated_input = None
-    previous_residual = None
-    previous_timestep = None
-    rescale_func = np.poly1d(coefficients)
+    if state is None:
+        state = _TeaCacheState(num_inference_steps, rel_l1_thresh, coefficients)
 
     def teacache_forward(
         self,
@@ -110,31 +322,9 @@ def _create_flux_teacache_forward(num_inference_steps, rel_l1_thresh, coefficien
         return_dict: bool = True,
         controlnet_blocks_repeat: bool = False,
     ) -> typing.Union[torch.FloatTensor, Transformer2DModelOutput]:
-        nonlocal cnt, accumulated_rel_l1_distance, previous_modulated_input, previous_residual, previous_timestep
-
-        # TeaCache assumes exactly one transformer forward call per denoising
-        # step. Pipelines running true classifier-free guidance (e.g. Flux with
-        # negative_prompt + true_cfg_scale > 1) call the transformer twice per
-        # step -- once for the conditional pass and once for the unconditional
-        # pass -- using the identical timestep both times. That second call
-        # would silently share/corrupt previous_modulated_input and
-        # previous_residual across the two passes, so detect it and fail loudly
-        # instead of producing a corrupted image.
-        if (
-            timestep is not None
-            and previous_timestep is not None
-            and timestep.shape == previous_timestep.shape
-            and torch.equal(timestep, previous_timestep)
-        ):
-            raise RuntimeError(
-                "TeaCache does not support true classifier-free guidance "
-                "(negative_prompt with true_cfg_scale > 1); disable one of them. "
-                "Detected two transformer forward calls with an identical "
-                "timestep within a single denoising step, which would corrupt "
-                "TeaCache's cached state."
-            )
-        if timestep is not None:
-            previous_timestep = timestep.detach().clone()
+        # True classifier-free guidance calls the transformer again with the same
+        # timestep for the unconditional pass, which gets cached state of its own
+        branch = state.begin_call(timestep)
 
         if joint_attention_kwargs is not None:
             joint_attention_kwargs = joint_attention_kwargs.copy()
@@ -184,33 +374,12 @@ def _create_flux_teacache_forward(num_inference_steps, rel_l1_thresh, coefficien
         )
 
         # Decide whether to compute or reuse cached result
-        if cnt == 0 or cnt == num_inference_steps - 1:
-            should_calc = True
-            accumulated_rel_l1_distance = 0
-        else:
-            relative_diff = (
-                (
-                    (modulated_inp - previous_modulated_input).abs().mean()
-                    / previous_modulated_input.abs().mean()
-                )
-                .cpu()
-                .item()
-            )
-            accumulated_rel_l1_distance += rescale_func(relative_diff)
-
-            if accumulated_rel_l1_distance < rel_l1_thresh:
-                should_calc = False
-            else:
-                should_calc = True
-                accumulated_rel_l1_distance = 0
-
-        previous_modulated_input = modulated_inp
-        cnt += 1
-        if cnt == num_inference_steps:
-            cnt = 0
+        should_calc = (
+            state.should_calc(branch, modulated_inp) or branch.previous_residual is None
+        )
 
         if not should_calc:
-            hidden_states += previous_residual
+            hidden_states += branch.previous_residual
         else:
             ori_hidden_states = hidden_states.clone()
 
@@ -264,7 +433,7 @@ def _create_flux_teacache_forward(num_inference_steps, rel_l1_thresh, coefficien
                         ]
                     )
 
-            previous_residual = hidden_states - ori_hidden_states
+            state.store_residual(branch, hidden_states - ori_hidden_states)
 
         hidden_states = self.norm_out(hidden_states, temb)
         output = self.proj_out(hidden_states)
@@ -287,6 +456,246 @@ _FORWARD_FACTORIES = {
 }
 
 
+# ---------------------------------------------------------------------------
+# Block-stack caching - the model's own forward, with its blocks run or skipped
+# together. Used for every architecture other than Flux.
+# ---------------------------------------------------------------------------
+
+
+def _argument(args, kwargs, name, position):
+    """A block call's argument, passed by keyword or by position."""
+    if name in kwargs:
+        return kwargs[name]
+    return args[position] if len(args) > position else None
+
+
+def _first_norm_signal(temb_name, temb_position):
+    """The signal of a block whose norm1(hidden_states, temb) returns the modulated input
+    first - Mochi and Lumina2."""
+
+    def signal(block, args, kwargs, captured):
+        hidden_states = _argument(args, kwargs, "hidden_states", 0)
+        temb = _argument(args, kwargs, temb_name, temb_position)
+        return block.norm1(hidden_states, temb)[0]
+
+    return signal
+
+
+def _hunyuan_signal(block, args, kwargs, captured):
+    hidden_states = _argument(args, kwargs, "hidden_states", 0)
+    temb = _argument(args, kwargs, "temb", 2)
+    token_replace_emb = _argument(args, kwargs, "token_replace_emb", 5)
+    if token_replace_emb is not None:
+        # The image-to-video token-replace block modulates the first frame apart
+        num_tokens = _argument(args, kwargs, "num_tokens", 6)
+        return block.norm1(hidden_states, temb, token_replace_emb, num_tokens)[0]
+    return block.norm1(hidden_states, emb=temb)[0]
+
+
+def _ltx_signal(block, args, kwargs, captured):
+    hidden_states = _argument(args, kwargs, "hidden_states", 0)
+    temb = _argument(args, kwargs, "temb", 2)
+    table = block.scale_shift_table
+    ada_values = table[None, None].to(temb.device) + temb.reshape(
+        hidden_states.size(0), temb.size(1), table.shape[0], -1
+    )
+    shift_msa, scale_msa = ada_values.unbind(dim=2)[:2]
+    return block.norm1(hidden_states) * (1 + scale_msa) + shift_msa
+
+
+def _temb_signal(block, args, kwargs, captured):
+    # CogVideoX compares its timestep embedding rather than a modulated input
+    return _argument(args, kwargs, "temb", 2)
+
+
+def _captured_signal(block, args, kwargs, captured):
+    return captured["signal"]
+
+
+class _BlockSpec(typing.NamedTuple):
+    """How TeaCache finds the block stack and its signal in one architecture.
+
+    block_lists: Attributes holding the blocks the forward runs in order. Nothing
+        between them may change the hidden states, so the stack's residual is the
+        difference between what enters the first block and leaves the last
+    returns_encoder: Blocks return (hidden_states, encoder_hidden_states) rather
+        than hidden_states
+    signal: Computes the signal compared between steps from the first block and
+        its call arguments - the one the registry's coefficients were fitted to
+    capture: A submodule whose output carries the signal, and the part of it that
+        does, for a signal the blocks never see
+    """
+
+    block_lists: tuple
+    returns_encoder: bool
+    signal: typing.Callable
+    capture: typing.Optional[tuple] = None
+
+
+_BLOCK_SPECS = {
+    "MochiTransformer3DModel": _BlockSpec(
+        ("transformer_blocks",), True, _first_norm_signal("temb", 2)
+    ),
+    "LTXVideoTransformer3DModel": _BlockSpec(
+        ("transformer_blocks",), False, _ltx_signal
+    ),
+    "CogVideoXTransformer3DModel": _BlockSpec(
+        ("transformer_blocks",), True, _temb_signal
+    ),
+    "Lumina2Transformer2DModel": _BlockSpec(
+        ("layers",), False, _first_norm_signal("temb", 3)
+    ),
+    "HunyuanVideoTransformer3DModel": _BlockSpec(
+        ("transformer_blocks", "single_transformer_blocks"), True, _hunyuan_signal
+    ),
+    # Wan compares the time embedding, which only its condition embedder returns
+    "WanTransformer3DModel": _BlockSpec(
+        ("blocks",),
+        False,
+        _captured_signal,
+        capture=("condition_embedder", lambda output: output[0]),
+    ),
+}
+
+
+class _CachedBlocks(torch.nn.Module):
+    """Stands in for a transformer's block list while TeaCache is on.
+
+    The forward iterates it as it would the list, and gets each block back wrapped
+    so the stack as a whole runs or is skipped. Indexing and len() reach the blocks.
+    """
+
+    def __init__(self, blocks, cache, offset):
+        super().__init__()
+        self.blocks = blocks
+        self._cache = [cache]  # a list, so the cache is not registered as a module
+        self._offset = offset
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, index):
+        return self.blocks[index]
+
+    def __iter__(self):
+        cache = self._cache[0]
+        for index, block in enumerate(self.blocks):
+            yield functools.partial(cache.run_block, block, self._offset + index)
+
+
+class _BlockStackCache:
+    """TeaCache over a transformer's own forward.
+
+    The first block's inputs give the signal; when the accumulated change since the
+    last computed step of the call's guidance branch is below the threshold, no
+    block runs and the hidden states that entered the stack get the residual that
+    step added.
+
+    Args:
+        transformer: The transformer model
+        spec: Its _BlockSpec
+        state: The _TeaCacheState deciding which steps skip
+    """
+
+    def __init__(self, transformer, spec, state):
+        self.transformer = transformer
+        self.spec = spec
+        self.state = state
+        self.captured = {}
+
+        # Per call: the guidance branch it runs, whether the stack is skipped, and
+        # what entered it
+        self.branch = None
+        self.skipping = False
+        self.entered = None
+
+        lengths = [len(getattr(transformer, name)) for name in spec.block_lists]
+        self.last_block = sum(lengths) - 1
+
+    def begin_call(self, module, args, kwargs):
+        """Forward pre-hook telling the guidance branch of each call from its timestep."""
+        self.branch = self.state.begin_call(kwargs.get("timestep", None))
+
+    def capture_signal(self, module, args, output):
+        self.captured["signal"] = self.spec.capture[1](output)
+
+    def run_block(self, block, index, *args, **kwargs):
+        """Run one block of the stack, or pass its input through when skipping."""
+        hidden_states = _argument(args, kwargs, "hidden_states", 0)
+        encoder_hidden_states = (
+            _argument(args, kwargs, "encoder_hidden_states", 1)
+            if self.spec.returns_encoder
+            else None
+        )
+
+        branch = self.branch
+        if index == 0:
+            signal = self.spec.signal(block, args, kwargs, self.captured)
+            self.skipping = (
+                not self.state.should_calc(branch, signal.clone())
+                and branch.previous_residual is not None
+                and branch.previous_residual.shape == hidden_states.shape
+            )
+            self.entered = (hidden_states, encoder_hidden_states)
+
+        if self.skipping:
+            if index == self.last_block:
+                hidden_states = hidden_states + branch.previous_residual
+                if branch.previous_encoder_residual is not None:
+                    encoder_hidden_states = (
+                        encoder_hidden_states + branch.previous_encoder_residual
+                    )
+            if self.spec.returns_encoder:
+                return hidden_states, encoder_hidden_states
+            return hidden_states
+
+        output = block(*args, **kwargs)
+        if index == self.last_block:
+            entered_hidden, entered_encoder = self.entered
+            if self.spec.returns_encoder:
+                self.state.store_residual(
+                    branch,
+                    output[0] - entered_hidden,
+                    (
+                        output[1] - entered_encoder
+                        if output[1] is not None
+                        and entered_encoder is not None
+                        and output[1].shape == entered_encoder.shape
+                        else None
+                    ),
+                )
+            else:
+                self.state.store_residual(branch, output - entered_hidden)
+            self.entered = None
+        return output
+
+    @contextmanager
+    def installed(self):
+        """Swap the transformer's block lists for cached ones, and hook the signal."""
+        transformer = self.transformer
+        originals = {}
+        offset = 0
+        for name in self.spec.block_lists:
+            blocks = getattr(transformer, name)
+            originals[name] = blocks
+            transformer._modules[name] = _CachedBlocks(blocks, self, offset)
+            offset += len(blocks)
+
+        handles = [
+            transformer.register_forward_pre_hook(self.begin_call, with_kwargs=True)
+        ]
+        if self.spec.capture is not None:
+            source = getattr(transformer, self.spec.capture[0])
+            handles.append(source.register_forward_hook(self.capture_signal))
+        try:
+            yield
+        finally:
+            for handle in handles:
+                handle.remove()
+            for name, blocks in originals.items():
+                transformer._modules[name] = blocks
+
+
 # ---------------------------------------------------------------------------
 # Public API
 # ---------------------------------------------------------------------------
@@ -294,7 +703,13 @@ _FORWARD_FACTORIES = {
 
 @contextmanager
 def teacache_context(
-    pipeline, num_inference_steps, rel_l1_thresh=None, coefficients=None, variant=None
+    pipeline,
+    num_inference_steps,
+    rel_l1_thresh=None,
+    coefficients=None,
+    variant=None,
+    calibrate=False,
+    calibration_file=None,
 ):
     """Context manager that enables TeaCache on a pipeline's transformer.
 
@@ -311,30 +726,61 @@ def teacache_context(
         variant: Explicit model variant name (e.g., "wan2.1_t2v_1.3b").
             Required when a transformer class has multiple variants (CogVideoX, Wan).
             If None, uses class_defaults from the registry.
+        calibrate: Skip nothing, and log a registry entry fitted to this run when
+            the context exits - for a checkpoint the registry lacks coefficients for.
+        calibration_file: Also write the calibrated registry entry to this JSON file.
     """
     transformer = pipeline.transformer
     class_name = transformer.__class__.__name__
 
-    # Look up model info from registry
-    model_info = _get_model_info(transformer, variant)
-
     # Check we have a forward implementation for this class
     factory = _FORWARD_FACTORIES.get(class_name)
-    if factory is None:
-        supported = ", ".join(_FORWARD_FACTORIES.keys())
+    spec = _BLOCK_SPECS.get(class_name)
+    if factory is None and spec is None:
+        supported = ", ".join([*_FORWARD_FACTORIES, *_BLOCK_SPECS])
         raise ValueError(
             f"No TeaCache forward implementation for {class_name}. "
             f"Implemented: {supported}. "
             f"The model is in the registry but needs a custom forward function."
         )
 
-    # Use overrides or defaults
-    if rel_l1_thresh is None:
-        rel_l1_thresh = model_info["default_threshold"]
-    if coefficients is None:
-        coefficients = model_info["coefficients"]
+    if calibrate:
+        # Calibration measures what the registry would otherwise supply
+        rel_l1_thresh, coefficients = 0.0, [0.0] * (CALIBRATION_DEGREE + 1)
+    else:
+        # Look up model info from registry, and use overrides or defaults
+        model_info = _get_model_info(transformer, variant)
+        if rel_l1_thresh is None:
+            rel_l1_thresh = model_info["default_threshold"]
+        if coefficients is None:
+            coefficients = model_info["coefficients"]
+
+    state = _TeaCacheState(
+        num_inference_steps, rel_l1_thresh, coefficients, calibrate=calibrate
+    )
+    if calibrate:
+        logger.info(
+            f"TeaCache calibrating {class_name} over {num_inference_steps} steps"
+        )
+    else:
+        logger.info(
+            f"TeaCache enabled for {class_name}: "
+            f"steps={num_inference_steps}, threshold={rel_l1_thresh}"
+        )
 
-    teacache_forward_fn = factory(num_inference_steps, rel_l1_thresh, coefficients)
+    if spec is not None:
+        # The model's own forward runs - accelerate hooks on it and its blocks
+        # are left in place
+        with _BlockStackCache(transformer, spec, state).installed():
+            yield pipeline
+        logger.debug("TeaCache disabled, block stack restored")
+        if calibrate:
+            _report_calibration(state, class_name, calibration_file)
+        return
+
+    teacache_forward_fn = factory(
+        num_inference_steps, rel_l1_thresh, coefficients, state=state
+    )
 
     # accelerate's enable_model_cpu_offload/enable_sequential_cpu_offload installs
     # an AlignDevicesHook via add_hook_to_module (accelerate/hooks.py), which
@@ -361,11 +807,6 @@ def teacache_context(
             transformer, transformer.__class__
         )
 
-    logger.info(
-        f"TeaCache enabled for {class_name}: "
-        f"steps={num_inference_steps}, threshold={rel_l1_thresh}"
-    )
-
     try:
         yield pipeline
     finally:
@@ -374,3 +815,54 @@ def teacache_context(
         else:
             transformer.forward = original_forward
         logger.debug("TeaCache disabled, original forward restored")
+    if calibrate:
+        _report_calibration(state, class_name, calibration_file)
+
+
+def _report_calibration(state, class_name, calibration_file=None):
+    """Log the registry entry a calibration run measured, and write it if asked."""
+    entry = state.calibration_entry(class_name)
+    if entry is None:
+        logger.warning(
+            f"TeaCache calibration needs at least {CALIBRATION_DEGREE + 2} "
+            f"denoising steps to fit coefficients - nothing to report"
+        )
+        return
+    text = json.dumps(entry, indent=4)
+    logger.info(
+        f"TeaCache calibration for {class_name} - add this entry to "
+        f"teacache_models.json, or pass its coefficients and default_threshold "
+        f"in the teacache configuration:\n{text}"
+    )
+    if calibration_file is not None:
+        path = Path(calibration_file)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text + "\n")
+        logger.info(f"TeaCache calibration written to {path}")
+
+
+def guide_thresholds(transformer, variant=None):
+    """The thresholds the registry quotes speedups for, lowest first.
+
+    Args:
+        transformer: The transformer model instance
+        variant: Optional explicit variant name, as for teacache_context
+
+    Returns:
+        The thresholds of the model's threshold_guide, or an empty list for a
+        transformer TeaCache does not run on
+    """
+    class_name = transformer.__class__.__name__
+    if class_name not in _FORWARD_FACTORIES and class_name not in _BLOCK_SPECS:
+        return []
+    try:
+        info = _get_model_info(transformer, variant)
+    except ValueError:
+        return []
+    thresholds = set()
+    for entry in info.get("threshold_guide", "").split(","):
+        try:
+            thresholds.add(float(entry.split("=")[0]))
+        except ValueError:
+            continue
+    return sorted(thresholds)
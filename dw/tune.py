@@ -0,0 +1,712 @@
+"""Sweep cache thresholds against a quality target.
+
+Every cache trades quality for speed through a threshold, and the right threshold
+depends on the model, the step count and the content: the registry's TeaCache
+guide and the first_block default are starting points, and checking one meant
+running the workflow, eyeballing the output, editing the JSON and running it
+again. Here a step is run once uncached as the reference, then once per candidate
+cache configuration. Each candidate's outputs are scored against the reference's
+with PSNR or SSIM and its step timed, and the report gives the Pareto frontier -
+the candidates no other candidate beats on both speed and quality - and the
+fastest candidate that still meets the target score, as the configuration to
+paste into the step:
+
+    python -m dw.tune workflow.json generate_image prompt="a red fox" --target 32
+
+Only the tuned step is timed. Steps before it run every time, since it may depend
+on their results, and steps after it do not run at all. Outputs go to a temporary
+directory. The first run loads the models and is not counted.
+
+Both metrics are computed with numpy, over images, video frames or arrays alike;
+a step with several outputs scores its worst one.
+"""
+
+import argparse
+import contextlib
+import copy
+import json
+import logging
+import math
+import tempfile
+import time
+
+import numpy as np
+
+from .pipeline_processors.cache_telemetry import get_cache_telemetry
+from .pipeline_processors.config_objects import get_cache_configuration
+from .pipeline_processors.pipeline import (
+    get_cache_transformer,
+    replace_cache_on_transformer,
+)
+from .workflow import Workflow
+
+logger = logging.getLogger("dw")
+
+METRICS = ("psnr", "ssim")
+# The score a candidate must reach to be recommended, per metric
+DEFAULT_TARGETS = {"psnr": 30.0, "ssim": 0.95}
+
+FIRST_BLOCK_THRESHOLDS = (0.05, 0.08, 0.12, 0.2)
+
+# Configuration keys a candidate replaces
+CACHE_KEYS = ("cache", "teacache")
+
+SSIM_WINDOW = 7
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+
+def psnr(reference, output, data_range=1.0):
+    """Peak signal-to-noise ratio in dB - infinite for identical arrays."""
+    reference = np.asarray(reference, dtype=np.float64)
+    output = np.asarray(output, dtype=np.float64)
+    mse = np.mean((reference - output) ** 2)
+    if mse == 0:
+        return math.inf
+    return float(10 * np.log10(data_range**2 / mse))
+
+
+def _box_mean(array, window):
+    # Mean over every window x window patch of (planes, height, width), kept to the
+    # patches that fit - two running sums, so the cost does not grow with the window
+    summed = np.pad(np.cumsum(array, axis=1), ((0, 0), (1, 0), (0, 0)))
+    array = (summed[:, window:] - summed[:, :-window]) / window
+    summed = np.pad(np.cumsum(array, axis=2), ((0, 0), (0, 0), (1, 0)))
+    return (summed[:, :, window:] - summed[:, :, :-window]) / window
+
+
+def ssim(reference, output, data_range=1.0):
+    """Mean structural similarity, 1.0 for identical arrays.
+
+    Local statistics are taken over 7x7 windows (smaller for smaller planes) of each
+    plane of planes(), as scikit-image does by default.
+    """
+    reference = planes(np.asarray(reference, dtype=np.float64))
+    output = planes(np.asarray(output, dtype=np.float64))
+    window = min(SSIM_WINDOW, reference.shape[1], reference.shape[2])
+    if window % 2 == 0:
+        window -= 1
+    # Sample covariances, unbiased over the window
+    correction = window * window / max(window * window - 1, 1)
+
+    mean_x = _box_mean(reference, window)
+    mean_y = _box_mean(output, window)
+    var_x = (_box_mean(reference * reference, window) - mean_x**2) * correction
+    var_y = (_box_mean(output * output, window) - mean_y**2) * correction
+    cov = (_box_mean(reference * output, window) - mean_x * mean_y) * correction
+
+    c1 = (SSIM_K1 * data_range) ** 2
+    c2 = (SSIM_K2 * data_range) ** 2
+    index = ((2 * mean_x * mean_y + c1) * (2 * cov + c2)) / (
+        (mean_x**2 + mean_y**2 + c1) * (var_x + var_y + c2)
+    )
+    return float(index.mean())
+
+
+def planes(array):
+    """An array as (planes, height, width) - channels and frames become planes.
+
+    Images are (height, width[, channels]); videos (frames, height, width,
+    channels); tensors channels-first, (batch, channels[, frames], height, width).
+    """
+    if array.ndim == 2:
+        return array[None]
+    channels_last = array.shape[-1] in (1, 3, 4) and array.shape[-3] > 4
+    if channels_last:
+        array = np.moveaxis(array, -1, 0)
+    return array.reshape(-1, array.shape[-2], array.shape[-1])
+
+
+def _artifact_array(artifact):
+    """An artifact as an array and the range of its values."""
+    frames = getattr(artifact, "frames", None)
+    if frames is not None and not isinstance(artifact, np.ndarray):
+        artifact = frames
+    if isinstance(artifact, (list, tuple)):
+        arrays = [_artifact_array(item) for item in artifact]
+        return np.stack([array for array, _ in arrays]), arrays[0][1]
+    if hasattr(artifact, "convert") and hasattr(artifact, "size"):
+        # A PIL image
+        return np.asarray(artifact.convert("RGB"), dtype=np.float64) / 255.0, 1.0
+    if hasattr(artifact, "detach"):
+        artifact = artifact.detach().float().cpu().numpy()
+    if not isinstance(artifact, np.ndarray):
+        raise ValueError(
+            f"Cannot score a {type(artifact).__name__} output - only images, video "
+            f"frames and arrays are compared"
+        )
+    if artifact.dtype == np.uint8:
+        return artifact.astype(np.float64) / 255.0, 1.0
+    return artifact.astype(np.float64), None
+
+
+def output_arrays(outputs):
+    """Each artifact of a step's outputs as an array, with the range of its values.
+
+    Float arrays are scored over the range of the reference's values; images and
+    8-bit arrays over [0, 1].
+    """
+    from .result import get_artifact_list
+
+    arrays = []
+    for output in outputs:
+        for artifact in get_artifact_list(output):
+            arrays.append(_artifact_array(artifact))
+    return arrays
+
+
+def score(reference, outputs, metric="psnr"):
+    """The lowest score of any of the outputs against the reference's.
+
+    Args:
+        reference: output_arrays() of the reference run
+        outputs: output_arrays() of the candidate run
+        metric: 'psnr' or 'ssim'
+
+    Raises:
+        ValueError: If the runs produced different numbers or shapes of outputs
+    """
+    if len(reference) != len(outputs):
+        raise ValueError(
+            f"The reference produced {len(reference)} outputs, the candidate "
+            f"{len(outputs)}"
+        )
+    compare = psnr if metric == "psnr" else ssim
+    scores = []
+    for (expected, data_range), (actual, _) in zip(reference, outputs):
+        if expected.shape != actual.shape:
+            raise ValueError(
+                f"Output shapes differ: {expected.shape} against {actual.shape}"
+            )
+        if data_range is None:
+            data_range = float(expected.max() - expected.min()) or 1.0
+        scores.append(compare(expected, actual, data_range))
+    return min(scores) if scores else math.inf
+
+
+# ---------------------------------------------------------------------------
+# Candidates
+# ---------------------------------------------------------------------------
+
+
+def describe_candidate(candidate):
+    """A short name for a candidate configuration, e.g. 'first_block threshold=0.08'."""
+    if not candidate:
+        return "uncached"
+    parts = []
+    for key in CACHE_KEYS:
+        options = candidate.get(key)
+        if options is None:
+            continue
+        options = dict(options)
+        name = options.pop("type", key)
+        settings = " ".join(
+            f"{option}={value}"
+            for option, value in options.items()
+            if not isinstance(value, (list, dict))
+        )
+        parts.append(f"{name} {settings}".strip())
+    return ", ".join(parts)
+
+
+def default_candidates(pipeline):
+    """Candidates for the caches a loaded pipeline's transformer supports.
+
+    first_block at a spread of thresholds when the transformer takes a diffusers
+    cache, and TeaCache at the thresholds the registry quotes speedups for when
+    TeaCache runs on it. mag, faster and taylorseer need settings per checkpoint
+    and are only swept when given as candidates.
+    """
+    from .teacache import guide_thresholds
+
+    transformer = get_cache_transformer(pipeline)
+    if transformer is None:
+        return []
+    candidates = []
+    if hasattr(transformer, "enable_cache"):
+        candidates.extend(
+            {"cache": {"type": "first_block", "threshold": threshold}}
+            for threshold in FIRST_BLOCK_THRESHOLDS
+        )
+    candidates.extend(
+        {"teacache": {"rel_l1_thresh": threshold}}
+        for threshold in guide_thresholds(transformer)
+    )
+    return candidates
+
+
+def with_candidate(configuration, candidate):
+    """A copy of a pipeline configuration with its caches replaced by a candidate's."""
+    configuration = {
+        key: value for key, value in configuration.items() if key not in CACHE_KEYS
+    }
+    configuration.update(copy.deepcopy(candidate or {}))
+    return configuration
+
+
+# ---------------------------------------------------------------------------
+# The sweep
+# ---------------------------------------------------------------------------
+
+
+def pareto_frontier(rows):
+    """The rows no other row is both faster than and scores at least as well as.
+
+    Rows that failed are left out. The frontier is ordered fastest first.
+    """
+    frontier = []
+    best = -math.inf
+    for row in sorted(
+        (row for row in rows if row.get("error") is None),
+        key=lambda row: (row["seconds"], -row["score"]),
+    ):
+        if row["score"] > best:
+            frontier.append(row)
+            best = row["score"]
+    return frontier
+
+
+class TuneReport:
+    """The measured candidates of a sweep, and the one to use.
+
+    Args:
+        rows: One dict per run - the uncached reference first - with the candidate's
+            name, configuration, seconds, speedup, score and compute_saved, or its
+            error
+        metric: 'psnr' or 'ssim'
+        target: The score a recommended candidate reaches
+    """
+
+    def __init__(self, rows, metric, target):
+        self.rows = rows
+        self.metric = metric
+        self.target = target
+
+    def frontier(self):
+        return pareto_frontier(self.rows)
+
+    def best(self):
+        """The fastest cached candidate scoring at least the target, or None."""
+        passing = [
+            row
+            for row in self.frontier()
+            if row["configuration"] and row["score"] >= self.target
+        ]
+        return passing[0] if passing else None
+
+    def to_dict(self):
+        best = self.best()
+        return {
+            "metric": self.metric,
+            "target": self.target,
+            "rows": [_json_row(row) for row in self.rows],
+            "frontier": [row["name"] for row in self.frontier()],
+            "best": best["configuration"] if best else None,
+        }
+
+    def table(self):
+        """The sweep as text: one line per run, frontier rows starred."""
+        frontier = {id(row) for row in self.frontier()}
+        lines = [
+            f"   {'candidate':<36} {'seconds':>8} {'speedup':>8} "
+            f"{self.metric:>8} {'saved':>6}"
+        ]
+        for row in self.rows:
+            marker = " * " if id(row) in frontier else "   "
+            if row.get("error") is not None:
+                lines.append(f"{marker}{row['name']:<36} failed: {row['error']}")
+                continue
+            saved = row.get("compute_saved")
+            lines.append(
+                f"{marker}{row['name']:<36} {row['seconds']:>8.2f} "
+                f"{row['speedup']:>7.2f}x {_format_score(row['score']):>8} "
+                f"{'' if saved is None else f'{saved:.0%}':>6}"
+            )
+        return "\n".join(lines)
+
+
+def _format_score(value):
+    return "inf" if math.isinf(value) else f"{value:.3f}"
+
+
+def _json_row(row):
+    # JSON has no infinity - an output identical to the reference scores null
+    return {
+        key: None if isinstance(value, float) and math.isinf(value) else value
+        for key, value in row.items()
+    }
+
+
+def _measure(run, candidate, repeats):
+    """The outputs of a candidate's first run and its fastest time over repeats."""
+    outputs, seconds = run(candidate)
+    for _ in range(repeats - 1):
+        seconds = min(seconds, run(candidate)[1])
+    return outputs, seconds
+
+
+def tune(run, candidates, metric="psnr", target=None, repeats=1, warmup=0):
+    """Time and score each candidate cache configuration against an uncached run.
+
+    Args:
+        run: Runs the step with a candidate's configuration - None for no cache -
+            and returns its outputs and the seconds the step took
+        candidates: Configuration fragments, each {'cache': {...}} or
+            {'teacache': {...}}
+        metric: 'psnr' or 'ssim'
+        target: The score a recommended candidate reaches. Defaults to
+            DEFAULT_TARGETS for the metric
+        repeats: Runs per candidate; the fastest is the one timed
+        warmup: Uncached runs made and discarded before the reference, so one-off
+            costs - compilation, kernel autotuning - are not charged to it
+
+    Returns:
+        A TuneReport
+
+    Raises:
+        ValueError: If the metric is unknown
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}' - use one of {', '.join(METRICS)}")
+    if target is None:
+        target = DEFAULT_TARGETS[metric]
+    repeats = max(1, repeats)
+
+    for _ in range(warmup):
+        run(None)
+    logger.info("Running the uncached reference")
+    reference_outputs, reference_seconds = _measure(run, None, repeats)
+    reference = output_arrays(reference_outputs)
+    rows = [
+        {
+            "name": "uncached",
+            "configuration": None,
+            "seconds": reference_seconds,
+            "speedup": 1.0,
+            "score": score(reference, reference, metric),
+            "compute_saved": 0.0,
+        }
+    ]
+
+    telemetry = get_cache_telemetry()
+    for candidate in candidates:
+        name = describe_candidate(candidate)
+        logger.info(f"Running {name}")
+        row = {"name": name, "configuration": candidate}
+        calls = telemetry.stats()["pipeline_calls"]
+        try:
+            outputs, seconds = _measure(run, candidate, repeats)
+            row["score"] = score(reference, output_arrays(outputs), metric)
+        except Exception as e:
+            logger.warning(f"{name} failed: {e}")
+            row["error"] = str(e)
+            rows.append(row)
+            continue
+        stats = telemetry.stats()
+        last_call = stats["last_call"] if stats["pipeline_calls"] > calls else None
+        row.update(
+            seconds=seconds,
+            speedup=reference_seconds / seconds if seconds else math.inf,
+            compute_saved=last_call["compute_saved"] if last_call else None,
+        )
+        rows.append(row)
+    return TuneReport(rows, metric, target)
+
+
+# ---------------------------------------------------------------------------
+# Running a step
+# ---------------------------------------------------------------------------
+
+
+def _timed(function, timer):
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timer.seconds += time.perf_counter() - start
+
+    return timed
+
+
+@contextlib.contextmanager
+def pipeline_runner(pipeline, arguments, seed=None):
+    """A run function for tune() calling a loaded Pipeline with fixed arguments.
+
+    The pipeline's configuration and cache are put back when the context exits.
+
+    Args:
+        pipeline: A loaded dw Pipeline
+        arguments: The call arguments
+        seed: Seeds a fresh generator for every run, so each starts from the same
+            noise. Defaults to the pipeline's seed
+    """
+    import torch
+
+    definition = pipeline.pipeline_definition
+    original = definition.get("configuration", None)
+    if seed is None:
+        seed = definition.get("seed", pipeline.default_seed)
+
+    def run(candidate):
+        definition["configuration"] = with_candidate(original or {}, candidate)
+        replace_cache_on_transformer(
+            pipeline.pipeline, get_cache_configuration(pipeline.configuration)
+        )
+        call_arguments = dict(arguments)
+        if seed is not None:
+            call_arguments["generator"] = torch.Generator(pipeline.device).manual_seed(
+                seed
+            )
+        start = time.perf_counter()
+        output = pipeline.run(call_arguments)
+        return [output], time.perf_counter() - start
+
+    try:
+        yield run
+    finally:
+        if original is None:
+            definition.pop("configuration", None)
+        else:
+            definition["configuration"] = original
+        replace_cache_on_transformer(
+            pipeline.pipeline, get_cache_configuration(pipeline.configuration)
+        )
+
+
+class _TimedWorkflow(Workflow):
+    """A workflow that runs one step with a candidate's caches, and times it."""
+
+    def __init__(self, workflow_definition, output_dir, file_spec, step_name):
+        super().__init__(workflow_definition, output_dir, file_spec)
+        self.step_name = step_name
+        self.candidate = None
+        self.seconds = 0.0
+
+    def create_step_action(
+        self,
+        step_definition,
+        shared_components,
+        previous_pipelines,
+        default_seed,
+        device,
+    ):
+        tuned = step_definition["name"] == self.step_name
+        if tuned:
+            pipeline_definition = step_definition["pipeline"]
+            pipeline_definition["configuration"] = with_candidate(
+                pipeline_definition.get("configuration", {}), self.candidate
+            )
+        action = super().create_step_action(
+            step_definition, shared_components, previous_pipelines, default_seed, device
+        )
+        if tuned:
+            # A pipeline kept loaded from an earlier run still has that run's cache
+            replace_cache_on_transformer(
+                action.pipeline, get_cache_configuration(action.configuration)
+            )
+            action.run = _timed(action.run, self)
+        return action
+
+
+def tuned_workflow_definition(workflow_definition, step_name):
+    """The workflow's steps up to and including the tuned one.
+
+    A workflow without a seed draws a new one on every run, so the reference and
+    each candidate would start from different noise. The copy is given one seed,
+    drawn here when the workflow names none, that every run shares.
+
+    Raises:
+        ValueError: If there is no such step, or it does not run a pipeline
+    """
+    steps = workflow_definition.get("steps", [])
+    names = [step["name"] for step in steps]
+    if step_name not in names:
+        raise ValueError(
+            f"No step '{step_name}' in the workflow. Steps: {', '.join(names)}"
+        )
+    index = names.index(step_name)
+    if "pipeline" not in steps[index]:
+        raise ValueError(
+            f"Step '{step_name}' does not run a pipeline - only pipeline steps "
+            f"have caches to tune"
+        )
+    definition = copy.deepcopy(workflow_definition)
+    definition["steps"] = definition["steps"][: index + 1]
+    if definition.get("seed") is None:
+        import torch
+
+        definition["seed"] = torch.Generator().seed()
+    return definition
+
+
+@contextlib.contextmanager
+def workflow_runner(workflow, step_name, arguments=None, previous_pipelines=None):
+    """A run function for tune() running a workflow up to one of its steps.
+
+    Args:
+        workflow: The Workflow
+        step_name: The pipeline step whose caches are tuned
+        arguments: The workflow arguments
+        previous_pipelines: Loaded pipelines kept between runs, as Workflow.run
+            takes them. The models load on the first run when not given
+
+    Yields:
+        The run function, and the dict of pipelines it keeps loaded
+    """
+    definition = tuned_workflow_definition(workflow.workflow_definition, step_name)
+    pipelines = {} if previous_pipelines is None else previous_pipelines
+    with tempfile.TemporaryDirectory() as output_dir:
+        timed = _TimedWorkflow(definition, output_dir, workflow.file_spec, step_name)
+
+        def run(candidate):
+            timed.candidate = candidate
+            timed.seconds = 0.0
+            outputs = timed.run(dict(arguments or {}), pipelines)
+            return outputs, timed.seconds
+
+        try:
+            yield run, pipelines
+        finally:
+            loaded = pipelines.get(step_name)
+            if loaded is not None:
+                replace_cache_on_transformer(loaded.pipeline, None)
+
+
+def _print_report(report):
+    print(report.table())
+    print("* on the Pareto frontier")
+    best = report.best()
+    if best is None:
+        print(
+            f"No cached candidate reaches {report.metric} {report.target} - lower "
+            f"the target or sweep lower thresholds"
+        )
+        return
+    print(
+        f"Fastest with {report.metric} >= {report.target}: {best['name']} "
+        f"({best['speedup']:.2f}x). Add to the step's configuration:"
+    )
+    print(json.dumps(best["configuration"], indent=4))
+
+
+if __name__ == "__main__":
+    import os
+
+    from . import startup
+    from .security import (
+        MAX_VARIABLE_VALUE_LENGTH,
+        SecurityError,
+        validate_string_input,
+        validate_variable_name,
+        validate_workflow_path,
+    )
+    from .workflow import workflow_from_file
+
+    parser = argparse.ArgumentParser(
+        description="Sweep cache configurations for a workflow step against a "
+        "quality target."
+    )
+    parser.add_argument("file_name", type=str, help="The workflow to tune")
+    parser.add_argument("step_name", type=str, help="The pipeline step to tune")
+    parser.add_argument(
+        "variables",
+        nargs="*",
+        help="Optional parameters in name=value format",
+    )
+    parser.add_argument("--metric", type=str, default="psnr", choices=list(METRICS))
+    parser.add_argument(
+        "--target",
+        type=float,
+        default=None,
+        help="The score a recommended configuration reaches. Defaults to 30 for "
+        "psnr and 0.95 for ssim",
+    )
+    parser.add_argument(
+        "--candidates",
+        type=str,
+        default=None,
+        help="A JSON file with a list of candidates, each {'cache': {...}} or "
+        "{'teacache': {...}}. Defaults to first_block and the registry's TeaCache "
+        "thresholds",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=1,
+        help="Runs per candidate; the fastest is the one timed",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="Uncached runs discarded before the reference. The first loads the "
+        "models",
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="Write the report to this JSON file"
+    )
+    parser.add_argument(
+        "-l",
+        "--log_level",
+        type=str,
+        default="INFO",
+        help="Set the logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)",
+    )
+    args = parser.parse_args()
+
+    variables = {}
+    for variable in args.variables:
+        try:
+            name, value = variable.split("=", 1)
+            variables[validate_variable_name(name.strip())] = validate_string_input(
+                value.strip(), max_length=MAX_VARIABLE_VALUE_LENGTH, allow_empty=True
+            )
+        except ValueError:
+            print(f"Error: Variable '{variable}' is not in name=value format")
+            exit(1)
+        except SecurityError as e:
+            print(f"Error: Invalid variable input: {e}")
+            exit(1)
+
+    try:
+        validated_file_path = validate_workflow_path(args.file_name)
+        if not os.path.exists(validated_file_path):
+            raise FileNotFoundError(f"File {validated_file_path} does not exist")
+    except SecurityError as e:
+        print(f"Error: Security validation failed: {e}")
+        exit(1)
+
+    startup(args.log_level)
+
+    try:
+        workflow = workflow_from_file(validated_file_path, ".")
+        workflow.validate()
+        with workflow_runner(workflow, args.step_name, variables) as (run, pipelines):
+            # Loads the models, so the reference is not charged for it
+            for _ in range(max(1, args.warmup)):
+                run(None)
+            if args.candidates is not None:
+                with open(args.candidates) as file:
+                    candidates = json.load(file)
+            else:
+                candidates = default_candidates(pipelines[args.step_name].pipeline)
+            if not candidates:
+                raise ValueError(
+                    f"Step '{args.step_name}' has no cache to tune - pass --candidates"
+                )
+            report = tune(run, candidates, args.metric, args.target, args.repeats)
+    except Exception as e:
+        print(f"Error tuning '{args.file_name}': {e}")
+        exit(1)
+
+    _print_report(report)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report.to_dict(), file, indent=4)
+        print(f"Report written to {args.output}")
@@ -1,8 +1,9 @@
 import argparse
+import json
 import os
 from .workflow import workflow_from_file
 from . import startup
-from .security import validate_workflow_path, SecurityError
+from .security import validate_output_path, validate_workflow_path, SecurityError
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Validate a workflow from a file.")
@@ -17,12 +18,49 @@ if __name__ == "__main__":
         default="INFO",
         help="Set the logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)",
     )
+    parser.add_argument(
+        "--quant-plan",
+        type=str,
+        metavar="BUDGET",
+        help="Recommend per-component quantization that fits each pipeline's weights "
+        "into BUDGET, e.g. '24GB'. Components are sized on the meta device, so no "
+        "weights are downloaded",
+    )
+    parser.add_argument(
+        "--quant-backend",
+        type=str,
+        default="sdnq",
+        choices=["bnb", "torchao", "sdnq", "quanto", "gguf"],
+        help="The quantization backend the plan uses",
+    )
+    parser.add_argument(
+        "--quant-exclude",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Component names the plan leaves unquantized, e.g. vae",
+    )
+    parser.add_argument(
+        "--quant-output",
+        type=str,
+        help="Write the workflow with the plan applied to this file",
+    )
     args = parser.parse_args()
 
     try:
         validated_file_path = validate_workflow_path(args.file_name)
         if not os.path.exists(validated_file_path):
             raise FileNotFoundError(f"File {validated_file_path} does not exist")
+        # Checked before anything is planned, so a bad path fails fast
+        quant_output = None
+        if args.quant_output is not None:
+            if args.quant_backend == "gguf":
+                print(
+                    "Error: a gguf plan is report-only - GGUF loads from pre-quantized "
+                    "files, so there is no workflow to write. Leave out --quant-output"
+                )
+                exit(1)
+            quant_output = validate_output_path(args.quant_output, None)
     except SecurityError as e:
         print(f"Error: Security validation failed: {e}")
         exit(1)
@@ -33,6 +71,42 @@ if __name__ == "__main__":
         workflow = workflow_from_file(validated_file_path, ".")
         workflow.validate()
         print("Workflow validated successfully")
+
+        from .pipeline_processors.component_registry import find_duplicate_components
+
+        for component_name, step_names in find_duplicate_components(
+            workflow.workflow_definition
+        ):
+            print(
+                f"Component '{component_name}' is loaded once and shared by steps: "
+                f"{', '.join(step_names)}"
+            )
     except Exception as e:
         print(f"Error validating workflow '{args.file_name}': {e}")
         exit(1)
+
+    if args.quant_plan is not None:
+        from .quantization_advisor import advise_workflow
+
+        try:
+            plans, updated = advise_workflow(
+                workflow.workflow_definition,
+                args.quant_plan,
+                args.quant_backend,
+                args.quant_exclude,
+            )
+        except Exception as e:
+            print(f"Error planning quantization for '{args.file_name}': {e}")
+            exit(1)
+
+        for step_name, plan in plans:
+            print(f"Step '{step_name}':")
+            print(plan.report())
+
+        if quant_output is not None:
+            with open(quant_output, "w") as file:
+                json.dump(updated, file, indent=4)
+            print(f"Workflow with quantization plan written to {quant_output}")
+
+        if not all(plan.fits for _, plan in plans):
+            exit(1)
@@ -0,0 +1,293 @@
+"""A video file opened lazily - its frames decoded only when asked for.
+
+fetch_video loaded an input video with load_video, which decodes every frame into
+a PIL image up front. A step that wanted one keyframe out of a two-minute clip
+decoded 3,600 frames and kept them all in memory to throw away all but one.
+
+A VideoSource reads the container's metadata - frame count, frame rate, size -
+when it is made, and nothing else. Indexing a frame seeks to the keyframe before
+it and decodes from there; a slice or a range decodes just that span, with the
+codec's own threads. A size to scale to and a stride to keep every n-th frame
+are applied as frames are decoded, so the full-size, full-rate video is never
+held. It indexes, slices and iterates like a frame list, so the steps that
+take one take it unchanged; a pipeline, which expects a real list, is handed
+as_list().
+"""
+
+import logging
+import math
+from fractions import Fraction
+
+import numpy
+
+from .decoded_media import load_decoded
+from .frame_buffer import FrameBuffer
+
+logger = logging.getLogger("dw")
+
+# Frames decoded and converted together when a source is streamed in chunks
+DEFAULT_CHUNK_FRAMES = 16
+
+
+class VideoSource:
+    """A video file whose frames are decoded on demand.
+
+    Args:
+        path: The video file
+        size: (width, height) to scale frames to as they are decoded, or None
+            for the file's own size
+        stride: Keep every stride-th frame - the frame rate is divided by it
+        max_size: Without a size, the longest side to scale larger frames down
+            to, keeping their aspect ratio and even dimensions
+
+    Raises:
+        ValueError: If the file has no video stream, or size or stride is invalid
+    """
+
+    def __init__(self, path, size=None, stride=1, max_size=None):
+        import av
+
+        self.path = str(path)
+        self.stride = int(stride)
+        if self.stride < 1:
+            raise ValueError(f"A video's frame stride must be at least 1, got {stride}")
+
+        with av.open(self.path) as container:
+            if not container.streams.video:
+                raise ValueError(f"{self.path} has no video stream")
+            stream = container.streams.video[0]
+            self.source_fps = Fraction(stream.average_rate or stream.guessed_rate or 0)
+            self.source_width = stream.codec_context.width
+            self.source_height = stream.codec_context.height
+            # Muxers that keep no frame count are counted by packet, which reads
+            # the file but decodes nothing
+            self.source_frames = stream.frames or sum(
+                1 for packet in container.demux(stream) if packet.size
+            )
+
+        if size is None and max_size is not None:
+            self.width, self.height = fit_within(
+                self.source_width, self.source_height, int(max_size)
+            )
+        elif size is None:
+            self.width, self.height = self.source_width, self.source_height
+        else:
+            self.width, self.height = (int(value) for value in size)
+            if self.width < 1 or self.height < 1:
+                raise ValueError(f"A video's decode size must be positive, got {size}")
+
+    @property
+    def fps(self):
+        """Frames per second of the frames this source gives - the file's over the stride."""
+        return self.source_fps / self.stride
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    def __len__(self):
+        return math.ceil(self.source_frames / self.stride)
+
+    def __repr__(self):
+        return (
+            f"VideoSource({self.path!r}, {len(self)} frames, "
+            f"{self.width}x{self.height} at {float(self.fps):g} fps)"
+        )
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indexes = range(*index.indices(len(self)))
+            if not indexes:
+                return self.decode(0, 0)
+            if indexes.step < 0:
+                return self.decode(indexes[-1], indexes[0] + 1, -indexes.step)[::-1]
+            return self.decode(indexes.start, indexes.stop, indexes.step)
+
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError(f"Frame {index} of a {length}-frame video")
+        return self.decode(index, index + 1)[0]
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            yield from FrameBuffer(chunk)
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.decode().array
+        return array if dtype is None else array.astype(dtype)
+
+    def decode(self, start=0, stop=None, step=1):
+        """Decode a range of frames.
+
+        Args:
+            start, stop, step: The range, in this source's frames - after stride
+
+        Returns:
+            A FrameBuffer holding just those frames
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        count = len(range(start, stop, step))
+        buffer = FrameBuffer.allocate(max(count, 1), self.height, self.width)
+        for chunk in self.chunks(start, stop, step):
+            buffer.append(chunk)
+        return buffer
+
+    def chunks(self, start=0, stop=None, step=1, chunk_frames=DEFAULT_CHUNK_FRAMES):
+        """Decode a range of frames a chunk at a time.
+
+        Args:
+            start, stop, step: The range, in this source's frames - after stride
+            chunk_frames: Frames per chunk
+
+        Yields:
+            uint8 (frames, height, width, 3) arrays, in order
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return
+        every = self.stride * step
+        first = start * self.stride
+        last = (stop - 1) * self.stride
+
+        chunk = []
+        for index, frame in self._decoded(first, last + 1):
+            if (index - first) % every:
+                continue
+            chunk.append(self._rgb(frame))
+            if len(chunk) == chunk_frames:
+                yield numpy.stack(chunk)
+                chunk = []
+        if chunk:
+            yield numpy.stack(chunk)
+
+    def as_list(self):
+        """Every frame, decoded, as a list of PIL images - what a pipeline takes."""
+        return list(self)
+
+    def _rgb(self, frame):
+        if (frame.width, frame.height) == (self.width, self.height):
+            return frame.to_ndarray(format="rgb24")
+        return frame.to_ndarray(format="rgb24", width=self.width, height=self.height)
+
+    def _decoded(self, start, stop):
+        """Decode the file's frames start to stop, seeking to the keyframe before start.
+
+        Yields:
+            (index, frame) - the index in the file's frames, and the av frame
+        """
+        import av
+
+        with av.open(self.path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            origin = stream.start_time or 0
+            rate = self.source_fps or 1
+
+            def index_of(frame):
+                return round((frame.pts - origin) * stream.time_base * rate)
+
+            seeked = False
+            if start > 0 and self.source_fps:
+                container.seek(
+                    origin + int(start / rate / stream.time_base),
+                    backward=True,
+                    any_frame=False,
+                    stream=stream,
+                )
+                seeked = True
+
+            counted = 0
+            for frame in container.decode(stream):
+                if frame.pts is None:
+                    if seeked:
+                        break
+                    index = counted
+                else:
+                    index = index_of(frame)
+                counted += 1
+
+                if seeked:
+                    seeked = False
+                    if index > start:
+                        # The seek landed past the frame - a file without an
+                        # index, or one whose timestamps are off. Decode from
+                        # the start instead
+                        break
+                if index >= stop:
+                    return
+                if index >= start:
+                    yield index, frame
+            else:
+                return
+
+        logger.debug(
+            f"Seeking {self.path} missed frame {start} - decoding from the start"
+        )
+        yield from self._decoded_from_start(start, stop)
+
+    def _decoded_from_start(self, start, stop):
+        import av
+
+        with av.open(self.path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            for index, frame in enumerate(container.decode(stream)):
+                if index >= stop:
+                    return
+                if index >= start:
+                    yield index, frame
+
+
+def fit_within(width, height, max_size):
+    """A size no larger than max_size on its longest side, at the same aspect ratio.
+
+    Scaled sizes are rounded to even numbers, which yuv420 encoding needs.
+
+    Raises:
+        ValueError: If max_size is below 2
+    """
+    if max_size < 2:
+        raise ValueError(f"A video's max_size must be at least 2, got {max_size}")
+    if max(width, height) <= max_size:
+        return width, height
+    scale = max_size / max(width, height)
+    return tuple(max(2, int(side * scale) // 2 * 2) for side in (width, height))
+
+
+def decode_video_sources(arguments):
+    """Replace VideoSources among a pipeline's arguments with their frames.
+
+    diffusers pipelines check for a list, array or tensor, so a video reaches
+    one decoded - only once its step actually runs.
+
+    Args:
+        arguments: The call's arguments, modified in place
+    """
+    for key, value in arguments.items():
+        if isinstance(value, VideoSource):
+            arguments[key] = decoded_frames(value)
+        elif isinstance(value, list) and any(
+            isinstance(item, VideoSource) for item in value
+        ):
+            arguments[key] = [
+                decoded_frames(item) if isinstance(item, VideoSource) else item
+                for item in value
+            ]
+
+
+def decoded_frames(source):
+    """Every frame of a source as a PIL list, through the decoded media cache.
+
+    The list is a copy, so a pipeline that edits the list it was given leaves the
+    cached frames alone.
+    """
+    frames = load_decoded(
+        source.path,
+        lambda path: source.as_list(),
+        kind="frames",
+        size=source.size,
+        stride=source.stride,
+    )
+    return list(frames)
@@ -0,0 +1,514 @@
+"""Encode video as its frames are produced, a chunk at a time.
+
+export_to_video and encode_video take the whole clip at once: a list of PIL frames
+becomes one numpy array of every frame before the first is encoded, so a video
+costs its own size twice over in host memory just to be saved - a two-minute
+1080p clip at 30 fps is tens of GB as PIL frames. VideoWriter is a sink instead:
+the container opens on the first chunk, each chunk is converted and encoded as it
+arrives, and the audio, which is often only final once every frame exists, is
+muxed in at close. Peak memory is the chunk being encoded, not the clip.
+
+write_video streams any frame source through it - a frame list or array, or an
+iterable of chunks such as a chain's segment files or a FrameStream, which a task
+returns to generate its frames only as they are encoded. A producer that writes
+the final file itself hands it on as an EncodedVideo, which the result moves into
+place rather than decoding and encoding it again, and files written the same way -
+a chain's segment files - are joined by remux_videos packet for packet, without
+decoding a frame.
+"""
+
+import logging
+import os
+import shutil
+from fractions import Fraction
+
+import numpy
+import torch
+from PIL import Image
+
+from .frame_buffer import FrameBuffer, rgb_frame, rgb_frame_array
+from .type_helpers import has_method
+
+logger = logging.getLogger("dw")
+
+# Frames converted to RGB arrays and encoded together - bounds the memory a frame
+# list or float array costs while it is encoded
+DEFAULT_CHUNK_FRAMES = 16
+
+# What encode_video writes, so a streamed file matches one written whole
+VIDEO_CODEC = "libx264"
+PIXEL_FORMAT = "yuv420p"
+
+
+def _is_frame_run(frames):
+    """A run of frames rather than an iterable of chunks of them."""
+    if isinstance(frames, (list, tuple)):
+        return (
+            not frames
+            or isinstance(frames[0], Image.Image)
+            or (hasattr(frames[0], "ndim") and frames[0].ndim == 3)
+        )
+    return isinstance(frames, (numpy.ndarray, FrameBuffer)) or torch.is_tensor(frames)
+
+
+def frame_chunks(frames, chunk_frames=DEFAULT_CHUNK_FRAMES):
+    """Split frames into uint8 (frames, height, width, 3) arrays of at most chunk_frames.
+
+    Args:
+        frames: A list of PIL images or frame arrays, a FrameBuffer, a (frames,
+            height, width, channels) array or tensor - channels-first tensors
+            too, a lazy source with a chunks() method - a VideoSource, joined
+            videos - read a chunk at a time, or an iterable of any of those as
+            chunks, such as SegmentedFrames
+        chunk_frames: Frames converted at a time. Chunks an iterable yields are
+            converted whole, at the size they come in
+
+    Yields:
+        Chunks of frames, in order. A uint8 channels-last array is sliced, not copied
+    """
+    if isinstance(frames, FrameBuffer):
+        frames = frames.array
+
+    if has_method(frames, "chunks"):
+        for chunk in frames.chunks(chunk_frames=chunk_frames):
+            yield from frame_chunks(chunk, chunk_frames)
+        return
+
+    if isinstance(frames, numpy.ndarray) or torch.is_tensor(frames):
+        if frames.ndim == 5 and frames.shape[0] == 1:  # a one-video batch
+            frames = frames[0]
+        for start in range(0, len(frames), chunk_frames):
+            yield rgb_frame_array(frames[start : start + chunk_frames])
+        return
+
+    if isinstance(frames, (list, tuple)) and _is_frame_run(frames):
+        for start in range(0, len(frames), chunk_frames):
+            yield numpy.stack(
+                [rgb_frame(frame) for frame in frames[start : start + chunk_frames]]
+            )
+        return
+
+    for chunk in frames:
+        if _is_frame_run(chunk):
+            yield from frame_chunks(chunk, max(chunk_frames, len(chunk)))
+        else:
+            raise TypeError(f"Cannot encode a {type(chunk).__name__} as video frames")
+
+
+class FrameStream:
+    """Frames a task generates on demand instead of returning as a list.
+
+    Iterating yields them in chunks, so saving one holds a chunk of frames at a
+    time. Each iteration generates the frames again - a step that needs them
+    more than once takes as_list(), which keeps them.
+
+    Args:
+        produce: Callable returning an iterator over the frames, in order
+        frame_count: How many it yields
+        chunk_frames: Frames per chunk
+    """
+
+    def __init__(self, produce, frame_count, chunk_frames=DEFAULT_CHUNK_FRAMES):
+        self.produce = produce
+        self.frame_count = frame_count
+        self.chunk_frames = chunk_frames
+
+    def __len__(self):
+        return self.frame_count
+
+    def __iter__(self):
+        chunk = []
+        for frame in self.produce():
+            chunk.append(frame)
+            if len(chunk) == self.chunk_frames:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def as_list(self):
+        """Every frame, generated once into a list."""
+        return list(self.produce())
+
+
+class VideoWriter:
+    """An open h264/mp4 file that frames are written into as they are produced.
+
+    Use as a context manager: leaving it normally closes the file, leaving it on an
+    exception removes the partial file, which no player could open anyway.
+
+    Args:
+        output_path: The file to write
+        fps: Frame rate
+        audio_sample_rate: Sample rate of the audio muxed in at close. The audio
+            stream is declared when the container opens on the first chunk, so the
+            rate must be known - here, or set on the writer - before then
+        chunk_frames: Frames converted and encoded at a time
+    """
+
+    def __init__(
+        self,
+        output_path,
+        fps,
+        audio_sample_rate=None,
+        chunk_frames=DEFAULT_CHUNK_FRAMES,
+    ):
+        self.output_path = str(output_path)
+        self.fps = fps
+        self.audio_sample_rate = audio_sample_rate
+        self.chunk_frames = chunk_frames
+        self.frames_written = 0
+        self.width = None
+        self.height = None
+        self.has_audio = False
+        self.closed = False
+
+        self._av = None
+        self._container = None
+        self._stream = None
+        self._audio_stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.abort()
+        elif not self.closed:
+            self.close()
+
+    def _open(self, height, width):
+        import av
+
+        self._av = av
+        self._container = av.open(self.output_path, mode="w")
+        # A fractional rate such as 23.976 stays exact instead of rounding to 23
+        rate = Fraction(self.fps).limit_denominator(1001)
+        self._stream = self._container.add_stream(VIDEO_CODEC, rate=rate)
+        self._stream.width = width
+        self._stream.height = height
+        self._stream.pix_fmt = PIXEL_FORMAT
+        self.height, self.width = height, width
+
+        if self.audio_sample_rate is not None:
+            from diffusers.utils.export_utils import _prepare_audio_stream
+
+            self._audio_stream = _prepare_audio_stream(
+                self._container, int(self.audio_sample_rate)
+            )
+
+    def write(self, frames):
+        """Encode frames - any source frame_chunks takes - onto the end of the video."""
+        if self.closed:
+            raise ValueError(f"{self.output_path} is already closed")
+        for chunk in frame_chunks(frames, self.chunk_frames):
+            if not len(chunk):
+                continue
+            height, width = chunk.shape[1:3]
+            if self._container is None:
+                self._open(height, width)
+            elif (height, width) != (self.height, self.width):
+                raise ValueError(
+                    f"Frames of {width}x{height} cannot join a "
+                    f"{self.width}x{self.height} video"
+                )
+            for frame_array in chunk:
+                frame = self._av.VideoFrame.from_ndarray(
+                    numpy.ascontiguousarray(frame_array), format="rgb24"
+                )
+                for packet in self._stream.encode(frame):
+                    self._container.mux(packet)
+            self.frames_written += len(chunk)
+
+    def close(self, audio=None):
+        """Flush the video, mux the audio and finish the file.
+
+        Args:
+            audio: The soundtrack as a (channels, samples) tensor or array, at the
+                writer's audio_sample_rate. None writes the video alone
+
+        Raises:
+            ValueError: If no frames were written, or audio is given without the
+                sample rate that declares its stream
+        """
+        if self.closed:
+            return
+        if self._container is None:
+            self.closed = True
+            raise ValueError(f"No frames were written to {self.output_path}")
+        try:
+            for packet in self._stream.encode():
+                self._container.mux(packet)
+            if audio is not None:
+                if self._audio_stream is None:
+                    raise ValueError(
+                        f"Cannot mux audio into {self.output_path} - its sample rate "
+                        f"was not known when the first frames were written"
+                    )
+                from diffusers.utils.export_utils import _write_audio
+
+                if not torch.is_tensor(audio):
+                    audio = torch.from_numpy(numpy.ascontiguousarray(audio))
+                _write_audio(
+                    self._container,
+                    self._audio_stream,
+                    audio.detach().float().cpu(),
+                    int(self.audio_sample_rate),
+                    self._av,
+                )
+                self.has_audio = True
+        except BaseException:
+            self.abort()
+            raise
+        self._container.close()
+        self.closed = True
+
+    def abort(self):
+        """Close without finishing and remove the partial file."""
+        if self._container is not None:
+            try:
+                self._container.close()
+            except Exception as e:
+                logger.debug(f"Closing the aborted {self.output_path}: {e}")
+        self.closed = True
+        try:
+            os.remove(self.output_path)
+        except FileNotFoundError:
+            pass
+
+
+def write_video(
+    frames,
+    output_path,
+    fps,
+    audio=None,
+    audio_sample_rate=None,
+    chunk_frames=DEFAULT_CHUNK_FRAMES,
+):
+    """Stream frames into an h264/mp4 file, with the audio muxed in.
+
+    Args:
+        frames: Anything frame_chunks takes
+        output_path: The file to write
+        fps: Frame rate
+        audio: Optional (channels, samples) soundtrack
+        audio_sample_rate: Its sample rate, required with audio
+        chunk_frames: Frames converted and encoded at a time
+
+    Returns:
+        The number of frames written
+    """
+    if audio is not None and audio_sample_rate is None:
+        raise ValueError("audio_sample_rate is required when audio is provided")
+    with VideoWriter(
+        output_path,
+        fps,
+        audio_sample_rate if audio is not None else None,
+        chunk_frames,
+    ) as writer:
+        writer.write(frames)
+        writer.close(audio)
+    return writer.frames_written
+
+
+class EncodedVideo:
+    """A finished video file a producer wrote while it ran.
+
+    Saving it moves the file into place; nothing is decoded or encoded again.
+    Iterating decodes it a chunk at a time, for a step that needs its frames.
+
+    Args:
+        path: The mp4 file
+        fps: Its frame rate
+        frame_count: Frames it holds
+        has_audio: Whether a soundtrack was muxed in
+    """
+
+    def __init__(self, path, fps, frame_count, has_audio=False):
+        self.path = str(path)
+        self.fps = fps
+        self.frame_count = frame_count
+        self.has_audio = has_audio
+
+    def __len__(self):
+        return self.frame_count
+
+    def __iter__(self):
+        import av
+
+        with av.open(self.path) as container:
+            chunk = []
+            for frame in container.decode(video=0):
+                chunk.append(frame.to_ndarray(format="rgb24"))
+                if len(chunk) == DEFAULT_CHUNK_FRAMES:
+                    yield torch.from_numpy(numpy.stack(chunk))
+                    chunk = []
+            if chunk:
+                yield torch.from_numpy(numpy.stack(chunk))
+
+    def decode_audio(self):
+        """The muxed soundtrack, decoded.
+
+        Returns:
+            A (channels, samples) float32 array and its sample rate, or (None, None)
+            when the file carries no audio
+        """
+        if not self.has_audio:
+            return None, None
+
+        import av
+
+        with av.open(self.path) as container:
+            if not container.streams.audio:
+                return None, None
+            stream = container.streams.audio[0]
+            sample_rate = stream.codec_context.sample_rate
+            # Planar float gives each frame as (channels, samples), whatever the
+            # codec decodes to
+            resampler = av.AudioResampler(format="fltp", rate=sample_rate)
+            chunks = [
+                planar.to_ndarray()
+                for frame in container.decode(stream)
+                for planar in resampler.resample(frame)
+            ]
+            chunks.extend(planar.to_ndarray() for planar in resampler.resample(None))
+        if not chunks:
+            return None, None
+        return numpy.concatenate(chunks, axis=1).astype(numpy.float32), sample_rate
+
+    def move_to(self, output_path):
+        """Move the file to where the result saves it."""
+        if os.path.abspath(output_path) == os.path.abspath(self.path):
+            return
+        shutil.move(self.path, output_path)
+        self.path = str(output_path)
+
+
+def _video_stream_description(path):
+    import av
+
+    with av.open(str(path)) as container:
+        if len(container.streams.video) != 1:
+            return None
+        stream = container.streams.video[0]
+        context = stream.codec_context
+        return {
+            "codec": context.name,
+            "size": (context.width, context.height),
+            "pix_fmt": context.pix_fmt,
+            "extradata": bytes(context.extradata or b""),
+            "time_base": stream.time_base,
+            "rate": stream.average_rate,
+        }
+
+
+def remux_incompatibility(paths, fps=None):
+    """Why video files cannot be joined packet for packet, or None if they can.
+
+    Their packets can only follow one another in one stream when every file was
+    encoded alike: one video stream each, of the same codec, size, pixel format,
+    codec headers and timing.
+
+    Args:
+        paths: The files, in order
+        fps: The frame rate the joined video must play at, or None for theirs
+    """
+    if not paths:
+        return "there are no files"
+    first = _video_stream_description(paths[0])
+    if first is None:
+        return f"{paths[0]} does not hold exactly one video stream"
+    if fps is not None and first["rate"] != Fraction(fps).limit_denominator(1001):
+        return f"the files play at {first['rate']} fps, not {fps}"
+    for path in paths[1:]:
+        description = _video_stream_description(path)
+        if description is None:
+            return f"{path} does not hold exactly one video stream"
+        for key, value in first.items():
+            if description[key] != value:
+                return f"{path} differs from {paths[0]} in its {key}"
+    return None
+
+
+def video_frame_count(path):
+    """Frames in a video file's video stream, from its index where it has one."""
+    import av
+
+    with av.open(str(path)) as container:
+        stream = container.streams.video[0]
+        if stream.frames:
+            return stream.frames
+        return sum(1 for packet in container.demux(stream) if packet.size)
+
+
+def remux_videos(paths, output_path, audio=None, audio_sample_rate=None):
+    """Join video files end to end by copying their packets, with a new soundtrack.
+
+    Nothing is decoded or encoded but the audio; each file's timestamps are
+    shifted past the end of the one before. The files must pass
+    remux_incompatibility, and each must start on a keyframe - every file an
+    encoder wrote from its first frame does.
+
+    Args:
+        paths: The files, in order
+        output_path: The mp4 to write
+        audio: Optional (channels, samples) soundtrack, encoded in. The files' own
+            audio is not carried over
+        audio_sample_rate: Its sample rate, required with audio
+
+    Returns:
+        The number of frames written
+    """
+    import av
+    from diffusers.utils.export_utils import _prepare_audio_stream, _write_audio
+
+    if audio is not None and audio_sample_rate is None:
+        raise ValueError("audio_sample_rate is required when audio is provided")
+
+    frames = 0
+    try:
+        with av.open(str(output_path), mode="w") as output:
+            video_stream = None
+            audio_stream = None
+            offset = 0
+            for path in paths:
+                with av.open(str(path)) as container:
+                    stream = container.streams.video[0]
+                    if video_stream is None:
+                        video_stream = output.add_stream_from_template(stream)
+                        # Declared before the first packet writes the header
+                        if audio is not None:
+                            audio_stream = _prepare_audio_stream(
+                                output, int(audio_sample_rate)
+                            )
+                    start, end = None, offset
+                    for packet in container.demux(stream):
+                        # The demuxer ends each stream with an empty packet
+                        if packet.dts is None or not packet.size:
+                            continue
+                        if start is None:
+                            start = packet.pts
+                        end = max(end, packet.pts - start + offset + packet.duration)
+                        packet.pts += offset - start
+                        packet.dts += offset - start
+                        packet.stream = video_stream
+                        output.mux(packet)
+                        frames += 1
+                    offset = end
+            if audio is not None:
+                if not torch.is_tensor(audio):
+                    audio = torch.from_numpy(numpy.ascontiguousarray(audio))
+                _write_audio(
+                    output,
+                    audio_stream,
+                    audio.detach().float().cpu(),
+                    int(audio_sample_rate),
+                    av,
+                )
+    except BaseException:
+        try:
+            os.remove(output_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return frames
@@ -170,7 +170,17 @@ class WorkflowWorker:
                 or workflow_path != self.workflow_path
             )
 
-            if workflow_changed:
+            if workflow_changed and self._only_loras_changed(workflow_path, output_dir):
+                # The models loaded stay valid; each cached pipeline switches to
+                # the new LoRAs when its step runs
+                self.result_queue.put(
+                    {
+                        "type": "output",
+                        "message": "Only LoRAs changed - reusing loaded models",
+                    }
+                )
+                self.workflow_hash = current_hash
+            elif workflow_changed:
                 self.result_queue.put(
                     {
                         "type": "output",
@@ -312,6 +322,29 @@ class WorkflowWorker:
 
         logger.debug("Inter-run cleanup complete")
 
+    def _only_loras_changed(self, workflow_path, output_dir):
+        """Whether a changed workflow file differs from the loaded one only in LoRAs.
+
+        When it does, the new definition replaces the loaded one and the loaded
+        pipelines are kept.
+        """
+        from .pipeline_processors.lora import without_loras
+
+        if self.current_workflow is None or workflow_path != self.workflow_path:
+            return False
+        try:
+            workflow = workflow_from_file(workflow_path, output_dir)
+        except Exception:
+            # Let the full reload surface the error
+            return False
+        if without_loras(workflow.workflow_definition) != without_loras(
+            self.current_workflow.workflow_definition
+        ):
+            return False
+        self.current_workflow = workflow
+        self.output_dir = output_dir
+        return True
+
     def _cleanup_all(self):
         """
         Complete cleanup - clear all cached models and components.
@@ -319,6 +352,10 @@ class WorkflowWorker:
         """
         import gc
         from .tasks.model_cache import clear_model_cache
+        from .pipeline_processors.residency import get_residency_manager
+        from .pipeline_processors.component_registry import clear_component_registry
+        from .pipeline_processors.embedding_cache import get_embedding_cache
+        from .pipeline_processors.remote import close_remote_encoder_clients
 
         logger.info("Performing full cleanup")
 
@@ -326,6 +363,15 @@ class WorkflowWorker:
         self.loaded_pipelines.clear()
         self.shared_components.clear()
         clear_model_cache()
+        # On-demand components kept on the device under the residency budget
+        # belong to pipelines that are gone now
+        get_residency_manager().evict_all()
+        clear_component_registry()
+        # Embeddings of encoders that are gone can never be hit again
+        get_embedding_cache().clear()
+        # Pooled connections to remote text encoders - the next run that uses
+        # one opens a new session
+        close_remote_encoder_clients()
 
         # Reset state
         self.current_workflow = None
@@ -439,6 +485,16 @@ class WorkflowWorker:
         except (ImportError, RuntimeError, AttributeError) as e:
             logger.debug(f"Could not access GPU: {e}")
 
+        from .decoded_media import get_decoded_media_cache
+        from .pipeline_processors.residency import get_residency_manager
+        from .pipeline_processors.embedding_cache import get_embedding_cache
+        from .pipeline_processors.cache_telemetry import get_cache_telemetry
+
+        info["residency"] = get_residency_manager().stats()
+        info["embedding_cache"] = get_embedding_cache().stats()
+        info["decoded_media_cache"] = get_decoded_media_cache().stats()
+        info["cache_telemetry"] = get_cache_telemetry().stats()
+
         return info
 
 
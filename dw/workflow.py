@@ -9,7 +9,7 @@ from .arguments import realize_args, realize_constants
 from .step import Step
 from .schema import validate_data, load_schema
 from .variables import replace_variables, set_variables
-from .pipeline_processors.pipeline import Pipeline
+from .pipeline_processors.pipeline import Pipeline, load_loras
 from .tasks.model_cache import clear_model_cache
 from .tasks.task import Task
 from . import get_device, empty_device_cache
@@ -292,10 +292,28 @@ class Workflow:
         if "pipeline" in step_definition:
             step_name = step_definition["name"]
 
+            # A pipeline loaded without LoRAs may share its encoders with other
+            # steps' pipelines, and LoRAs loaded into it would be injected into
+            # theirs as well. Asked for LoRAs, it is loaded again with components of
+            # its own - a pipeline with LoRAs shares nothing
+            loras = step_definition["pipeline"].get("loras", [])
+            cached_pipeline = previous_pipelines.get(step_name)
+            if loras and cached_pipeline is not None:
+                shared = cached_pipeline.shared_component_names()
+                if shared:
+                    logger.info(
+                        f"Reloading the pipeline for step {step_name} - its "
+                        f"{', '.join(shared)} may be shared with other steps, and "
+                        f"LoRAs would change them there too"
+                    )
+                    del previous_pipelines[step_name]
+                    cached_pipeline = None
+                    gc.collect()
+                    empty_device_cache()
+
             # Check if pipeline already loaded in cache (GPU persistence)
-            if step_name in previous_pipelines:
+            if cached_pipeline is not None:
                 logger.debug(f"Reusing cached pipeline for step: {step_name}")
-                cached_pipeline = previous_pipelines[step_name]
                 # Create new Pipeline wrapper with updated step definition
                 # but reuse the loaded model from cache
                 new_pipeline_wrapper = Pipeline(
@@ -306,6 +324,13 @@ class Workflow:
                     output_dir=self.output_dir,
                     file_prefix=self.step_file_prefix(step_name),
                 )
+                # The LoRAs are the run's to choose - switch the cached pipeline to
+                # this run's set rather than keeping whatever it last ran with
+                load_loras(
+                    loras,
+                    cached_pipeline.pipeline,
+                    new_pipeline_wrapper.configuration.get("lora_cache"),
+                )
                 # Set up generator with potentially new seed. no_generator is a
                 # boolean - only an explicit true disables the generator - and the
                 # generator lives on the pipeline's own device, which may override
@@ -25,6 +25,103 @@ def _clear_task_model_cache():
     clear_model_cache()
 
 
+@pytest.fixture(autouse=True)
+def _clear_component_registry():
+    """Ensure no pipeline component is shared into a test from an earlier one.
+
+    Component blocks loaded identically are deduplicated process-wide, so a test
+    loading the same mocked VAE as the test before it would otherwise be handed
+    that test's mock.
+    """
+    from dw.pipeline_processors.component_registry import clear_component_registry
+
+    clear_component_registry()
+    yield
+    clear_component_registry()
+
+
+@pytest.fixture(autouse=True)
+def _fresh_embedding_cache(monkeypatch):
+    """Start each test with an empty prompt embedding cache.
+
+    Encodings are cached process-wide, so a test encoding the same prompt with a
+    mocked encoder as the test before it would otherwise be handed that test's
+    embeddings.
+    """
+    from dw.pipeline_processors import embedding_cache
+
+    monkeypatch.setattr(embedding_cache, "_cache", None)
+
+
+@pytest.fixture(autouse=True)
+def _fresh_cache_telemetry(monkeypatch):
+    """Start each test with no cache telemetry recorded.
+
+    Telemetry is kept process-wide, so a test reading the totals would otherwise
+    count the pipeline calls of the tests before it.
+    """
+    from dw.pipeline_processors import cache_telemetry
+
+    monkeypatch.setattr(cache_telemetry, "_telemetry", None)
+
+
+@pytest.fixture(autouse=True)
+def _fresh_attention_backend_table(monkeypatch, tmp_path):
+    """Give each test an empty attention backend table of its own.
+
+    "attention_backend": "auto" writes its choices to the settings directory, which
+    a test must neither read another run's choices from nor write to.
+    """
+    from dw import settings
+    from dw.pipeline_processors import attention_select
+
+    monkeypatch.setattr(attention_select, "_table", None)
+    monkeypatch.setattr(
+        settings, "attention_backend_table", str(tmp_path / "attention_backends.json")
+    )
+
+
+@pytest.fixture(autouse=True)
+def _fresh_decoded_media_cache(monkeypatch):
+    """Start each test with no decoded media cached.
+
+    Decoded files are kept process-wide, so a test that writes a file at a path an
+    earlier test used, within the same mtime tick, could be handed the old decode.
+    """
+    from dw import decoded_media
+
+    monkeypatch.setattr(decoded_media, "_cache", None)
+
+
+@pytest.fixture(autouse=True)
+def _fresh_media_cache(monkeypatch, tmp_path):
+    """Give each test an empty media cache of its own, online.
+
+    URL media is cached in the settings directory, which a test must neither serve
+    another run's downloads from nor fill.
+    """
+    from dw import media_cache, settings
+
+    monkeypatch.setattr(media_cache, "_cache", None)
+    monkeypatch.setattr(settings, "media_cache_dir", str(tmp_path / "media_cache"))
+    monkeypatch.setattr(settings, "media_cache_offline", False)
+    monkeypatch.delenv("DW_OFFLINE", raising=False)
+
+
+@pytest.fixture(autouse=True)
+def _close_remote_encoder_clients():
+    """Give each test its own remote text encoder clients.
+
+    Clients are kept per service process-wide, so a test pointing at a local
+    stand-in server would otherwise reuse the session of a test before it.
+    """
+    from dw.pipeline_processors.remote import close_remote_encoder_clients
+
+    close_remote_encoder_clients()
+    yield
+    close_remote_encoder_clients()
+
+
 @pytest.fixture
 def test_data_dir():
     """Get path to test data directory"""
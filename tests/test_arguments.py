@@ -21,6 +21,13 @@ from dw.security import InvalidInputError, SecurityError
 from dw.variables import set_variables
 
 
+@pytest.fixture
+def uncached_urls(monkeypatch):
+    """URLs handed to the loaders as they are, without the media cache or PyAV."""
+    monkeypatch.setattr("dw.arguments.cached_path", lambda url: url)
+    monkeypatch.setattr("dw.arguments.is_av_available", lambda: False)
+
+
 class TestFetchImage:
     """Test image fetching from files and URLs"""
 
@@ -62,6 +69,7 @@ class TestFetchImage:
             assert isinstance(loaded_image, Image.Image)
             assert loaded_image.size == (100, 100)
 
+    @pytest.mark.usefixtures("uncached_urls")
     @patch("dw.arguments.load_image")
     @patch("dw.arguments.validate_url")
     def test_fetch_image_from_url(self, mock_validate_url, mock_load_image):
@@ -158,6 +166,7 @@ class TestFetchVideo:
             fetch_video(456)
         assert "must be a string" in str(exc_info.value)
 
+    @pytest.mark.usefixtures("uncached_urls")
     def test_fetch_video_dict_format(self):
         """Test that video can be specified as dict with 'location' key"""
         with patch("dw.arguments.load_video") as mock_load:
@@ -174,6 +183,7 @@ class TestFetchVideo:
             fetch_video({"url": "test.mp4"})
         assert "location" in str(exc_info.value).lower()
 
+    @pytest.mark.usefixtures("uncached_urls")
     @patch("dw.arguments.load_video")
     @patch("dw.arguments.validate_url")
     def test_fetch_video_from_url(self, mock_validate_url, mock_load_video):
@@ -198,6 +208,7 @@ class TestFetchVideo:
                 fetch_video(invalid_file)
             assert "extension not allowed" in str(exc_info.value)
 
+    @pytest.mark.usefixtures("uncached_urls")
     @patch("dw.arguments.load_video")
     @patch("dw.arguments.validate_url")
     def test_fetch_video_list(self, mock_validate_url, mock_load_video):
@@ -214,6 +225,7 @@ class TestFetchVideo:
         assert result[0] == ["frames1"]
         assert result[1] == ["frames2"]
 
+    @pytest.mark.usefixtures("uncached_urls")
     @patch("dw.arguments.load_video")
     @patch("dw.arguments.validate_url")
     def test_fetch_video_list_with_dicts(self, mock_validate_url, mock_load_video):
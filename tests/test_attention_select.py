@@ -0,0 +1,212 @@
+"""Tests for "attention_backend": "auto": benchmarking, rejection and the stored table.
+
+Everything runs on the CPU, where native SDPA and the math backend are both
+available and the flash and cuDNN backends reject float32 - the same choices a GPU
+makes among more backends.
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from dw.pipeline_processors import attention_select
+from dw.pipeline_processors.attention_select import (
+    AttentionBackendTable,
+    auto_attention_backend,
+    available_backends,
+    benchmark_backends,
+    get_attention_backend_table,
+    shape_key,
+)
+from dw.pipeline_processors.pipeline import Pipeline
+
+dispatch = pytest.importorskip("diffusers.models.attention_dispatch")
+
+
+def qkv(sequence=32, heads=2, head_dim=16, dtype=torch.float32):
+    generator = torch.Generator().manual_seed(0)
+    return [
+        torch.randn(1, sequence, heads, head_dim, generator=generator, dtype=dtype)
+        for _ in range(3)
+    ]
+
+
+def tiny_wan():
+    diffusers = pytest.importorskip("diffusers")
+    torch.manual_seed(0)
+    model = diffusers.WanTransformer3DModel(
+        patch_size=(1, 2, 2),
+        num_attention_heads=2,
+        attention_head_dim=8,
+        in_channels=4,
+        out_channels=4,
+        text_dim=16,
+        freq_dim=16,
+        ffn_dim=32,
+        num_layers=2,
+        rope_max_seq_len=32,
+    ).eval()
+    generator = torch.Generator().manual_seed(0)
+    inputs = dict(
+        hidden_states=torch.randn(1, 4, 2, 8, 8, generator=generator),
+        encoder_hidden_states=torch.randn(1, 8, 16, generator=generator),
+        timestep=torch.tensor([500]),
+        return_dict=False,
+    )
+    return model, inputs
+
+
+class TestBenchmark:
+    def test_available_backends_run_here(self):
+        backends = available_backends()
+        assert "native" in backends
+        assert not any(name.endswith("_hub") for name in backends)
+        assert "flex" not in backends
+        assert "_native_math" not in backends
+
+    def test_failing_backends_are_rejected_with_their_reason(self):
+        result = benchmark_backends(*qkv(), backends=["native", "_native_flash"])
+        assert result["backend"] == "native"
+        assert set(result["timings_ms"]) == {"native"}
+        # The flash kernel takes half precision only
+        assert "bfloat16 or float16" in result["rejected"]["_native_flash"]
+
+    def test_a_backend_that_mismatches_numerically_is_rejected(self, monkeypatch):
+        math = dispatch.AttentionBackendName("_native_math")
+        registry = dispatch._AttentionBackendRegistry
+        original = registry._backends[math]
+
+        def off_by_a_bit(**kwargs):
+            return original(**kwargs) * 1.1
+
+        monkeypatch.setitem(registry._backends, math, off_by_a_bit)
+        result = benchmark_backends(*qkv(), backends=["native", "_native_math"])
+        assert result["backend"] == "native"
+        assert result["rejected"]["_native_math"].startswith("relative error")
+
+    def test_no_usable_backend_is_an_error(self):
+        with pytest.raises(RuntimeError, match="No attention backend"):
+            benchmark_backends(*qkv(), backends=["_native_flash"])
+
+    def test_the_fastest_matching_backend_wins(self, monkeypatch):
+        registry = dispatch._AttentionBackendRegistry
+        native = registry._backends[dispatch.AttentionBackendName("native")]
+        clock = iter(range(100))
+        # Every perf_counter reading is a second later; native's timed calls
+        # are made slower by reading it three more times
+        monkeypatch.setattr(attention_select.time, "perf_counter", lambda: next(clock))
+
+        def slow_native(**kwargs):
+            for _ in range(3):
+                attention_select.time.perf_counter()
+            return native(**kwargs)
+
+        result = benchmark_backends(
+            *qkv(), backends=["native", "_native_math"], repeats=1, native=slow_native
+        )
+        assert result["backend"] == "_native_math"
+        assert result["timings_ms"]["native"] > result["timings_ms"]["_native_math"]
+
+
+class TestTable:
+    def test_entries_persist_across_tables(self, tmp_path):
+        path = tmp_path / "table.json"
+        AttentionBackendTable(path).put("shape", {"backend": "native"})
+        assert AttentionBackendTable(path).get("shape") == {"backend": "native"}
+        assert json.loads(path.read_text())["entries"]["shape"]["backend"] == "native"
+
+    def test_an_unreadable_table_starts_empty(self, tmp_path, caplog):
+        path = tmp_path / "table.json"
+        path.write_text("{not json")
+        assert AttentionBackendTable(path).get("shape") is None
+        assert "Ignoring unreadable" in caplog.text
+
+    def test_the_process_table_is_at_the_configured_path(self, tmp_path):
+        # conftest points the setting into the test's directory
+        assert (
+            get_attention_backend_table().path == tmp_path / "attention_backends.json"
+        )
+
+    def test_shape_keys_name_what_the_choice_depends_on(self):
+        query, key, _ = qkv(sequence=32, head_dim=16)
+        assert (
+            shape_key("FluxTransformer2DModel", query, key[:, :8])
+            == "FluxTransformer2DModel|head_dim=16|seq=32x8|float32|cpu"
+        )
+        assert shape_key("M", query, key, torch.ones(1, 32)).endswith("|masked")
+
+
+class TestAuto:
+    def test_auto_matches_native_and_stores_each_shape(self):
+        model, inputs = tiny_wan()
+        table = get_attention_backend_table()
+        with torch.no_grad():
+            expected = model(**inputs)[0]
+            with auto_attention_backend(SimpleNamespace(transformer=model)):
+                output = model(**inputs)[0]
+
+        torch.testing.assert_close(output, expected)
+        # Self attention over 32 tokens and cross attention to 8 text tokens
+        assert sorted(table.entries()) == [
+            "WanTransformer3DModel|head_dim=8|seq=32x32|float32|cpu",
+            "WanTransformer3DModel|head_dim=8|seq=32x8|float32|cpu",
+        ]
+        assert table.path.is_file()
+
+    def test_a_stored_choice_is_used_without_benchmarking(self, monkeypatch):
+        model, inputs = tiny_wan()
+        pipeline = SimpleNamespace(transformer=model)
+        with torch.no_grad(), auto_attention_backend(pipeline):
+            model(**inputs)
+
+        calls = []
+        monkeypatch.setattr(
+            attention_select, "benchmark_backends", lambda *a, **k: calls.append(a)
+        )
+        # A later run reads the table from disk
+        monkeypatch.setattr(attention_select, "_table", None)
+        with torch.no_grad(), auto_attention_backend(pipeline):
+            model(**inputs)
+        assert calls == []
+
+    def test_a_stored_backend_no_longer_available_is_benchmarked_again(self):
+        model, inputs = tiny_wan()
+        table = get_attention_backend_table()
+        shape = "WanTransformer3DModel|head_dim=8|seq=32x32|float32|cpu"
+        table.put(shape, {"backend": "sage"})
+
+        with torch.no_grad(), auto_attention_backend(
+            SimpleNamespace(transformer=model)
+        ):
+            model(**inputs)
+        assert table.get(shape)["backend"] in available_backends()
+
+    def test_the_registry_is_restored(self):
+        registry = dispatch._AttentionBackendRegistry
+        native = dispatch.AttentionBackendName("native")
+        original, active = registry._backends[native], registry._active_backend
+        model, _ = tiny_wan()
+        with auto_attention_backend(SimpleNamespace(transformer=model)):
+            assert registry._backends[native] is not original
+        assert registry._backends[native] is original
+        assert registry._active_backend == active
+
+    def test_a_pipeline_configured_for_auto(self):
+        model, inputs = tiny_wan()
+
+        class TinyPipeline:
+            transformer = model
+
+            def __call__(self, **arguments):
+                return model(**inputs)[0]
+
+        pipeline = Pipeline(
+            {"configuration": {"attention_backend": "auto"}, "arguments": {}},
+            0,
+            "cpu",
+            pipeline=TinyPipeline(),
+        )
+        pipeline.run({})
+        assert len(get_attention_backend_table().entries()) == 2
@@ -11,6 +11,7 @@ from dw.tasks.audio_utils import (
     as_channels_samples,
     crossfade_concat,
     equal_power_crossfade_join,
+    equal_power_crossfade_join_all,
     frames_to_samples,
     load_audio,
     slice_samples,
@@ -149,6 +150,39 @@ class TestEqualPowerCrossfadeJoin:
         assert joined.shape == (2, 900)
 
 
+class TestEqualPowerCrossfadeJoinAll:
+    def segments(self, seed=0):
+        rng = numpy.random.default_rng(seed)
+        segments = []
+        for channels, head, length in [
+            (2, 0, 900),
+            (1, 120, 700),
+            (2, 0, 500),
+            (2, 60, 10),
+            (1, 300, 800),
+        ]:
+            waveform = rng.standard_normal(
+                (channels, head + length), dtype=numpy.float32
+            )
+            segments.append((waveform[:, :head], waveform[:, head:]))
+        return segments
+
+    def test_it_matches_joining_a_pair_at_a_time(self):
+        segments = self.segments()
+        expected = segments[0][1]
+        for head, following in segments[1:]:
+            expected = equal_power_crossfade_join(expected, head, following, 16000, 5)
+
+        joined = equal_power_crossfade_join_all(segments, 16000, 5)
+
+        assert joined.shape == expected.shape == (2, 2910)
+        numpy.testing.assert_allclose(joined, expected, atol=1e-6)
+
+    def test_no_segments_raises(self):
+        with pytest.raises(ValueError, match="No audio"):
+            equal_power_crossfade_join_all([], 16000, 5)
+
+
 class TestCrossfadeConcat:
     def test_each_seam_overlaps_by_the_fade_window(self):
         first = numpy.ones((1, 1000), dtype=numpy.float32)
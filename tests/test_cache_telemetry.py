@@ -0,0 +1,193 @@
+"""Tests for cache telemetry: what a transformer cache computed and reused per call.
+
+A tiny random-weight Wan transformer is denoised over a few steps with each cache, so
+the blocks really run or are skipped the way they would on a full-size model.
+"""
+
+import logging
+
+import pytest
+import torch
+
+from dw.pipeline_processors.cache_telemetry import (
+    cache_telemetry_context,
+    get_cache_telemetry,
+)
+from dw.pipeline_processors.config_objects import get_cache_configuration
+from dw.pipeline_processors.pipeline import (
+    enable_cache_on_transformer,
+    stateful_cache_context,
+)
+from dw.teacache import teacache_context
+
+TIMESTEPS = (900, 700, 500, 300)
+
+
+class FakePipeline:
+    def __init__(self, transformer):
+        self.transformer = transformer
+
+
+def tiny_wan():
+    diffusers = pytest.importorskip("diffusers")
+    torch.manual_seed(0)
+    model = diffusers.WanTransformer3DModel(
+        patch_size=(1, 2, 2),
+        num_attention_heads=2,
+        attention_head_dim=8,
+        in_channels=4,
+        out_channels=4,
+        text_dim=16,
+        freq_dim=16,
+        ffn_dim=32,
+        num_layers=2,
+        rope_max_seq_len=32,
+    ).eval()
+    generator = torch.Generator().manual_seed(0)
+    inputs = dict(
+        hidden_states=torch.randn(1, 4, 2, 4, 4, generator=generator),
+        encoder_hidden_states=torch.randn(1, 8, 16, generator=generator),
+    )
+    return model, inputs
+
+
+def denoise(model, inputs, branches=1):
+    with torch.no_grad():
+        for t in TIMESTEPS:
+            for _ in range(branches):
+                model(**inputs, timestep=torch.tensor([t]))
+
+
+def last_call():
+    return get_cache_telemetry().stats()["last_call"]
+
+
+class TestTeaCache:
+    def test_reused_steps_and_compute_saved(self):
+        model, inputs = tiny_wan()
+        pipeline = FakePipeline(model)
+        configuration = {"teacache": {}}
+
+        with cache_telemetry_context(pipeline, configuration):
+            with teacache_context(
+                pipeline, len(TIMESTEPS), 1.0, coefficients=[0, 0, 0, 0, 0]
+            ):
+                denoise(model, inputs)
+
+        summary = last_call()
+        assert summary["method"] == "teacache"
+        assert summary["transformer_calls"] == 4
+        assert summary["calls_computed"] == 2
+        assert summary["calls_reused"] == 2
+        assert (summary["blocks_computed"], summary["blocks_total"]) == (4, 8)
+        assert summary["compute_saved"] == pytest.approx(0.5)
+
+    def test_the_accumulated_error_of_each_compared_step(self):
+        model, inputs = tiny_wan()
+        pipeline = FakePipeline(model)
+
+        with cache_telemetry_context(pipeline, {"teacache": {}}):
+            with teacache_context(
+                pipeline, len(TIMESTEPS), 1.0, coefficients=[0, 0, 0, 1, 0]
+            ):
+                denoise(model, inputs)
+
+        signals = [record["signal"] for record in last_call()["records"]]
+        # The first and last step are computed without comparing
+        assert signals[0] is None and signals[-1] is None
+        assert all(signal > 0 for signal in signals[1:-1])
+
+    def test_guidance_branches_are_recorded_apart(self):
+        model, inputs = tiny_wan()
+        pipeline = FakePipeline(model)
+
+        with cache_telemetry_context(pipeline, {"teacache": {}}):
+            with teacache_context(pipeline, len(TIMESTEPS)):
+                denoise(model, inputs, branches=2)
+
+        records = last_call()["records"]
+        assert [(r["step"], r["branch"]) for r in records[:4]] == [
+            (0, 0),
+            (0, 1),
+            (1, 0),
+            (1, 1),
+        ]
+        assert last_call()["steps"] == 4
+
+
+class TestDiffusersCaches:
+    def test_first_block_cache_runs_only_the_first_block_when_reusing(self):
+        model, inputs = tiny_wan()
+        pipeline = FakePipeline(model)
+        configuration = {"cache": {"type": "first_block", "threshold": 10.0}}
+        enable_cache_on_transformer(pipeline, get_cache_configuration(configuration))
+
+        with cache_telemetry_context(pipeline, configuration):
+            with stateful_cache_context(pipeline):
+                denoise(model, inputs)
+
+        summary = last_call()
+        assert summary["method"] == "first_block"
+        assert summary["calls_reused"] == 3
+        assert (summary["blocks_computed"], summary["blocks_total"]) == (5, 8)
+        assert summary["compute_saved"] == pytest.approx(3 / 8)
+
+    def test_a_cache_whose_transformer_is_never_called_is_reported(self, caplog):
+        model, _ = tiny_wan()
+        pipeline = FakePipeline(model)
+        configuration = {"cache": {"type": "first_block", "threshold": 0.1}}
+        enable_cache_on_transformer(pipeline, get_cache_configuration(configuration))
+
+        with caplog.at_level(logging.WARNING, logger="dw"):
+            with cache_telemetry_context(pipeline, configuration):
+                pass
+
+        assert last_call()["transformer_calls"] == 0
+        assert "was never called" in caplog.text
+
+
+class TestContext:
+    def test_nothing_is_recorded_without_a_cache(self):
+        model, inputs = tiny_wan()
+
+        with cache_telemetry_context(FakePipeline(model), {}):
+            denoise(model, inputs)
+
+        assert get_cache_telemetry().stats()["pipeline_calls"] == 0
+
+    def test_can_be_turned_off(self):
+        model, inputs = tiny_wan()
+
+        with cache_telemetry_context(
+            FakePipeline(model), {"teacache": {}, "cache_telemetry": False}
+        ):
+            denoise(model, inputs)
+
+        assert get_cache_telemetry().stats()["pipeline_calls"] == 0
+
+    def test_hooks_are_removed_after_the_call(self):
+        model, inputs = tiny_wan()
+
+        with cache_telemetry_context(FakePipeline(model), {"teacache": {}}):
+            denoise(model, inputs)
+
+        assert all(
+            not module._forward_hooks and not module._forward_pre_hooks
+            for module in model.modules()
+        )
+
+    def test_totals_accumulate_across_calls(self):
+        model, inputs = tiny_wan()
+        pipeline = FakePipeline(model)
+
+        for _ in range(2):
+            with cache_telemetry_context(pipeline, {"teacache": {}}):
+                with teacache_context(
+                    pipeline, len(TIMESTEPS), 1.0, coefficients=[0, 0, 0, 0, 0]
+                ):
+                    denoise(model, inputs)
+
+        stats = get_cache_telemetry().stats()
+        assert stats["pipeline_calls"] == 2
+        assert stats["transformer_calls"] == 8
+        assert stats["compute_saved"] == pytest.approx(0.5)
@@ -468,6 +468,86 @@ class TestSaveSegments:
         assert len(list(tmp_path.glob("wf-step.0.segment-*.mp4"))) == 3
         assert len(list(tmp_path.glob("wf-step.1.segment-*.mp4"))) == 3
 
+    def test_segments_are_encoded_while_the_next_one_generates(
+        self, tmp_path, monkeypatch
+    ):
+        import threading
+
+        from dw.pipeline_processors import chain as chain_module
+
+        encoding = threading.Event()
+        release = threading.Event()
+        write_video = chain_module.write_video
+
+        def slow_write(frames, **kwargs):
+            encoding.set()
+            assert release.wait(10)
+            return write_video(frames, **kwargs)
+
+        def output(arguments, index):
+            if index == 1:
+                # the first segment's encode is under way, not finished
+                assert encoding.wait(10)
+                release.set()
+            return video_output(arguments, index)
+
+        monkeypatch.setattr(chain_module, "write_video", slow_write)
+        pipeline = self.make_pipeline(tmp_path, output)
+
+        result = run_chain(pipeline, self.chain(), {})
+
+        # every segment is on disk when the chain returns
+        assert sum(len(chunk) for chunk in result.frames) == 4 + 3 + 3
+
+    def test_an_encode_error_is_raised_at_the_next_segment(self, tmp_path, monkeypatch):
+        from dw.pipeline_processors import chain as chain_module
+
+        def failing_write(frames, **kwargs):
+            raise RuntimeError("encoder failed")
+
+        monkeypatch.setattr(chain_module, "write_video", failing_write)
+        monkeypatch.setattr(chain_module, "SPILL_QUEUE_SEGMENTS", 1)
+        pipeline = self.make_pipeline(tmp_path)
+
+        with pytest.raises(RuntimeError, match="encoder failed"):
+            run_chain(pipeline, self.chain(segments=5), {})
+
+        # the first segment's error surfaces when the second one is handed over
+        assert len(pipeline.calls) == 2
+
+    def test_an_encode_error_of_the_last_segment_is_raised_at_finish(
+        self, tmp_path, monkeypatch
+    ):
+        from dw.pipeline_processors import chain as chain_module
+
+        write_video = chain_module.write_video
+
+        def write(frames, output_path, **kwargs):
+            if output_path.endswith("segment-002.mp4"):
+                raise RuntimeError("encoder failed")
+            return write_video(frames, output_path=output_path, **kwargs)
+
+        monkeypatch.setattr(chain_module, "write_video", write)
+        pipeline = self.make_pipeline(tmp_path)
+
+        with pytest.raises(RuntimeError, match="encoder failed"):
+            run_chain(pipeline, self.chain(), {})
+
+        assert len(list(tmp_path.glob("wf-step.0.segment-*.mp4"))) == 2
+
+    def test_a_crashed_chain_leaves_its_queued_segments_written(self, tmp_path):
+        def output(arguments, index):
+            if index == 2:
+                raise RuntimeError("out of memory")
+            return video_output(arguments, index)
+
+        pipeline = self.make_pipeline(tmp_path, output)
+
+        with pytest.raises(RuntimeError, match="out of memory"):
+            run_chain(pipeline, self.chain(), {})
+
+        assert len(list(tmp_path.glob("wf-step.0.segment-*.mp4"))) == 2
+
     def test_without_a_workflow_output_dir_raises(self):
         pipeline = FakePipeline(video_output)
 
@@ -483,6 +563,116 @@ class TestSaveSegments:
             run_chain(pipeline, chain, {})
 
 
+class TestStream:
+    """Streaming the stitched video into one file as segments finish."""
+
+    def chain(self, **overrides):
+        return {"segments": 3, "trim_frames": 1, "fps": 4, "stream": True} | overrides
+
+    def make_pipeline(self, tmp_path, factory=video_output):
+        return FakePipeline(factory, output_dir=str(tmp_path), file_prefix="wf-step")
+
+    def decoded(self, path):
+        import av
+
+        with av.open(str(path)) as container:
+            count = sum(1 for _ in container.decode(video=0))
+            return count, len(container.streams.audio)
+
+    def test_segments_are_encoded_into_one_file(self, tmp_path):
+        from dw.video_writer import EncodedVideo
+
+        pipeline = self.make_pipeline(tmp_path)
+
+        result = run_chain(pipeline, self.chain(), {})
+
+        assert isinstance(result, EncodedVideo)
+        assert result.path == str(tmp_path / "wf-step.0.chain.mp4")
+        assert len(result) == 4 + 3 + 3
+        assert self.decoded(result.path) == (10, 0)
+
+    def test_generated_audio_is_muxed_in_when_the_chain_ends(self, tmp_path):
+        def output(arguments, index):
+            return modular_output(arguments, index, sample_rate=8000)
+
+        pipeline = self.make_pipeline(tmp_path, output)
+
+        result = run_chain(pipeline, self.chain(trim_frames=2), {"num_frames": 8})
+
+        assert result.has_audio
+        assert self.decoded(result.path) == (8 + 6 + 6, 1)
+
+    def test_match_audio_never_writes_the_overshoot(self, tmp_path):
+        subject = FakeImageReference(solid_frame((9, 9, 9)))
+        voice = FakeAudioReference(torch.zeros(2, int(4.6 * 8000)), 8000)
+        chain = self.chain(trim_frames=2, segment_argument="references")
+        del chain["segments"]
+        chain["match_audio"] = True
+
+        def output(arguments, index):
+            return modular_output(arguments, index, sample_rate=8000)
+
+        pipeline = self.make_pipeline(tmp_path, output)
+
+        result = run_chain(
+            pipeline, chain, {"num_frames": 8, "references": [subject, voice]}
+        )
+
+        assert self.decoded(result.path) == (18, 1)
+
+    def test_frames_read_back_keep_their_pixel_values(self, tmp_path):
+        from dw.tasks.video_utils import extract_frame, frames_as_array
+
+        pipeline = self.make_pipeline(tmp_path)
+
+        result = run_chain(pipeline, self.chain(), {})
+
+        # The last segment is (100, 100, 150); h264 keeps a solid frame close
+        last = numpy.asarray(extract_frame(result, -1), dtype=numpy.float32)
+        assert numpy.abs(last.mean(axis=(0, 1)) - (100, 100, 150)).max() < 4
+        frames = frames_as_array(result)
+        assert frames.dtype == numpy.uint8
+        assert numpy.abs(frames[-1].astype(numpy.float32) - last).max() == 0
+        assert abs(float(frames[0].mean()) - (0 + 100 + 150) / 3) < 4
+
+    def test_a_streamed_chain_conditions_with_its_frames_and_soundtrack(self, tmp_path):
+        from dw.arguments import media_arguments
+
+        def output(arguments, index):
+            return modular_output(arguments, index, sample_rate=8000)
+
+        pipeline = self.make_pipeline(tmp_path, output)
+        result = run_chain(pipeline, self.chain(), {"num_frames": 8})
+
+        arguments = media_arguments(FakeVideoReference, result)
+
+        assert len(arguments["frames"]) == 8 + 7 + 7
+        pixel = arguments["frames"][0].getpixel((4, 4))
+        assert numpy.abs(numpy.subtract(pixel, (0, 100, 150))).max() < 4
+        assert arguments["sample_rate"] == 8000
+        assert arguments["audio"].shape[0] == 2
+        # 22 frames at 4 fps, give or take the codec's padding
+        assert abs(arguments["audio"].shape[1] - 22 / 4 * 8000) < 2048
+
+    def test_a_failing_segment_removes_the_partial_file(self, tmp_path):
+        def output(arguments, index):
+            if index == 2:
+                raise RuntimeError("out of memory")
+            return video_output(arguments, index)
+
+        pipeline = self.make_pipeline(tmp_path, output)
+
+        with pytest.raises(RuntimeError, match="out of memory"):
+            run_chain(pipeline, self.chain(), {})
+        assert list(tmp_path.iterdir()) == []
+
+    def test_stream_and_save_segments_exclude_each_other(self, tmp_path):
+        pipeline = self.make_pipeline(tmp_path)
+
+        with pytest.raises(ValueError, match="not both"):
+            run_chain(pipeline, self.chain(save_segments=True), {})
+
+
 class TestLastSegmentContinuity:
     def make_arguments(self, num_frames=8):
         subject = FakeImageReference(solid_frame((9, 9, 9)))
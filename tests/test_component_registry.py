@@ -0,0 +1,217 @@
+"""Tests for sharing identically loaded components between steps.
+
+Loading is stubbed: what matters is which loads are handed an existing module and
+which get their own, and that a shared module is released with its last holder.
+"""
+
+import copy
+import gc
+
+import pytest
+import torch
+
+from dw.pipeline_processors import pipeline as pipeline_module
+from dw.pipeline_processors.component_registry import (
+    component_fingerprint,
+    component_registry_stats,
+    find_duplicate_components,
+)
+
+
+def vae_pipeline(**vae_arguments):
+    return {
+        "configuration": {"component_type": "SomePipeline"},
+        "from_pretrained_arguments": {"model_name": "some/model"},
+        "vae": {
+            "configuration": {"component_type": "AutoencoderKL"},
+            "from_pretrained_arguments": {
+                "model_name": "some/model",
+                "subfolder": "vae",
+                "torch_dtype": "torch.bfloat16",
+                **vae_arguments,
+            },
+        },
+        "arguments": {},
+    }
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Stub load_component to build a fresh module per load, recording each."""
+    loaded = []
+
+    def load_component(component_name, *arguments, **keywords):
+        component = torch.nn.Linear(2, 2)
+        loaded.append((component_name, component))
+        return component
+
+    monkeypatch.setattr(pipeline_module, "load_component", load_component)
+    return loaded
+
+
+def populate(definition, device="cpu"):
+    pipeline = pipeline_module.Pipeline(definition, 42, device)
+    return pipeline, pipeline.populate_from_pretrained_arguments(device, {})
+
+
+class TestFingerprint:
+    def test_identical_definitions_match(self):
+        assert component_fingerprint(
+            "vae", vae_pipeline(), "cuda"
+        ) == component_fingerprint("vae", vae_pipeline(), "cuda")
+
+    @pytest.mark.parametrize(
+        "change",
+        [
+            {"torch_dtype": "torch.float16"},
+            {"subfolder": "vae_2"},
+            {"revision": "refs/pr/1"},
+        ],
+    )
+    def test_a_different_load_does_not_match(self, change):
+        assert component_fingerprint(
+            "vae", vae_pipeline(), "cuda"
+        ) != component_fingerprint("vae", vae_pipeline(**change), "cuda")
+
+    def test_a_different_device_does_not_match(self):
+        assert component_fingerprint(
+            "vae", vae_pipeline(), "cuda:0"
+        ) != component_fingerprint("vae", vae_pipeline(), "cuda:1")
+
+    def test_a_different_placement_does_not_match(self):
+        placed = vae_pipeline()
+        placed["configuration"]["components"] = {"vae": {"residency": "on_demand"}}
+
+        assert component_fingerprint(
+            "vae", vae_pipeline(), "cuda"
+        ) != component_fingerprint("vae", placed, "cuda")
+
+    @pytest.mark.parametrize(
+        "setting",
+        [
+            {"offload": "sequential"},
+            {"offload": "model", "exclude_from_cpu_offload": ["vae"]},
+            {"enable_layerwise_casting": {"storage_dtype": "torch.float8_e4m3fn"}},
+            {"preserve_device_placement": True},
+        ],
+    )
+    def test_a_different_pipeline_offload_does_not_match(self, setting):
+        offloaded = vae_pipeline()
+        offloaded["configuration"].update(setting)
+
+        assert component_fingerprint(
+            "vae", vae_pipeline(), "cuda"
+        ) != component_fingerprint("vae", offloaded, "cuda")
+
+    def test_realized_types_fingerprint_by_name(self):
+        realized = vae_pipeline()
+        realized["vae"]["from_pretrained_arguments"]["torch_dtype"] = torch.bfloat16
+
+        assert component_fingerprint("vae", realized, "cuda") is not None
+
+    def test_denoisers_are_never_shared(self):
+        definition = vae_pipeline()
+        definition["transformer"] = definition.pop("vae")
+
+        assert component_fingerprint("transformer", definition, "cuda") is None
+
+    def test_a_pipeline_with_loras_shares_nothing(self):
+        definition = vae_pipeline()
+        definition["loras"] = [{"model_name": "some/lora"}]
+
+        assert component_fingerprint("vae", definition, "cuda") is None
+
+    def test_it_can_be_turned_off(self):
+        definition = vae_pipeline()
+        definition["configuration"]["deduplicate_components"] = False
+
+        assert component_fingerprint("vae", definition, "cuda") is None
+
+
+class TestDeduplicatedLoading:
+    def test_a_second_identical_load_gets_the_first_module(self, loads):
+        first, first_arguments = populate(vae_pipeline())
+        second, second_arguments = populate(vae_pipeline())
+
+        assert second_arguments["vae"] is first_arguments["vae"]
+        assert len(loads) == 1
+        assert second.deduplicated_components == {"vae": first_arguments["vae"]}
+        assert component_registry_stats()["deduplicated"] == 1
+
+    def test_both_pipelines_know_the_module_is_shared(self, loads):
+        first, _ = populate(vae_pipeline())
+        second, _ = populate(vae_pipeline())
+        definition = vae_pipeline()
+        definition["loras"] = [{"model_name": "some/lora"}]
+        private, _ = populate(definition)
+
+        assert first.shared_component_names() == ["vae"]
+        assert second.shared_component_names() == ["vae"]
+        assert private.shared_component_names() == []
+
+    def test_a_different_load_gets_its_own_module(self, loads):
+        _, first_arguments = populate(vae_pipeline())
+        _, second_arguments = populate(vae_pipeline(torch_dtype="torch.float16"))
+
+        assert second_arguments["vae"] is not first_arguments["vae"]
+        assert len(loads) == 2
+
+    def test_the_module_is_released_with_its_last_holder(self, loads):
+        _, arguments = populate(vae_pipeline())
+        del arguments
+        loads.clear()
+        gc.collect()
+
+        _, arguments = populate(vae_pipeline())
+
+        assert len(loads) == 1
+        assert component_registry_stats()["deduplicated"] == 0
+
+
+class TestFindDuplicateComponents:
+    def workflow(self, *pipelines):
+        return {
+            "id": "two_steps",
+            "variables": {"model": "some/model"},
+            "steps": [
+                {"name": f"step_{i}", "pipeline": pipeline}
+                for i, pipeline in enumerate(pipelines)
+            ],
+        }
+
+    def test_reports_components_loaded_by_more_than_one_step(self):
+        workflow = self.workflow(vae_pipeline(), vae_pipeline(), vae_pipeline())
+
+        assert find_duplicate_components(workflow) == [
+            ("vae", ["step_0", "step_1", "step_2"])
+        ]
+
+    def test_variables_are_substituted_before_comparing(self):
+        by_variable = vae_pipeline(model_name="variable:model")
+
+        assert find_duplicate_components(
+            self.workflow(vae_pipeline(), by_variable)
+        ) == [("vae", ["step_0", "step_1"])]
+
+    def test_distinct_components_are_not_reported(self):
+        workflow = self.workflow(
+            vae_pipeline(), vae_pipeline(torch_dtype="torch.float16")
+        )
+
+        assert find_duplicate_components(workflow) == []
+
+    def test_steps_on_different_devices_are_not_reported(self):
+        other_device = vae_pipeline()
+        other_device["configuration"]["device"] = "cuda:1"
+
+        assert (
+            find_duplicate_components(self.workflow(vae_pipeline(), other_device)) == []
+        )
+
+    def test_the_workflow_is_not_modified(self):
+        workflow = self.workflow(vae_pipeline(model_name="variable:model"))
+        original = copy.deepcopy(workflow)
+
+        find_duplicate_components(workflow)
+
+        assert workflow == original
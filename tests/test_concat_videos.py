@@ -3,14 +3,19 @@ Unit tests for the concat_videos task - the standalone counterpart of the
 chained pipeline step's stitching.
 """
 
+import os
+
 import numpy
 import pytest
 import torch
 from PIL import Image
 
-from dw.result import AudioVideo, get_artifact_list
+from dw.result import AudioVideo, Result, get_artifact_list
 from dw.tasks.concat_videos import concat_videos
 from dw.tasks.task import Task
+from dw.tasks.video_utils import ConcatenatedFrames
+from dw.video_source import VideoSource
+from dw.video_writer import write_video
 
 
 def frames(count, color=(0, 0, 0)):
@@ -93,6 +98,66 @@ class TestConcatVideos:
         assert len(get_artifact_list(result)) == 1
 
 
+class TestStreaming:
+    """Inputs are read one video at a time, as the joined frames are consumed."""
+
+    def clip(self, tmp_path, name, count, level):
+        path = tmp_path / f"{name}.mp4"
+        write_video(frames(count, (level, level, level)), path, fps=4)
+        return path
+
+    def test_nothing_is_decoded_until_the_frames_are_used(self, tmp_path, monkeypatch):
+        av = pytest.importorskip("av")
+        decoded = []
+        chunks = VideoSource.chunks
+
+        def recording(self, start=0, *args, **kwargs):
+            decoded.append((os.path.basename(self.path), start))
+            return chunks(self, start, *args, **kwargs)
+
+        monkeypatch.setattr(VideoSource, "chunks", recording)
+        videos = [
+            VideoSource(self.clip(tmp_path, name, 6, level))
+            for name, level in (("a", 0), ("b", 128))
+        ]
+
+        result = concat_videos(videos, trim_frames=2)
+
+        assert isinstance(result.frames, ConcatenatedFrames)
+        assert len(result.frames) == 10
+        assert decoded == []
+
+        result_set = Result({"content_type": "video/mp4", "fps": 4})
+        result_set.add_result(result)
+        result_set.save(str(tmp_path), "joined")
+
+        # the trimmed head of b was never decoded
+        assert decoded == [("a.mp4", 0), ("b.mp4", 2)]
+        with av.open(str(tmp_path / "joined-0.0.mp4")) as container:
+            assert sum(1 for _ in container.decode(video=0)) == 10
+
+    def test_frames_index_across_the_inputs(self):
+        first, second, third = frames(3), frames(4), frames(2)
+
+        joined = concat_videos([first, second, third], trim_frames=1).frames
+
+        assert joined[2] is first[2]
+        assert joined[3] is second[1]
+        assert joined[-1] is third[1]
+        assert joined[2:5] == [first[2], second[1], second[2]]
+        assert list(joined) == first + second[1:] + third[1:]
+
+    def test_inputs_of_every_shape_stream_in_chunks(self):
+        array = numpy.zeros((5, 8, 8, 3), dtype=numpy.uint8)
+
+        joined = concat_videos(
+            [array, frames(5), torch.zeros(5, 8, 8, 3)], trim_frames=1
+        )
+
+        chunks = list(joined.frames.chunks(chunk_frames=2))
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1, 2, 2, 2, 2]
+
+
 class TestTaskDispatch:
     def test_concat_videos_runs_through_task(self):
         task = Task({"command": "concat_videos", "arguments": {}}, "cpu")
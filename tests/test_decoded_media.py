@@ -0,0 +1,157 @@
+"""
+Unit tests for the decoded media cache - files decoded once and handed back on
+later loads until they change - and the loaders that read through it.
+"""
+
+import os
+from unittest.mock import patch
+
+import numpy
+import pytest
+import soundfile
+from PIL import Image
+
+from dw import settings
+from dw.arguments import fetch_image, fetch_video
+from dw.decoded_media import DecodedMediaCache, get_decoded_media_cache, media_bytes
+from dw.tasks.audio_utils import load_audio
+from dw.video_source import VideoSource, decode_video_sources
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = tmp_path / "reference.png"
+    Image.new("RGB", (40, 20), (255, 0, 0)).save(path)
+    return str(path)
+
+
+def decode_rgb(path):
+    return Image.open(path).convert("RGB")
+
+
+def rewrite(path, color):
+    """Write a new image over a file, with a modification time of its own."""
+    stat = os.stat(path)
+    Image.new("RGB", (40, 20), color).save(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+class TestDecodedMediaCache:
+    def test_a_file_is_decoded_once(self, image_path):
+        cache = DecodedMediaCache()
+        decodes = []
+
+        def decode(path):
+            decodes.append(path)
+            return Image.open(path).convert("RGB")
+
+        first = cache.load(image_path, decode, kind="image")
+        second = cache.load(image_path, decode, kind="image")
+
+        assert first is second
+        assert len(decodes) == 1
+        assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+    def test_a_changed_file_is_decoded_again(self, image_path):
+        cache = DecodedMediaCache()
+        cache.load(image_path, decode_rgb)
+
+        rewrite(image_path, (0, 0, 255))
+
+        assert cache.load(image_path, decode_rgb).getpixel((0, 0)) == (0, 0, 255)
+
+    def test_other_options_are_other_entries(self, image_path):
+        cache = DecodedMediaCache()
+
+        small = cache.load(image_path, lambda path: "small", size=(4, 2))
+        large = cache.load(image_path, lambda path: "large", size=(8, 4))
+
+        assert (small, large) == ("small", "large")
+
+    def test_the_least_recently_used_is_evicted(self, tmp_path):
+        paths = []
+        for name in "abc":
+            path = tmp_path / f"{name}.npy"
+            path.write_bytes(b"")
+            paths.append(str(path))
+        cache = DecodedMediaCache(max_bytes=2 * 8000)
+
+        def decode(path):
+            return numpy.zeros(1000)
+
+        a = cache.load(paths[0], decode)
+        cache.load(paths[1], decode)
+        cache.load(paths[0], decode)
+        cache.load(paths[2], decode)
+
+        assert cache.load(paths[0], decode) is a
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["entries"] == 2
+
+    def test_a_zero_cap_decodes_every_time(self, image_path):
+        cache = DecodedMediaCache(max_bytes=0)
+
+        assert cache.load(image_path, decode_rgb) is not cache.load(
+            image_path, decode_rgb
+        )
+
+    def test_the_cap_is_read_from_settings(self, monkeypatch):
+        monkeypatch.setattr(settings, "decoded_media_cache_size", "2MB")
+
+        assert get_decoded_media_cache().max_bytes == 2 * 1024**2
+
+    def test_sizes_of_decoded_media(self):
+        image = Image.new("RGB", (10, 5))
+
+        assert media_bytes(image) == 150
+        assert media_bytes([image, image]) == 300
+        assert media_bytes((numpy.zeros((2, 100), dtype=numpy.float32), 8000)) == 800
+
+
+class TestLoaders:
+    def test_fetch_image_hands_back_the_decoded_image(self, image_path):
+        with patch("dw.arguments.load_image", side_effect=Image.open) as load:
+            first = fetch_image(image_path)
+            second = fetch_image({"location": image_path})
+
+        assert first is second
+        load.assert_called_once()
+
+    def test_fetch_image_sees_an_edited_file(self, image_path):
+        fetch_image(image_path)
+        rewrite(image_path, (0, 255, 0))
+
+        assert fetch_image(image_path).getpixel((0, 0)) == (0, 255, 0)
+
+    def test_load_audio_reads_a_file_once(self, tmp_path):
+        path = tmp_path / "track.wav"
+        soundfile.write(path, numpy.zeros(800, dtype="float32"), 8000)
+
+        with patch("dw.tasks.audio_utils.soundfile.read", wraps=soundfile.read) as read:
+            first = load_audio(str(path))
+            second = load_audio(str(path))
+
+        assert first[0] is second[0]
+        assert read.call_count == 1
+
+    def test_a_video_is_opened_and_decoded_once(self, tmp_path):
+        pytest.importorskip("av")
+        from dw.video_writer import write_video
+
+        path = tmp_path / "clip.mp4"
+        write_video([Image.new("RGB", (32, 16))] * 6, path, fps=8)
+
+        source = fetch_video({"location": str(path), "stride": 2})
+        assert fetch_video({"location": str(path), "stride": 2}) is source
+        assert fetch_video(str(path)) is not source
+
+        with patch.object(VideoSource, "as_list", wraps=source.as_list) as as_list:
+            first = {"video": source}
+            second = {"video": source}
+            decode_video_sources(first)
+            decode_video_sources(second)
+
+        as_list.assert_called_once()
+        assert len(first["video"]) == 3
+        assert first["video"] is not second["video"]
+        assert first["video"][0] is second["video"][0]
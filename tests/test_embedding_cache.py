@@ -0,0 +1,206 @@
+"""Tests for the prompt embedding cache.
+
+A stand-in pipeline counts how often its encoder runs, so which calls reuse an
+encoding and which encode again is checked without a text encoder.
+"""
+
+from unittest.mock import MagicMock
+
+import pytest
+import torch
+
+from dw.pipeline_processors import embedding_cache
+from dw.pipeline_processors.embedding_cache import (
+    EmbeddingCache,
+    cached_encoding,
+    embedding_cache_context,
+    encoder_identity,
+    freeze,
+    Uncacheable,
+)
+from dw.pipeline_processors.lora import activate_loras
+
+
+class FakePipeline:
+    """Encodes a prompt into a tensor of its length, counting encodes."""
+
+    def __init__(self):
+        self.text_encoder = torch.nn.Linear(1, 1)
+        self.encodes = 0
+
+    def encode_prompt(
+        self, prompt, negative_prompt=None, device=None, prompt_embeds=None
+    ):
+        self.encodes += 1
+        return torch.full((1, 4), float(len(prompt))), torch.zeros(1, 4)
+
+    def __call__(self, prompt, negative_prompt=None, prompt_embeds=None):
+        return self.encode_prompt(
+            prompt,
+            negative_prompt,
+            device=torch.device("cpu"),
+            prompt_embeds=prompt_embeds,
+        )
+
+
+def run(pipeline, **arguments):
+    with embedding_cache_context(pipeline):
+        return pipeline(**arguments)
+
+
+class TestEmbeddingCache:
+    def test_the_least_recently_used_entry_makes_room(self):
+        cache = EmbeddingCache(max_bytes=32)
+        cache.put("a", torch.zeros(4))  # 16 bytes
+        cache.put("b", torch.zeros(4))
+        cache.get("a")
+
+        cache.put("c", torch.zeros(4))
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None and cache.get("c") is not None
+        assert cache.stats()["evictions"] == 1
+
+    def test_an_entry_larger_than_the_cap_is_not_kept(self):
+        cache = EmbeddingCache(max_bytes=8)
+
+        cache.put("a", torch.zeros(4))
+
+        assert cache.stats()["entries"] == 0
+
+    def test_a_cap_of_zero_always_computes(self):
+        cache = EmbeddingCache(max_bytes=0)
+        compute = MagicMock(return_value=torch.zeros(1))
+
+        cache.encode("a", compute)
+        cache.encode("a", compute)
+
+        assert compute.call_count == 2
+
+    def test_stats_report_the_hit_rate(self):
+        cache = EmbeddingCache()
+        for _ in range(4):
+            cache.encode("a", lambda: torch.zeros(4))
+
+        stats = cache.stats()
+
+        assert (stats["hits"], stats["misses"]) == (3, 1)
+        assert stats["hit_rate"] == 0.75
+        assert stats["cached_bytes"] == 16
+
+
+class TestFreeze:
+    def test_values_are_compared_by_value(self):
+        assert freeze({"prompt": ["a", "b"], "device": torch.device("cpu")}) == freeze(
+            {"device": torch.device("cpu"), "prompt": ["a", "b"]}
+        )
+
+    def test_a_tensor_cannot_be_compared(self):
+        with pytest.raises(Uncacheable):
+            freeze({"prompt_embeds": torch.zeros(1)})
+
+
+class TestEncodePromptCaching:
+    def test_a_repeated_prompt_is_encoded_once(self):
+        pipeline = FakePipeline()
+
+        first = run(pipeline, prompt="a marmot")
+        second = run(pipeline, prompt="a marmot")
+
+        assert pipeline.encodes == 1
+        assert second[0] is first[0]
+
+    def test_a_different_prompt_or_negative_prompt_is_encoded(self):
+        pipeline = FakePipeline()
+
+        run(pipeline, prompt="a marmot")
+        run(pipeline, prompt="a beaver")
+        run(pipeline, prompt="a marmot", negative_prompt="blurry")
+
+        assert pipeline.encodes == 3
+
+    def test_a_new_text_encoder_does_not_see_the_old_embeddings(self):
+        pipeline = FakePipeline()
+        run(pipeline, prompt="a marmot")
+
+        pipeline.text_encoder = torch.nn.Linear(1, 1)
+        run(pipeline, prompt="a marmot")
+
+        assert pipeline.encodes == 2
+
+    def test_switching_loras_encodes_again(self):
+        pipeline = FakePipeline()
+        for name in ("load_lora_weights", "set_adapters"):
+            setattr(pipeline, name, MagicMock())
+        run(pipeline, prompt="a marmot")
+
+        activate_loras(pipeline, [{"model_name": "some/lora"}])
+        run(pipeline, prompt="a marmot")
+
+        assert pipeline.encodes == 2
+
+    def test_embeddings_passed_in_are_not_cached(self):
+        pipeline = FakePipeline()
+
+        run(pipeline, prompt="a marmot", prompt_embeds=torch.zeros(1))
+        run(pipeline, prompt="a marmot", prompt_embeds=torch.zeros(1))
+
+        assert pipeline.encodes == 2
+
+    def test_the_method_is_restored_after_the_call(self):
+        pipeline = FakePipeline()
+
+        run(pipeline, prompt="a marmot")
+
+        assert "encode_prompt" not in vars(pipeline)
+
+    def test_a_disabled_context_encodes_every_call(self):
+        pipeline = FakePipeline()
+
+        for _ in range(2):
+            with embedding_cache_context(pipeline, enabled=False):
+                pipeline(prompt="a marmot")
+
+        assert pipeline.encodes == 2
+
+    def test_the_size_setting_caps_the_cache(self, monkeypatch):
+        monkeypatch.setattr(embedding_cache.settings, "embedding_cache_size", "0")
+        pipeline = FakePipeline()
+
+        run(pipeline, prompt="a marmot")
+        run(pipeline, prompt="a marmot")
+
+        assert pipeline.encodes == 2
+
+
+class TestCachedEncoding:
+    def test_weighted_and_remote_encodings_are_reused(self):
+        compute = MagicMock(return_value=torch.zeros(2))
+        identity = encoder_identity(FakePipeline())
+
+        cached_encoding(identity, ("prompt_weighting", "a (marmot:1.2)"), compute)
+        cached_encoding(identity, ("prompt_weighting", "a (marmot:1.2)"), compute)
+
+        assert compute.call_count == 1
+
+    def test_run_once_reuses_a_remote_encoding(self, monkeypatch):
+        from dw.pipeline_processors import pipeline as pipeline_module
+
+        remote = MagicMock(return_value=torch.zeros(2))
+        monkeypatch.setattr(pipeline_module, "remote_text_encoder", remote)
+        wrapper = pipeline_module.Pipeline(
+            {
+                "configuration": {"component_type": "FluxPipeline"},
+                "remote_text_encoder": {"url": "http://encoder"},
+            },
+            42,
+            "cpu",
+            pipeline=MagicMock(),
+        )
+        monkeypatch.setattr(wrapper, "_execute_pipeline", lambda arguments: arguments)
+
+        for _ in range(2):
+            arguments = wrapper._run_once({"prompt": "a marmot"})
+
+        assert remote.call_count == 1
+        assert "prompt" not in arguments and "prompt_embeds" in arguments
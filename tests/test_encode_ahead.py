@@ -0,0 +1,216 @@
+"""Tests for encoding a step's prompts ahead and releasing its text encoders.
+
+A small torch pipeline stands in for a diffusers one: it encodes its prompt, draws
+noise from the generator and runs its transformer, so the order of those matters here
+the way it does in a real pipeline.
+"""
+
+import pytest
+import torch
+from PIL import Image
+
+from dw.lazy_image import LazyImage
+from dw.pipeline_processors.encode_ahead import (
+    chain_prompt_arguments,
+    encode_ahead_options,
+)
+from dw.pipeline_processors.pipeline import Pipeline
+from dw.step import Step
+
+
+class FakePipeline:
+    def __init__(self, denoiser=True):
+        self.text_encoder = torch.nn.Linear(1, 1)
+        self.transformer = torch.nn.Identity() if denoiser else None
+        self.encoded = []
+        self.encoders_seen = []
+
+    def encode_prompt(self, prompt, device=None):
+        self.encoded.append(prompt)
+        return torch.full((1, 2), float(len(prompt)))
+
+    def __call__(self, prompt, generator=None, num_inference_steps=2):
+        embeds = self.encode_prompt(prompt)
+        latents = torch.randn(1, 2, generator=generator)
+        if self.transformer is not None:
+            for _ in range(num_inference_steps):
+                latents = self.transformer(latents + embeds)
+        # Only a call that ran to completion records the encoder it denoised beside
+        self.encoders_seen.append(self.text_encoder)
+        return latents
+
+
+class ImagePipeline(FakePipeline):
+    """Checks its image before encoding, as a diffusers image processor does."""
+
+    def __call__(self, prompt, image, generator=None, num_inference_steps=2):
+        if not isinstance(image, Image.Image):
+            raise ValueError(f"image must be a PIL image, not {type(image).__name__}")
+        return super().__call__(prompt, generator, num_inference_steps)
+
+
+class VideoPipeline(FakePipeline):
+    """Checks its video is a frame list before encoding, as diffusers does."""
+
+    def __call__(self, prompt, video, generator=None, num_inference_steps=2):
+        if not isinstance(video, list):
+            raise ValueError(f"video must be a list of frames, not {type(video)}")
+        return super().__call__(prompt, generator, num_inference_steps)
+
+
+def wrapper(pipeline, **configuration):
+    return Pipeline(
+        {
+            "configuration": {"component_type": "FakePipeline", **configuration},
+            "arguments": {},
+        },
+        42,
+        "cpu",
+        pipeline=pipeline,
+    )
+
+
+def iterations(*prompts, seed=7):
+    return [
+        {"prompt": prompt, "generator": torch.Generator().manual_seed(seed)}
+        for prompt in prompts
+    ]
+
+
+def run_step(pipeline_wrapper, calls):
+    with pipeline_wrapper.encode_ahead(calls):
+        return [pipeline_wrapper.run(arguments) for arguments in calls]
+
+
+class TestOptions:
+    @pytest.mark.parametrize(
+        "value, expected",
+        [
+            (False, None),
+            (True, "offload"),
+            ({}, "offload"),
+            ({"release": "delete"}, "delete"),
+        ],
+    )
+    def test_release_modes(self, value, expected):
+        assert encode_ahead_options({"encode_ahead": value}) == expected
+
+    def test_rejects_an_unknown_release(self):
+        with pytest.raises(ValueError, match="release must be one of"):
+            encode_ahead_options({"encode_ahead": {"release": "forget"}})
+
+    def test_chain_segments_contribute_each_distinct_prompt(self):
+        calls = chain_prompt_arguments(
+            {"prompt": "base", "num_frames": 9}, ["open", "continue", "continue"]
+        )
+
+        assert calls == [
+            {"prompt": "open", "num_frames": 9},
+            {"prompt": "continue", "num_frames": 9},
+        ]
+
+
+class TestEncodeAhead:
+    def test_prompts_are_encoded_before_any_denoising(self):
+        pipeline = FakePipeline()
+
+        run_step(wrapper(pipeline, encode_ahead=True), iterations("a", "bb", "a"))
+
+        assert pipeline.encoded == ["a", "bb"]
+        assert pipeline.encoders_seen == [None, None, None]
+
+    def test_the_encoder_is_back_in_place_when_the_step_ends(self):
+        pipeline = FakePipeline()
+        encoder = pipeline.text_encoder
+
+        run_step(wrapper(pipeline, encode_ahead=True), iterations("a"))
+
+        assert pipeline.text_encoder is encoder
+
+    def test_seeds_make_the_same_output_as_without_it(self):
+        ahead = run_step(
+            wrapper(FakePipeline(), encode_ahead=True), iterations("a", "bb")
+        )
+        plain = run_step(wrapper(FakePipeline()), iterations("a", "bb"))
+
+        assert all(torch.equal(a, b) for a, b in zip(ahead, plain))
+
+    def test_a_prompt_not_encoded_ahead_brings_the_encoder_back(self):
+        pipeline = FakePipeline()
+        encoder = pipeline.text_encoder
+        step = wrapper(pipeline, encode_ahead=True)
+
+        with step.encode_ahead(iterations("a")):
+            step.run(iterations("something else")[0])
+
+        assert pipeline.encoders_seen == [encoder]
+
+    def test_delete_cannot_encode_a_new_prompt(self):
+        pipeline = FakePipeline()
+        step = wrapper(pipeline, encode_ahead={"release": "delete"})
+
+        with step.encode_ahead(iterations("a")):
+            step.run(iterations("a")[0])
+            with pytest.raises(ValueError, match="deleted it"):
+                step.run(iterations("something else")[0])
+
+        assert pipeline.text_encoder is None
+
+    def test_without_a_denoiser_the_step_runs_as_usual(self):
+        pipeline = FakePipeline(denoiser=False)
+        encoder = pipeline.text_encoder
+
+        run_step(wrapper(pipeline, encode_ahead=True), iterations("a"))
+
+        assert pipeline.encoders_seen == [encoder]
+
+    def test_gathered_images_are_decoded_for_the_encoding_call(self, tmp_path):
+        path = tmp_path / "reference.png"
+        Image.new("RGB", (8, 8)).save(path)
+        pipeline = ImagePipeline()
+        calls = iterations("a")
+        calls[0]["image"] = LazyImage(str(path))
+
+        with wrapper(pipeline, encode_ahead=True).encode_ahead(calls):
+            assert pipeline.encoded == ["a"]
+            assert pipeline.text_encoder is None
+        assert isinstance(calls[0]["image"], LazyImage)
+
+    def test_input_videos_are_decoded_for_the_encoding_call(self, tmp_path):
+        pytest.importorskip("av")
+        from dw.video_source import VideoSource
+        from dw.video_writer import write_video
+
+        path = tmp_path / "clip.mp4"
+        write_video([Image.new("RGB", (16, 16))] * 4, path, fps=8)
+        pipeline = VideoPipeline()
+        calls = iterations("a")
+        calls[0]["video"] = VideoSource(str(path))
+
+        with wrapper(pipeline, encode_ahead=True).encode_ahead(calls):
+            assert pipeline.encoded == ["a"]
+            assert pipeline.text_encoder is None
+        assert isinstance(calls[0]["video"], VideoSource)
+
+    def test_without_the_option_nothing_is_encoded_ahead(self):
+        pipeline = FakePipeline()
+        step = wrapper(pipeline)
+
+        with step.encode_ahead(iterations("a")):
+            assert pipeline.encoded == []
+
+
+class TestStep:
+    def test_step_run_encodes_before_its_iterations(self):
+        pipeline = FakePipeline()
+        step_action = wrapper(pipeline, encode_ahead=True)
+        step_action.pipeline_definition["arguments"] = {
+            "prompt": "a",
+            "num_inference_steps": 1,
+        }
+        step = Step({"name": "main", "pipeline": {}}, 42)
+
+        step.run({}, {}, step_action)
+
+        assert pipeline.encoded == ["a"]
+        assert pipeline.encoders_seen == [None]
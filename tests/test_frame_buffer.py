@@ -0,0 +1,143 @@
+"""
+Unit tests for FrameBuffer - video frames as one uint8 array - and the video
+paths that take it in place of a frame list.
+"""
+
+import numpy
+import pytest
+import torch
+from PIL import Image
+
+from dw.frame_buffer import FrameBuffer
+from dw.pipeline_processors.chain import run_chain
+from dw.result import AudioVideo
+from dw.tasks.concat_videos import concat_videos
+from dw.tasks.video_utils import (
+    extract_frame,
+    frames_as_array,
+    frames_as_buffer,
+    frames_as_pil_list,
+)
+
+
+def pil_frames(count, size=8):
+    return [Image.new("RGB", (size, size), (i * 10, 0, 0)) for i in range(count)]
+
+
+def buffer(count=6, size=8):
+    array = numpy.zeros((count, size, size, 3), dtype=numpy.uint8)
+    array[:, 0, 0, 0] = numpy.arange(count) * 10
+    return FrameBuffer(array)
+
+
+class TestFrameBuffer:
+    def test_indexing_makes_a_pil_frame(self):
+        frame = buffer()[2]
+
+        assert isinstance(frame, Image.Image)
+        assert frame.getpixel((0, 0)) == (20, 0, 0)
+
+    def test_slices_share_the_array(self):
+        frames = buffer()
+
+        tail = frames[2:]
+
+        assert isinstance(tail, FrameBuffer)
+        assert len(tail) == 4
+        assert numpy.shares_memory(tail.array, frames.array)
+
+    def test_array_tensor_and_dlpack_export_are_the_same_memory(self):
+        frames = buffer()
+
+        assert numpy.shares_memory(numpy.asarray(frames), frames.array)
+        assert frames.as_tensor().data_ptr() == frames.array.ctypes.data
+        assert torch.from_dlpack(frames).data_ptr() == frames.array.ctypes.data
+
+    def test_only_uint8_rgb_frames(self):
+        with pytest.raises(ValueError, match="uint8"):
+            FrameBuffer(numpy.zeros((2, 4, 4, 3), dtype=numpy.float32))
+
+    def test_from_frames_converts_into_one_allocation(self):
+        images = pil_frames(5)
+
+        frames = FrameBuffer.from_frames(images)
+
+        assert frames.shape == (5, 8, 8, 3)
+        assert frames.capacity == 5
+        assert frames[4].getpixel((0, 0)) == images[4].getpixel((0, 0))
+
+    def test_from_frames_wraps_a_uint8_array(self):
+        array = numpy.zeros((3, 4, 4, 3), dtype=numpy.uint8)
+
+        assert numpy.shares_memory(FrameBuffer.from_frames(array).array, array)
+
+    def test_from_frames_scales_float_tensors(self):
+        frames = FrameBuffer.from_frames(torch.full((2, 3, 8, 6), 0.5))
+
+        assert frames.shape == (2, 8, 6, 3)
+        assert frames.array[0, 0, 0, 0] == 128
+
+    def test_append_grows_past_the_capacity(self):
+        frames = FrameBuffer.allocate(2, 8, 8)
+
+        array = frames_as_array(pil_frames(3))
+
+        frames.append(array)
+
+        assert len(frames) == 3
+        assert frames.capacity >= 3
+        assert numpy.array_equal(frames.array, array)
+
+    def test_append_rejects_another_frame_size(self):
+        frames = FrameBuffer.allocate(2, 8, 8)
+
+        with pytest.raises(ValueError, match="cannot join"):
+            frames.append(numpy.zeros((1, 4, 4, 3), dtype=numpy.uint8))
+
+    def test_a_memory_mapped_buffer_round_trips(self, tmp_path):
+        path = tmp_path / "frames.npy"
+        frames = FrameBuffer.allocate(4, 8, 8, path=path)
+        frames.append(frames_as_array(pil_frames(4)))
+        frames.array.flush()
+
+        opened = FrameBuffer.open(path)
+
+        assert isinstance(opened.array, numpy.memmap)
+        assert opened[3].getpixel((0, 0)) == (30, 0, 0)
+
+    def test_a_memory_mapped_buffer_does_not_grow(self, tmp_path):
+        frames = FrameBuffer.allocate(1, 8, 8, path=tmp_path / "frames.npy")
+
+        with pytest.raises(ValueError, match="memory-mapped"):
+            frames.append(frames_as_array(pil_frames(2)))
+
+
+class TestVideoPathsTakeBuffers:
+    def test_video_utils(self):
+        frames = buffer()
+
+        assert numpy.shares_memory(frames_as_array(frames), frames.array)
+        assert frames_as_buffer(frames) is frames
+        assert extract_frame(AudioVideo(frames, None, None), -1).getpixel((0, 0)) == (
+            50,
+            0,
+            0,
+        )
+        assert len(frames_as_pil_list(frames)) == 6
+
+    def test_concat_videos(self):
+        result = concat_videos([buffer(4), buffer(4)], trim_frames=1)
+
+        assert len(result.frames) == 7
+
+    def test_a_chain_stitches_into_a_buffer(self):
+        class Pipeline:
+            def _run_once(self, arguments):
+                return [pil_frames(4)]
+
+        result = run_chain(Pipeline(), {"segments": 3, "trim_frames": 1}, {})
+
+        assert isinstance(result.frames, FrameBuffer)
+        assert len(result.frames) == 4 + 3 + 3
+        # Allocated once, for the whole chain
+        assert result.frames.capacity == 10
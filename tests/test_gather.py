@@ -8,6 +8,9 @@ import os
 import tempfile
 from unittest.mock import patch, MagicMock
 from PIL import Image
+from dw.lazy_image import LazyImage, load_lazy_images
+from dw.result import Result
+from dw.step import Step
 from dw.tasks.gather import gather_images, gather_videos, gather_inputs
 from dw.security import SecurityError
 
@@ -31,15 +34,18 @@ class TestGatherImages:
             images = gather_images(glob=glob_pattern)
 
             assert len(images) == 2
-            assert all(isinstance(img, Image.Image) for img in images)
+            assert all(isinstance(img, LazyImage) for img in images)
+            assert all(isinstance(img.load(), Image.Image) for img in images)
 
-    @patch("dw.tasks.gather.load_image")
+    @patch("dw.lazy_image.cached_path")
     @patch("dw.tasks.gather.validate_url")
-    def test_gather_images_from_urls(self, mock_validate_url, mock_load_image):
+    def test_gather_images_from_urls(
+        self, mock_validate_url, mock_cached_path, tmp_path
+    ):
         """Test gathering images from URLs"""
         mock_validate_url.side_effect = lambda x: x
-        mock_image = Image.new("RGB", (100, 100))
-        mock_load_image.return_value = mock_image
+        Image.new("RGB", (100, 100)).save(tmp_path / "cached.png")
+        mock_cached_path.return_value = str(tmp_path / "cached.png")
 
         urls = ["https://example.com/img1.jpg", "https://example.com/img2.jpg"]
 
@@ -47,7 +53,10 @@ class TestGatherImages:
 
         assert len(images) == 2
         assert mock_validate_url.call_count == 2
-        assert mock_load_image.call_count == 2
+        assert mock_cached_path.call_count == 0
+
+        assert [image.load().size for image in images] == [(100, 100), (100, 100)]
+        assert sorted(call.args[0] for call in mock_cached_path.call_args_list) == urls
 
     def test_gather_images_mixed_sources(self):
         """Test gathering images from both files and URLs"""
@@ -56,23 +65,25 @@ class TestGatherImages:
             img1 = Image.new("RGB", (50, 50))
             path1 = os.path.join(temp_dir, "local.jpg")
             img1.save(path1)
+            remote = os.path.join(temp_dir, "remote.png")
+            Image.new("RGB", (100, 100)).save(remote)
 
             glob_pattern = os.path.join(temp_dir, "*.jpg")
 
-            with patch("dw.tasks.gather.load_image") as mock_load:
+            with patch("dw.lazy_image.cached_path", return_value=remote):
                 with patch("dw.tasks.gather.validate_url") as mock_validate:
                     mock_validate.return_value = "https://example.com/remote.jpg"
-                    mock_load.side_effect = [
-                        Image.new("RGB", (50, 50)),  # For file
-                        Image.new("RGB", (100, 100)),  # For URL
-                    ]
 
                     images = gather_images(
                         glob=glob_pattern, urls=["https://example.com/remote.jpg"]
                     )
 
-                    # Should have images from both sources
-                    assert len(images) >= 1
+                    # Files first, then URLs
+                    assert [image.location for image in images] == [
+                        os.path.realpath(path1),
+                        "https://example.com/remote.jpg",
+                    ]
+                    assert images[1].load().size == (100, 100)
 
     def test_gather_images_no_results_raises_error(self):
         """Test that gathering no images raises ValueError"""
@@ -139,19 +150,22 @@ class TestGatherImages:
         images = gather_images(glob=glob_pattern)
 
         assert len(images) == 2
-        assert all(isinstance(img, Image.Image) for img in images)
+        assert [img.load().getpixel((0, 0)) for img in images] == [
+            (255, 0, 0),
+            (0, 0, 255),
+        ]
 
 
 class TestGatherVideos:
     """Test video gathering functionality"""
 
-    @patch("dw.tasks.gather.load_video")
+    @patch("dw.tasks.gather.fetch_video")
     @patch("dw.tasks.gather.validate_url")
-    def test_gather_videos_from_urls(self, mock_validate_url, mock_load_video):
+    def test_gather_videos_from_urls(self, mock_validate_url, mock_fetch_video):
         """Test gathering videos from URLs"""
         mock_validate_url.side_effect = lambda x: x
         mock_frames = ["frame1", "frame2"]
-        mock_load_video.return_value = mock_frames
+        mock_fetch_video.return_value = mock_frames
 
         urls = ["https://example.com/video.mp4"]
         videos = gather_videos(urls=urls)
@@ -159,6 +173,7 @@ class TestGatherVideos:
         assert len(videos) == 1
         assert videos[0] == mock_frames
         mock_validate_url.assert_called_once()
+        mock_fetch_video.assert_called_once_with({"location": urls[0]})
 
     def test_gather_videos_no_results_raises_error(self):
         """Test that gathering no videos raises ValueError"""
@@ -193,6 +208,25 @@ class TestGatherVideos:
         with pytest.raises(SecurityError):
             gather_videos(glob=glob_pattern)
 
+    def test_gather_videos_opens_files_sorted_and_capped(self, tmp_path):
+        """Video files open lazily, in sorted order, up to max_count."""
+        pytest.importorskip("av")
+        from dw.video_source import VideoSource
+        from dw.video_writer import write_video
+
+        for name, count in (("c", 4), ("a", 2), ("b", 3)):
+            write_video(
+                [Image.new("RGB", (64, 32))] * count, tmp_path / f"{name}.mp4", fps=8
+            )
+
+        videos = gather_videos(
+            glob=os.path.join(str(tmp_path), "*.mp4"), max_count=2, max_size=32
+        )
+
+        assert all(isinstance(video, VideoSource) for video in videos)
+        assert [len(video) for video in videos] == [2, 3]
+        assert videos[0].size == (32, 16)
+
     def test_gather_videos_traversal_glob_raises(self, tmp_path):
         """A glob pattern that walks outside its own directory via '..' must be
         rejected, not silently followed to read the target file."""
@@ -208,6 +242,112 @@ class TestGatherVideos:
             gather_videos(glob=traversal_pattern)
 
 
+class TestLazyGathering:
+    """Gathered images are decoded as steps use them, a few ahead"""
+
+    @pytest.fixture
+    def folder(self, tmp_path):
+        for index in (3, 1, 0, 2):
+            Image.new("RGB", (64, 32), (index * 60, 0, 0)).save(
+                tmp_path / f"frame-{index}.png"
+            )
+        return os.path.join(str(tmp_path), "*.png")
+
+    def test_matches_are_sorted(self, folder):
+        images = gather_images(glob=folder)
+
+        assert [os.path.basename(image.location) for image in images] == [
+            f"frame-{index}.png" for index in range(4)
+        ]
+
+    def test_max_count_keeps_the_first_matches(self, folder):
+        images = gather_images(glob=folder, max_count=2)
+
+        assert [image.load().getpixel((0, 0))[0] for image in images] == [0, 60]
+
+    def test_max_count_must_be_positive(self, folder):
+        with pytest.raises(ValueError, match="max_count"):
+            gather_images(glob=folder, max_count=0)
+
+    def test_max_size_scales_down_as_it_loads(self, folder):
+        (image,) = gather_images(glob=folder, max_count=1, max_size=16)
+
+        assert image.load().size == (16, 8)
+
+    def test_nothing_decodes_until_an_image_is_loaded(self, folder):
+        with patch("dw.lazy_image.load_image") as mock_load:
+            gather_images(glob=folder)
+
+        mock_load.assert_not_called()
+
+    def test_loading_an_image_decodes_the_next_ahead(self, folder):
+        images = gather_images(glob=folder, prefetch=2)
+        prefetcher = images[0].prefetcher
+
+        images[0].load()
+
+        assert sorted(prefetcher.pending) == [1, 2]
+        assert images[1].load().getpixel((0, 0))[0] == 60
+        assert sorted(prefetcher.pending) == [2, 3]
+
+    def test_the_pool_closes_once_the_last_image_is_handed_over(self, folder):
+        images = gather_images(glob=folder, prefetch=2)
+        prefetcher = images[0].prefetcher
+        images[0].load()
+        pool = prefetcher.pool
+
+        assert images[3].load().getpixel((0, 0))[0] == 180
+        assert prefetcher.pending == {}
+        assert prefetcher.pool is None
+        assert pool._shutdown
+        # Loaded again, as a later run of a cached result would
+        assert images[1].load().getpixel((0, 0))[0] == 60
+
+    def test_without_prefetch_only_the_loaded_image_decodes(self, folder):
+        images = gather_images(glob=folder, prefetch=0)
+
+        images[0].load()
+
+        assert images[0].prefetcher.pending == {}
+
+    def test_arguments_are_loaded_into_new_containers(self, folder):
+        image = gather_images(glob=folder, max_count=1)[0]
+        template = {"prompt": "a", "images": [image], "nested": {"image": image}}
+
+        arguments = load_lazy_images(template)
+
+        assert isinstance(arguments["images"][0], Image.Image)
+        assert isinstance(arguments["nested"]["image"], Image.Image)
+        assert template["images"][0] is image
+        assert template["nested"]["image"] is image
+
+    def test_a_step_is_handed_decoded_images(self, folder):
+        gathered = Result({})
+        gathered.add_result(gather_images(glob=folder))
+        received = []
+
+        class Action:
+            name = "consume"
+            argument_template = {"image": "previous_result:gather"}
+
+            def run(self, arguments, previous_pipelines):
+                received.append(arguments["image"])
+                return arguments["image"]
+
+        Step({"name": "use"}, 0).run({"gather": gathered}, {}, Action())
+
+        assert len(received) == 4
+        assert all(isinstance(image, Image.Image) for image in received)
+
+    def test_a_gathered_image_is_saved_as_its_image(self, folder, tmp_path):
+        result = Result({"content_type": "image/png"})
+        result.add_result(gather_images(glob=folder, max_count=1))
+
+        result.save(str(tmp_path), "out")
+
+        assert Image.open(tmp_path / "out-0.0.png").size == (64, 32)
+
+
 class TestGatherInputs:
     """Test input gathering functionality"""
 
@@ -63,6 +63,29 @@ class TestInterpolateFrames:
         assert len(result) == 13
         assert all(isinstance(f, Image.Image) for f in result)
 
+    @patch("dw.tasks.interpolate_frames._load_rife_model")
+    def test_stream_interpolates_as_the_frames_are_taken(self, mock_load):
+        """stream returns the same frames, generated only when iterated."""
+        from dw.tasks.interpolate_frames import interpolate_frames
+        from dw.video_writer import FrameStream
+
+        calls = []
+
+        def fake_inference(img1, img2):
+            calls.append((img1, img2))
+            return img1
+
+        mock_load.return_value = fake_inference
+
+        frames = _make_test_frames(4)
+        stream = interpolate_frames(frames, multiplier=4, stream=True)
+
+        assert isinstance(stream, FrameStream)
+        assert len(stream) == 13
+        assert calls == []
+        assert sum(len(chunk) for chunk in stream) == 13
+        assert stream.as_list() == interpolate_frames(frames, multiplier=4)
+
     def test_invalid_multiplier_raises(self):
         """multiplier must be 2, 4, or 8."""
         from dw.tasks.interpolate_frames import interpolate_frames
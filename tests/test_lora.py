@@ -0,0 +1,259 @@
+"""Tests for switching LoRAs on a loaded pipeline.
+
+A stand-in pipeline records the adapter calls diffusers would see, so what a run
+loads, switches and deletes is checked without loading anything.
+"""
+
+from unittest.mock import MagicMock
+
+from dw.pipeline_processors.lora import (
+    activate_loras,
+    lora_adapters,
+    lora_key,
+    without_loras,
+)
+from dw.pipeline_processors.pipeline import Pipeline
+from dw.workflow import Workflow
+
+
+class FakePipeline:
+    """Records the adapter calls made on it."""
+
+    def __init__(self):
+        self.calls = []
+        self.adapters = set()
+
+    def load_lora_weights(self, model_name, adapter_name, hotswap=False, **kwargs):
+        self.calls.append(("load", model_name, adapter_name, hotswap))
+        self.adapters.add(adapter_name)
+
+    def set_adapters(self, names, adapter_weights):
+        self.calls.append(("set", list(names), list(adapter_weights)))
+
+    def delete_adapters(self, names):
+        self.calls.append(("delete", list(names)))
+        self.adapters.difference_update(names)
+
+    def disable_lora(self):
+        self.calls.append(("disable",))
+
+    def enable_lora(self):
+        self.calls.append(("enable",))
+
+    def fuse_lora(self, adapter_names):
+        self.calls.append(("fuse", list(adapter_names)))
+
+    def unfuse_lora(self):
+        self.calls.append(("unfuse",))
+
+    def loads(self):
+        return [call[1] for call in self.calls if call[0] == "load"]
+
+
+def lora(model_name, **properties):
+    return {"model_name": model_name, **properties}
+
+
+class TestLoraKey:
+    def test_scale_and_name_do_not_change_the_key(self):
+        assert lora_key(lora("a/lora")) == lora_key(
+            lora("a/lora", scale=0.5, adapter_name="mine")
+        )
+
+    def test_the_weight_file_does(self):
+        assert lora_key(lora("a/lora", weight_name="one.safetensors")) != lora_key(
+            lora("a/lora", weight_name="two.safetensors")
+        )
+
+
+class TestActivate:
+    def test_a_lora_sweep_loads_each_adapter_once(self):
+        pipeline = FakePipeline()
+
+        for model_name in ["a/lora", "b/lora", "a/lora", "b/lora"]:
+            activate_loras(pipeline, [lora(model_name)])
+
+        assert pipeline.loads() == ["a/lora", "b/lora"]
+        assert lora_adapters(pipeline).stats()["hits"] == 2
+
+    def test_only_the_requested_adapters_are_active(self):
+        pipeline = FakePipeline()
+        activate_loras(pipeline, [lora("a/lora")])
+        activate_loras(pipeline, [lora("b/lora", scale=0.5)])
+
+        names, weights = pipeline.calls[-1][1:]
+        assert len(names) == 1 and weights == [0.5]
+        assert names[0] == lora_adapters(pipeline).loaded[lora_key(lora("b/lora"))]
+
+    def test_a_new_scale_is_applied_without_a_load(self):
+        pipeline = FakePipeline()
+        activate_loras(pipeline, [lora("a/lora", scale=1.0)])
+        activate_loras(pipeline, [lora("a/lora", scale="0.3")])
+
+        assert pipeline.loads() == ["a/lora"]
+        assert pipeline.calls[-1][2] == [0.3]
+
+    def test_an_unchanged_request_makes_no_calls(self):
+        pipeline = FakePipeline()
+        activate_loras(pipeline, [lora("a/lora")])
+        calls = len(pipeline.calls)
+
+        activate_loras(pipeline, [lora("a/lora")])
+
+        assert len(pipeline.calls) == calls
+
+    def test_the_definitions_are_not_modified(self):
+        pipeline = FakePipeline()
+        loras = [lora("a/lora", scale=0.5, adapter_name="mine")]
+
+        activate_loras(pipeline, loras)
+
+        assert loras == [lora("a/lora", scale=0.5, adapter_name="mine")]
+
+    def test_the_least_recently_used_adapter_is_deleted(self):
+        pipeline = FakePipeline()
+        options = {"max_adapters": 2}
+        for model_name in ["a/lora", "b/lora", "a/lora", "c/lora"]:
+            activate_loras(pipeline, [lora(model_name)], options)
+
+        deleted = [call for call in pipeline.calls if call[0] == "delete"]
+        assert len(deleted) == 1
+        assert set(lora_adapters(pipeline).loaded) == {
+            lora_key(lora("a/lora")),
+            lora_key(lora("c/lora")),
+        }
+
+    def test_requested_adapters_are_kept_beyond_the_cap(self):
+        pipeline = FakePipeline()
+
+        activate_loras(pipeline, [lora("a/lora"), lora("b/lora")], {"max_adapters": 1})
+
+        assert not [call for call in pipeline.calls if call[0] == "delete"]
+
+    def test_an_adapter_name_taken_by_another_lora_is_freed_first(self):
+        pipeline = FakePipeline()
+        activate_loras(pipeline, [lora("a/lora", adapter_name="style")])
+        activate_loras(pipeline, [lora("b/lora", adapter_name="style")])
+
+        assert ("delete", ["style"]) in pipeline.calls
+        assert pipeline.calls[-2] == ("load", "b/lora", "style", False)
+
+    def test_no_loras_disables_them_until_some_are_asked_for(self):
+        pipeline = FakePipeline()
+        activate_loras(pipeline, [lora("a/lora")])
+
+        activate_loras(pipeline, [])
+        activate_loras(pipeline, [lora("a/lora")])
+
+        assert [call[0] for call in pipeline.calls] == [
+            "load",
+            "set",
+            "disable",
+            "enable",
+            "set",
+        ]
+
+    def test_a_pipeline_that_never_had_loras_is_left_alone(self):
+        pipeline = MagicMock()
+
+        activate_loras(pipeline, [])
+
+        assert not pipeline.method_calls
+
+
+class TestHotswapAndFuse:
+    def test_a_full_cache_hotswaps_into_the_least_recently_used_adapter(self):
+        pipeline = FakePipeline()
+        options = {"max_adapters": 1, "hotswap": True}
+        activate_loras(pipeline, [lora("a/lora")], options)
+        first_name = pipeline.calls[0][2]
+
+        activate_loras(pipeline, [lora("b/lora")], options)
+
+        assert ("load", "b/lora", first_name, True) in pipeline.calls
+        assert not [call for call in pipeline.calls if call[0] == "delete"]
+
+    def test_target_rank_is_enabled_before_the_first_load(self):
+        pipeline = FakePipeline()
+        pipeline.enable_lora_hotswap = MagicMock(
+            side_effect=lambda target_rank: pipeline.calls.append(("enable_hotswap",))
+        )
+
+        activate_loras(pipeline, [lora("a/lora")], {"hotswap": True, "target_rank": 64})
+
+        pipeline.enable_lora_hotswap.assert_called_once_with(target_rank=64)
+        assert pipeline.calls[0] == ("enable_hotswap",)
+
+    def test_fused_adapters_are_unfused_before_a_switch(self):
+        pipeline = FakePipeline()
+        activate_loras(pipeline, [lora("a/lora")], {"fuse": True})
+        activate_loras(pipeline, [lora("a/lora")], {"fuse": True})
+        activate_loras(pipeline, [lora("b/lora")], {"fuse": True})
+
+        operations = [call[0] for call in pipeline.calls]
+        assert operations.count("fuse") == 2
+        assert operations.index("unfuse") < operations.index("load", 1)
+
+
+class TestWithoutLoras:
+    def test_only_loras_are_dropped(self):
+        definition = {
+            "steps": [{"pipeline": {"loras": [lora("a/lora")], "arguments": {}}}]
+        }
+
+        assert without_loras(definition) == {"steps": [{"pipeline": {"arguments": {}}}]}
+
+
+class TestCachedPipelines:
+    def workflow(self, lora_name):
+        return Workflow(
+            {
+                "id": "sweep",
+                "steps": [
+                    {
+                        "name": "main",
+                        "pipeline": {
+                            "configuration": {
+                                "component_type": "FluxPipeline",
+                                "no_generator": True,
+                            },
+                            "from_pretrained_arguments": {"model_name": "base/model"},
+                            "loras": [lora(lora_name)],
+                            "arguments": {},
+                        },
+                    }
+                ],
+            },
+            "/tmp",
+            None,
+        )
+
+    def test_a_cached_pipeline_switches_to_the_runs_loras(self):
+        pipeline = FakePipeline()
+        cached = MagicMock()
+        cached.pipeline = pipeline
+        cached.shared_component_names.return_value = []
+        workflow = self.workflow("b/lora")
+        step = workflow.workflow_definition["steps"][0]
+
+        workflow.create_step_action(step, {}, {"main": cached}, 42, "cpu")
+
+        assert pipeline.loads() == ["b/lora"]
+
+    def test_a_cached_pipeline_sharing_components_is_loaded_again(self, monkeypatch):
+        pipeline = FakePipeline()
+        cached = MagicMock()
+        cached.pipeline = pipeline
+        cached.shared_component_names.return_value = ["text_encoder"]
+        loaded = []
+        monkeypatch.setattr(Pipeline, "load", lambda self, shared: loaded.append(self))
+        workflow = self.workflow("b/lora")
+        step = workflow.workflow_definition["steps"][0]
+        pipelines = {"main": cached}
+
+        action = workflow.create_step_action(step, {}, pipelines, 42, "cpu")
+
+        assert loaded == [action]
+        assert pipelines["main"] is action
+        # Nothing was loaded into the components the other steps hold
+        assert pipeline.loads() == []
@@ -0,0 +1,218 @@
+"""Tests for the on-disk media cache.
+
+A local stand-in server serves files with an ETag or a Last-Modified date, answers
+conditional requests with 304 and records every request, so downloads and
+revalidations are checked over real HTTP.
+"""
+
+import io
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy
+import pytest
+import soundfile
+from PIL import Image
+
+from dw.arguments import fetch_image, fetch_video
+from dw.media_cache import MediaCache, get_media_cache
+from dw.tasks.audio_utils import load_audio
+
+LAST_MODIFIED = "Mon, 05 Oct 2026 10:00:00 GMT"
+
+
+class Server:
+    def __init__(self):
+        # path -> (body, etag or None)
+        self.files = {}
+        self.requests = []
+        self.not_modified = 0
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.path)
+                if self.path not in server.files:
+                    self.send_error(404)
+                    return
+                body, etag = server.files[self.path]
+                if (etag and self.headers.get("If-None-Match") == etag) or (
+                    not etag and self.headers.get("If-Modified-Since") == LAST_MODIFIED
+                ):
+                    server.not_modified += 1
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                if etag:
+                    self.send_header("ETag", etag)
+                else:
+                    self.send_header("Last-Modified", LAST_MODIFIED)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def server():
+    stand_in = Server()
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), stand_in.handler())
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    stand_in.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    stand_in.stop = lambda: (httpd.shutdown(), httpd.server_close())
+    yield stand_in
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return MediaCache(tmp_path / "cache", retries=0)
+
+
+def png_bytes(size=(8, 8), color=(255, 0, 0)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TestRevalidation:
+    def test_a_url_is_downloaded_once_then_revalidated(self, server, cache):
+        server.files["/a.png"] = (b"first", '"v1"')
+
+        path = cache.fetch(f"{server.url}/a.png")
+        again = cache.fetch(f"{server.url}/a.png")
+
+        assert path == again
+        assert path.endswith(".png")
+        assert open(path, "rb").read() == b"first"
+        assert (cache.downloads, cache.revalidations) == (1, 1)
+        assert server.not_modified == 1
+
+    def test_last_modified_revalidates_without_an_etag(self, server, cache):
+        server.files["/a.png"] = (b"first", None)
+
+        cache.fetch(f"{server.url}/a.png")
+        cache.fetch(f"{server.url}/a.png")
+
+        assert server.not_modified == 1
+
+    def test_a_changed_file_is_downloaded_again(self, server, cache):
+        server.files["/a.png"] = (b"first", '"v1"')
+        cache.fetch(f"{server.url}/a.png")
+        server.files["/a.png"] = (b"second", '"v2"')
+
+        path = cache.fetch(f"{server.url}/a.png")
+
+        assert open(path, "rb").read() == b"second"
+        assert cache.downloads == 2
+
+    def test_an_error_response_raises_and_caches_nothing(self, server, cache):
+        with pytest.raises(Exception, match="404"):
+            cache.fetch(f"{server.url}/missing.png")
+
+        assert list(cache.directory.iterdir()) == []
+
+    def test_an_unreachable_server_serves_the_cached_copy(self, server, cache, caplog):
+        server.files["/a.png"] = (b"first", '"v1"')
+        url = f"{server.url}/a.png"
+        cache.fetch(url)
+        server.stop()
+
+        with caplog.at_level(logging.WARNING, logger="dw"):
+            path = cache.fetch(url)
+
+        assert open(path, "rb").read() == b"first"
+        assert "using the cached copy" in caplog.text
+
+
+class TestOffline:
+    def test_a_cached_url_is_served_without_a_request(self, server, tmp_path):
+        server.files["/a.png"] = (b"first", '"v1"')
+        url = f"{server.url}/a.png"
+        MediaCache(tmp_path / "cache").fetch(url)
+        offline = MediaCache(tmp_path / "cache", offline=True)
+
+        path = offline.fetch(url)
+
+        assert open(path, "rb").read() == b"first"
+        assert server.requests == ["/a.png"]
+
+    def test_an_uncached_url_raises(self, server, tmp_path):
+        offline = MediaCache(tmp_path / "cache", offline=True)
+
+        with pytest.raises(ValueError, match="offline"):
+            offline.fetch(f"{server.url}/a.png")
+        assert server.requests == []
+
+    def test_the_environment_turns_offline_mode_on(self, monkeypatch):
+        monkeypatch.setenv("DW_OFFLINE", "1")
+
+        assert get_media_cache().offline
+
+
+class TestEviction:
+    def test_the_least_recently_used_file_is_evicted(self, server, tmp_path):
+        for name in "abc":
+            server.files[f"/{name}.bin"] = (b"x" * 100, f'"{name}"')
+        cache = MediaCache(tmp_path / "cache", max_bytes=250)
+        a = cache.fetch(f"{server.url}/a.bin")
+        b = cache.fetch(f"{server.url}/b.bin")
+        # Used again, so b is now the least recent
+        os.utime(b, (1, 1))
+        cache.fetch(f"{server.url}/a.bin")
+
+        c = cache.fetch(f"{server.url}/c.bin")
+
+        assert os.path.exists(a) and os.path.exists(c)
+        assert not os.path.exists(b)
+
+    def test_the_file_just_fetched_is_kept_over_the_cap(self, server, tmp_path):
+        server.files["/big.bin"] = (b"x" * 100, '"big"')
+        cache = MediaCache(tmp_path / "cache", max_bytes=10)
+
+        assert os.path.exists(cache.fetch(f"{server.url}/big.bin"))
+
+
+class TestLoaders:
+    def test_fetch_image_reads_through_the_cache(self, server):
+        server.files["/image.png"] = (png_bytes(), '"image"')
+
+        first = fetch_image(f"{server.url}/image.png")
+        second = fetch_image(f"{server.url}/image.png")
+
+        assert first.size == second.size == (8, 8)
+        assert server.not_modified == 1
+
+    def test_load_audio_reads_through_the_cache(self, server):
+        buffer = io.BytesIO()
+        soundfile.write(buffer, numpy.zeros(800, dtype="float32"), 8000, format="WAV")
+        server.files["/track.wav"] = (buffer.getvalue(), '"track"')
+
+        audio, sample_rate = load_audio(f"{server.url}/track.wav")
+
+        assert (audio.shape, sample_rate) == ((1, 800), 8000)
+
+    def test_a_url_video_opens_as_a_video_source(self, server, tmp_path):
+        pytest.importorskip("av")
+        from dw.video_source import VideoSource
+        from dw.video_writer import write_video
+
+        clip = tmp_path / "clip.mp4"
+        write_video([Image.new("RGB", (32, 16))] * 6, clip, fps=8)
+        server.files["/clip.mp4"] = (clip.read_bytes(), '"clip"')
+
+        video = fetch_video({"location": f"{server.url}/clip.mp4", "stride": 2})
+
+        assert isinstance(video, VideoSource)
+        assert (len(video), video.size) == (3, (32, 16))
@@ -2,10 +2,123 @@
 Unit tests for prompt weighting device handling
 """
 
+from types import SimpleNamespace
+
 import torch
 from unittest.mock import MagicMock, patch
 
-from dw.prompt_weighting import _get_device, _hook_managed, apply_prompt_weighting
+from dw.prompt_weighting import (
+    _get_device,
+    _hook_managed,
+    apply_prompt_weighting,
+    encode_weighted_prompts,
+    get_weighted_text_embeddings_flux,
+    get_weighted_text_embeddings_flux_batch,
+    get_weighted_text_embeddings_sd3,
+    get_weighted_text_embeddings_sdxl_batch,
+)
+
+
+class FakeTokenizer:
+    """Splits on whitespace; CLIP wraps the ids in bos/eos, T5 ends them with eos."""
+
+    pad_token_id = 0
+
+    def __init__(self, t5=False):
+        self.t5 = t5
+
+    def __call__(self, text, truncation=False, add_special_tokens=True):
+        ids = [2 + sum(map(ord, word)) % 900 for word in text.split()]
+        return SimpleNamespace(input_ids=ids + [1] if self.t5 else [49406, *ids, 49407])
+
+
+class FakeClip(torch.nn.Module):
+    """Mixes each 77-token group within itself, never across groups.
+
+    Like CLIPTextModel its output has pooler_output, and like
+    CLIPTextModelWithProjection only text_embeds when it has a projection.
+    """
+
+    def __init__(self, width, projection=False):
+        super().__init__()
+        torch.manual_seed(width)
+        self.embedding = torch.nn.Embedding(49408, width)
+        self.dtype = torch.float32
+        self.projection = projection
+        self.calls = 0
+
+    def forward(self, input_ids, output_hidden_states=False):
+        self.calls += 1
+        hidden = self.embedding(input_ids)
+        hidden = hidden + hidden.mean(dim=1, keepdim=True)
+        pooled = {"text_embeds" if self.projection else "pooler_output": hidden[:, -1]}
+        return SimpleNamespace(**pooled, hidden_states=(hidden * 3, hidden, hidden * 2))
+
+
+class FakeT5(torch.nn.Module):
+    """Mixes every token it is not masked from into every other."""
+
+    def __init__(self, width=12):
+        super().__init__()
+        torch.manual_seed(width)
+        self.embedding = torch.nn.Embedding(1000, width)
+        self.dtype = torch.float32
+        self.calls = 0
+
+    def forward(self, input_ids, attention_mask=None):
+        self.calls += 1
+        hidden = self.embedding(input_ids)
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        mask = attention_mask.unsqueeze(-1).float()
+        context = (hidden * mask).sum(dim=1, keepdim=True) / mask.sum(
+            dim=1, keepdim=True
+        )
+        return (hidden + context,)
+
+
+def fake_pipeline(name):
+    """A pipeline named like a diffusers one with the SD3 encoder stack - the Flux
+    and SDXL stacks are its first four encoders."""
+    pipeline = type(name, (), {})()
+    pipeline.device = torch.device("cpu")
+    pipeline.tokenizer = FakeTokenizer()
+    pipeline.tokenizer_2 = FakeTokenizer(t5=name.startswith("Flux"))
+    pipeline.tokenizer_3 = FakeTokenizer(t5=True)
+    sd3 = name.startswith("StableDiffusion3")
+    pipeline.text_encoder = FakeClip(4, projection=sd3)
+    pipeline.text_encoder_2 = (
+        FakeT5() if name.startswith("Flux") else FakeClip(6, projection=True)
+    )
+    pipeline.text_encoder_3 = FakeT5()
+    return pipeline
+
+
+def tiny_clip(projection=False):
+    """A CLIP text encoder as small as it gets, with CLIP's vocabulary."""
+    from transformers import (
+        CLIPTextConfig,
+        CLIPTextModel,
+        CLIPTextModelWithProjection,
+    )
+
+    torch.manual_seed(0)
+    config = CLIPTextConfig(
+        vocab_size=49408,
+        hidden_size=8,
+        intermediate_size=16,
+        projection_dim=6,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        max_position_embeddings=77,
+        bos_token_id=49406,
+        eos_token_id=49407,
+    )
+    model = (CLIPTextModelWithProjection if projection else CLIPTextModel)(config)
+    return model.eval()
+
+
+LONG_PROMPT = " ".join(f"word{i}" for i in range(100))
 
 
 class TestDeviceResolution:
@@ -66,7 +179,25 @@ class TestEmbeddingFunctionSelection:
         pipeline = self.flux_like("FluxKontextPipeline", missing="text_encoder_2")
         assert _select_embedding_function(pipeline) is None
 
-    def test_non_flux_pipelines_are_not_supported(self):
+    def test_other_pipelines_are_not_supported(self):
+        from dw.prompt_weighting import _select_embedding_function
+
+        pipeline = self.flux_like("AuraFlowPipeline")
+        assert _select_embedding_function(pipeline) is None
+
+    def test_sdxl_and_sd3_pipelines_are_supported(self):
+        from dw.prompt_weighting import (
+            _select_embedding_function,
+            get_weighted_text_embeddings_sd3,
+            get_weighted_text_embeddings_sdxl,
+        )
+
+        sdxl = self.flux_like("StableDiffusionXLPAGPipeline")
+        sd3 = fake_pipeline("StableDiffusion3Pipeline")
+        assert _select_embedding_function(sdxl) is get_weighted_text_embeddings_sdxl
+        assert _select_embedding_function(sd3) is get_weighted_text_embeddings_sd3
+
+    def test_sd3_loaded_without_t5_is_not(self):
         from dw.prompt_weighting import _select_embedding_function
 
         pipeline = self.flux_like("StableDiffusion3Pipeline")
@@ -88,3 +219,145 @@ class TestApplyPromptWeighting:
         assert applied
         assert embed_fn.call_args.kwargs["device"] == "cuda:1"
         assert "prompt_embeds" in arguments
+
+
+class TestBatchedEncoding:
+    def test_a_batch_encodes_each_prompt_as_on_its_own(self):
+        pipeline = fake_pipeline("FluxPipeline")
+        prompts = ["a (red:1.3) fox", LONG_PROMPT, "[snow]"]
+
+        batched = get_weighted_text_embeddings_flux_batch(
+            pipeline, prompts, device="cpu"
+        )
+        alone = [
+            get_weighted_text_embeddings_flux(pipeline, prompt, device="cpu")
+            for prompt in prompts
+        ]
+
+        for (embeds, pooled), (embeds_alone, pooled_alone) in zip(batched, alone):
+            assert torch.allclose(embeds, embeds_alone, atol=1e-6)
+            assert torch.allclose(pooled, pooled_alone, atol=1e-6)
+
+    def test_each_encoder_runs_once_for_the_batch(self):
+        pipeline = fake_pipeline("FluxPipeline")
+
+        get_weighted_text_embeddings_flux_batch(
+            pipeline, ["a (fox)", LONG_PROMPT, "a [hare]"], device="cpu"
+        )
+
+        assert (pipeline.text_encoder.calls, pipeline.text_encoder_2.calls) == (1, 1)
+
+    def test_weights_scale_the_embeddings(self):
+        pipeline = fake_pipeline("FluxPipeline")
+
+        (weighted, _), (plain, _) = get_weighted_text_embeddings_flux_batch(
+            pipeline, ["(fox:2)", "(fox:1)"], device="cpu"
+        )
+
+        assert torch.allclose(weighted, plain * 2)
+
+    def test_same_length_pads_every_prompt_to_the_longest(self):
+        pipeline = fake_pipeline("FluxPipeline")
+
+        rows = get_weighted_text_embeddings_flux_batch(
+            pipeline, ["a (fox)", "a (quick brown) fox"], device="cpu", same_length=True
+        )
+
+        assert rows[0][0].shape == rows[1][0].shape
+
+
+class TestEncoderStacks:
+    def test_sdxl_concatenates_both_clip_encoders(self):
+        pipeline = fake_pipeline("StableDiffusionXLPipeline")
+
+        (short, pooled), (long, _) = get_weighted_text_embeddings_sdxl_batch(
+            pipeline, ["a (fox:1.2)", LONG_PROMPT], device="cpu"
+        )
+
+        assert short.shape == (1, 77, 4 + 6)
+        assert long.shape == (1, 154, 4 + 6)
+        # The pooled embeddings come from text_encoder_2
+        assert pooled.shape == (1, 6)
+        assert pipeline.text_encoder.calls == pipeline.text_encoder_2.calls == 1
+
+    def test_sd3_follows_clip_with_t5(self):
+        pipeline = fake_pipeline("StableDiffusion3Pipeline")
+
+        embeds, pooled = get_weighted_text_embeddings_sd3(
+            pipeline, "a (fox:1.2)", device="cpu"
+        )
+
+        # T5 ends each of the two fragments with eos
+        assert embeds.shape == (1, 77 + 4, 12)
+        assert pooled.shape == (1, 4 + 6)
+        # The CLIP hidden states are zero-padded to T5's width
+        assert not embeds[0, :77, 10:].any()
+
+
+class TestRealClipEncoders:
+    """The transformers models, whose outputs hold only the fields they compute."""
+
+    def test_sdxl_pools_from_the_projected_encoder(self):
+        pipeline = fake_pipeline("StableDiffusionXLPipeline")
+        pipeline.text_encoder = tiny_clip()
+        pipeline.text_encoder_2 = tiny_clip(projection=True)
+
+        ((embeds, pooled),) = get_weighted_text_embeddings_sdxl_batch(
+            pipeline, ["a (fox:1.2)"], device="cpu"
+        )
+
+        assert embeds.shape == (1, 77, 8 + 8)
+        assert pooled.shape == (1, 6)
+
+    def test_sd3_pools_both_projected_encoders(self):
+        pipeline = fake_pipeline("StableDiffusion3Pipeline")
+        pipeline.text_encoder = tiny_clip(projection=True)
+        pipeline.text_encoder_2 = tiny_clip(projection=True)
+
+        embeds, pooled = get_weighted_text_embeddings_sd3(
+            pipeline, "a (fox:1.2)", device="cpu"
+        )
+
+        assert embeds.shape == (1, 77 + 4, 12)
+        assert pooled.shape == (1, 6 + 6)
+
+
+class TestNegativePrompts:
+    def test_sdxl_weights_the_negative_prompt_to_the_same_length(self):
+        pipeline = fake_pipeline("StableDiffusionXLPipeline")
+        arguments = {"prompt": "a (fox:1.2)", "negative_prompt": LONG_PROMPT}
+
+        assert apply_prompt_weighting(pipeline, arguments, device="cpu")
+
+        assert "negative_prompt" not in arguments
+        assert arguments["negative_prompt_embeds"].shape == (1, 154, 10)
+        assert arguments["prompt_embeds"].shape == (1, 154, 10)
+        assert pipeline.text_encoder.calls == 1
+
+    def test_flux_still_drops_the_negative_prompt(self):
+        pipeline = fake_pipeline("FluxPipeline")
+        arguments = {"prompt": "a (fox:1.2)", "negative_prompt": "blurry"}
+
+        apply_prompt_weighting(pipeline, arguments, device="cpu")
+
+        assert "negative_prompt" not in arguments
+        assert "negative_prompt_embeds" not in arguments
+
+
+class TestEncodeWeightedPrompts:
+    def test_calls_find_their_prompts_encoded_ahead(self):
+        pipeline = fake_pipeline("FluxPipeline")
+        calls = [{"prompt": "a (fox)"}, {"prompt": "a [hare]"}, {"prompt": "plain"}]
+
+        assert encode_weighted_prompts(pipeline, calls, device="cpu") == 2
+        for arguments in calls:
+            apply_prompt_weighting(pipeline, arguments, device="cpu")
+
+        assert pipeline.text_encoder_2.calls == 1
+        assert calls[2] == {"prompt": "plain"}
+
+    def test_prompts_already_cached_are_not_encoded_again(self):
+        pipeline = fake_pipeline("FluxPipeline")
+        apply_prompt_weighting(pipeline, {"prompt": "a (fox)"}, device="cpu")
+
+        assert encode_weighted_prompts(pipeline, [{"prompt": "a (fox)"}], "cpu") == 0
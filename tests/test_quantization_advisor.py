@@ -0,0 +1,355 @@
+"""Tests for the quantization advisor.
+
+The advisor sizes components on the meta device and picks per-component precision
+to fit a budget. Sizing runs against a tiny local config here, and planning against
+hand-built footprints, so nothing is downloaded.
+"""
+
+import json
+
+import pytest
+import torch
+
+from dw.quantization_advisor import (
+    BACKENDS,
+    ComponentFootprint,
+    advise_pipeline,
+    advise_workflow,
+    apply_plan,
+    estimate_component_footprint,
+    module_footprint,
+    plan_quantization,
+    quantization_definition,
+)
+from dw.schema import load_schema, validate_data
+from dw.settings import parse_size
+
+GB = 1024**3
+
+
+def footprint(name, quantizable_gb, other_gb=0.0, library="diffusers"):
+    """A bf16 component of the given size, in GB of its own weights."""
+    return ComponentFootprint(
+        name=name,
+        component_type=f"{name.title()}Model",
+        library=library,
+        quantizable_params=int(quantizable_gb * GB / 2),
+        other_params=int(other_gb * GB / 2),
+        dtype_bytes=2,
+    )
+
+
+class TestParseSize:
+    def test_units_are_binary(self):
+        assert parse_size("24GB") == 24 * GB
+        assert parse_size("1.5GiB") == int(1.5 * GB)
+        assert parse_size("512mb") == 512 * 1024**2
+
+    def test_a_number_is_bytes(self):
+        assert parse_size(1000) == 1000
+        assert parse_size("1000") == 1000
+
+    def test_rejects_what_is_not_a_size(self):
+        with pytest.raises(ValueError, match="not a memory size"):
+            parse_size("lots")
+
+
+class TestModuleFootprint:
+    def test_only_linear_weights_are_quantizable(self):
+        module = torch.nn.Sequential(
+            torch.nn.Linear(8, 4),  # 32 weights + 4 bias
+            torch.nn.LayerNorm(4),  # 4 + 4
+            torch.nn.Embedding(10, 4),  # 40
+        )
+
+        result = module_footprint("m", module, "Sequential", "diffusers")
+
+        assert result.quantizable_params == 32
+        assert result.other_params == 4 + 8 + 40
+        assert result.dtype_bytes == 4
+
+    def test_the_load_dtype_overrides_the_parameter_dtype(self):
+        module = torch.nn.Linear(8, 4)
+
+        result = module_footprint(
+            "m", module, "Linear", "diffusers", dtype="torch.bfloat16"
+        )
+
+        assert result.dtype_bytes == 2
+
+    def test_estimates_from_config_alone_on_the_meta_device(self, tmp_path):
+        from diffusers import AutoencoderKL
+
+        AutoencoderKL.from_config({}).save_config(tmp_path / "vae")
+
+        result = estimate_component_footprint(
+            "vae", "AutoencoderKL", "diffusers", str(tmp_path), "vae", "torch.float16"
+        )
+
+        expected = sum(p.numel() for p in AutoencoderKL.from_config({}).parameters())
+        assert result.quantizable_params + result.other_params == expected
+        assert result.dtype_bytes == 2
+
+    def test_a_component_without_weights_is_skipped(self, tmp_path):
+        assert (
+            estimate_component_footprint(
+                "scheduler", "DDIMScheduler", "diffusers", str(tmp_path), "scheduler"
+            )
+            is None
+        )
+
+
+class TestPlanQuantization:
+    def test_nothing_is_quantized_when_the_pipeline_fits(self):
+        plan = plan_quantization(
+            [footprint("transformer", 10), footprint("text_encoder", 4)], "16GB"
+        )
+
+        assert plan.levels == {"transformer": "none", "text_encoder": "none"}
+        assert plan.fits
+
+    def test_int8_everywhere_comes_before_any_int4(self):
+        # 24GB of bf16 into 13GB: int8 on both halves it to 12GB, which fits - int4
+        # on the transformer alone would fit too, but is lossier
+        plan = plan_quantization(
+            [footprint("transformer", 16), footprint("text_encoder", 8)], "13GB"
+        )
+
+        assert plan.levels == {"transformer": "int8", "text_encoder": "int8"}
+
+    def test_the_smallest_component_that_closes_the_gap_is_chosen(self):
+        # 2GB over: the 8GB text encoder at int8 saves 4GB, enough on its own
+        plan = plan_quantization(
+            [footprint("transformer", 16), footprint("text_encoder", 8)], "22GB"
+        )
+
+        assert plan.levels == {"transformer": "none", "text_encoder": "int8"}
+
+    def test_falls_through_to_int4(self):
+        plan = plan_quantization(
+            [footprint("transformer", 16), footprint("text_encoder", 8)], "8GB"
+        )
+
+        assert plan.levels["transformer"] == "int4"
+        assert plan.fits
+
+    def test_unquantizable_weights_count_against_the_budget(self):
+        # Convolutions and norms stay at their dtype, so no plan gets under 2GB; the
+        # plan returned is the smallest there is
+        plan = plan_quantization([footprint("vae", 0.1, other_gb=2)], "1GB")
+
+        assert plan.levels == {"vae": "int4"}
+        assert not plan.fits
+
+    def test_excluded_components_stay_at_full_precision(self):
+        plan = plan_quantization(
+            [footprint("transformer", 16), footprint("text_encoder", 8)],
+            "22GB",
+            exclude=("text_encoder",),
+        )
+
+        assert plan.levels == {"transformer": "int8", "text_encoder": "none"}
+
+    def test_gguf_does_not_quantize_transformers_components(self):
+        plan = plan_quantization(
+            [footprint("text_encoder", 8, library="transformers")], "2GB", "gguf"
+        )
+
+        assert plan.levels == {"text_encoder": "none"}
+
+    def test_a_gguf_report_names_the_file_each_component_needs(self):
+        plan = plan_quantization([footprint("transformer", 16)], "9GB", "gguf")
+
+        report = plan.report()
+
+        assert "int8 Q8_0" in report
+        assert "from_single_file" in report
+
+    def test_rejects_an_unknown_backend(self):
+        with pytest.raises(ValueError, match="Unknown quantization backend"):
+            plan_quantization([], "1GB", backend="fp3")
+
+    def test_report_names_every_component(self):
+        plan = plan_quantization(
+            [footprint("transformer", 16), footprint("text_encoder", 8)], "13GB"
+        )
+
+        report = plan.report()
+
+        assert "transformer" in report and "text_encoder" in report
+        assert "int8" in report
+
+
+class TestQuantizationDefinition:
+    @pytest.mark.parametrize("backend", [name for name in BACKENDS if name != "gguf"])
+    @pytest.mark.parametrize("level", ["int8", "int4"])
+    def test_matches_the_schema(self, backend, level):
+        definition = quantization_definition(backend, level, "diffusers")
+
+        schema = load_schema("workflow")
+        schema = {**schema["$defs"]["quantization_config"], "$defs": schema["$defs"]}
+        assert validate_data(definition, schema)[0]
+
+    def test_gguf_has_no_config_to_write(self):
+        with pytest.raises(ValueError, match="Q4_K .gguf checkpoint"):
+            quantization_definition("gguf", "int4", "diffusers")
+
+    def test_transformers_components_take_the_transformers_class(self):
+        definition = quantization_definition("torchao", "int8", "transformers")
+
+        assert (
+            definition["configuration"]["config_type"] == "transformers.TorchAoConfig"
+        )
+
+    def test_string_arguments_are_escaped_from_type_loading(self):
+        definition = quantization_definition("sdnq", "int4", "diffusers")
+
+        assert definition["arguments"]["weights_dtype"] == "{int4}"
+
+
+def fake_estimate(sizes):
+    def estimate(name, component_type, library, model_name, subfolder, dtype):
+        if name not in sizes:
+            return None
+        result = footprint(name, sizes[name], library=library)
+        result.component_type = component_type
+        return result
+
+    return estimate
+
+
+@pytest.fixture
+def flux_index(monkeypatch):
+    monkeypatch.setattr(
+        "dw.quantization_advisor.component_index",
+        lambda model_name: {
+            "transformer": ("diffusers", "FluxTransformer2DModel"),
+            "text_encoder_2": ("transformers", "T5EncoderModel"),
+            "scheduler": ("diffusers", "FlowMatchEulerDiscreteScheduler"),
+        },
+    )
+
+
+def flux_pipeline():
+    return {
+        "configuration": {"component_type": "FluxPipeline"},
+        "from_pretrained_arguments": {
+            "model_name": "black-forest-labs/FLUX.1-dev",
+            "torch_dtype": "torch.bfloat16",
+        },
+        "arguments": {"prompt": "a marmot"},
+    }
+
+
+class TestApplyPlan:
+    def test_component_blocks_are_created_for_a_standard_pipeline(self, flux_index):
+        pipeline = flux_pipeline()
+        plan = advise_pipeline(
+            pipeline,
+            "14GB",
+            estimate=fake_estimate({"transformer": 22, "text_encoder_2": 9}),
+        )
+
+        updated = apply_plan(pipeline, plan)
+
+        assert "transformer" not in pipeline
+        transformer = updated["transformer"]
+        assert (
+            transformer["configuration"]["component_type"] == "FluxTransformer2DModel"
+        )
+        assert transformer["from_pretrained_arguments"]["subfolder"] == "transformer"
+        assert transformer["quantization_config"]["configuration"] == {
+            "config_type": "sdnq.SDNQConfig"
+        }
+        encoder = updated["text_encoder_2"]
+        assert (
+            encoder["configuration"]["component_type"] == "transformers.T5EncoderModel"
+        )
+
+    def test_an_existing_component_block_keeps_its_source(self, flux_index):
+        pipeline = flux_pipeline()
+        pipeline["transformer"] = {
+            "configuration": {"component_type": "FluxTransformer2DModel"},
+            "from_pretrained_arguments": {
+                "model_name": "someone/flux-finetune",
+                "subfolder": "transformer",
+            },
+        }
+        plan = advise_pipeline(
+            pipeline, "10GB", estimate=fake_estimate({"transformer": 22})
+        )
+
+        updated = apply_plan(pipeline, plan)
+
+        assert (
+            updated["transformer"]["from_pretrained_arguments"]["model_name"]
+            == "someone/flux-finetune"
+        )
+        assert "quantization_config" in updated["transformer"]
+
+    def test_a_modular_pipeline_is_planned_under_load_components(self, flux_index):
+        pipeline = flux_pipeline()
+        pipeline["configuration"] = {
+            "component_type": "ModularPipeline",
+            "load_components": {"dtype": "torch.bfloat16"},
+        }
+        plan = advise_pipeline(
+            pipeline,
+            "14GB",
+            estimate=fake_estimate({"transformer": 22, "text_encoder_2": 9}),
+        )
+
+        updated = apply_plan(pipeline, plan)
+
+        quantization = updated["configuration"]["load_components"][
+            "quantization_config"
+        ]
+        assert set(quantization) == {"transformer", "text_encoder_2"}
+        assert "transformer" not in updated
+
+
+class TestAdviseWorkflow:
+    def test_variables_resolve_but_survive_in_the_output(self, flux_index):
+        seen = []
+
+        def estimate(name, component_type, library, model_name, subfolder, dtype):
+            seen.append(model_name)
+            return footprint(name, 22) if name == "transformer" else None
+
+        pipeline = flux_pipeline()
+        pipeline["from_pretrained_arguments"]["model_name"] = "variable:model"
+        workflow = {
+            "id": "flux",
+            "variables": {"model": "black-forest-labs/FLUX.1-dev"},
+            "steps": [
+                {"name": "main", "pipeline": pipeline},
+                {"name": "other", "task": {"command": "qr_code", "arguments": {}}},
+            ],
+        }
+
+        plans, updated = advise_workflow(workflow, "16GB", estimate=estimate)
+
+        assert [name for name, _ in plans] == ["main"]
+        assert set(seen) == {"black-forest-labs/FLUX.1-dev"}
+        main = updated["steps"][0]["pipeline"]
+        assert main["from_pretrained_arguments"]["model_name"] == "variable:model"
+        assert main["transformer"]["quantization_config"] is not None
+        assert validate_data(json.loads(json.dumps(updated)), load_schema("workflow"))[
+            0
+        ]
+
+    def test_a_gguf_plan_leaves_the_workflow_unchanged(self, flux_index):
+        workflow = {
+            "id": "flux",
+            "steps": [{"name": "main", "pipeline": flux_pipeline()}],
+        }
+
+        plans, updated = advise_workflow(
+            workflow,
+            "16GB",
+            "gguf",
+            estimate=fake_estimate({"transformer": 22, "text_encoder_2": 9}),
+        )
+
+        assert plans[0][1].levels["transformer"] != "none"
+        assert updated == workflow
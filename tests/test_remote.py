@@ -0,0 +1,162 @@
+"""Tests for the remote text encoder client.
+
+The bundled stand-in server runs on a free local port with an encode function that
+records the prompts of each request, so which calls share a request is checked over
+real HTTP without a text encoder.
+"""
+
+import io
+import threading
+import time
+
+import pytest
+import requests
+import torch
+
+from dw.pipeline_processors.remote import (
+    RAW_TYPE,
+    close_remote_encoder_clients,
+    decode_response,
+    remote_encoder_client,
+    remote_text_encoder,
+)
+from dw.remote_encoder_server import serve_text_encoder
+
+
+def embeds_for(prompts):
+    """One row per prompt, filled with its length."""
+    return torch.stack(
+        [torch.full((3, 2), float(len(prompt))) for prompt in prompts]
+    ).to(torch.bfloat16)
+
+
+class Service:
+    def __init__(self):
+        self.requests = []
+        self.failures = 0
+        self.gate = None
+
+    def encode(self, prompts):
+        if self.gate is not None:
+            self.gate.wait()
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("encoder unavailable")
+        self.requests.append(prompts)
+        return embeds_for(prompts)
+
+
+@pytest.fixture
+def service():
+    service = Service()
+    server = serve_text_encoder(service.encode, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    service.url = f"http://127.0.0.1:{server.server_address[1]}/predict"
+    yield service
+    server.shutdown()
+    server.server_close()
+
+
+class TestDecoding:
+    def test_safetensors_keep_their_dtype(self, service):
+        embeds = remote_text_encoder("a marmot", service.url, "cpu")
+
+        assert embeds.dtype == torch.bfloat16
+        assert torch.equal(embeds, embeds_for(["a marmot"]))
+
+    def test_a_raw_buffer_is_read_by_its_headers(self, service):
+        client = remote_encoder_client(service.url)
+        client.session.headers["Accept"] = RAW_TYPE
+
+        embeds = client.encode("a marmot")
+
+        assert torch.equal(embeds, embeds_for(["a marmot"]))
+
+    def test_a_pickled_tensor_is_still_read(self):
+        buffer = io.BytesIO()
+        torch.save(torch.ones(1, 2), buffer)
+        response = requests.Response()
+        response.raw = io.BytesIO(buffer.getvalue())
+        response.headers["Content-Length"] = str(len(buffer.getvalue()))
+
+        assert torch.equal(decode_response(response), torch.ones(1, 2))
+
+
+class TestRequests:
+    def test_a_batch_is_one_request(self, service):
+        rows = remote_encoder_client(service.url).encode_batch(["a", "bb", "ccc"])
+
+        assert service.requests == [["a", "bb", "ccc"]]
+        assert [row[0, 0, 0].item() for row in rows] == [1.0, 2.0, 3.0]
+
+    def test_max_batch_splits_the_requests(self, service):
+        remote_encoder_client(service.url, {"max_batch": 2}).encode_batch(
+            ["a", "bb", "ccc"]
+        )
+
+        assert service.requests == [["a", "bb"], ["ccc"]]
+
+    def test_a_server_error_is_retried(self, service):
+        service.failures = 1
+
+        embeds = remote_text_encoder("a marmot", service.url, "cpu")
+
+        assert torch.equal(embeds, embeds_for(["a marmot"]))
+
+    def test_prompts_sent_during_a_request_share_the_next(self, service):
+        client = remote_encoder_client(service.url)
+        service.gate = threading.Event()
+        results = {}
+
+        def encode(prompt):
+            results[prompt] = client.encode_prompt(prompt)
+
+        threads = [threading.Thread(target=encode, args=("first",))]
+        threads[0].start()
+        while not client._sending:
+            time.sleep(0.01)
+        for prompt in ("second", "third!"):
+            threads.append(threading.Thread(target=encode, args=(prompt,)))
+            threads[-1].start()
+        while len(client._queue) < 2:
+            time.sleep(0.01)
+        service.gate.set()
+        for thread in threads:
+            thread.join(timeout=10)
+
+        assert service.requests == [["first"], ["second", "third!"]]
+        assert results["third!"][0, 0, 0].item() == 6.0
+
+    def test_closed_clients_are_replaced_on_next_use(self, service):
+        client = remote_encoder_client(service.url)
+
+        close_remote_encoder_clients()
+        replacement = remote_encoder_client(service.url)
+        replacement.encode_batch(["a"])
+
+        assert replacement is not client
+        assert service.requests == [["a"]]
+
+
+class TestStepPrompts:
+    def test_a_steps_prompts_are_requested_together(self, service):
+        from dw.pipeline_processors.pipeline import Pipeline
+
+        wrapper = Pipeline(
+            {
+                "configuration": {"component_type": "Flux2Pipeline"},
+                "remote_text_encoder": {"url": service.url},
+            },
+            42,
+            "cpu",
+            pipeline=object(),
+        )
+        iterations = [{"prompt": p} for p in ("a marmot", "a beaver", "a marmot")]
+
+        with wrapper.encode_ahead(iterations):
+            for arguments in iterations:
+                wrapper._prepare_prompt(arguments)
+
+        assert service.requests == [["a marmot", "a beaver"]]
+        assert arguments["prompt_embeds"].shape == (1, 3, 2)
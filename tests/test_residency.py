@@ -0,0 +1,373 @@
+"""Tests for the residency manager behind on-demand component placement.
+
+The manager decides whether an on-demand component leaves the device when its call
+returns. These drive it with components that record their moves, so the policy is
+checked without an accelerator.
+"""
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+import torch
+
+from dw.pipeline_processors import residency
+from dw.pipeline_processors.pipeline import configure_components
+from dw.pipeline_processors.residency import ResidencyManager, component_bytes
+
+
+class FakeComponent(torch.nn.Module):
+    """A module of a known size that records where it is moved."""
+
+    def __init__(self, numel):
+        super().__init__()
+        self.weight = torch.nn.Parameter(torch.zeros(numel), requires_grad=False)
+        self.moves = []
+        self.location = "cpu"
+
+    def to(self, device):
+        self.location = str(device)
+        self.moves.append(str(device))
+        return self
+
+    def decode(self, latents):
+        return (self.location, latents)
+
+
+@pytest.fixture(autouse=True)
+def fresh_manager(monkeypatch):
+    monkeypatch.setattr(residency, "_manager", None)
+    yield
+
+
+def managed(manager, *sizes, device="cuda"):
+    components = []
+    for i, numel in enumerate(sizes):
+        component = FakeComponent(numel)
+        component.name = f"c{i}"
+        manager.register(component, f"c{i}", device)
+        components.append(component)
+    return components
+
+
+def call(manager, component):
+    manager.acquire(component)
+    manager.release(component)
+
+
+class TestComponentBytes:
+    def test_counts_parameters_and_buffers(self):
+        module = torch.nn.BatchNorm1d(4)  # weight, bias + running mean, var, count
+        assert component_bytes(module) == 4 * 4 * 4 + 8
+
+    def test_an_object_without_tensors_is_empty(self):
+        assert component_bytes(object()) == 0
+
+
+class TestResidencyManager:
+    def test_without_a_budget_every_call_moves_in_and_out(self):
+        manager = ResidencyManager()
+        (vae,) = managed(manager, 10)
+
+        call(manager, vae)
+        call(manager, vae)
+
+        assert vae.moves == ["cpu", "cuda", "cpu", "cuda", "cpu"]
+        assert (manager.hits, manager.misses) == (0, 2)
+
+    def test_a_component_within_budget_stays_resident(self):
+        manager = ResidencyManager(budget_bytes=1000)
+        (vae,) = managed(manager, 10)
+
+        call(manager, vae)
+        call(manager, vae)
+        call(manager, vae)
+
+        assert vae.moves == ["cpu", "cuda"]
+        assert (manager.hits, manager.misses) == (2, 1)
+        assert manager.resident_bytes("cuda") == 40
+
+    def test_the_least_recently_used_component_is_evicted(self):
+        # Room for two 40-byte components, not three
+        manager = ResidencyManager(budget_bytes=100)
+        first, second, third = managed(manager, 10, 10, 10)
+
+        call(manager, first)
+        call(manager, second)
+        call(manager, first)  # second is now least recently used
+        call(manager, third)
+
+        assert first.location == "cuda"
+        assert second.location == "cpu"
+        assert third.location == "cuda"
+        assert manager.evictions == 1
+
+    def test_a_component_in_use_is_never_evicted(self):
+        manager = ResidencyManager(budget_bytes=50)
+        first, second = managed(manager, 10, 10)
+
+        manager.acquire(first)
+        call(manager, second)
+
+        # Over budget with both on the device: the idle one leaves, even though the
+        # one still running is older
+        assert first.location == "cuda"
+        assert second.location == "cpu"
+        manager.release(first)
+        assert first.location == "cuda"
+
+    def test_budgets_are_per_device(self):
+        manager = ResidencyManager(budget_bytes=50)
+        (first,) = managed(manager, 10, device="cuda:0")
+        (second,) = managed(manager, 10, device="cuda:1")
+
+        call(manager, first)
+        call(manager, second)
+
+        assert first.location == "cuda:0"
+        assert second.location == "cuda:1"
+
+    def test_evict_all_clears_the_device(self):
+        manager = ResidencyManager(budget_bytes=1000)
+        first, second = managed(manager, 10, 10)
+        call(manager, first)
+        call(manager, second)
+
+        manager.evict_all()
+
+        assert first.location == second.location == "cpu"
+        assert manager.resident_bytes() == 0
+
+    def test_collected_components_are_forgotten(self):
+        manager = ResidencyManager(budget_bytes=1000)
+        (vae,) = managed(manager, 10)
+        call(manager, vae)
+
+        del vae
+
+        assert manager.stats()["resident_components"] == []
+
+    def test_stats_report_the_hit_rate(self):
+        manager = ResidencyManager(budget_bytes=1000)
+        (vae,) = managed(manager, 10)
+        for _ in range(4):
+            call(manager, vae)
+
+        stats = manager.stats()
+
+        assert stats["hits"] == 3
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.75
+        assert stats["resident_components"] == ["c0"]
+
+
+class TestOnDemandPlacementUsesTheManager:
+    def configure(self, pipeline):
+        with patch("diffusers.hooks.apply_group_offloading"):
+            configure_components(
+                pipeline, {"components": {"vae": {"residency": "on_demand"}}}, "cuda"
+            )
+
+    def test_the_budget_setting_keeps_a_vae_resident_across_calls(self, monkeypatch):
+        monkeypatch.setattr(residency.settings, "residency_budget", "1GB")
+        pipeline = MagicMock()
+        pipeline.vae = FakeComponent(10)
+        self.configure(pipeline)
+
+        assert pipeline.vae.decode("a") == ("cuda", "a")
+        assert pipeline.vae.decode("b") == ("cuda", "b")
+
+        assert pipeline.vae.moves == ["cpu", "cuda"]
+        assert residency.get_residency_manager().stats()["hits"] == 1
+
+    def test_without_the_setting_the_vae_leaves_after_each_call(self, monkeypatch):
+        monkeypatch.setattr(residency.settings, "residency_budget", None)
+        pipeline = MagicMock()
+        pipeline.vae = FakeComponent(10)
+        self.configure(pipeline)
+
+        pipeline.vae.decode("a")
+
+        assert pipeline.vae.location == "cpu"
+
+
+class RecordingBackend:
+    """A transfer backend that records what the manager asks of it."""
+
+    def __init__(self):
+        self.calls = []
+
+    def pin(self, component, offload_device):
+        self.calls.append(("pin", component.name))
+        return {"pinned": True}
+
+    def onload(self, component, store, device, non_blocking):
+        self.calls.append(("onload", component.name, non_blocking))
+        component.location = device
+        return f"copy:{component.name}"
+
+    def wait(self, component, handle):
+        self.calls.append(("wait", handle))
+
+    def offload(self, component, store, offload_device):
+        self.calls.append(("offload", component.name))
+        component.location = offload_device
+
+
+def pinned_manager(budget_bytes=0):
+    backend = RecordingBackend()
+    manager = ResidencyManager(budget_bytes, pin_memory=True, backend=backend)
+    components = managed(manager, 10, 10)
+    backend.calls.clear()
+    return manager, backend, components
+
+
+class TestPrefetch:
+    def test_components_are_pinned_once_at_registration(self):
+        backend = RecordingBackend()
+        manager = ResidencyManager(pin_memory=True, backend=backend)
+
+        (vae,) = managed(manager, 10)
+        call(manager, vae)
+        call(manager, vae)
+
+        assert [c for c in backend.calls if c[0] == "pin"] == [("pin", "c0")]
+
+    def test_a_prefetched_call_waits_for_the_copy_instead_of_making_one(self):
+        manager, backend, (vae, _) = pinned_manager()
+
+        manager.prefetch(vae)
+        call(manager, vae)
+
+        assert backend.calls == [
+            ("onload", "c0", True),
+            ("wait", "copy:c0"),
+            ("offload", "c0"),
+        ]
+        assert (manager.hits, manager.misses, manager.prefetches) == (1, 0, 1)
+
+    def test_a_miss_copies_synchronously(self):
+        manager, backend, (vae, _) = pinned_manager()
+
+        call(manager, vae)
+
+        assert backend.calls[0] == ("onload", "c0", False)
+        assert ("wait", "copy:c0") in backend.calls
+
+    def test_prefetching_twice_copies_once(self):
+        manager, backend, (vae, _) = pinned_manager()
+
+        manager.prefetch(vae)
+        manager.prefetch(vae)
+
+        assert [c[0] for c in backend.calls] == ["onload"]
+
+    def test_a_prefetched_component_survives_another_release(self):
+        # Without a budget every idle component leaves on release - but not one
+        # fetched for a call that has not come yet
+        manager, backend, (vae, other) = pinned_manager()
+
+        manager.prefetch(vae)
+        call(manager, other)
+
+        assert vae.location == "cuda"
+        assert ("offload", "c0") not in backend.calls
+
+    def test_an_unused_prefetch_lands_before_it_is_evicted(self):
+        manager, backend, (vae, _) = pinned_manager()
+
+        manager.prefetch(vae)
+        manager.evict_all()
+
+        assert backend.calls == [
+            ("onload", "c0", True),
+            ("wait", "copy:c0"),
+            ("offload", "c0"),
+        ]
+
+
+class TestTorchTransferBackend:
+    def test_weights_round_trip_through_the_host_copy(self):
+        from dw.pipeline_processors.residency import TorchTransferBackend
+
+        backend = TorchTransferBackend()
+        module = torch.nn.Linear(4, 4)
+        expected = module.weight.detach().clone()
+
+        store = backend.pin(module, "cpu")
+        handle = backend.onload(module, store, "cpu", non_blocking=True)
+        backend.wait(module, handle)
+        backend.offload(module, store, "cpu")
+
+        assert module.weight.data_ptr() == store["weight"].data_ptr()
+        assert torch.equal(module.weight, expected)
+
+    def test_a_plain_object_is_moved_with_its_own_to(self):
+        from dw.pipeline_processors.residency import TorchTransferBackend
+
+        backend = TorchTransferBackend()
+        component = MagicMock()
+
+        assert backend.pin(component, "cpu") is None
+        backend.onload(component, None, "cuda", non_blocking=True)
+        component.to.assert_called_with("cuda")
+
+
+class TestPrefetchContext:
+    def configuration(self, **prefetch):
+        return {"components": {"vae": {"residency": "on_demand", "prefetch": prefetch}}}
+
+    def test_the_vae_is_prefetched_before_the_last_steps(self, monkeypatch):
+        from dw.pipeline_processors.pipeline import prefetch_context
+
+        manager = MagicMock()
+        monkeypatch.setattr(residency, "_manager", manager)
+        pipeline = MagicMock()
+        pipeline.transformer = torch.nn.Identity()
+        pipeline.vae = FakeComponent(10)
+        prefetched_at = []
+        manager.prefetch.side_effect = lambda c: prefetched_at.append(calls)
+
+        with prefetch_context(
+            pipeline, self.configuration(), {"num_inference_steps": 10}
+        ):
+            for calls in range(1, 11):
+                pipeline.transformer(torch.zeros(1))
+
+        assert prefetched_at == [8]
+        # The trigger is gone once the call returns
+        pipeline.transformer(torch.zeros(1))
+        assert manager.prefetch.call_count == 1
+
+    def test_steps_before_end_moves_the_trigger(self, monkeypatch):
+        from dw.pipeline_processors.pipeline import prefetch_context
+
+        manager = MagicMock()
+        monkeypatch.setattr(residency, "_manager", manager)
+        pipeline = MagicMock()
+        pipeline.unet = torch.nn.Identity()
+        pipeline.vae = FakeComponent(10)
+
+        with prefetch_context(
+            pipeline,
+            self.configuration(after="unet", steps_before_end=5),
+            {"num_inference_steps": 10},
+        ):
+            for _ in range(4):
+                pipeline.unet(torch.zeros(1))
+            assert not manager.prefetch.called
+            pipeline.unet(torch.zeros(1))
+
+        manager.prefetch.assert_called_once_with(pipeline.vae)
+
+    def test_without_num_inference_steps_nothing_is_prefetched(self, monkeypatch):
+        from dw.pipeline_processors.pipeline import prefetch_context
+
+        manager = MagicMock()
+        monkeypatch.setattr(residency, "_manager", manager)
+        pipeline = MagicMock()
+        pipeline.transformer = torch.nn.Identity()
+
+        with prefetch_context(pipeline, self.configuration(), {}):
+            pipeline.transformer(torch.zeros(1))
+
+        assert not manager.prefetch.called
@@ -377,7 +377,7 @@ class TestModularOutputs:
         result.add_result(outputs)
 
         with (
-            patch("dw.result.encode_video") as encode,
+            patch("dw.result.write_video") as encode,
             patch("dw.result.export_to_video") as export,
             patch("dw.result.is_av_available", return_value=True),
             tempfile.TemporaryDirectory() as temp_dir,
@@ -463,7 +463,7 @@ class TestSaveAudioVideo:
         result = Result(result_definition)
         result.add_result(artifact)
         with (
-            patch("dw.result.encode_video") as encode,
+            patch("dw.result.write_video") as encode,
             patch("dw.result.export_to_video") as export,
             patch("dw.result.is_av_available", return_value=True),
         ):
@@ -494,21 +494,22 @@ class TestSaveAudioVideo:
 
         assert encode.call_args.kwargs["audio_sample_rate"] == 24000
 
-    def test_video_without_audio_falls_back_to_export(self):
+    def test_video_without_audio_is_streamed_alone(self):
         artifact = AudioVideo("frames", None, 48000)
 
         encode, export = self.save({"content_type": "video/mp4"}, artifact)
 
-        encode.assert_not_called()
-        export.assert_called_once()
+        export.assert_not_called()
+        encode.assert_called_once()
+        assert "audio" not in encode.call_args.kwargs
 
-    def test_video_without_a_sample_rate_falls_back_to_export(self):
+    def test_video_without_a_sample_rate_is_streamed_alone(self):
         artifact = AudioVideo("frames", torch.zeros((2, 100)), None)
 
         encode, export = self.save({"content_type": "video/mp4"}, artifact)
 
-        encode.assert_not_called()
-        export.assert_called_once()
+        export.assert_not_called()
+        assert "audio" not in encode.call_args.kwargs
 
     def test_other_containers_fall_back_to_export(self):
         artifact = AudioVideo("frames", torch.zeros((2, 100)), 48000)
@@ -523,7 +524,7 @@ class TestSaveAudioVideo:
         result.add_result(AudioVideo("frames", torch.zeros((2, 100)), 48000))
 
         with (
-            patch("dw.result.encode_video") as encode,
+            patch("dw.result.write_video") as encode,
             patch("dw.result.export_to_video") as export,
             patch("dw.result.is_av_available", return_value=False),
         ):
@@ -884,6 +885,52 @@ class TestSegmentBackedSave:
         with av.open(str(tmp_path / "final-0.0.mp4")) as container:
             assert len(container.streams.audio) == 1
 
+    def test_segments_are_remuxed_without_re_encoding(self, tmp_path):
+        import av
+
+        frames = self.make_segments(tmp_path, counts=(4, 3, 5))
+        with av.open(frames.paths[1]) as container:
+            middle = [
+                bytes(packet) for packet in container.demux(video=0) if packet.size
+            ]
+        result = Result({"content_type": "video/mp4", "fps": 4})
+        result.add_result(AudioVideo(frames, None, None))
+
+        with patch("dw.pipeline_processors.chain.write_video") as encode:
+            result.save(str(tmp_path), "final")
+
+        encode.assert_not_called()
+        with av.open(str(tmp_path / "final-0.0.mp4")) as container:
+            joined = [
+                bytes(packet) for packet in container.demux(video=0) if packet.size
+            ]
+        assert joined[4:7] == middle
+        assert self.decode_frame_count(tmp_path / "final-0.0.mp4") == 12
+
+    def test_a_tail_trim_inside_a_segment_re_encodes_only_that_segment(self, tmp_path):
+        frames = self.make_segments(tmp_path, counts=(4, 3, 5))
+        frames.total_frames = 9
+        result = Result({"content_type": "video/mp4", "fps": 4})
+        result.add_result(AudioVideo(frames, None, None))
+
+        result.save(str(tmp_path), "final")
+
+        assert self.decode_frame_count(tmp_path / "final-0.0.mp4") == 9
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["final-0.0.mp4"]
+
+    def test_another_frame_rate_is_re_encoded(self, tmp_path, caplog):
+        import logging
+
+        frames = self.make_segments(tmp_path)
+        result = Result({"content_type": "video/mp4", "fps": 8})
+        result.add_result(AudioVideo(frames, None, None))
+
+        with caplog.at_level(logging.DEBUG, logger="dw"):
+            result.save(str(tmp_path), "final")
+
+        assert "Re-encoding the segments" in caplog.text
+        assert self.decode_frame_count(tmp_path / "final-0.0.mp4") == 7
+
     def test_a_non_mp4_content_type_raises(self, tmp_path):
         frames = self.make_segments(tmp_path)
         result = Result({"content_type": "video/gif", "fps": 4})
@@ -893,5 +940,142 @@ class TestSegmentBackedSave:
             result.save(str(tmp_path), "final")
 
 
+def noise_image(seed, size=128):
+    pixels = numpy.random.default_rng(seed).integers(0, 64, (size, size, 3))
+    return Image.fromarray(pixels.astype(numpy.uint8))
+
+
+class TestParallelSave:
+    """Artifacts encoded on a thread pool keep their names and report their errors."""
+
+    @pytest.fixture(autouse=True)
+    def four_workers(self, monkeypatch):
+        import dw
+
+        monkeypatch.setattr(dw.settings, "save_workers", 4)
+
+    def test_names_and_contents_match_the_artifacts(self, tmp_path):
+        images = [noise_image(seed) for seed in range(6)]
+        result = Result({"content_type": "image/png"})
+        # Two iterations' outputs, three images each
+        result.add_result(type("Output", (), {"images": images[:3]})())
+        result.add_result(type("Output", (), {"images": images[3:]})())
+
+        result.save(str(tmp_path), "batch")
+
+        assert sorted(path.name for path in tmp_path.iterdir()) == [
+            f"batch-{i}.{j}.png" for i in range(2) for j in range(3)
+        ]
+        for i in range(2):
+            for j in range(3):
+                saved = Image.open(tmp_path / f"batch-{i}.{j}.png")
+                assert numpy.array_equal(
+                    numpy.asarray(saved), numpy.asarray(images[i * 3 + j])
+                )
+
+    def test_a_failing_artifact_does_not_stop_the_others(self, tmp_path, caplog):
+        result = Result({"content_type": "image/png"})
+        result.add_result([noise_image(0), object(), noise_image(1), object()])
+
+        with pytest.raises(ValueError, match="does not match result type"):
+            result.save(str(tmp_path), "batch")
+
+        assert sorted(path.name for path in tmp_path.iterdir()) == [
+            "batch-0.0.png",
+            "batch-2.0.png",
+        ]
+        assert "2 of 4 artifacts failed to save: batch-1.0, batch-3.0" in caplog.text
+
+    def test_one_worker_saves_in_order(self, tmp_path, monkeypatch):
+        import dw
+
+        monkeypatch.setattr(dw.settings, "save_workers", 1)
+        saved = []
+        result = Result({"content_type": "image/png"})
+        result.add_result([noise_image(seed) for seed in range(3)])
+        with patch.object(
+            Result,
+            "save_artifact",
+            lambda self, directory, artifact, name, *args: saved.append(name),
+        ):
+            result.save(str(tmp_path), "batch")
+
+        assert saved == ["batch-0.0", "batch-1.0", "batch-2.0"]
+
+    def test_workers_default_to_the_cpus(self, monkeypatch):
+        import dw
+        from dw.result import DEFAULT_MAX_SAVE_WORKERS, save_workers
+
+        monkeypatch.setattr(dw.settings, "save_workers", None)
+        monkeypatch.setattr(os, "cpu_count", lambda: 64)
+        assert save_workers() == DEFAULT_MAX_SAVE_WORKERS
+        monkeypatch.setattr(os, "cpu_count", lambda: 2)
+        assert save_workers() == 2
+
+
+class TestImageEncoding:
+    """image_preset and the per-format settings reach Pillow."""
+
+    def test_no_preset_keeps_pillow_defaults(self):
+        assert Result({}).get_image_save_arguments("image/png") == {}
+
+    def test_presets_per_content_type(self):
+        result = Result({"image_preset": "fast"})
+        assert result.get_image_save_arguments("image/png") == {"compress_level": 1}
+        assert result.get_image_save_arguments("image/webp") == {
+            "quality": 90,
+            "method": 0,
+        }
+
+    def test_settings_override_the_preset_for_their_formats(self):
+        result = Result(
+            {"image_preset": "small", "quality": 70, "png_compress_level": 3}
+        )
+        assert result.get_image_save_arguments("image/jpeg")["quality"] == 70
+        assert result.get_image_save_arguments("image/png") == {
+            "compress_level": 3,
+            "optimize": True,
+        }
+
+    def test_an_unknown_preset_is_an_error(self):
+        with pytest.raises(ValueError, match="image_preset"):
+            Result({"image_preset": "fastest"}).get_image_save_arguments("image/png")
+
+    def test_png_compress_level_changes_the_file(self, tmp_path):
+        sizes = {}
+        for level in (0, 9):
+            result = Result({"content_type": "image/png", "png_compress_level": level})
+            result.add_result(noise_image(0, size=256))
+            result.save(str(tmp_path), f"level{level}")
+            sizes[level] = (tmp_path / f"level{level}-0.0.png").stat().st_size
+        assert sizes[0] > sizes[9]
+
+    def test_jpeg_quality_changes_the_file(self, tmp_path):
+        sizes = {}
+        for quality in (20, 95):
+            result = Result({"content_type": "image/jpeg", "quality": quality})
+            result.add_result(noise_image(0, size=256))
+            result.save(str(tmp_path), f"q{quality}")
+            sizes[quality] = (tmp_path / f"q{quality}-0.0.jpg").stat().st_size
+        assert sizes[95] > sizes[20]
+
+    def test_presets_apply_with_embedded_metadata(self, tmp_path):
+        result = Result(
+            {
+                "content_type": "image/png",
+                "embed_metadata": True,
+                "png_compress_level": 0,
+            }
+        )
+        result.set_metadata({"prompt": "a cat"})
+        result.add_result(noise_image(0, size=256))
+        result.save(str(tmp_path), "meta")
+
+        saved = tmp_path / "meta-0.0.png"
+        assert "parameters" in Image.open(saved).info
+        # Uncompressed, the file holds every pixel
+        assert saved.stat().st_size > 256 * 256 * 3
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
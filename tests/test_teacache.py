@@ -1,31 +1,42 @@
 #!/usr/bin/env python3
 """
-Tests for TeaCache's multi-forward-per-step guard.
+Tests for TeaCache's per-guidance-branch state.
 
-TeaCache's Flux forward wrapper (dw/teacache.py) assumes exactly one
-transformer forward call per denoising step. Pipelines that run true
-classifier-free guidance (e.g. FluxPipeline with negative_prompt and
+TeaCache's forward wrappers (dw/teacache.py) skip a step's transformer blocks
+when the signal has barely changed since the previous step. Pipelines that run
+true classifier-free guidance (e.g. FluxPipeline with negative_prompt and
 true_cfg_scale > 1) call the transformer twice per step -- once for the
 conditional pass and once for the unconditional pass -- using the identical
-timestep both times. Without a guard, the second call would silently reuse
-and corrupt the cached previous_modulated_input/previous_residual state,
-producing corrupted images with no error.
+timestep both times. Each pass is a guidance branch with cached state of its
+own: sharing previous_modulated_input/previous_residual across them would
+silently corrupt the image.
 
-These tests exercise the guard directly against the wrapped forward function
-returned by ``_create_flux_teacache_forward``, using a minimal fake
-transformer so no real model weights are required.
+These tests exercise the Flux forward returned by
+``_create_flux_teacache_forward`` directly, using a minimal fake transformer
+so no real model weights are required.
+
+The other architectures keep their diffusers forward under TeaCache, and are
+checked against it on tiny random-weight models.
 """
 
 import functools
+import json
 import os
 import sys
 
+import numpy as np
 import pytest
 import torch
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from dw.teacache import _create_flux_teacache_forward, teacache_context
+from dw.teacache import (
+    CALIBRATION_THRESHOLDS,
+    _create_flux_teacache_forward,
+    _simulated_speedup,
+    _TeaCacheState,
+    teacache_context,
+)
 
 
 class _FakeBlock:
@@ -101,29 +112,87 @@ def _call(bound_forward, timestep_value):
     )
 
 
-def test_duplicate_timestep_raises_runtime_error():
-    """Two forward calls with the identical timestep (true CFG) must raise."""
-    _, bound_forward = _make_bound_forward()
+class _ShiftingBlock(_FakeBlock):
+    """A block adding the mean of its encoder states, so each branch's residual differs."""
 
-    _call(bound_forward, 0.9)  # first call: no prior timestep, always allowed
+    def __call__(self, hidden_states, encoder_hidden_states, **kwargs):
+        self.calls += 1
+        return (
+            encoder_hidden_states,
+            hidden_states + encoder_hidden_states.mean(),
+        )
 
-    with pytest.raises(RuntimeError, match="true classifier-free guidance"):
-        _call(bound_forward, 0.9)  # duplicate timestep: simulates the uncond pass
 
+def _make_branch_forward(num_inference_steps=4, rel_l1_thresh=1.0):
+    """A TeaCache Flux forward over one shifting block, which skips every middle step."""
+    transformer = _FakeFluxTransformer()
+    block = _ShiftingBlock()
+    block.calls = 0
+    transformer.transformer_blocks = [block]
+    forward_fn = _create_flux_teacache_forward(
+        num_inference_steps, rel_l1_thresh, coefficients=[0, 0, 0, 0, 0]
+    )
+    return block, forward_fn.__get__(transformer, _FakeFluxTransformer)
 
-def test_duplicate_timestep_error_names_both_features():
-    """The guard's error message must name both TeaCache and true CFG."""
-    _, bound_forward = _make_bound_forward()
-    _call(bound_forward, 0.9)
 
-    with pytest.raises(RuntimeError) as excinfo:
-        _call(bound_forward, 0.9)
+def _branch_call(bound_forward, timestep_value, encoder_value):
+    return bound_forward(
+        hidden_states=torch.ones(1, 4, 8),
+        encoder_hidden_states=torch.full((1, 3, 8), encoder_value),
+        pooled_projections=torch.zeros(1, 8),
+        timestep=torch.tensor([timestep_value]),
+        img_ids=torch.zeros(2, 3),
+        txt_ids=torch.zeros(2, 3),
+        return_dict=False,
+    )[0]
 
-    message = str(excinfo.value)
-    assert "TeaCache" in message
-    assert "true classifier-free guidance" in message
-    assert "negative_prompt" in message
-    assert "true_cfg_scale" in message
+
+def test_repeated_timestep_runs_as_its_own_branch():
+    """The unconditional pass of a step reuses its own residual, not the conditional one's."""
+    block, bound_forward = _make_branch_forward()
+
+    outputs = []
+    for t in (1.0, 0.75, 0.5, 0.25):
+        outputs.append(
+            (_branch_call(bound_forward, t, 1.0), _branch_call(bound_forward, t, 0.0))
+        )
+
+    for conditional, unconditional in outputs:
+        assert torch.all(conditional == 2.0)
+        assert torch.all(unconditional == 1.0)
+    # Both branches computed the first and last step, and skipped the two between
+    assert block.calls == 4
+
+
+def test_each_branch_decides_to_skip_on_its_own():
+    """A branch whose signal changes computes while the other keeps skipping."""
+    transformer = _FakeFluxTransformer()
+    block = _ShiftingBlock()
+    block.calls = 0
+    transformer.transformer_blocks = [block]
+    forward_fn = _create_flux_teacache_forward(
+        4, rel_l1_thresh=0.5, coefficients=[0, 0, 0, 1, 0]
+    )
+    bound_forward = forward_fn.__get__(transformer, _FakeFluxTransformer)
+
+    def call(t, hidden_value):
+        return bound_forward(
+            hidden_states=torch.full((1, 4, 8), hidden_value),
+            encoder_hidden_states=torch.ones(1, 3, 8),
+            pooled_projections=torch.zeros(1, 8),
+            timestep=torch.tensor([t]),
+            img_ids=torch.zeros(2, 3),
+            txt_ids=torch.zeros(2, 3),
+            return_dict=False,
+        )[0]
+
+    call(1.0, 1.0), call(1.0, 1.0)
+    calls_after_first_step = block.calls
+    # The conditional branch's input is unchanged, the unconditional one's doubles
+    call(0.75, 1.0), call(0.75, 2.0)
+
+    assert calls_after_first_step == 2
+    assert block.calls == 3
 
 
 def test_distinct_timesteps_do_not_raise():
@@ -308,3 +377,386 @@ def test_teacache_context_no_hook_replaces_and_restores_forward():
         assert result.sample is not None
 
     assert transformer.forward.__func__ is original_forward_func
+
+
+# ---------------------------------------------------------------------------
+# Block-stack TeaCache on the diffusers video and Lumina2 transformers
+#
+# These models keep their own forward under TeaCache; only the block list it
+# iterates is swapped. Tiny random-weight models check the result against the
+# uncached forward: every computed step must match it exactly, and a skipped
+# step must run none of the blocks.
+# ---------------------------------------------------------------------------
+
+
+def _generator():
+    return torch.Generator().manual_seed(0)
+
+
+def _tiny_mochi():
+    from diffusers import MochiTransformer3DModel
+
+    model = MochiTransformer3DModel(
+        patch_size=2,
+        num_attention_heads=2,
+        attention_head_dim=8,
+        num_layers=2,
+        pooled_projection_dim=16,
+        in_channels=4,
+        text_embed_dim=16,
+        time_embed_dim=4,
+        max_sequence_length=16,
+    )
+    g = _generator()
+    inputs = dict(
+        hidden_states=torch.randn(1, 4, 2, 4, 4, generator=g),
+        encoder_hidden_states=torch.randn(1, 8, 16, generator=g),
+        encoder_attention_mask=torch.ones(1, 8, dtype=torch.bool),
+    )
+    return model, inputs
+
+
+def _tiny_ltx():
+    from diffusers import LTXVideoTransformer3DModel
+
+    model = LTXVideoTransformer3DModel(
+        in_channels=4,
+        out_channels=4,
+        num_attention_heads=2,
+        attention_head_dim=8,
+        cross_attention_dim=16,
+        num_layers=2,
+        caption_channels=16,
+    )
+    g = _generator()
+    inputs = dict(
+        hidden_states=torch.randn(1, 2 * 4 * 4, 4, generator=g),
+        encoder_hidden_states=torch.randn(1, 8, 16, generator=g),
+        encoder_attention_mask=torch.ones(1, 8),
+        num_frames=2,
+        height=4,
+        width=4,
+    )
+    return model, inputs
+
+
+def _tiny_cogvideox():
+    from diffusers import CogVideoXTransformer3DModel
+
+    model = CogVideoXTransformer3DModel(
+        num_attention_heads=2,
+        attention_head_dim=8,
+        in_channels=4,
+        out_channels=4,
+        time_embed_dim=8,
+        text_embed_dim=16,
+        num_layers=2,
+        sample_width=8,
+        sample_height=8,
+        sample_frames=9,
+        patch_size=2,
+        temporal_compression_ratio=4,
+        max_text_seq_length=8,
+    )
+    g = _generator()
+    inputs = dict(
+        hidden_states=torch.randn(1, 3, 4, 8, 8, generator=g),
+        encoder_hidden_states=torch.randn(1, 8, 16, generator=g),
+    )
+    return model, inputs
+
+
+def _tiny_lumina2():
+    from diffusers import Lumina2Transformer2DModel
+
+    model = Lumina2Transformer2DModel(
+        sample_size=8,
+        patch_size=2,
+        in_channels=4,
+        hidden_size=24,
+        num_layers=2,
+        num_refiner_layers=1,
+        num_attention_heads=2,
+        num_kv_heads=1,
+        multiple_of=16,
+        axes_dim_rope=(4, 4, 4),
+        axes_lens=(64, 64, 64),
+        cap_feat_dim=16,
+    )
+    g = _generator()
+    inputs = dict(
+        hidden_states=torch.randn(1, 4, 8, 8, generator=g),
+        encoder_hidden_states=torch.randn(1, 8, 16, generator=g),
+        encoder_attention_mask=torch.ones(1, 8, dtype=torch.bool),
+    )
+    return model, inputs
+
+
+def _tiny_hunyuan_video():
+    from diffusers import HunyuanVideoTransformer3DModel
+
+    model = HunyuanVideoTransformer3DModel(
+        in_channels=4,
+        out_channels=4,
+        num_attention_heads=2,
+        attention_head_dim=8,
+        num_layers=1,
+        num_single_layers=1,
+        num_refiner_layers=1,
+        text_embed_dim=16,
+        pooled_projection_dim=8,
+        rope_axes_dim=(2, 2, 4),
+    )
+    g = _generator()
+    inputs = dict(
+        hidden_states=torch.randn(1, 4, 1, 4, 4, generator=g),
+        encoder_hidden_states=torch.randn(1, 8, 16, generator=g),
+        encoder_attention_mask=torch.ones(1, 8),
+        pooled_projections=torch.randn(1, 8, generator=g),
+        guidance=torch.tensor([3000.0]),
+    )
+    return model, inputs
+
+
+def _tiny_wan():
+    from diffusers import WanTransformer3DModel
+
+    model = WanTransformer3DModel(
+        patch_size=(1, 2, 2),
+        num_attention_heads=2,
+        attention_head_dim=8,
+        in_channels=4,
+        out_channels=4,
+        text_dim=16,
+        freq_dim=16,
+        ffn_dim=32,
+        num_layers=2,
+        rope_max_seq_len=32,
+    )
+    g = _generator()
+    inputs = dict(
+        hidden_states=torch.randn(1, 4, 2, 4, 4, generator=g),
+        encoder_hidden_states=torch.randn(1, 8, 16, generator=g),
+    )
+    return model, inputs
+
+
+_TINY_MODELS = {
+    "mochi": (_tiny_mochi, ("transformer_blocks",)),
+    "ltx_video": (_tiny_ltx, ("transformer_blocks",)),
+    "cogvideox": (_tiny_cogvideox, ("transformer_blocks",)),
+    "lumina2": (_tiny_lumina2, ("layers",)),
+    "hunyuan_video": (
+        _tiny_hunyuan_video,
+        ("transformer_blocks", "single_transformer_blocks"),
+    ),
+    "wan": (_tiny_wan, ("blocks",)),
+}
+
+_TIMESTEPS = (900, 700, 500, 300)
+
+
+def _tiny_model(name):
+    pytest.importorskip("diffusers")
+    build, block_lists = _TINY_MODELS[name]
+    torch.manual_seed(0)
+    model, inputs = build()
+    model.eval()
+    return model, inputs, block_lists
+
+
+def _denoise(model, inputs):
+    """One forward per step over the test's timesteps, as a pipeline would call it."""
+    outputs = []
+    with torch.no_grad():
+        for t in _TIMESTEPS:
+            result = model(**inputs, timestep=torch.tensor([t]), return_dict=False)
+            outputs.append(result[0])
+    return outputs
+
+
+def _count_block_calls(model, block_lists):
+    calls = []
+    for name in block_lists:
+        for block in getattr(model, name):
+            block.register_forward_hook(lambda *args: calls.append(True))
+    return calls
+
+
+@pytest.mark.parametrize("name", list(_TINY_MODELS))
+def test_block_stack_teacache_without_skipping_matches_the_uncached_forward(name):
+    model, inputs, _ = _tiny_model(name)
+    expected = _denoise(model, inputs)
+
+    # The registry polynomials can rescale a small change below zero; the identity
+    # never does, so a zero threshold computes every step
+    with teacache_context(
+        _FakePipeline(model),
+        len(_TIMESTEPS),
+        rel_l1_thresh=0.0,
+        coefficients=[0, 0, 0, 1, 0],
+    ):
+        outputs = _denoise(model, inputs)
+
+    for output, uncached in zip(outputs, expected):
+        assert torch.equal(output, uncached)
+
+
+@pytest.mark.parametrize("name", list(_TINY_MODELS))
+def test_block_stack_teacache_skips_the_blocks_between_first_and_last_step(name):
+    model, inputs, block_lists = _tiny_model(name)
+    expected = _denoise(model, inputs)
+    per_step = sum(len(getattr(model, list_name)) for list_name in block_lists)
+    calls = _count_block_calls(model, block_lists)
+
+    # Zero coefficients rescale every change to nothing, so the middle steps skip
+    with teacache_context(
+        _FakePipeline(model),
+        len(_TIMESTEPS),
+        rel_l1_thresh=1.0,
+        coefficients=[0, 0, 0, 0, 0],
+    ):
+        outputs = _denoise(model, inputs)
+
+    # Only the first and the forced last step ran the blocks
+    assert len(calls) == 2 * per_step
+    assert torch.equal(outputs[0], expected[0])
+    assert torch.equal(outputs[-1], expected[-1])
+    for output, uncached in zip(outputs[1:-1], expected[1:-1]):
+        assert output.shape == uncached.shape
+        assert torch.isfinite(output).all()
+
+
+@pytest.mark.parametrize("name", ["wan", "hunyuan_video"])
+def test_block_stack_teacache_restores_the_blocks_on_exit(name):
+    model, inputs, block_lists = _tiny_model(name)
+    originals = [getattr(model, list_name) for list_name in block_lists]
+
+    with teacache_context(_FakePipeline(model), len(_TIMESTEPS)):
+        _denoise(model, inputs)
+
+    assert [getattr(model, list_name) for list_name in block_lists] == originals
+    assert not model._forward_pre_hooks
+    assert all(not module._forward_hooks for module in model.modules())
+
+
+def _denoise_with_guidance(model, inputs, negative_inputs):
+    """A conditional and an unconditional call per step, as Wan's pipeline makes them."""
+    outputs = []
+    with torch.no_grad():
+        for t in _TIMESTEPS:
+            timestep = torch.tensor([t])
+            outputs.append(
+                (
+                    model(**inputs, timestep=timestep, return_dict=False)[0],
+                    model(**negative_inputs, timestep=timestep, return_dict=False)[0],
+                )
+            )
+    return outputs
+
+
+@pytest.mark.parametrize("name", ["wan", "lumina2"])
+def test_block_stack_teacache_keeps_each_guidance_branch_apart(name):
+    model, inputs, block_lists = _tiny_model(name)
+    negative_inputs = {
+        **inputs,
+        "encoder_hidden_states": torch.randn(
+            inputs["encoder_hidden_states"].shape, generator=_generator()
+        ),
+    }
+    expected = _denoise_with_guidance(model, inputs, negative_inputs)
+    per_step = sum(len(getattr(model, list_name)) for list_name in block_lists)
+    calls = _count_block_calls(model, block_lists)
+
+    with teacache_context(
+        _FakePipeline(model),
+        len(_TIMESTEPS),
+        rel_l1_thresh=1.0,
+        coefficients=[0, 0, 0, 0, 0],
+    ):
+        outputs = _denoise_with_guidance(model, inputs, negative_inputs)
+
+    # Both branches computed the first and the last step, and skipped the others
+    assert len(calls) == 2 * 2 * per_step
+    for step in (0, -1):
+        assert torch.equal(outputs[step][0], expected[step][0])
+        assert torch.equal(outputs[step][1], expected[step][1])
+    # A skipped step reuses each branch's own residual: the two stay apart
+    conditional, unconditional = outputs[1]
+    assert not torch.equal(conditional, unconditional)
+
+
+# ---------------------------------------------------------------------------
+# Calibration
+# ---------------------------------------------------------------------------
+
+
+def test_calibration_fits_the_residual_change_to_the_input_change():
+    state = _TeaCacheState(12, 0.0, [0, 0, 0, 0, 0], calibrate=True)
+    branch = state.begin_call(torch.tensor([1.0]))
+    changes = [0.01 * step for step in range(1, 11)]
+    branch.samples = [(x, 3 * x * x + 0.5 * x) for x in changes]
+
+    entry = state.calibration_entry("WanTransformer3DModel")
+
+    assert entry["transformer_class"] == "WanTransformer3DModel"
+    assert len(entry["coefficients"]) == 5
+    fitted = np.polyval(entry["coefficients"], changes)
+    assert np.allclose(fitted, [3 * x * x + 0.5 * x for x in changes], atol=1e-6)
+    assert entry["default_threshold"] in CALIBRATION_THRESHOLDS
+
+
+def test_simulated_speedup_counts_the_steps_a_threshold_would_compute():
+    # Ten steps changing 0.1 each: the first and last compute, and with a 0.25
+    # threshold every third step between them
+    changes = [0.1] * 9
+
+    def identity(change):
+        return change
+
+    assert _simulated_speedup([changes], identity, 0.25) == 10 / 4
+    assert _simulated_speedup([changes], identity, 0.05) == 1.0
+
+
+def test_calibration_skips_nothing_and_writes_a_registry_entry(tmp_path):
+    model, inputs, _ = _tiny_model("wan")
+    timesteps = (900, 800, 700, 600, 500, 400, 300, 200)
+
+    def denoise():
+        with torch.no_grad():
+            return [
+                model(**inputs, timestep=torch.tensor([t]), return_dict=False)[0]
+                for t in timesteps
+            ]
+
+    expected = denoise()
+    calibration_file = tmp_path / "calibration.json"
+    with teacache_context(
+        _FakePipeline(model),
+        len(timesteps),
+        calibrate=True,
+        calibration_file=str(calibration_file),
+    ):
+        outputs = denoise()
+
+    for output, uncached in zip(outputs, expected):
+        assert torch.equal(output, uncached)
+    entry = json.loads(calibration_file.read_text())
+    assert entry["transformer_class"] == "WanTransformer3DModel"
+    assert len(entry["coefficients"]) == 5
+    assert entry["default_threshold"] in CALIBRATION_THRESHOLDS
+
+
+def test_calibration_with_too_few_steps_writes_nothing(tmp_path):
+    model, inputs, _ = _tiny_model("wan")
+    calibration_file = tmp_path / "calibration.json"
+
+    with teacache_context(
+        _FakePipeline(model),
+        len(_TIMESTEPS),
+        calibrate=True,
+        calibration_file=str(calibration_file),
+    ):
+        _denoise(model, inputs)
+
+    assert not calibration_file.exists()
@@ -0,0 +1,351 @@
+"""Tests for the cache autotuner: metrics, the Pareto frontier and a sweep end to end.
+
+The sweeps run a tiny random-weight Wan transformer through a small denoising loop on
+the CPU, so each cache really skips blocks and really changes the image.
+"""
+
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from dw.pipeline_processors.pipeline import Pipeline
+from dw.tune import (
+    TuneReport,
+    default_candidates,
+    describe_candidate,
+    output_arrays,
+    pareto_frontier,
+    pipeline_runner,
+    planes,
+    psnr,
+    score,
+    ssim,
+    tune,
+    tuned_workflow_definition,
+    with_candidate,
+    workflow_runner,
+)
+from dw.workflow import Workflow
+
+# Identity rescaling - the registry's polynomials are fitted to full-size models
+TEACACHE_IDENTITY = [0, 0, 0, 1, 0]
+
+
+class TinyWanPipeline:
+    """Denoises a 16x16 latent with a tiny Wan transformer, returning a PIL image."""
+
+    def __init__(self):
+        diffusers = pytest.importorskip("diffusers")
+        torch.manual_seed(0)
+        self.transformer = diffusers.WanTransformer3DModel(
+            patch_size=(1, 2, 2),
+            num_attention_heads=2,
+            attention_head_dim=8,
+            in_channels=4,
+            out_channels=4,
+            text_dim=16,
+            freq_dim=16,
+            ffn_dim=32,
+            num_layers=3,
+            rope_max_seq_len=32,
+        ).eval()
+        self.text = torch.randn(1, 8, 16, generator=torch.Generator().manual_seed(1))
+        self._current_timestep = None
+
+    def __call__(self, prompt=None, num_inference_steps=6, generator=None):
+        latents = torch.randn(1, 4, 1, 16, 16, generator=generator)
+        timesteps = torch.linspace(950, 50, num_inference_steps)
+        for t in timesteps:
+            self._current_timestep = t
+            velocity = self.transformer(
+                hidden_states=latents,
+                encoder_hidden_states=self.text,
+                timestep=t[None],
+                return_dict=False,
+            )[0]
+            latents = latents - velocity / num_inference_steps
+        pixels = torch.sigmoid(latents[0, :3, 0]).permute(1, 2, 0).numpy()
+        return SimpleNamespace(
+            images=[Image.fromarray((pixels * 255).astype(np.uint8))]
+        )
+
+
+def tiny_pipeline(configuration=None):
+    definition = {"arguments": {"prompt": "a fox", "num_inference_steps": 6}}
+    if configuration is not None:
+        definition["configuration"] = configuration
+    return Pipeline(definition, 42, "cpu", pipeline=TinyWanPipeline())
+
+
+class TestMetrics:
+    def test_psnr_of_identical_arrays_is_infinite(self):
+        image = np.random.default_rng(0).random((8, 8, 3))
+        assert psnr(image, image) == math.inf
+
+    def test_psnr_of_a_known_error(self):
+        reference = np.zeros((4, 4))
+        # MSE 0.01 over a range of 1 is 20 dB
+        assert psnr(reference, reference + 0.1) == pytest.approx(20.0)
+
+    def test_ssim_is_one_for_identical_and_falls_with_noise(self):
+        rng = np.random.default_rng(0)
+        image = rng.random((32, 32, 3))
+        slightly = np.clip(image + rng.normal(0, 0.02, image.shape), 0, 1)
+        very = np.clip(image + rng.normal(0, 0.2, image.shape), 0, 1)
+        assert ssim(image, image) == pytest.approx(1.0)
+        assert 1.0 > ssim(image, slightly) > ssim(image, very)
+
+    def test_ssim_matches_a_direct_computation(self):
+        rng = np.random.default_rng(1)
+        x, y = rng.random((7, 7)), rng.random((7, 7))
+        # One 7x7 window covers the whole plane
+        n = x.size
+        cov = ((x - x.mean()) * (y - y.mean())).sum() / (n - 1)
+        c1, c2 = 0.01**2, 0.03**2
+        expected = ((2 * x.mean() * y.mean() + c1) * (2 * cov + c2)) / (
+            (x.mean() ** 2 + y.mean() ** 2 + c1) * (x.var(ddof=1) + y.var(ddof=1) + c2)
+        )
+        assert ssim(x, y) == pytest.approx(expected)
+
+    @pytest.mark.parametrize(
+        "shape, expected",
+        [
+            ((16, 16), (1, 16, 16)),
+            ((16, 16, 3), (3, 16, 16)),
+            ((5, 16, 16, 3), (15, 16, 16)),
+            ((2, 4, 16, 16), (8, 16, 16)),
+            ((1, 4, 3, 16, 16), (12, 16, 16)),
+        ],
+    )
+    def test_images_videos_and_tensors_become_planes(self, shape, expected):
+        assert planes(np.zeros(shape)).shape == expected
+
+    def test_outputs_of_images_frames_and_tensors(self):
+        image = Image.new("RGB", (8, 8), (255, 0, 0))
+        outputs = [
+            SimpleNamespace(images=[image]),
+            SimpleNamespace(frames=[[image, image]]),
+            torch.ones(1, 4, 8, 8),
+        ]
+        arrays = output_arrays(outputs)
+        assert [array.shape for array, _ in arrays] == [
+            (8, 8, 3),
+            (2, 8, 8, 3),
+            (1, 4, 8, 8),
+        ]
+        assert arrays[0][0][0, 0].tolist() == [1.0, 0.0, 0.0]
+        # Images compare over [0, 1]; tensors over the reference's range
+        assert [data_range for _, data_range in arrays] == [1.0, 1.0, None]
+
+    def test_score_is_the_worst_output(self):
+        reference = [(np.zeros((4, 4)), 1.0), (np.zeros((4, 4)), 1.0)]
+        outputs = [(np.full((4, 4), 0.01), 1.0), (np.full((4, 4), 0.1), 1.0)]
+        assert score(reference, outputs) == pytest.approx(20.0)
+
+    def test_outputs_of_another_shape_are_an_error(self):
+        with pytest.raises(ValueError, match="shapes differ"):
+            score([(np.zeros((4, 4)), 1.0)], [(np.zeros((4, 5)), 1.0)])
+
+
+class TestFrontier:
+    def rows(self):
+        return [
+            {
+                "name": "uncached",
+                "configuration": None,
+                "seconds": 10.0,
+                "score": math.inf,
+            },
+            {
+                "name": "a",
+                "configuration": {"cache": {}},
+                "seconds": 6.0,
+                "score": 35.0,
+            },
+            {
+                "name": "b",
+                "configuration": {"cache": {}},
+                "seconds": 7.0,
+                "score": 33.0,
+            },
+            {
+                "name": "c",
+                "configuration": {"cache": {}},
+                "seconds": 4.0,
+                "score": 28.0,
+            },
+            {"name": "d", "configuration": {"cache": {}}, "error": "unsupported"},
+        ]
+
+    def test_dominated_and_failed_rows_are_left_out(self):
+        names = [row["name"] for row in pareto_frontier(self.rows())]
+        # b is slower than a and scores lower
+        assert names == ["c", "a", "uncached"]
+
+    def test_best_is_the_fastest_reaching_the_target(self):
+        assert TuneReport(self.rows(), "psnr", 30.0).best()["name"] == "a"
+        assert TuneReport(self.rows(), "psnr", 25.0).best()["name"] == "c"
+        assert TuneReport(self.rows(), "psnr", 40.0).best() is None
+
+    def test_the_report_is_json(self):
+        report = TuneReport(self.rows(), "psnr", 30.0).to_dict()
+        assert report["frontier"] == ["c", "a", "uncached"]
+        assert report["best"] == {"cache": {}}
+        # Infinity is not JSON
+        assert report["rows"][0]["score"] is None
+
+
+class TestCandidates:
+    def test_names(self):
+        assert describe_candidate(None) == "uncached"
+        assert (
+            describe_candidate({"cache": {"type": "first_block", "threshold": 0.08}})
+            == "first_block threshold=0.08"
+        )
+        assert (
+            describe_candidate({"teacache": {"rel_l1_thresh": 0.2}})
+            == "teacache rel_l1_thresh=0.2"
+        )
+
+    def test_a_candidate_replaces_the_configured_caches(self):
+        configuration = {"cache": {"type": "faster"}, "device": "cpu"}
+        assert with_candidate(configuration, {"teacache": {}}) == {
+            "device": "cpu",
+            "teacache": {},
+        }
+        assert with_candidate(configuration, None) == {"device": "cpu"}
+
+    def test_defaults_for_a_wan_transformer(self):
+        candidates = default_candidates(TinyWanPipeline())
+        caches = [c["cache"]["threshold"] for c in candidates if "cache" in c]
+        teacache = [
+            c["teacache"]["rel_l1_thresh"] for c in candidates if "teacache" in c
+        ]
+        assert caches == [0.05, 0.08, 0.12, 0.2]
+        # The threshold guide of wan2.1_t2v_14b, the class default
+        assert teacache == [0.14, 0.15, 0.2]
+
+    def test_no_candidates_without_a_transformer(self):
+        assert default_candidates(SimpleNamespace()) == []
+
+
+class TestSweep:
+    def test_a_pipeline_sweep_end_to_end(self):
+        pipeline = tiny_pipeline()
+        candidates = [
+            {"cache": {"type": "first_block", "threshold": 1e-9}},
+            {"cache": {"type": "first_block", "threshold": 10.0}},
+            {
+                "teacache": {
+                    "rel_l1_thresh": 10.0,
+                    "coefficients": TEACACHE_IDENTITY,
+                }
+            },
+        ]
+
+        with pipeline_runner(pipeline, pipeline.argument_template) as run:
+            report = tune(run, candidates, metric="psnr", target=30.0)
+
+        uncached, exact, first_block, teacache = report.rows
+        assert uncached["score"] == math.inf
+        # A threshold nothing falls under computes every step, as uncached does
+        assert exact["score"] == math.inf
+        # Huge thresholds reuse every step they can and change the image
+        for row in (first_block, teacache):
+            assert row.get("error") is None
+            assert 0 < row["score"] < math.inf
+            assert row["compute_saved"] > 0
+            assert row["seconds"] > 0
+        assert report.frontier()
+        # The sweep leaves the pipeline as it found it
+        assert "configuration" not in pipeline.pipeline_definition
+        assert not pipeline.pipeline.transformer.is_cache_enabled
+
+    def test_ssim_sweep_ranks_lower_thresholds_higher(self):
+        pipeline = tiny_pipeline()
+        candidates = [
+            {"teacache": {"rel_l1_thresh": 0.05, "coefficients": TEACACHE_IDENTITY}},
+            {"teacache": {"rel_l1_thresh": 10.0, "coefficients": TEACACHE_IDENTITY}},
+        ]
+        with pipeline_runner(pipeline, pipeline.argument_template) as run:
+            report = tune(run, candidates, metric="ssim")
+
+        low, high = report.rows[1:]
+        assert 1.0 >= low["score"] >= high["score"]
+
+    def test_a_failing_candidate_is_reported_not_raised(self):
+        pipeline = tiny_pipeline({"device": "cpu"})
+        with pipeline_runner(pipeline, pipeline.argument_template) as run:
+            report = tune(run, [{"teacache": {"variant": "no_such_variant"}}])
+
+        assert "no_such_variant" in report.rows[1]["error"]
+        assert report.best() is None
+        assert pipeline.configuration == {"device": "cpu"}
+
+    def test_an_unknown_metric_is_an_error(self):
+        with pytest.raises(ValueError, match="Unknown metric"):
+            tune(lambda candidate: ([], 1.0), [], metric="lpips")
+
+
+class TestWorkflow:
+    def definition(self):
+        return {
+            "id": "tune",
+            "steps": [
+                {
+                    "name": "generate",
+                    "pipeline": {
+                        "configuration": {"cache": {"type": "faster"}},
+                        "arguments": {"prompt": "a fox", "num_inference_steps": 6},
+                    },
+                },
+                {"name": "after", "pipeline": {"arguments": {}}},
+            ],
+        }
+
+    def test_steps_after_the_tuned_one_do_not_run(self):
+        definition = tuned_workflow_definition(self.definition(), "generate")
+        assert [step["name"] for step in definition["steps"]] == ["generate"]
+
+    def test_the_tuned_step_must_exist_and_run_a_pipeline(self):
+        with pytest.raises(ValueError, match="No step 'missing'"):
+            tuned_workflow_definition(self.definition(), "missing")
+        definition = self.definition()
+        definition["steps"][0] = {"name": "generate", "task": {"command": "x"}}
+        with pytest.raises(ValueError, match="does not run a pipeline"):
+            tuned_workflow_definition(definition, "generate")
+
+    def test_every_run_of_an_unseeded_workflow_shares_one_seed(self):
+        workflow = Workflow(self.definition(), "./output", "")
+        pipelines = {"generate": tiny_pipeline()}
+
+        with workflow_runner(workflow, "generate", {}, pipelines) as (run, _):
+            # No cache keys - the candidate runs the step uncached, as the reference does
+            report = tune(run, [{}])
+
+        assert report.rows[1]["score"] == math.inf
+        assert "seed" not in workflow.workflow_definition
+
+    def test_a_workflow_sweep_times_the_step(self):
+        workflow = Workflow(self.definition(), "./output", "")
+        # Already loaded, as after the first run
+        pipelines = {"generate": tiny_pipeline()}
+        candidates = [{"cache": {"type": "first_block", "threshold": 10.0}}]
+
+        with workflow_runner(workflow, "generate", {}, pipelines) as (run, loaded):
+            report = tune(run, candidates)
+
+        assert loaded is pipelines
+        uncached, first_block = report.rows
+        assert uncached["seconds"] > 0
+        assert 0 < first_block["score"] < math.inf
+        assert first_block["compute_saved"] > 0
+        # The workflow's own configuration is untouched
+        assert workflow.workflow_definition["steps"][0]["pipeline"][
+            "configuration"
+        ] == {"cache": {"type": "faster"}}
+        assert not pipelines["generate"].pipeline.transformer.is_cache_enabled
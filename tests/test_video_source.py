@@ -0,0 +1,207 @@
+"""
+Unit tests for VideoSource - video files opened for their metadata, with frames
+decoded only as steps ask for them - and the paths that take one.
+"""
+
+from dataclasses import dataclass
+
+import numpy
+import pytest
+from PIL import Image
+
+from dw.arguments import fetch_video, realize_args
+from dw.frame_buffer import FrameBuffer
+from dw.pipeline_processors.chain import run_chain
+from dw.tasks.concat_videos import concat_videos
+from dw.tasks.video_utils import extract_frame, frame_count, frames_as_array
+from dw.video_source import VideoSource, decode_video_sources
+from dw.video_writer import write_video
+
+av = pytest.importorskip("av")
+
+FRAMES = 60
+
+
+@pytest.fixture
+def clip(tmp_path):
+    path = tmp_path / "clip.mp4"
+    write_video(
+        [Image.new("RGB", (32, 16), (i * 4, 255 - i * 4, 0)) for i in range(FRAMES)],
+        path,
+        fps=24,
+    )
+    return path
+
+
+def decoded_frames(path):
+    with av.open(str(path)) as container:
+        return numpy.stack(
+            [frame.to_ndarray(format="rgb24") for frame in container.decode(video=0)]
+        )
+
+
+class TestMetadata:
+    def test_length_rate_and_size_come_from_the_container(self, clip):
+        source = VideoSource(clip)
+
+        assert len(source) == FRAMES
+        assert source.fps == 24
+        assert source.size == (32, 16)
+
+    def test_stride_and_size_describe_the_frames_given(self, clip):
+        source = VideoSource(clip, size=(16, 8), stride=4)
+
+        assert len(source) == FRAMES // 4
+        assert source.fps == 6
+        assert source.size == (16, 8)
+
+    def test_max_size_fits_the_longest_side_at_even_sizes(self, clip):
+        assert VideoSource(clip, max_size=20).size == (20, 10)
+        assert VideoSource(clip, max_size=15).size == (14, 6)
+        assert VideoSource(clip, max_size=64).size == (32, 16)
+
+    def test_an_invalid_stride_raises(self, clip):
+        with pytest.raises(ValueError, match="stride"):
+            VideoSource(clip, stride=0)
+
+
+class TestDecoding:
+    def test_a_frame_is_the_one_a_full_decode_gives(self, clip):
+        source = VideoSource(clip)
+        frames = decoded_frames(clip)
+
+        for index in (0, 1, 29, FRAMES - 1, -1):
+            assert (numpy.asarray(source[index]) == frames[index]).all()
+
+    def test_a_slice_decodes_into_a_frame_buffer(self, clip):
+        source = VideoSource(clip)
+        frames = decoded_frames(clip)
+
+        span = source[40:50]
+
+        assert isinstance(span, FrameBuffer)
+        assert (span.array == frames[40:50]).all()
+        assert (source[50:40:-3].array == frames[50:40:-3]).all()
+
+    def test_stride_keeps_every_nth_frame(self, clip):
+        frames = decoded_frames(clip)
+
+        source = VideoSource(clip, stride=7)
+
+        assert (numpy.asarray(source) == frames[::7]).all()
+        assert (numpy.asarray(source[3]) == frames[21]).all()
+
+    def test_frames_are_scaled_as_they_are_decoded(self, clip):
+        source = VideoSource(clip, size=(16, 8))
+
+        assert source[5].size == (16, 8)
+        assert source.decode(0, 4).shape == (4, 8, 16, 3)
+
+    def test_one_frame_decodes_from_the_keyframe_before_it(self, clip, monkeypatch):
+        converted = []
+        rgb = VideoSource._rgb
+
+        def counted(self, frame):
+            converted.append(frame)
+            return rgb(self, frame)
+
+        monkeypatch.setattr(VideoSource, "_rgb", counted)
+
+        VideoSource(clip)[-1]
+
+        assert len(converted) == 1
+
+    def test_out_of_range_raises(self, clip):
+        with pytest.raises(IndexError):
+            VideoSource(clip)[FRAMES]
+
+
+class TestConsumers:
+    def test_fetch_video_opens_a_file_lazily(self, clip):
+        source = fetch_video(
+            {"location": str(clip), "size": {"width": 16, "height": 8}, "stride": 2}
+        )
+
+        assert isinstance(source, VideoSource)
+        assert (len(source), source.size) == (FRAMES // 2, (16, 8))
+        assert fetch_video(source) is source
+
+    def test_realize_args_opens_video_arguments(self, clip):
+        arguments = {
+            "video": str(clip),
+            "reference": {"media_type": "video", "location": str(clip)},
+        }
+
+        realize_args(arguments)
+
+        assert isinstance(arguments["video"], VideoSource)
+        assert isinstance(arguments["reference"], VideoSource)
+
+    def test_a_pipeline_is_handed_the_frames(self, clip):
+        arguments = {
+            "prompt": "a",
+            "video": VideoSource(clip, stride=10),
+            "videos": [VideoSource(clip, stride=30)],
+        }
+
+        decode_video_sources(arguments)
+
+        assert len(arguments["video"]) == 6
+        assert all(isinstance(frame, Image.Image) for frame in arguments["video"])
+        assert len(arguments["videos"][0]) == 2
+
+    def test_frame_helpers_take_a_source(self, clip):
+        source = VideoSource(clip)
+
+        assert frame_count(source) == FRAMES
+        assert extract_frame(source, -1).size == (32, 16)
+        assert frames_as_array(source).shape == (FRAMES, 16, 32, 3)
+
+    def test_concat_videos_joins_sources(self, clip):
+        result = concat_videos([VideoSource(clip), VideoSource(clip)], trim_frames=1)
+
+        assert len(result.frames) == 2 * FRAMES - 1
+
+    def test_a_source_is_saved_a_chunk_at_a_time(self, clip, tmp_path):
+        output = tmp_path / "saved.mp4"
+
+        assert write_video(VideoSource(clip, stride=2), output, fps=12) == FRAMES // 2
+
+    def test_last_segment_carries_only_the_decoded_tail(self, clip, monkeypatch):
+        decoded = []
+        chunks = VideoSource.chunks
+
+        def recording(self, start=0, stop=None, *args, **kwargs):
+            decoded.append((start, stop))
+            return chunks(self, start, stop, *args, **kwargs)
+
+        monkeypatch.setattr(VideoSource, "chunks", recording)
+
+        class Pipeline:
+            calls = []
+
+            def _run_once(self, arguments):
+                self.calls.append(arguments)
+                return VideoSource(clip)
+
+        pipeline = Pipeline()
+        chain = {
+            "segments": 2,
+            "continuity": "last_segment",
+            "carry_frames": 8,
+            "segment_argument": "references",
+        }
+
+        @dataclass
+        class VideoReference:
+            frames: object
+            audio: object = None
+            sample_rate: int = None
+
+            kind = "video"
+
+        run_chain(pipeline, chain, {"references": [VideoReference([])]})
+
+        carried = pipeline.calls[1]["references"][-1]
+        assert len(carried.frames) == 8
+        assert (FRAMES - 8, FRAMES) in decoded
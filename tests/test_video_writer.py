@@ -0,0 +1,218 @@
+"""
+Unit tests for the streaming video sink - frames encoded a chunk at a time,
+audio muxed in at close, and the lazy and pre-encoded sources it saves.
+"""
+
+import numpy
+import pytest
+import torch
+from PIL import Image
+
+from dw.result import AudioVideo, Result
+from dw.video_writer import (
+    EncodedVideo,
+    FrameStream,
+    VideoWriter,
+    frame_chunks,
+    remux_incompatibility,
+    remux_videos,
+    video_frame_count,
+    write_video,
+)
+
+av = pytest.importorskip("av")
+
+
+def frames(count, size=16):
+    return [Image.new("RGB", (size, size), (i * 20 % 256, 0, 0)) for i in range(count)]
+
+
+def decoded(path):
+    with av.open(str(path)) as container:
+        count = sum(1 for _ in container.decode(video=0))
+        return count, len(container.streams.audio)
+
+
+class TestFrameChunks:
+    def test_a_frame_list_is_converted_a_chunk_at_a_time(self):
+        chunks = list(frame_chunks(frames(7), chunk_frames=3))
+
+        assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+        assert chunks[0].dtype == numpy.uint8
+        assert chunks[0].shape[1:] == (16, 16, 3)
+
+    def test_float_arrays_are_scaled(self):
+        video = numpy.full((2, 4, 4, 3), 0.5, dtype=numpy.float32)
+
+        (chunk,) = frame_chunks(video)
+
+        assert chunk.dtype == numpy.uint8
+        assert chunk[0, 0, 0, 0] == 128
+
+    def test_a_uint8_array_is_sliced_not_copied(self):
+        video = numpy.zeros((5, 4, 4, 3), dtype=numpy.uint8)
+
+        chunks = list(frame_chunks(video, chunk_frames=2))
+
+        assert all(numpy.shares_memory(chunk, video) for chunk in chunks)
+
+    def test_channels_first_tensors_become_channels_last(self):
+        video = torch.zeros(3, 3, 8, 6)
+
+        (chunk,) = frame_chunks(video)
+
+        assert chunk.shape == (3, 8, 6, 3)
+
+    def test_an_iterable_of_chunks_keeps_its_chunks(self):
+        segments = [torch.zeros(4, 8, 8, 3, dtype=torch.uint8)] * 2
+
+        chunks = list(frame_chunks(iter(segments), chunk_frames=3))
+
+        assert [len(chunk) for chunk in chunks] == [4, 4]
+
+
+class TestVideoWriter:
+    def test_frames_written_across_calls_make_one_video(self, tmp_path):
+        path = tmp_path / "out.mp4"
+
+        with VideoWriter(path, fps=8, chunk_frames=3) as writer:
+            writer.write(frames(5))
+            writer.write(frames(4))
+
+        assert writer.frames_written == 9
+        assert decoded(path) == (9, 0)
+
+    def test_audio_is_muxed_in_at_close(self, tmp_path):
+        path = tmp_path / "out.mp4"
+
+        frame_count = write_video(
+            frames(8),
+            path,
+            fps=8,
+            audio=torch.zeros(2, 8000),
+            audio_sample_rate=8000,
+        )
+
+        assert frame_count == 8
+        assert decoded(path) == (8, 1)
+
+    def test_a_failure_removes_the_partial_file(self, tmp_path):
+        path = tmp_path / "out.mp4"
+
+        with pytest.raises(ValueError, match="cannot join"):
+            with VideoWriter(path, fps=8) as writer:
+                writer.write(frames(3))
+                writer.write(frames(3, size=32))
+
+        assert not path.exists()
+
+    def test_audio_needs_its_rate_before_the_first_frames(self, tmp_path):
+        path = tmp_path / "out.mp4"
+        writer = VideoWriter(path, fps=8)
+        writer.write(frames(3))
+
+        with pytest.raises(ValueError, match="sample rate"):
+            writer.close(torch.zeros(2, 8000))
+        assert not path.exists()
+
+    def test_closing_without_frames_raises(self, tmp_path):
+        with pytest.raises(ValueError, match="No frames"):
+            VideoWriter(tmp_path / "out.mp4", fps=8).close()
+
+
+class TestSavedSources:
+    def test_a_frame_stream_is_generated_as_it_is_saved(self, tmp_path):
+        generated = []
+
+        def produce():
+            for frame in frames(20):
+                generated.append(frame)
+                yield frame
+
+        stream = FrameStream(produce, 20, chunk_frames=4)
+        result = Result({"content_type": "video/mp4", "fps": 8})
+        result.add_result([stream])
+        assert generated == []
+
+        result.save(str(tmp_path), "out")
+
+        assert decoded(tmp_path / "out-0.0.mp4") == (20, 0)
+
+    def test_frames_are_streamed_into_an_mp4(self, tmp_path):
+        result = Result({"content_type": "video/mp4", "fps": 8})
+        result.add_result(AudioVideo(frames(6), torch.zeros(2, 6000), 8000))
+
+        result.save(str(tmp_path), "out")
+
+        assert decoded(tmp_path / "out-0.0.mp4") == (6, 1)
+
+    def test_an_encoded_video_is_moved_not_encoded(self, tmp_path):
+        source = tmp_path / "made.mp4"
+        write_video(frames(5), source, fps=8)
+        result = Result({"content_type": "video/mp4"})
+        result.add_result([EncodedVideo(source, 8, 5)])
+
+        result.save(str(tmp_path), "out")
+
+        assert not source.exists()
+        assert decoded(tmp_path / "out-0.0.mp4") == (5, 0)
+
+    def test_an_encoded_video_decodes_in_chunks(self, tmp_path):
+        source = tmp_path / "made.mp4"
+        write_video(frames(20), source, fps=8)
+
+        chunks = list(EncodedVideo(source, 8, 20))
+
+        assert sum(len(chunk) for chunk in chunks) == 20
+        assert chunks[0].shape[1:] == (16, 16, 3)
+
+    def test_an_encoded_video_is_only_an_mp4(self, tmp_path):
+        source = tmp_path / "made.mp4"
+        write_video(frames(2), source, fps=8)
+        result = Result({"content_type": "video/webm"})
+        result.add_result([EncodedVideo(source, 8, 2)])
+
+        with pytest.raises(ValueError, match="video/mp4"):
+            result.save(str(tmp_path), "out")
+
+
+def packets(path):
+    with av.open(str(path)) as container:
+        return [bytes(packet) for packet in container.demux(video=0) if packet.size]
+
+
+class TestRemux:
+    def files(self, tmp_path, counts=(5, 7, 4), size=16, fps=8):
+        paths = []
+        for index, count in enumerate(counts):
+            path = tmp_path / f"part-{index}.mp4"
+            write_video(frames(count, size), path, fps=fps)
+            paths.append(path)
+        return paths
+
+    def test_packets_are_copied_not_re_encoded(self, tmp_path):
+        paths = self.files(tmp_path)
+        output = tmp_path / "joined.mp4"
+
+        assert remux_incompatibility(paths, 8) is None
+        assert remux_videos(paths, output) == 16
+
+        assert packets(output) == [packet for path in paths for packet in packets(path)]
+        assert decoded(output) == (16, 0)
+        assert video_frame_count(output) == 16
+
+    def test_the_new_soundtrack_is_muxed_in(self, tmp_path):
+        output = tmp_path / "joined.mp4"
+
+        remux_videos(self.files(tmp_path), output, torch.zeros(2, 16000), 8000)
+
+        assert decoded(output) == (16, 1)
+
+    def test_files_encoded_differently_cannot_be_remuxed(self, tmp_path):
+        paths = self.files(tmp_path, counts=(3,)) + [tmp_path / "other.mp4"]
+        write_video(frames(3, size=32), paths[1], fps=8)
+
+        assert "size" in remux_incompatibility(paths)
+
+    def test_another_frame_rate_cannot_be_remuxed(self, tmp_path):
+        assert "fps" in remux_incompatibility(self.files(tmp_path), 24)